@@ -14,9 +14,12 @@ from models import ( # noqa
     JsonCache
 )
 from securities_logic import (
-    fetch_moex_historical_prices, fetch_moex_securities_metadata, fetch_moex_historical_price_range
+    fetch_moex_historical_prices, fetch_moex_securities_metadata, fetch_moex_historical_price_range,
+    fetch_moex_market_leaders
 )
 from api_clients import fetch_bybit_historical_price_range, fetch_bybit_spot_tickers, PRICE_TICKER_DISPATCHER
+from services.json_cache import get_cached, set_cached
+from services.currency_rates import get_currency_rates
 
 from flask_login import current_user
 from extensions import db
@@ -431,16 +434,8 @@ def refresh_performance_chart_data():
         performance_tickers = ['BTC', 'ETH', 'SOL', 'TON', 'SUI', 'NEAR', 'XRP']
         chart_data = _generate_performance_chart_data(performance_tickers)
 
-        cache_key = 'performance_chart_data'
-        cache_entry = JsonCache.query.filter_by(cache_key=cache_key).first()
-        if not cache_entry:
-            cache_entry = JsonCache(cache_key=cache_key)
-            db.session.add(cache_entry)
-        
-        # Используем default=str для сериализации Decimal в строку
-        cache_entry.json_data = json.dumps(chart_data, default=str)
-        cache_entry.last_updated = datetime.now(timezone.utc)
-        db.session.commit()
+        # Decimal сериализуется в строку (default=str внутри set_cached)
+        set_cached('performance_chart_data', chart_data)
         print("--- [Analytics] Данные для графика производительности успешно обновлены и сохранены в кэш. ---")
         return True, "Данные для графика производительности успешно обновлены."
     except Exception as e:
@@ -454,12 +449,7 @@ def get_performance_chart_data_from_cache():
     Возвращает (data, last_updated_timestamp).
     Если кэш пуст, возвращает пустые данные.
     """
-    cache_key = 'performance_chart_data'
-    cache_entry = JsonCache.query.filter_by(cache_key=cache_key).first()
-    if cache_entry:
-        return json.loads(cache_entry.json_data), cache_entry.last_updated
-    else:
-        return {}, None
+    return get_cached('performance_chart_data', default={})
 
 def refresh_market_leaders_cache():
     """Fetches and caches market leader data from MOEX and crypto exchanges."""
@@ -474,14 +464,7 @@ def refresh_market_leaders_cache():
             'last_updated': datetime.now(timezone.utc).isoformat()
         }
 
-        cache_key = 'market_leaders_data'
-        cache_entry = JsonCache.query.filter_by(cache_key=cache_key).first()
-        if not cache_entry:
-            cache_entry = JsonCache(cache_key=cache_key)
-            db.session.add(cache_entry)
-        
-        cache_entry.json_data = json.dumps(market_data, default=str) # Use default=str for Decimal
-        db.session.commit()
+        set_cached('market_leaders_data', market_data)
         print("--- [Analytics] Кэш лидеров рынка успешно обновлен. ---")
         return True, "Кэш лидеров рынка обновлен."
     except Exception as e:
@@ -495,8 +478,7 @@ def get_crypto_portfolio_overview():
     Возвращает словарь с агрегированными данными и общую стоимость в рублях.
     Эта функция используется для анализа новостей и не влияет на основной дашборд.
     """
-    # Временное решение для курсов, в будущем можно вынести в общую утилиту
-    currency_rates_to_rub = {'USDT': Decimal('90.0'), 'RUB': Decimal('1.0')}
+    currency_rates_to_rub = get_currency_rates()
     
     query = InvestmentAsset.query.join(InvestmentPlatform).filter(
         InvestmentPlatform.platform_type == 'crypto_exchange',
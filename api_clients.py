@@ -22,6 +22,7 @@ OKX_BASE_URL = "https://www.okx.com"
 from flask import current_app
 import threading
 from extensions import db
+from services.conditional_fetch import conditional_get
 
 # --- Вспомогательные функции для аутентификации и запросов ---
 class RateLimiter:
@@ -408,32 +409,42 @@ def fetch_okx_spot_tickers(target_symbols: list) -> list:
         current_app.logger.error(f"Ошибка при получении тикеров OKX: {e}")
         return []
 
-def fetch_cbr_usd_rub_rate() -> Decimal | None:
-    """Получает курс USD к RUB с сайта ЦБ РФ."""
+def fetch_cbr_rates() -> dict:
+    """
+    Получает курсы всех валют к RUB с сайта ЦБ РФ за один запрос.
+    Возвращает словарь {код валюты: Decimal} с учетом номинала (например, 10 CNY).
+    """
     try:
         # Дата в формате, который требует ЦБ: dd/mm/YYYY
         today_str = datetime.now(timezone.utc).strftime('%d/%m/%Y')
         url = f"https://www.cbr.ru/scripts/XML_daily.asp?date_req={today_str}"
-        current_app.logger.info(f"--- [Exchange Rate] Запрос курса USD/RUB с ЦБ РФ: {url}")
+        current_app.logger.info(f"--- [Exchange Rate] Запрос курсов валют с ЦБ РФ: {url}")
         response = requests.get(url, timeout=10)
         response.raise_for_status()
 
         # Парсим XML
         root = ET.fromstring(response.content)
-        # Ищем валюту с кодом 'USD' (ID R01235)
-        usd_node = root.find("./Valute[@ID='R01235']")
-        if usd_node is not None:
-            value_str = usd_node.find('Value').text
+        rates = {}
+        for node in root.findall('./Valute'):
+            code = node.findtext('CharCode')
+            value_str = node.findtext('Value')
+            if not code or not value_str:
+                continue
             # Заменяем запятую на точку для конвертации в Decimal
-            rate = Decimal(value_str.replace(',', '.'))
-            current_app.logger.info(f"--- [Exchange Rate] Успешно получен курс USD/RUB от ЦБ РФ: {rate}")
-            return rate
-        else:
-            current_app.logger.warning("--- [Exchange Rate] Не удалось найти курс USD в ответе от ЦБ РФ.")
-            return None
+            nominal = Decimal((node.findtext('Nominal') or '1').replace(',', '.'))
+            rates[code] = Decimal(value_str.replace(',', '.')) / nominal
+        current_app.logger.info(f"--- [Exchange Rate] Получено курсов от ЦБ РФ: {len(rates)}")
+        return rates
     except Exception as e:
-        current_app.logger.error(f"--- [Exchange Rate] Ошибка при получении курса от ЦБ РФ: {e}")
-        return None
+        current_app.logger.error(f"--- [Exchange Rate] Ошибка при получении курсов от ЦБ РФ: {e}")
+        return {}
+
+def fetch_cbr_usd_rub_rate() -> Decimal | None:
+    """Получает курс USD к RUB с сайта ЦБ РФ."""
+    rate = fetch_cbr_rates().get('USD')
+    if rate is None:
+        current_app.logger.warning("--- [Exchange Rate] Не удалось найти курс USD в ответе от ЦБ РФ.")
+    return rate
 
 def fetch_usdt_rub_rate() -> Decimal | None:
     """
@@ -449,12 +460,19 @@ def fetch_usdt_rub_rate() -> Decimal | None:
     # Если ЦБ РФ недоступен, возвращаем None, чтобы сработал fallback в вызывающем коде.
     return None
 
-def fetch_cryptocompare_news(limit: int = 50, categories: str = None) -> list:
-    """Получает последние новости из CryptoCompare API."""
+def fetch_cryptocompare_news(limit: int = 50, categories: str = None, before_ts: int = None, if_changed: bool = False) -> tuple:
+    """
+    Получает последние новости из CryptoCompare API (не больше 50 за запрос).
+    before_ts - курсор API (lTs): вернуть новости, опубликованные до этого UNIX-времени.
+    if_changed=True - условный запрос (services/conditional_fetch.py): если ответ не изменился
+    с прошлого запроса с теми же параметрами, разбор пропускается и возвращается [].
+    Возвращает (новости, FetchResult). Вызывающий код сам вызывает remember(result) после того,
+    как новости сохранены; при ошибке или неизмененном ответе result равен None.
+    """
     api_key = current_app.config.get('CRYPTOCOMPARE_API_KEY')
     if not api_key:
         current_app.logger.warning("CRYPTOCOMPARE_API_KEY не установлен. Запрос новостей не будет выполнен.")
-        return []
+        return [], None
 
     # ИЗМЕНЕНО: Убираем feeds из URL и добавляем в параметры.
     # Добавляем 'sentiment': 'true' для явного запроса тональности.
@@ -470,12 +488,16 @@ def fetch_cryptocompare_news(limit: int = 50, categories: str = None) -> list:
         if categories:
             params['categories'] = categories
             current_app.logger.info(f"--- [CryptoCompare] Запрос новостей для категорий: {categories}...")
+        if before_ts:
+            params['lTs'] = int(before_ts)
         # Логируем параметры без API ключа для безопасности
         log_params = {k: v for k, v in params.items() if k != 'api_key'}
         current_app.logger.info(f"--- [CryptoCompare] Запрос новостей с параметрами: {log_params}")
-        response = requests.get(url, params=params, timeout=15)
-        response.raise_for_status()
-        response_data = response.json()
+        result = conditional_get(url, params=params, timeout=15, force=not if_changed)
+        if result.not_modified:
+            current_app.logger.info("--- [CryptoCompare] Новости не изменились с прошлого запроса.")
+            return [], None
+        response_data = json.loads(result.content)
         if response_data.get('Type') == 100: # 100 is success for CryptoCompare
             # Для отладки, проверим первую новость на наличие поля sentiment
             news_data = response_data.get('Data', [])
@@ -485,13 +507,13 @@ def fetch_cryptocompare_news(limit: int = 50, categories: str = None) -> list:
                     current_app.logger.info("--- [CryptoCompare] Поле 'sentiment' присутствует в ответе API.")
                 else:
                     current_app.logger.warning("--- [CryptoCompare] ВНИМАНИЕ: Поле 'sentiment' отсутствует в ответе API. Возможно, эта функция не включена для вашего API ключа.")
-            return news_data[:limit] # Ограничиваем количество уже после получения
+            return news_data[:limit], result # Ограничиваем количество уже после получения
         else:
             current_app.logger.error(f"Ошибка API CryptoCompare: {response_data.get('Message')}")
-            return []
+            return [], None
     except Exception as e:
         current_app.logger.error(f"Исключение при запросе новостей из CryptoCompare: {e}")
-        return []
+        return [], None
 
 def fetch_bingx_account_assets(api_key: str, api_secret: str, passphrase: str = None) -> list:
     """Получает балансы активов с BingX."""
@@ -1,16 +1,18 @@
-import io
+from concurrent.futures import ThreadPoolExecutor
+
 from flask import Blueprint, request, jsonify, current_app
 from fns_client import parse_receipt_qr
-from PIL import Image
-
-import os
-import sys
+from services.qr_decoder import decode_qr_image, decode_qr_images
 
 api_bp = Blueprint('api', __name__)
-import pyzbar.pyzbar as pyzbar
 
-print(f"Python executable: {sys.executable}")
-print(f"sys.path: {sys.path}")
+DEFAULT_BATCH_MAX_IMAGES = 20
+DEFAULT_RECEIPT_WORKERS = 2
+
+
+def _fns_configured() -> bool:
+    return bool(current_app.config.get('FNS_API_USERNAME') and current_app.config.get('FNS_API_PASSWORD'))
+
 
 @api_bp.route('/parse-qr', methods=['POST'])
 def handle_parse_qr():
@@ -21,31 +23,28 @@ def handle_parse_qr():
 
     Если qr_string не передан, ожидает получить изображение чека в multipart/form-data.
     """
-
-    if 'qr_string' in request.form:
+    json_data = request.get_json(silent=True) or {}
+    if json_data.get('qr_string'):
+        qr_string = json_data['qr_string']
+    elif 'qr_string' in request.form:
         qr_string = request.form['qr_string']
     elif 'qr_image' in request.files:
-        try:
-            img = Image.open(io.BytesIO(request.files['qr_image'].read()))
-            decoded_objects = pyzbar.decode(img)
-            if decoded_objects:
-                qr_string = decoded_objects[0].data.decode('utf-8')
-
-            
-        except Exception as e:
-            return jsonify({'error': f'Ошибка обработки изображения: {str(e)}'}), 400
+        result = decode_qr_image(request.files['qr_image'].read())
+        if not result.qr_string:
+            return jsonify({'error': result.error}), 400
+        qr_string = result.qr_string
     else:
         return jsonify({'error': 'Необходимо передать qr_string или изображение чека.'}), 400
 
 
-    if not current_app.config.get('FNS_API_USERNAME') or not current_app.config.get('FNS_API_PASSWORD'):
+    if not _fns_configured():
         return jsonify({'error': 'Сервис QR-кодов не настроен на сервере.'}), 503
 
     try:
         parsed_data = parse_receipt_qr(qr_string)
         if parsed_data.get('error'):
             return jsonify(parsed_data), 400
-        
+
         return jsonify(parsed_data), 200
 
     except Exception as e:
@@ -53,4 +52,43 @@ def handle_parse_qr():
 
 
 
-        return jsonify({'error': f'Внутренняя ошибка сервера: {e}'}), 500
\ No newline at end of file
+        return jsonify({'error': f'Внутренняя ошибка сервера: {e}'}), 500
+
+
+@api_bp.route('/parse-qr/batch', methods=['POST'])
+def handle_parse_qr_batch():
+    """
+    Пакетное распознавание чеков: изображения передаются в multipart/form-data под ключом 'qr_images'.
+    Поле 'parse=0' отключает запрос данных чеков, тогда возвращаются только строки QR-кодов.
+    Возвращает {'results': [...]} в порядке файлов: filename, qr_string, receipt и error для каждого изображения.
+    """
+    files = request.files.getlist('qr_images')
+    if not files:
+        return jsonify({'error': 'Необходимо передать изображения чеков (qr_images).'}), 400
+    max_images = current_app.config.get('QR_BATCH_MAX_IMAGES', DEFAULT_BATCH_MAX_IMAGES)
+    if len(files) > max_images:
+        return jsonify({'error': f'За один запрос можно передать не больше {max_images} изображений.'}), 400
+
+    parse_receipts = request.form.get('parse', '1') != '0'
+    if parse_receipts and not _fns_configured():
+        return jsonify({'error': 'Сервис QR-кодов не настроен на сервере.'}), 503
+
+    decoded = decode_qr_images([file.read() for file in files])
+    results = [
+        {'filename': file.filename, 'qr_string': result.qr_string, 'receipt': None, 'error': result.error}
+        for file, result in zip(files, decoded)
+    ]
+
+    to_parse = [item for item in results if item['qr_string']] if parse_receipts else []
+    if to_parse:
+        # Запросы к API чеков ограничены по частоте, поэтому параллельно выполняется лишь несколько
+        workers = current_app.config.get('QR_RECEIPT_WORKERS', DEFAULT_RECEIPT_WORKERS)
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(to_parse)))) as executor:
+            receipts = list(executor.map(parse_receipt_qr, [item['qr_string'] for item in to_parse]))
+        for item, receipt in zip(to_parse, receipts):
+            if receipt.get('error'):
+                item['error'] = receipt['error']
+            else:
+                item['receipt'] = receipt
+
+    return jsonify({'results': results}), 200
@@ -42,6 +42,38 @@ def create_app():
     app.config['FNS_API_PASSWORD'] = os.environ.get('FNS_API_PASSWORD')
     # --- CryptoCompare News API Key ---
     app.config['CRYPTOCOMPARE_API_KEY'] = os.environ.get('CRYPTOCOMPARE_API_KEY')
+    # --- Секрет для эндпоинта cron-задач (/tasks/refresh-all/<secret_key>) ---
+    app.config['CRON_SECRET_KEY'] = os.environ.get('CRON_SECRET_KEY')
+    # Двухуровневый кэш JsonCache (services/json_cache.py)
+    app.config['JSON_CACHE_LRU_SIZE'] = int(os.environ.get('JSON_CACHE_LRU_SIZE', 64))
+    app.config['JSON_CACHE_COMPRESS_MIN_BYTES'] = int(os.environ.get('JSON_CACHE_COMPRESS_MIN_BYTES', 4096))
+    app.config['JSON_CACHE_REFRESH_LEASE_SECONDS'] = int(os.environ.get('JSON_CACHE_REFRESH_LEASE_SECONDS', 300))
+    # Как часто воркер перечитывает снимок курсов валют из JsonCache (services/currency_rates.py)
+    app.config['CURRENCY_RATES_RELOAD_SECONDS'] = int(os.environ.get('CURRENCY_RATES_RELOAD_SECONDS', 600))
+    # Материализованная сводка главной страницы (services/dashboard_service.py)
+    app.config['DASHBOARD_SNAPSHOT_ENABLED'] = os.environ.get('DASHBOARD_SNAPSHOT_ENABLED', '1') != '0'
+    app.config['DASHBOARD_SNAPSHOT_MAX_AGE_SECONDS'] = int(os.environ.get('DASHBOARD_SNAPSHOT_MAX_AGE_SECONDS', 900))
+    # За сколько дней до срока создаются долги из регулярных платежей (services/recurring_payments.py)
+    app.config['RECURRING_PAYMENTS_HORIZON_DAYS'] = int(os.environ.get('RECURRING_PAYMENTS_HORIZON_DAYS', 30))
+    # Срок жизни снимков рыночных данных досок MOEX во время торгов и вне их (services/moex_market_snapshot.py)
+    app.config['MOEX_SNAPSHOT_TTL_SECONDS'] = int(os.environ.get('MOEX_SNAPSHOT_TTL_SECONDS', 60))
+    app.config['MOEX_SNAPSHOT_CLOSED_TTL_SECONDS'] = int(os.environ.get('MOEX_SNAPSHOT_CLOSED_TTL_SECONDS', 1800))
+    # Количество параллельных запросов к API перевода при пакетном переводе новостей (translation_logic.py)
+    app.config['TRANSLATION_MAX_WORKERS'] = int(os.environ.get('TRANSLATION_MAX_WORKERS', 4))
+    # LRU переводов в памяти процесса и срок хранения кэша переводов в БД (translation_logic.py)
+    app.config['TRANSLATION_LRU_SIZE'] = int(os.environ.get('TRANSLATION_LRU_SIZE', 2048))
+    app.config['TRANSLATION_CACHE_RETENTION_DAYS'] = int(os.environ.get('TRANSLATION_CACHE_RETENTION_DAYS', 90))
+    app.config['TRANSLATION_CACHE_MAX_ROWS'] = int(os.environ.get('TRANSLATION_CACHE_MAX_ROWS', 50000))
+    # Глубина загрузки новых статей по курсору (страниц по 50) и порог дозагрузки тикера (services/news_store.py)
+    app.config['NEWS_FETCH_MAX_PAGES'] = int(os.environ.get('NEWS_FETCH_MAX_PAGES', 5))
+    app.config['NEWS_MIN_TICKER_ARTICLES'] = int(os.environ.get('NEWS_MIN_TICKER_ARTICLES', 30))
+    # Распознавание QR-кодов чеков в пуле процессов и пакетный эндпоинт (services/qr_decoder.py, api_routes.py)
+    app.config['QR_DECODE_WORKERS'] = int(os.environ.get('QR_DECODE_WORKERS', 2))
+    app.config['QR_DECODE_TIMEOUT_SECONDS'] = int(os.environ.get('QR_DECODE_TIMEOUT_SECONDS', 20))
+    app.config['QR_BATCH_MAX_IMAGES'] = int(os.environ.get('QR_BATCH_MAX_IMAGES', 20))
+    app.config['QR_RECEIPT_WORKERS'] = int(os.environ.get('QR_RECEIPT_WORKERS', 2))
+    # Размер пачки записи при фоновом импорте брокерских отчетов (services/report_import.py)
+    app.config['REPORT_IMPORT_CHUNK_SIZE'] = int(os.environ.get('REPORT_IMPORT_CHUNK_SIZE', 500))
 
     # --- Scheduler Configuration ---
     app.config['SCHEDULER_API_ENABLED'] = True
@@ -62,13 +94,32 @@ def create_app():
             'id': 'job_update_usdt_rub_rate',
             'func': 'background_tasks:update_usdt_rub_rate_in_background',
             'trigger': 'interval',
-            'hours': 1 # Обновлять курс каждый час
+            'hours': 1, # Обновлять курс каждый час
+            'next_run_time': datetime.now() # И сразу после старта, чтобы не ждать час с курсами по умолчанию
         },
         {
             'id': 'job_create_debts_from_recurring_payments',
             'func': 'background_tasks:create_debts_from_recurring_payments_in_background',
             'trigger': 'interval',
             'hours': 24 # Проверять и создавать долги каждый день
+        },
+        {
+            'id': 'job_refresh_balance_snapshots',
+            'func': 'background_tasks:refresh_balance_snapshots_in_background',
+            'trigger': 'interval',
+            'hours': 24 # Снимки балансов на начало месяца (services/account_ledger.py)
+        },
+        {
+            'id': 'job_refresh_moex_securities',
+            'func': 'background_tasks:refresh_moex_securities_in_background',
+            'trigger': 'interval',
+            'hours': 24 # Справочник инструментов MOEX для сопоставления ISIN -> SECID (services/moex_securities.py)
+        },
+        {
+            'id': 'job_prune_translation_cache',
+            'func': 'background_tasks:prune_translation_cache_in_background',
+            'trigger': 'interval',
+            'hours': 24 # Удаление старых записей кэша переводов
         }
     ]
 
@@ -120,11 +171,13 @@ def create_app():
         from api_routes import api_bp
         from commands import analytics_cli, seed_cli
         from securities_logic import securities_bp
+        from task import tasks_bp
 
         app.register_blueprint(main_bp)
         app.register_blueprint(auth_bp)
         app.register_blueprint(securities_bp)
         app.register_blueprint(api_bp, url_prefix='/api')
+        app.register_blueprint(tasks_bp)
         app.cli.add_command(analytics_cli)
         app.cli.add_command(seed_cli)
 
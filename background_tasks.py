@@ -1,22 +1,44 @@
-from flask import current_app
+from functools import wraps
+
+from flask import current_app, has_app_context
 import time
 import json
 
 from logic.news_analysis import get_news_trends_for_portfolio
-from news_logic import get_crypto_news, get_securities_news
+from news_logic import get_securities_news
 from logic.platform_sync_logic import sync_platform_balances, sync_platform_transactions
-from models import InvestmentPlatform, JsonCache
-from api_clients import fetch_usdt_rub_rate
-from routes.debts import _create_debt_from_recurring_payment
-from extensions import db
+from models import InvestmentPlatform
+from services.currency_rates import refresh_currency_rates
+from services.account_ledger import refresh_balance_snapshots
+from services.recurring_payments import materialize_recurring_payments
+from services.moex_securities import refresh_moex_securities
+from services.news_store import refresh_crypto_news
+from translation_logic import prune_translation_cache
+from extensions import db, scheduler
+
+
+def in_app_context(job):
+    """
+    Выполняет задачу планировщика в контексте приложения.
+    Flask-APScheduler 1.13 вызывает задачи в потоке планировщика без контекста приложения,
+    а задачи обращаются к current_app и db.session.
+    """
+    @wraps(job)
+    def wrapper(*args, **kwargs):
+        if has_app_context():
+            return job(*args, **kwargs)
+        with scheduler.app.app_context():
+            return job(*args, **kwargs)
+    return wrapper
 
 
+@in_app_context
 def update_all_news_in_background():
     """
     Фоновая задача для обновления и кэширования всех новостей.
     Эта функция будет запускаться планировщиком периодически.
     """
-    # flask-apscheduler автоматически предоставляет контекст приложения для фоновых задач.
+    # Контекст приложения предоставляет in_app_context.
     # Явное создание приложения через create_app() здесь не требуется и вызывает ошибку.
     current_app.logger.info("--- [BG_TASK] Запуск фонового обновления новостей ---")
     try:
@@ -24,20 +46,15 @@ def update_all_news_in_background():
         # Нам не нужны сами тренды, только список тикеров для обновления кэша.
         _, top_10_tickers = get_news_trends_for_portfolio()
 
-        # 2. Обновляем кэш для каждого тикера из топа.
-        if top_10_tickers:
-            for ticker in top_10_tickers:
-                current_app.logger.info(f"--- [BG_TASK] Обновление кэша новостей для: {ticker} ---")
-                get_crypto_news(categories=ticker, limit=30)
-
-        # 3. Обновляем кэш для общих крипто-новостей (используется на главной и странице новостей).
-        current_app.logger.info("--- [BG_TASK] Обновление кэша общих крипто-новостей ---")
-        get_crypto_news(limit=30)  # Для /crypto-news
-        get_crypto_news(limit=5)   # Для /crypto-assets (главная)
+        # 2. Загружаем новые статьи общей ленты по курсору; статьи тикеров приходят в ней же.
+        # Отдельно запрашиваются только тикеры, для которых в хранилище мало статей.
+        current_app.logger.info("--- [BG_TASK] Обновление хранилища крипто-новостей ---")
+        new_count = refresh_crypto_news(top_10_tickers or [])
+        current_app.logger.info(f"--- [BG_TASK] Новых крипто-новостей: {new_count} ---")
 
-        # 4. Обновляем кэш для новостей фондового рынка.
+        # 3. Обновляем кэш для новостей фондового рынка.
         current_app.logger.info("--- [BG_TASK] Обновление кэша новостей фондового рынка ---")
-        get_securities_news(limit=50)
+        get_securities_news(limit=50, force_refresh=True)
 
         current_app.logger.info("--- [BG_TASK] Фоновое обновление новостей завершено успешно. ---")
 
@@ -45,6 +62,7 @@ def update_all_news_in_background():
         current_app.logger.error(f"--- [BG_TASK] Ошибка во время фонового обновления новостей: {e}", exc_info=True)
 
 
+@in_app_context
 def sync_all_platforms_in_background():
     """
     Фоновая задача для обновления балансов и транзакций по всем активным крипто-платформам.
@@ -71,41 +89,66 @@ def sync_all_platforms_in_background():
         current_app.logger.error(f"--- [BG_TASK] Ошибка во время фонового обновления платформ: {e}", exc_info=True)
 
 
+@in_app_context
 def update_usdt_rub_rate_in_background():
-    """Фоновая задача для обновления курса USDT/RUB в кэше."""
-    current_app.logger.info("--- [BG_TASK] Запуск фонового обновления курса USDT/RUB ---")
-    try:        
-        rate = fetch_usdt_rub_rate()
-        if rate is not None:
-            cache_key = 'currency_rates'
-            cache_entry = JsonCache.query.filter_by(cache_key=cache_key).first()
-            if not cache_entry:
-                cache_entry = JsonCache(cache_key=cache_key)
-                db.session.add(cache_entry)
-
-            try:                
-                rates_data = json.loads(cache_entry.json_data) if cache_entry.json_data else {}
-            except (json.JSONDecodeError, TypeError):
-                rates_data = {}
-
-            rates_data['USDT'] = str(rate)
-            rates_data['USD'] = str(rate)
-
-            cache_entry.json_data = json.dumps(rates_data)
-            db.session.commit()
-            current_app.logger.info(f"--- [BG_TASK] Курс USDT/RUB успешно обновлен в кэше: {rate}")
-    except Exception as e:        
+    """Фоновая задача для обновления курсов валют (USD, EUR, CNY и др., USDT=USD) в кэше и снимке процесса."""
+    current_app.logger.info("--- [BG_TASK] Запуск фонового обновления курсов валют ---")
+    try:
+        success, message = refresh_currency_rates()
+        if success:
+            current_app.logger.info(f"--- [BG_TASK] {message}")
+        else:
+            current_app.logger.warning(f"--- [BG_TASK] {message}")
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"--- [BG_TASK] Ошибка во время фонового обновления курсов валют: {e}", exc_info=True)
+
+@in_app_context
+def refresh_moex_securities_in_background():
+    """Фоновая задача: загружает справочник инструментов MOEX (ISIN <-> SECID) из ISS."""
+    current_app.logger.info("--- [BG_TASK] Запуск обновления справочника инструментов MOEX ---")
+    try:
+        success, message = refresh_moex_securities()
+        if success:
+            current_app.logger.info(f"--- [BG_TASK] {message}")
+        else:
+            current_app.logger.warning(f"--- [BG_TASK] {message}")
+    except Exception as e:
         db.session.rollback()
-        current_app.logger.error(f"--- [BG_TASK] Ошибка во время фонового обновления курса USDT/RUB: {e}", exc_info=True)
+        current_app.logger.error(f"--- [BG_TASK] Ошибка при обновлении справочника инструментов MOEX: {e}", exc_info=True)
 
+@in_app_context
+def prune_translation_cache_in_background():
+    """Фоновая задача: удаляет устаревшие записи кэша переводов и записи сверх лимита."""
+    current_app.logger.info("--- [BG_TASK] Запуск очистки кэша переводов ---")
+    try:
+        deleted_count = prune_translation_cache()
+        current_app.logger.info(f"--- [BG_TASK] Кэш переводов очищен, удалено записей: {deleted_count}")
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"--- [BG_TASK] Ошибка при очистке кэша переводов: {e}", exc_info=True)
+
+@in_app_context
+def refresh_balance_snapshots_in_background():
+    """Фоновая задача: дописывает месячные снимки балансов счетов по журналу изменений."""
+    current_app.logger.info("--- [BG_TASK] Запуск обновления снимков балансов счетов ---")
+    try:
+        created_count = refresh_balance_snapshots()
+        current_app.logger.info(f"--- [BG_TASK] Снимки балансов обновлены, создано: {created_count}")
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"--- [BG_TASK] Ошибка при обновлении снимков балансов: {e}", exc_info=True)
+
+@in_app_context
 def create_debts_from_recurring_payments_in_background():
     """
-    Фоновая задача для создания долгов из регулярных платежей за месяц до их даты исполнения.
+    Фоновая задача для создания долгов из регулярных платежей за месяц до их даты исполнения
+    (горизонт RECURRING_PAYMENTS_HORIZON_DAYS), включая все пропущенные периоды.
     """
-    with current_app.app_context():
-        current_app.logger.info("--- [BG_TASK] Запуск фонового создания долгов из регулярных платежей ---")
-        from models import RecurringPayment
-        recurring_payments = RecurringPayment.query.all()
-        for payment in recurring_payments:
-            _create_debt_from_recurring_payment(payment)
-        current_app.logger.info("--- [BG_TASK] Фоновое создание долгов из регулярных платежей завершено. ---")
\ No newline at end of file
+    current_app.logger.info("--- [BG_TASK] Запуск фонового создания долгов из регулярных платежей ---")
+    try:
+        created_count, payments_count = materialize_recurring_payments()
+        current_app.logger.info(f"--- [BG_TASK] Фоновое создание долгов завершено: платежей {payments_count}, новых долгов {created_count}.")
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"--- [BG_TASK] Ошибка при создании долгов из регулярных платежей: {e}", exc_info=True)
@@ -1,4 +1,8 @@
+import glob
+import os
+
 import click
+from flask import current_app
 from flask.cli import AppGroup
 from analytics_logic import (
     refresh_crypto_price_change_data,
@@ -7,6 +11,18 @@ from analytics_logic import (
     refresh_performance_chart_data,
     refresh_securities_price_change_data
 )
+from logic.refresh_orchestrator import run_refresh_tasks, DEFAULT_REFRESH_JOBS
+from services.account_ledger import backfill_ledger, realign_opening_entries, refresh_balance_snapshots
+from services.analytics_rollup import rebuild_all_rollups
+from services.counterparty_balances import rebuild_all_counterparty_balances
+from services.counterparty_directory import rebuild_counterparties
+from services.moex_benchmark import DEFAULT_HISTORY_DAYS, run_securities_benchmark
+from services.moex_iss_emulator import load_recordings
+from services.moex_securities import refresh_moex_securities
+from services.transaction_search import rebuild_search_index
+from services.sql_helpers import check_analytics_indexes
+from securities_logic import benchmark_broker_report
+from translation_logic import prune_translation_cache
 from models import Bank, Category
 from extensions import db
 from data_seeds import DEFAULT_BANKS, DEFAULT_CATEGORIES
@@ -76,17 +92,129 @@ def refresh_all_history_command():
     print("\n--- ПЕРЕСЧЕТ ИСТОРИИ ПОРТФЕЛЕЙ ЗАВЕРШЕН ---")
 
 @analytics_cli.command('refresh-all')
-def refresh_all_command():
+@click.option('--jobs', '-j', default=DEFAULT_REFRESH_JOBS, show_default=True, type=int, help='Количество параллельно выполняемых задач.')
+@click.option('--only', 'only', multiple=True, help='Запустить только указанные задачи (можно через запятую или несколько раз).')
+@click.option('--user', 'user', default=None, help='ID или имя пользователя для задач, требующих пользователя.')
+def refresh_all_command(jobs, only, user):
     """Запускает все основные задачи по обновлению аналитических данных."""
     print("--- НАЧАЛО ПОЛНОГО ОБНОВЛЕНИЯ АНАЛИТИКИ ---")
-    for name, func in [
-        ("кэша цен криптоактивов", refresh_crypto_price_change_data),
-        ("графика производительности", refresh_performance_chart_data),
-        ("истории крипто-портфеля", refresh_crypto_portfolio_history),
-        ("истории портфеля ЦБ", refresh_securities_portfolio_history),
-        ("кэша цен ценных бумаг", refresh_securities_price_change_data)
-    ]:
-        print(f"\n-> Обновление {name}...")
-        success, message = func()
-        print(message)
-    print("\n--- ПОЛНОЕ ОБНОВЛЕНИЕ АНАЛИТИКИ ЗАВЕРШЕНО ---")
\ No newline at end of file
+    only_names = [name.strip() for value in only for name in value.split(',') if name.strip()]
+
+    def print_result(task, result):
+        status = 'OK' if result['success'] else 'FAIL'
+        print(f"\n-> [{status}] Обновление {task.label} ({task.name}) за {result['duration']:.2f} с: {result['message']}")
+
+    try:
+        results = run_refresh_tasks(jobs=jobs, only=only_names or None, user=user, on_result=print_result)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+
+    total = sum(result['duration'] for result in results.values())
+    failed = [name for name, result in results.items() if not result['success']]
+    print(f"\nСуммарное время задач: {total:.2f} с. Неуспешных задач: {len(failed)}{' (' + ', '.join(failed) + ')' if failed else ''}.")
+    print("\n--- ПОЛНОЕ ОБНОВЛЕНИЕ АНАЛИТИКИ ЗАВЕРШЕНО ---")
+
+@analytics_cli.command('refresh-moex-securities')
+def refresh_moex_securities_command():
+    """Загружает справочник инструментов MOEX (ISIN <-> SECID, доска, рынок) из ISS."""
+    print("Запуск загрузки справочника инструментов MOEX...")
+    success, message = refresh_moex_securities()
+    print(message)
+
+@analytics_cli.command('prune-translation-cache')
+@click.option('--days', '-d', default=None, type=int, help='Срок хранения в днях (по умолчанию TRANSLATION_CACHE_RETENTION_DAYS).')
+@click.option('--max-rows', default=None, type=int, help='Максимум записей (по умолчанию TRANSLATION_CACHE_MAX_ROWS).')
+def prune_translation_cache_command(days, max_rows):
+    """Удаляет устаревшие записи кэша переводов и самые старые записи сверх лимита."""
+    print("Запуск очистки кэша переводов...")
+    deleted_count = prune_translation_cache(days, max_rows)
+    print(f"Кэш переводов очищен: удалено {deleted_count} записей.")
+
+@analytics_cli.command('rebuild-rollup')
+def rebuild_rollup_command():
+    """Полностью перестраивает дневные агрегаты банковских операций для страницы аналитики."""
+    print("Запуск перестройки дневных агрегатов банковских операций...")
+    days_count = rebuild_all_rollups()
+    print(f"Агрегаты перестроены: пересчитано {days_count} дней по счетам.")
+
+@analytics_cli.command('rebuild-counterparties')
+def rebuild_counterparties_command():
+    """Заполняет справочник контрагентов для автодополнения из долгов, регулярных платежей и транзакций."""
+    print("Запуск перестройки справочника контрагентов...")
+    names_count = rebuild_counterparties()
+    print(f"Справочник перестроен: {names_count} имен.")
+
+@analytics_cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    """Перестраивает полнотекстовый индекс банковских операций и позиций чеков."""
+    print("Запуск перестройки поискового индекса операций...")
+    indexed_count = rebuild_search_index()
+    print(f"Поисковый индекс перестроен: {indexed_count} операций.")
+
+@analytics_cli.command('backfill-ledger')
+def backfill_ledger_command():
+    """Сверяет журнал изменений балансов с операциями и балансами счетов, переносит начальные балансы раньше первой операции и дописывает месячные снимки."""
+    print("Запуск сверки журнала балансов счетов...")
+    accounts_count, entries_count = backfill_ledger()
+    moved_count = realign_opening_entries()
+    snapshots_count = refresh_balance_snapshots()
+    print(f"Журнал сверен: изменено счетов {accounts_count}, записей {entries_count}; перенесено начальных балансов: {moved_count}; новых снимков: {snapshots_count}.")
+
+@analytics_cli.command('rebuild-counterparty-balances')
+def rebuild_counterparty_balances_command():
+    """Перестраивает агрегаты по контрагентам для страницы долгов и истории по контрагенту."""
+    print("Запуск перестройки агрегатов по контрагентам...")
+    counterparties_count = rebuild_all_counterparty_balances()
+    print(f"Агрегаты перестроены: {counterparties_count} контрагентов.")
+
+@analytics_cli.command('benchmark-broker-parsers')
+@click.argument('files', nargs=-1, type=click.Path(exists=True, dir_okay=False))
+@click.option('--repeat', '-r', default=3, show_default=True, type=int, help='Количество повторов, берется лучшее время.')
+def benchmark_broker_parsers_command(files, repeat):
+    """Замеряет разбор брокерских XLS-отчетов (по умолчанию - образцы B_k-*.xls и Brokersk.xls из корня проекта)."""
+    if not files:
+        files = sorted(glob.glob(os.path.join(current_app.root_path, 'B_k-*.xls')))
+        files += [path for path in [os.path.join(current_app.root_path, 'Brokersk.xls')] if os.path.exists(path)]
+    if not files:
+        raise click.ClickException("Не найдены файлы отчетов для замера.")
+    for path in files:
+        print(f"\n{os.path.basename(path)}:")
+        total = 0.0
+        for stage, elapsed, outcome in benchmark_broker_report(path, repeat):
+            total += elapsed
+            print(f"  {stage:<36} {elapsed * 1000:9.1f} мс   {outcome}")
+        print(f"  {'Итого':<36} {total * 1000:9.1f} мс")
+
+@analytics_cli.command('benchmark-moex')
+@click.option('--sizes', '-s', default='10,100,1000', show_default=True, help='Размеры портфелей (количество инструментов) через запятую.')
+@click.option('--days', '-d', default=DEFAULT_HISTORY_DAYS, show_default=True, type=int, help='Глубина истории сделок в днях.')
+@click.option('--recordings', type=click.Path(exists=True, dir_okay=False), help='JSON с записанными ответами ISS {путь: ответ}.')
+@click.option('--verbose', '-v', is_flag=True, help='Не скрывать вывод функций цепочки.')
+def benchmark_moex_command(sizes, days, recordings, verbose):
+    """Замеряет цепочку ценных бумаг MOEX на эмуляторе ISS: время и число запросов к ISS по операциям."""
+    try:
+        size_list = [int(size) for size in sizes.split(',') if size.strip()]
+    except ValueError:
+        raise click.UsageError(f"Некорректный список размеров: {sizes}")
+
+    def print_result(result):
+        print(f"  {result.size:>5} {result.operation:<52} {result.seconds * 1000:10.1f} мс {result.requests:7} запр.   {result.result}")
+
+    print(f"{'Инстр.':>7} {'Операция':<52} {'Время':>13} {'ISS':>12}")
+    run_securities_benchmark(size_list, days, load_recordings(recordings) if recordings else None, verbose, on_result=print_result)
+
+@analytics_cli.command('check-indexes')
+@click.option('--verbose', '-v', is_flag=True, help='Печатать полный план каждого запроса.')
+def check_indexes_command(verbose):
+    """Проверяет через EXPLAIN, что запросы аналитики используют составные индексы."""
+    results = check_analytics_indexes()
+    for result in results:
+        status = 'OK' if result['used'] else 'FAIL'
+        print(f"[{status}] {result['name']}: ожидается {result['index']}")
+        if verbose or not result['used']:
+            for line in result['plan']:
+                print(f"    {line}")
+    failed = [result['name'] for result in results if not result['used']]
+    if failed:
+        raise click.ClickException(f"Индексы не используются в запросах: {', '.join(failed)}")
+    print("Все запросы аналитики используют ожидаемые индексы.")
@@ -0,0 +1,150 @@
+"""
+Локальный анализ тональности финансовых новостей по словарю, без обращения к сети.
+
+Замена get_sentiment_g4f (logic/llm_sentiment_logic.py): удаленный вызов LLM медленный и
+ненадежный и отключен. Оценка строится как в VADER: сумма весов слов словаря с учетом
+отрицаний ("not", "не", "без" меняют знак следующих слов) и усилителей ("sharply", "резко"),
+нормированная в compound от -1.0 до 1.0. Английские слова ищутся с отбрасыванием окончаний
+-s/-es/-ed/-ing, русские - по основе (самый длинный префикс слова, найденный в словаре).
+
+Пакет текстов обрабатывается векторно: вес каждого различного слова вычисляется один раз,
+суммы по текстам считаются через numpy.
+"""
+import re
+from functools import lru_cache
+from itertools import chain
+
+import numpy as np
+
+# Нормировка суммы весов, как в VADER: compound = s / sqrt(s^2 + alpha)
+NORMALIZATION_ALPHA = 15
+# Множитель для слов после отрицания и число слов, на которые оно действует
+NEGATION_SCALAR = -0.74
+NEGATION_WINDOW = 3
+BOOSTER_SCALAR = 1.3
+# Заголовок короче текста, но лучше передает тональность новости
+TITLE_WEIGHT = 2.0
+_MIN_RU_STEM = 3
+
+_TOKEN_RE = re.compile(r"[a-zа-яё]+(?:['’][a-z]+)?")
+
+EN_LEXICON = {
+    # Позитив
+    'surge': 2.5, 'soar': 2.7, 'rally': 2.3, 'gain': 1.8, 'bullish': 2.5, 'rise': 1.5, 'jump': 1.8,
+    'record': 1.5, 'high': 0.8, 'growth': 1.8, 'grow': 1.5, 'profit': 2.0, 'profitable': 2.2, 'adoption': 1.8,
+    'adopt': 1.5, 'approve': 2.2, 'approval': 2.2, 'partnership': 1.6, 'partner': 1.2, 'launch': 1.2,
+    'upgrade': 1.5, 'boost': 2.0, 'recover': 1.8, 'recovery': 1.8, 'rebound': 2.0, 'outperform': 2.0,
+    'breakout': 2.0, 'win': 2.0, 'success': 2.2, 'successful': 2.2, 'strong': 1.5, 'optimism': 2.0,
+    'optimistic': 2.0, 'inflow': 1.8, 'accumulate': 1.2, 'beat': 1.2, 'positive': 1.8, 'support': 1.0,
+    'integrate': 1.0, 'integration': 1.0, 'expansion': 1.5, 'expand': 1.3, 'milestone': 1.8, 'upside': 1.8,
+    'uptrend': 2.0, 'climb': 1.6, 'soaring': 2.7, 'top': 0.8, 'innovation': 1.2, 'secure': 1.0, 'legal': 0.8,
+    'green': 0.8, 'greenlight': 2.0, 'institutional': 0.8, 'bull': 1.8, 'moon': 1.8, 'gainer': 1.8, 'dividend': 1.2,
+    # Негатив
+    'crash': -3.0, 'plunge': -2.8, 'drop': -1.8, 'fall': -1.8, 'slump': -2.5, 'bearish': -2.5, 'decline': -1.8,
+    'loss': -2.0, 'lose': -1.8, 'hack': -2.8, 'hacker': -2.5, 'exploit': -2.5, 'scam': -3.0, 'fraud': -3.0,
+    'lawsuit': -2.2, 'sue': -2.0, 'ban': -2.3, 'crackdown': -2.5, 'fined': -2.0, 'liquidation': -2.2,
+    'liquidate': -2.0, 'selloff': -2.5, 'dump': -2.3, 'fear': -2.0, 'warning': -1.5, 'warn': -1.5,
+    'risk': -1.2, 'risky': -1.5, 'outflow': -1.8, 'bankrupt': -3.0, 'bankruptcy': -3.0, 'collapse': -3.0,
+    'stolen': -2.8, 'steal': -2.5, 'theft': -2.8, 'investigation': -1.5, 'probe': -1.5, 'charge': -1.0,
+    'delay': -1.2, 'reject': -2.0, 'rejection': -2.0, 'weak': -1.5, 'weakness': -1.5, 'volatility': -0.8,
+    'uncertainty': -1.5, 'downturn': -2.2, 'crisis': -2.5, 'default': -2.5, 'sanction': -2.0, 'penalty': -2.0,
+    'tumble': -2.5, 'sink': -2.0, 'slide': -1.6, 'downtrend': -2.0, 'bear': -1.8, 'panic': -2.7, 'losses': -2.0,
+    'concern': -1.3, 'pressure': -1.0, 'vulnerability': -2.0, 'attack': -2.2, 'illegal': -2.3, 'halt': -1.8,
+    'suspend': -1.8, 'shutdown': -2.0, 'layoff': -2.0, 'downside': -1.8, 'correction': -1.2, 'red': -0.8,
+}
+
+# Основы слов: слово из текста сопоставляется с самой длинной основой, с которой оно начинается
+RU_STEMS = {
+    # Позитив
+    'рост': 1.8, 'вырос': 1.8, 'выраст': 1.8, 'раст': 1.3, 'подорож': 1.5, 'укреп': 1.8, 'прибыл': 2.0,
+    'рекорд': 1.5, 'одобр': 2.2, 'запуск': 1.2, 'запуст': 1.2, 'партнер': 1.5, 'партнёр': 1.5, 'восстанов': 1.8,
+    'позитив': 1.8, 'оптимизм': 2.0, 'оптимист': 2.0, 'бычь': 2.3, 'приток': 1.8, 'дивиденд': 1.5, 'повыш': 1.5,
+    'повыс': 1.5, 'увелич': 1.3, 'успе': 2.0, 'сильн': 1.3, 'выигр': 2.0, 'взлет': 2.5, 'взлёт': 2.5,
+    'ралли': 2.3, 'подъем': 1.8, 'подъём': 1.8, 'поддерж': 1.0, 'расшир': 1.3, 'максимум': 1.0, 'прорыв': 2.0,
+    'улучш': 1.8, 'внедр': 1.0, 'превзош': 2.0, 'превыс': 1.3, 'выгод': 1.5, 'стабилиз': 1.0, 'интерес': 0.8,
+    # Негатив
+    'паден': -2.0, 'упал': -2.0, 'упад': -2.0, 'пада': -1.8, 'снижен': -1.5, 'сниз': -1.5, 'сниж': -1.5,
+    'обвал': -3.0, 'убыт': -2.2, 'мошен': -3.0, 'взлом': -2.8, 'украд': -2.8, 'украл': -2.8, 'краж': -2.8,
+    'хищен': -2.8, 'запрет': -2.3, 'запрещ': -2.3, 'штраф': -2.0, 'санкц': -2.0, 'банкрот': -3.0,
+    'крах': -3.0, 'кризис': -2.5, 'риск': -1.2, 'медвеж': -2.3, 'отток': -1.8, 'ликвидац': -2.0,
+    'дефолт': -2.8, 'подешев': -1.8, 'ослаб': -1.8, 'потер': -2.0, 'угроз': -2.0, 'расследов': -1.5,
+    'обвин': -2.0, 'давлен': -1.0, 'неопредел': -1.5, 'волатил': -0.8, 'отклон': -1.5, 'спад': -2.0,
+    'рецесс': -2.5, 'инфляц': -1.0, 'минимум': -1.0, 'распрод': -2.0, 'паник': -2.7, 'атак': -2.2,
+    'опасен': -1.8, 'опасн': -1.8, 'приостанов': -1.8, 'задерж': -1.2, 'дефицит': -1.5, 'просед': -1.8,
+    'обесцен': -2.2, 'сокращ': -1.3, 'негатив': -1.8, 'тревож': -1.8, 'провал': -2.5, 'ухудш': -1.8,
+}
+
+NEGATIONS = frozenset({'not', 'no', 'never', 'without', 'nor', 'neither', 'hardly',
+                       'не', 'нет', 'без', 'ни', 'никогда'})
+BOOSTERS = frozenset({'very', 'sharply', 'significantly', 'massive', 'massively', 'huge', 'extremely', 'strongly',
+                      'резко', 'сильно', 'значительно', 'рекордно', 'очень', 'крайне', 'существенно', 'масштабно'})
+
+_EN_SUFFIXES = ('ing', 'ed', 'es', 's', 'd')
+
+
+@lru_cache(maxsize=65536)
+def token_valence(token: str) -> float:
+    """Вес слова по словарю, 0.0 - слово не найдено."""
+    if token in EN_LEXICON:
+        return EN_LEXICON[token]
+    if token.isascii():
+        for suffix in _EN_SUFFIXES:
+            if token.endswith(suffix) and token[:-len(suffix)] in EN_LEXICON:
+                return EN_LEXICON[token[:-len(suffix)]]
+        # surging -> surge, approved -> approve
+        for suffix in ('ing', 'ed'):
+            if token.endswith(suffix) and token[:-len(suffix)] + 'e' in EN_LEXICON:
+                return EN_LEXICON[token[:-len(suffix)] + 'e']
+        return 0.0
+    for length in range(len(token), _MIN_RU_STEM - 1, -1):
+        valence = RU_STEMS.get(token[:length])
+        if valence is not None:
+            return valence
+    return 0.0
+
+
+def _is_negation(token: str) -> bool:
+    return token in NEGATIONS or token.endswith("n't") or token.endswith("n’t")
+
+
+def valence_sums(texts: list) -> np.ndarray:
+    """Суммы весов слов для каждого текста пакета (с учетом отрицаний и усилителей)."""
+    tokenized = [_TOKEN_RE.findall(text.lower()) if isinstance(text, str) else [] for text in texts]
+    flat = list(chain.from_iterable(tokenized))
+    if not flat:
+        return np.zeros(len(texts))
+    doc_ids = np.repeat(np.arange(len(texts)), [len(tokens) for tokens in tokenized])
+
+    # Вес, признак отрицания и усилителя вычисляются один раз для каждого различного слова
+    vocabulary = {}
+    token_ids = np.fromiter((vocabulary.setdefault(token, len(vocabulary)) for token in flat), dtype=np.int64, count=len(flat))
+    words = list(vocabulary)
+    values = np.array([token_valence(word) for word in words])[token_ids]
+    negations = np.array([_is_negation(word) for word in words])[token_ids]
+    boosters = np.array([word in BOOSTERS for word in words])[token_ids]
+
+    # Отрицание действует на NEGATION_WINDOW следующих слов того же текста, усилитель - на одно
+    for shift in range(1, NEGATION_WINDOW + 1):
+        affected = np.zeros(len(flat), dtype=bool)
+        affected[shift:] = negations[:-shift] & (doc_ids[shift:] == doc_ids[:-shift])
+        values[affected] *= NEGATION_SCALAR
+    boosted = np.zeros(len(flat), dtype=bool)
+    boosted[1:] = boosters[:-1] & (doc_ids[1:] == doc_ids[:-1])
+    values[boosted] *= BOOSTER_SCALAR
+
+    return np.bincount(doc_ids, weights=values, minlength=len(texts))
+
+
+def normalize(sums: np.ndarray) -> np.ndarray:
+    return sums / np.sqrt(sums * sums + NORMALIZATION_ALPHA)
+
+
+def score_texts(texts: list) -> list[float]:
+    """Compound от -1.0 (негатив) до 1.0 (позитив) для каждого текста."""
+    return [round(float(score), 4) for score in normalize(valence_sums(texts))]
+
+
+def score_articles(titles: list, bodies: list) -> list[float]:
+    """Compound для пакета новостей: заголовок учитывается с весом TITLE_WEIGHT."""
+    sums = TITLE_WEIGHT * valence_sums(titles) + valence_sums(bodies)
+    return [round(float(score), 4) for score in normalize(sums)]
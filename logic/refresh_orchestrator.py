@@ -0,0 +1,155 @@
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from flask import current_app
+from flask_login import login_user
+
+from models import User
+from analytics_logic import (
+    refresh_securities_portfolio_history,
+    refresh_crypto_portfolio_history,
+    refresh_securities_price_change_data,
+    refresh_crypto_price_change_data,
+    refresh_performance_chart_data,
+    refresh_market_leaders_cache
+)
+
+# Описание одной задачи обновления.
+# depends_on - имена задач, которые должны успешно завершиться до запуска этой.
+# requires_user - задача читает current_user и без пользователя не имеет смысла.
+# serial - задача очищает и перезаписывает общие таблицы (HistoricalPriceCache, истории портфелей без user_id):
+# такие задачи выполняются по одной в порядке объявления, параллельно с ними идут только остальные.
+RefreshTask = namedtuple('RefreshTask', ['name', 'label', 'func', 'depends_on', 'requires_user', 'serial'],
+                         defaults=(False,))
+
+# Истории портфелей не читают кэш цен, поэтому зависимости по данным между задачами нет:
+# история объявлена после обновления цен и благодаря serial запускается после него,
+# но не пропускается, если обновление цен не удалось (например, все активы проданы).
+REFRESH_TASKS = [
+    RefreshTask('crypto_price_change', 'кэша цен криптоактивов', refresh_crypto_price_change_data, (), False, True),
+    RefreshTask('securities_price_change', 'кэша цен ценных бумаг', refresh_securities_price_change_data, (), False, True),
+    RefreshTask('performance_chart', 'графика производительности', refresh_performance_chart_data, (), False),
+    RefreshTask('market_leaders', 'кэша лидеров рынка', refresh_market_leaders_cache, (), False),
+    RefreshTask('crypto_portfolio_history', 'истории крипто-портфеля', refresh_crypto_portfolio_history, (), True, True),
+    RefreshTask('securities_portfolio_history', 'истории портфеля ЦБ', refresh_securities_portfolio_history, (), True, True),
+]
+
+DEFAULT_REFRESH_JOBS = 4
+
+
+def _tasks_by_name() -> dict:
+    tasks = {task.name: task for task in REFRESH_TASKS}
+    for task in REFRESH_TASKS:
+        unknown = [dep for dep in task.depends_on if dep not in tasks]
+        if unknown:
+            raise ValueError(f"Задача '{task.name}' зависит от неизвестных задач: {unknown}")
+    return tasks
+
+
+def select_refresh_tasks(only: list[str] | None = None) -> list[RefreshTask]:
+    """
+    Возвращает задачи для запуска в порядке объявления.
+    Если передан список only, в выборку попадают указанные задачи и все их зависимости.
+    """
+    tasks = _tasks_by_name()
+    if not only:
+        return list(REFRESH_TASKS)
+
+    unknown = [name for name in only if name not in tasks]
+    if unknown:
+        raise ValueError(f"Неизвестные задачи: {', '.join(unknown)}. Доступны: {', '.join(tasks)}")
+
+    selected = set()
+    stack = list(only)
+    while stack:
+        name = stack.pop()
+        if name in selected:
+            continue
+        selected.add(name)
+        stack.extend(tasks[name].depends_on)
+    return [task for task in REFRESH_TASKS if task.name in selected]
+
+
+def _resolve_user_id(user) -> int | None:
+    """Принимает id или имя пользователя и возвращает id."""
+    if user is None or user == '':
+        return None
+    if isinstance(user, User):
+        return user.id
+    user_obj = User.query.get(int(user)) if str(user).isdigit() else User.query.filter_by(username=str(user)).first()
+    if not user_obj:
+        raise ValueError(f"Пользователь '{user}' не найден.")
+    return user_obj.id
+
+
+def _run_refresh_task(app, task: RefreshTask, user_id: int | None) -> dict:
+    """Выполняет одну задачу в собственном контексте приложения (и запроса, если нужен пользователь)."""
+    started = time.monotonic()
+    try:
+        if user_id is not None:
+            with app.test_request_context():
+                login_user(User.query.get(user_id))
+                success, message = task.func()
+        else:
+            with app.app_context():
+                success, message = task.func()
+    except Exception as e:
+        app.logger.error(f"--- [Refresh] Задача '{task.name}' завершилась с ошибкой: {e}", exc_info=True)
+        success, message = False, f"Ошибка: {e}"
+    return {'success': success, 'message': message, 'duration': round(time.monotonic() - started, 3)}
+
+
+def run_refresh_tasks(jobs: int = DEFAULT_REFRESH_JOBS, only: list[str] | None = None, user=None, on_result=None) -> dict:
+    """
+    Запускает задачи обновления аналитики с учетом зависимостей.
+    Независимые задачи выполняются параллельно в пуле из jobs потоков, задачи с serial=True - по одной.
+    Возвращает словарь {имя задачи: {'success', 'message', 'duration'}}.
+    on_result(task, result) вызывается по мере завершения каждой задачи.
+    """
+    app = current_app._get_current_object()
+    tasks = select_refresh_tasks(only)
+    user_id = _resolve_user_id(user)
+    selected_names = {task.name for task in tasks}
+
+    results = {}
+    pending = {task.name: task for task in tasks}
+    running = {}
+
+    def finish(task, result):
+        results[task.name] = result
+        if on_result:
+            on_result(task, result)
+
+    with ThreadPoolExecutor(max_workers=max(1, int(jobs))) as executor:
+        while pending or running:
+            for name, task in list(pending.items()):
+                deps = [dep for dep in task.depends_on if dep in selected_names]
+                if not all(dep in results for dep in deps):
+                    continue
+                if task.serial and any(other.serial for other in running.values()):
+                    continue
+                del pending[name]
+                failed_deps = [dep for dep in deps if not results[dep]['success']]
+                if failed_deps:
+                    finish(task, {'success': False, 'message': f"Пропущено: не выполнены зависимости {', '.join(failed_deps)}", 'duration': 0.0})
+                elif task.requires_user and user_id is None:
+                    finish(task, {'success': False, 'message': "Пропущено: задача требует указания пользователя.", 'duration': 0.0})
+                else:
+                    app.logger.info(f"--- [Refresh] Запуск задачи '{task.name}'...")
+                    running[executor.submit(_run_refresh_task, app, task, user_id)] = task
+
+            if not running:
+                if pending:
+                    # Сюда попадаем только при циклической зависимости
+                    raise ValueError(f"Циклическая зависимость между задачами: {', '.join(pending)}")
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                task = running.pop(future)
+                result = future.result()
+                app.logger.info(f"--- [Refresh] Задача '{task.name}' завершена за {result['duration']} с: {result['message']}")
+                finish(task, result)
+
+    return {task.name: results[task.name] for task in tasks}
@@ -0,0 +1,78 @@
+"""add full-text search index for banking transactions
+
+Revision ID: f8a9b0c1d2e4
+Revises: e7f8a9b0c1d2
+Create Date: 2026-10-19 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'f8a9b0c1d2e4'
+down_revision = 'e7f8a9b0c1d2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Поисковый индекс зависит от СУБД (см. services/transaction_search.py)
+    if op.get_bind().dialect.name == 'postgresql':
+        op.create_table('banking_transaction_search',
+        sa.Column('transaction_id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('body', sa.Text(), nullable=False),
+        sa.Column('document', postgresql.TSVECTOR(), nullable=False),
+        sa.PrimaryKeyConstraint('transaction_id')
+        )
+        op.create_index('ix_banking_transaction_search_user_id', 'banking_transaction_search', ['user_id'], unique=False)
+        op.create_index('ix_banking_transaction_search_document', 'banking_transaction_search', ['document'], unique=False, postgresql_using='gin')
+    else:
+        op.execute(
+            "CREATE VIRTUAL TABLE banking_transaction_fts USING fts5("
+            "user_id UNINDEXED, description, merchant, counterparty, items, "
+            "tokenize = 'unicode61 remove_diacritics 2')"
+        )
+
+    # Заполняем индекс существующими операциями
+    bind = op.get_bind()
+    documents = bind.execute(sa.text(
+        "SELECT t.id AS transaction_id, a.user_id AS user_id, "
+        "COALESCE(t.description, '') AS description, COALESCE(t.merchant, '') AS merchant, "
+        "COALESCE(t.counterparty, '') AS counterparty "
+        "FROM banking_transaction t JOIN account a ON a.id = t.account_id"
+    )).mappings().all()
+    item_names = {}
+    for transaction_id, name in bind.execute(sa.text("SELECT transaction_id, name FROM transaction_item")):
+        item_names.setdefault(transaction_id, []).append(name)
+    documents = [
+        {key: value.replace('ё', 'е').replace('Ё', 'Е') if isinstance(value, str) else value
+         for key, value in dict(doc, items=' '.join(item_names.get(doc['transaction_id'], []))).items()}
+        for doc in documents
+    ]
+    if not documents:
+        return
+    if bind.dialect.name == 'postgresql':
+        bind.execute(sa.text(
+            "INSERT INTO banking_transaction_search (transaction_id, user_id, body, document) VALUES ("
+            ":transaction_id, :user_id, concat_ws(' ', :description, :merchant, :counterparty, :items), "
+            "setweight(to_tsvector('russian', :description), 'A') || "
+            "setweight(to_tsvector('russian', :merchant || ' ' || :counterparty), 'B') || "
+            "setweight(to_tsvector('russian', :items), 'C'))"
+        ), documents)
+    else:
+        bind.execute(sa.text(
+            "INSERT INTO banking_transaction_fts (rowid, user_id, description, merchant, counterparty, items) "
+            "VALUES (:transaction_id, :user_id, :description, :merchant, :counterparty, :items)"
+        ), documents)
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.drop_index('ix_banking_transaction_search_document', table_name='banking_transaction_search', postgresql_using='gin')
+        op.drop_index('ix_banking_transaction_search_user_id', table_name='banking_transaction_search')
+        op.drop_table('banking_transaction_search')
+    else:
+        op.execute("DROP TABLE banking_transaction_fts")
@@ -228,6 +228,13 @@ class Debt(db.Model):
 
     recurring_payment_ref = db.relationship('RecurringPayment', backref=db.backref('debts', lazy='dynamic'))
 
+    __table_args__ = (
+        # История по контрагенту и пересчет агрегатов CounterpartyBalance
+        db.Index('ix_debt_user_counterparty_created', 'user_id', 'counterparty', 'created_at'),
+        # Проверка уже созданных периодов регулярных платежей (services/recurring_payments.py)
+        db.Index('ix_debt_recurring_payment_due', 'recurring_payment_id', 'due_date'),
+    )
+
     def __repr__(self):
         return f'<Debt {self.id} from/to {self.counterparty}>'
 
@@ -254,6 +261,17 @@ class BankingTransaction(db.Model):
     # Связь с элементами транзакции (для покупок)
     items = db.relationship('TransactionItem', back_populates='transaction', cascade="all, delete-orphan")
 
+    # Составные индексы под фильтры аналитики и списков операций (проверка: flask analytics check-indexes)
+    __table_args__ = (
+        db.Index('ix_banking_transaction_account_date', 'account_id', 'date'),
+        # Покрывающий индекс для сумм по типам операций счета за период
+        db.Index('ix_banking_transaction_account_type_date', 'account_id', 'transaction_type', 'date', 'amount'),
+        db.Index('ix_banking_transaction_category_date', 'category_id', 'date'),
+        db.Index('ix_banking_transaction_merchant', 'merchant'),
+        # История по контрагенту: (counterparty = X OR merchant = X) ORDER BY date
+        db.Index('ix_banking_transaction_counterparty_date', 'counterparty', 'date'),
+    )
+
     def __repr__(self):
         return f'<BankingTransaction {self.id} {self.transaction_type} {self.amount}>'
 class HistoricalPriceCache(db.Model):
@@ -289,11 +307,36 @@ class MoexHistoricalPrice(db.Model):
     price_rub = db.Column(db.Numeric(20, 8), nullable=False)
     __table_args__ = (db.UniqueConstraint('isin', 'date', name='_moex_isin_date_uc'),)
 
+class MoexSecurity(db.Model):
+    """Справочник инструментов MOEX, загружается из ISS раз в сутки (см. services/moex_securities.py)."""
+    __tablename__ = 'moex_security'
+    id = db.Column(db.Integer, primary_key=True)
+    secid = db.Column(db.String(36), nullable=False, unique=True, index=True)
+    isin = db.Column(db.String(32), nullable=True, index=True)
+    shortname = db.Column(db.String(128))
+    name = db.Column(db.String(255))
+    security_group = db.Column(db.String(32))  # 'stock_shares', 'stock_bonds', 'stock_etf', ...
+    primary_boardid = db.Column(db.String(16))
+    engine = db.Column(db.String(16))
+    market = db.Column(db.String(16))
+    asset_type = db.Column(db.String(16), nullable=False, default='other')
+    is_traded = db.Column(db.Boolean, nullable=False, default=False)
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+
+    def __repr__(self):
+        return f'<MoexSecurity {self.secid} {self.isin}>'
+
 class JsonCache(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     cache_key = db.Column(db.String(128), nullable=False, unique=True, index=True)
     json_data = db.Column(db.Text, nullable=False)
     last_updated = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+    # Номер версии данных: увеличивается при каждой записи, 0 - данных еще нет
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # json_data хранится как base64(zlib(json))
+    is_compressed = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+    # Время захвата обновления ключа одним из воркеров (single-flight)
+    refresh_started_at = db.Column(db.DateTime, nullable=True)
 
     def __repr__(self):
         return f'<JsonCache {self.cache_key}>'
@@ -306,7 +349,7 @@ class TransactionItem(db.Model):
     price = db.Column(db.Numeric(20, 2), nullable=False)
     total = db.Column(db.Numeric(20, 2), nullable=False)
     
-    transaction_id = db.Column(db.Integer, db.ForeignKey('banking_transaction.id'), nullable=False)
+    transaction_id = db.Column(db.Integer, db.ForeignKey('banking_transaction.id'), nullable=False, index=True)
     category_id = db.Column(db.Integer, db.ForeignKey('category.id'), nullable=True)
     
     transaction = db.relationship('BankingTransaction', back_populates='items')
@@ -328,14 +371,16 @@ class TranslationCache(db.Model):
     __tablename__ = 'translation_cache'
     id = db.Column(db.Integer, primary_key=True)
     # Хэш используется как быстрый и уникальный ключ для оригинального текста
-    source_hash = db.Column(db.String(32), nullable=False, index=True)
+    source_hash = db.Column(db.String(32), nullable=False)
     source_lang = db.Column(db.String(10), nullable=False)
     target_lang = db.Column(db.String(10), nullable=False)
     translated_text = db.Column(db.Text, nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # По дате создания удаляются устаревшие записи (prune_translation_cache в translation_logic.py)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
 
 
-    # Гарантируем, что для одной и той же фразы и пары языков будет только одна запись
+    # Гарантируем, что для одной и той же фразы и пары языков будет только одна запись.
+    # Уникальный индекс по трем колонкам обслуживает и поиск перевода, отдельный индекс по source_hash не нужен.
     __table_args__ = (
         db.UniqueConstraint('source_hash', 'source_lang', 'target_lang', name='_source_hash_lang_uc'),
     )
@@ -343,6 +388,64 @@ class TranslationCache(db.Model):
     def __repr__(self):
         return f'<TranslationCache {self.source_hash} [{self.source_lang}->{self.target_lang}]>'
 
+class HttpFetchState(db.Model):
+    """
+    Валидаторы последнего обработанного ответа источника (см. services/conditional_fetch.py).
+    url_hash - MD5 URL с параметрами запроса без секретов.
+    """
+    __tablename__ = 'http_fetch_state'
+    id = db.Column(db.Integer, primary_key=True)
+    url_hash = db.Column(db.String(32), nullable=False, unique=True, index=True)
+    url = db.Column(db.Text, nullable=False)
+    etag = db.Column(db.String(255))
+    last_modified = db.Column(db.String(64))
+    # SHA-256 тела ответа
+    content_hash = db.Column(db.String(64))
+    checked_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+
+    def __repr__(self):
+        return f'<HttpFetchState {self.url}>'
+
+class NewsArticle(db.Model):
+    """
+    Новость CryptoCompare, хранится один раз независимо от того, в скольких лентах она встретилась
+    (см. services/news_store.py). url_hash - MD5 ссылки на статью.
+    """
+    __tablename__ = 'news_article'
+    id = db.Column(db.Integer, primary_key=True)
+    url_hash = db.Column(db.String(32), nullable=False, unique=True, index=True)
+    url = db.Column(db.Text, nullable=False)
+    title = db.Column(db.Text, nullable=False)
+    body = db.Column(db.Text)
+    title_ru = db.Column(db.Text)
+    body_ru = db.Column(db.Text)
+    source_name = db.Column(db.String(128))
+    image_url = db.Column(db.Text)
+    # Тональность от -1.0 до 1.0 (logic/lexicon_sentiment_logic.py), None - еще не оценена
+    sentiment_compound = db.Column(db.Float, nullable=True)
+    published_at = db.Column(db.DateTime, nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+
+    def __repr__(self):
+        return f'<NewsArticle {self.url_hash} {self.published_at}>'
+
+class NewsArticleCategory(db.Model):
+    """
+    Связь новости с тикером или категорией CryptoCompare (многие ко многим).
+    published_at дублирует дату новости, чтобы лента категории читалась по одному индексу.
+    """
+    __tablename__ = 'news_article_category'
+    article_id = db.Column(db.Integer, db.ForeignKey('news_article.id', ondelete='CASCADE'), primary_key=True)
+    category = db.Column(db.String(64), primary_key=True)
+    published_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_news_article_category_category_published', 'category', 'published_at'),
+    )
+
+    def __repr__(self):
+        return f'<NewsArticleCategory {self.category} {self.article_id}>'
+
 class RecurringPayment(db.Model):
     """Модель для хранения информации о регулярных платежах."""
     id = db.Column(db.Integer, primary_key=True)
@@ -351,7 +454,7 @@ class RecurringPayment(db.Model):
     interval_value = db.Column(db.Integer, default=1, nullable=False)
     amount = db.Column(db.Numeric(20, 2), nullable=False)
     currency = db.Column(db.String(16), nullable=False)
-    next_due_date = db.Column(db.Date, nullable=False)
+    next_due_date = db.Column(db.Date, nullable=False, index=True)
     counterparty = db.Column(db.String(255), nullable=True)
     category_id = db.Column(db.Integer, db.ForeignKey('category.id'), nullable=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False) # To associate with a user, if needed later
@@ -360,3 +463,171 @@ class RecurringPayment(db.Model):
 
     def __repr__(self):
         return f'<RecurringPayment {self.description} - {self.amount} {self.currency}>'
+
+class DashboardSnapshot(db.Model):
+    """Материализованная сводка главной страницы для пользователя (см. services/dashboard_service.py)."""
+    __tablename__ = 'dashboard_snapshot'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, unique=True, index=True)
+    json_data = db.Column(db.Text, nullable=False)
+    # Выставляется при изменении входных данных сводки, сбрасывается при пересчете
+    is_stale = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+    computed_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+
+    def __repr__(self):
+        return f'<DashboardSnapshot user={self.user_id} stale={self.is_stale}>'
+
+class BankingDailyRollup(db.Model):
+    """
+    Дневные агрегаты банковских операций для страницы аналитики (см. services/analytics_rollup.py).
+    Производные данные: внешних ключей нет, строки пересчитываются из banking_transaction/transaction_item.
+    """
+    __tablename__ = 'banking_daily_rollup'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=True)
+    day = db.Column(db.Date, nullable=False)
+    transaction_type = db.Column(db.String(50), nullable=False)
+    account_id = db.Column(db.Integer, nullable=False)
+    category_id = db.Column(db.Integer, nullable=True)
+    merchant = db.Column(db.String(255), nullable=True)
+    source = db.Column(db.String(16), nullable=False)  # 'transaction' или 'item'
+    total = db.Column(db.Numeric(20, 2), nullable=False)
+    tx_count = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_banking_daily_rollup_user_day', 'user_id', 'day', 'source', 'transaction_type'),
+        db.Index('ix_banking_daily_rollup_account_day', 'account_id', 'day'),
+    )
+
+    def __repr__(self):
+        return f'<BankingDailyRollup {self.day} {self.transaction_type} {self.total}>'
+
+class Counterparty(db.Model):
+    """
+    Справочник контрагентов и мерчантов пользователя для автодополнения в формах
+    (см. services/counterparty_directory.py). Поддерживается при записи операций, долгов и регулярных платежей.
+    """
+    __tablename__ = 'counterparty'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    name = db.Column(db.String(255), nullable=False)
+    # Имя в нижнем регистре без лишних пробелов - по нему ищется и уникализируется запись
+    name_key = db.Column(db.String(255), nullable=False)
+    usage_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    last_used_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'name_key', name='_counterparty_user_name_uc'),
+        db.Index('ix_counterparty_user_usage', 'user_id', 'usage_count'),
+    )
+
+    def __repr__(self):
+        return f'<Counterparty {self.name} ({self.usage_count})>'
+
+class AccountLedgerEntry(db.Model):
+    """
+    Запись журнала изменений баланса счета (см. services/account_ledger.py).
+    Журнал только дополняется: изменение операции записывается сторно прежней суммы и новой записью.
+    """
+    __tablename__ = 'account_ledger_entry'
+    id = db.Column(db.Integer, primary_key=True)
+    account_id = db.Column(db.Integer, db.ForeignKey('account.id'), nullable=False)
+    transaction_id = db.Column(db.Integer, db.ForeignKey('banking_transaction.id'), nullable=True, index=True)
+    entry_type = db.Column(db.String(16), nullable=False)  # 'opening', 'transaction', 'reversal', 'adjustment'
+    amount = db.Column(db.Numeric(20, 2), nullable=False)  # Изменение баланса со знаком
+    occurred_at = db.Column(db.DateTime, nullable=False)  # Дата, на которую изменение относится к балансу
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+
+    account = db.relationship('Account')
+    transaction = db.relationship('BankingTransaction')
+
+    __table_args__ = (
+        # Покрывающий индекс для суммы изменений счета за период
+        db.Index('ix_account_ledger_entry_account_occurred', 'account_id', 'occurred_at', 'amount'),
+    )
+
+    def __repr__(self):
+        return f'<AccountLedgerEntry {self.account_id} {self.entry_type} {self.amount}>'
+
+class AccountBalanceSnapshot(db.Model):
+    """Баланс счета на начало месяца по журналу AccountLedgerEntry. Производные данные, пересоздаются."""
+    __tablename__ = 'account_balance_snapshot'
+    id = db.Column(db.Integer, primary_key=True)
+    account_id = db.Column(db.Integer, db.ForeignKey('account.id'), nullable=False)
+    as_of = db.Column(db.DateTime, nullable=False)  # Учтены все записи с occurred_at < as_of
+    balance = db.Column(db.Numeric(20, 2), nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('account_id', 'as_of', name='_account_balance_snapshot_uc'),
+    )
+
+    def __repr__(self):
+        return f'<AccountBalanceSnapshot {self.account_id} {self.as_of} {self.balance}>'
+
+class CounterpartyBalance(db.Model):
+    """
+    Агрегаты по контрагенту и валюте для страниц долгов (см. services/counterparty_balances.py).
+    Производные данные: внешних ключей нет, строки пересчитываются из debt/banking_transaction.
+    """
+    __tablename__ = 'counterparty_balance'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    counterparty = db.Column(db.String(255), nullable=False)
+    currency = db.Column(db.String(16), nullable=False)
+    # Остаток активных долгов: отрицательный - я должен, положительный - мне должны
+    active_balance = db.Column(db.Numeric(20, 2), nullable=False, default=0)
+    # Остаток по всем долгам независимо от статуса (для истории по контрагенту)
+    total_balance = db.Column(db.Numeric(20, 2), nullable=False, default=0)
+    i_owe_active_count = db.Column(db.Integer, nullable=False, default=0)
+    owed_to_me_active_count = db.Column(db.Integer, nullable=False, default=0)
+    debt_count = db.Column(db.Integer, nullable=False, default=0)
+    tx_count = db.Column(db.Integer, nullable=False, default=0)
+    # Сумма операций со знаком: доход - плюс, расход - минус, переводы и обмены не учитываются
+    tx_total = db.Column(db.Numeric(20, 2), nullable=False, default=0)
+    last_activity_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'counterparty', 'currency', name='_counterparty_balance_uc'),
+    )
+
+    def __repr__(self):
+        return f'<CounterpartyBalance {self.counterparty} {self.currency} {self.active_balance}>'
+
+class ReportImportJob(db.Model):
+    """
+    Фоновый импорт брокерского отчета (см. services/report_import.py).
+    content_hash - SHA-256 содержимого файла: повторная загрузка того же файла завершается без изменений.
+    """
+    __tablename__ = 'report_import_job'
+    id = db.Column(db.Integer, primary_key=True)
+    platform_id = db.Column(db.Integer, db.ForeignKey('investment_platform.id', ondelete='CASCADE'), nullable=False)
+    kind = db.Column(db.String(32), nullable=False)  # 'portfolio', 'transactions', 'pdf_portfolio'
+    filename = db.Column(db.String(255))
+    content_hash = db.Column(db.String(64), nullable=False)
+    status = db.Column(db.String(16), nullable=False, default='pending')  # 'pending', 'running', 'done', 'failed'
+    total_rows = db.Column(db.Integer, nullable=False, default=0)
+    processed_rows = db.Column(db.Integer, nullable=False, default=0)
+    created_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_count = db.Column(db.Integer, nullable=False, default=0)
+    zeroed_count = db.Column(db.Integer, nullable=False, default=0)
+    skipped_count = db.Column(db.Integer, nullable=False, default=0)
+    message = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    platform = db.relationship('InvestmentPlatform')
+
+    __table_args__ = (
+        # Поиск уже импортированного файла по хэшу содержимого
+        db.Index('ix_report_import_job_platform_hash', 'platform_id', 'kind', 'content_hash'),
+    )
+
+    @property
+    def progress_percent(self):
+        if self.status == 'done':
+            return 100
+        return int(self.processed_rows * 100 / self.total_rows) if self.total_rows else 0
+
+    def __repr__(self):
+        return f'<ReportImportJob {self.id} {self.kind} {self.status}>'
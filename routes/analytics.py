@@ -10,6 +10,10 @@ from routes import main_bp
 from extensions import db
 from models import Account, BankingTransaction, Category, TransactionItem
 from services.common import _get_currency_rates
+from services.analytics_rollup import (
+    SOURCE_ITEM, get_category_totals, get_type_totals, get_flow_over_time, get_account_totals, get_merchant_totals,
+    get_period_comparison
+)
 
 from flask_login import login_required, current_user
 
@@ -73,16 +77,12 @@ def ui_analytics_overview():
         BankingTransaction.date <= end_date
     ).order_by(BankingTransaction.date.desc()).limit(100).all()
 
+    # Агрегаты по операциям читаются из дневной таблицы BankingDailyRollup
+    start_day = start_date.date()
+    end_day = end_date.date()
+
     # --- 3. Рассчитать расходы по категориям за выбранный период ---
-    category_spending = db.session.query(
-        Category.name,
-        func.sum(BankingTransaction.amount)
-    ).join(Category, BankingTransaction.category_id == Category.id).join(Account, BankingTransaction.account_id == Account.id).filter(
-        Account.user_id == current_user.id,
-        BankingTransaction.date >= start_date,
-        BankingTransaction.date <= end_date,
-        BankingTransaction.transaction_type == 'expense'
-    ).group_by(Category.name).order_by(func.sum(BankingTransaction.amount).desc()).limit(10).all()
+    category_spending = get_category_totals(current_user.id, start_day, end_day)
 
     category_labels = [item[0] for item in category_spending]
     category_data = [float(item[1]) for item in category_spending]
@@ -95,15 +95,7 @@ def ui_analytics_overview():
     else:
       category_percentages = [0.0] * len(category_data)
     
-    purchase_category_spending = db.session.query(
-        Category.name,
-        func.sum(TransactionItem.total)
-    ).join(Category, TransactionItem.category_id == Category.id).join(BankingTransaction, TransactionItem.transaction_id == BankingTransaction.id).join(Account, BankingTransaction.account_id == Account.id).filter(
-        Account.user_id == current_user.id,
-        BankingTransaction.date >= start_date,
-        BankingTransaction.date <= end_date,
-        BankingTransaction.transaction_type == 'expense'
-    ).group_by(Category.name).order_by(func.sum(TransactionItem.total).desc()).limit(10).all()
+    purchase_category_spending = get_category_totals(current_user.id, start_day, end_day, source=SOURCE_ITEM)
 
     purchase_total_spending = sum(item[1] for item in purchase_category_spending)
     purchase_category_labels = [item[0] for item in purchase_category_spending]
@@ -143,16 +135,7 @@ def ui_analytics_overview():
 
 
     # Получить детализированные данные о расходах по подкатегориям
-    subcategory_spending = db.session.query(
-        Category.name,
-            func.sum(BankingTransaction.amount)
-        ).join(Category, BankingTransaction.category_id == Category.id).join(Account, BankingTransaction.account_id == Account.id).filter(
-        Account.user_id == current_user.id,
-        BankingTransaction.date >= start_date,
-        BankingTransaction.date <= end_date,
-        BankingTransaction.transaction_type == 'expense',
-        Category.parent_id.isnot(None)
-    ).group_by(Category.name).order_by(func.sum(BankingTransaction.amount).desc()).limit(10).all()
+    subcategory_spending = get_category_totals(current_user.id, start_day, end_day, subcategories_only=True)
 
     subcategory_labels = [item[0] for item in subcategory_spending]
     subcategory_data = [float(item[1]) for item in subcategory_spending]
@@ -162,45 +145,23 @@ def ui_analytics_overview():
     products_labels = ["Product A", "Product B", "Product C", "Product D", "Product E"]
 
     # --- 4. Расчет общего денежного потока (Income vs Expense) за выбранный период ---
-    cash_flow_data = db.session.query(
-        BankingTransaction.transaction_type,
-        func.sum(BankingTransaction.amount)
-    ).join(Account, BankingTransaction.account_id == Account.id).filter(
-        Account.user_id == current_user.id,
-        BankingTransaction.date >= start_date,
-        BankingTransaction.date <= end_date, 
-        BankingTransaction.transaction_type.in_(['income', 'expense'])
-    ).group_by(BankingTransaction.transaction_type).all()
-
-    income_total = next((item[1] for item in cash_flow_data if item[0] == 'income'), Decimal(0))
-    expense_total = next((item[1] for item in cash_flow_data if item[0] == 'expense'), Decimal(0))
+    type_totals = get_type_totals(current_user.id, start_day, end_day)
+    income_total = type_totals['income']
+    expense_total = type_totals['expense']
     cash_flow_values = [float(income_total), float(expense_total)]
     
     # Add net_cash_flow calculation
     net_cash_flow = income_total - expense_total
 
+    # Сравнение с тем же периодом месяц и год назад
+    period_comparison = get_period_comparison(current_user.id, start_day, end_day)
+
     # --- 5. Additional Charts Data Calculation ---
     
     # 5.1 Net Flow Over Time (Dynamic grouping)
     # Determine grouping interval
     delta_days = (end_date - start_date).days
-    if delta_days > 60:
-        date_grouping = func.strftime('%Y-%m', BankingTransaction.date)
-        date_format = '%Y-%m'
-    else:
-        date_grouping = func.strftime('%Y-%m-%d', BankingTransaction.date)
-        date_format = '%Y-%m-%d'
-
-    flow_query = db.session.query(
-        date_grouping.label('period'),
-        BankingTransaction.transaction_type,
-        func.sum(BankingTransaction.amount)
-    ).join(Account, BankingTransaction.account_id == Account.id).filter(
-        Account.user_id == current_user.id,
-        BankingTransaction.date >= start_date,
-        BankingTransaction.date <= end_date,
-        BankingTransaction.transaction_type.in_(['income', 'expense'])
-    ).group_by('period', BankingTransaction.transaction_type).order_by('period').all()
+    flow_query = get_flow_over_time(current_user.id, start_day, end_day, unit='month' if delta_days > 60 else 'day')
 
     flow_periods = sorted(list(set(item[0] for item in flow_query)))
     flow_income_map = {item[0]: float(item[2]) for item in flow_query if item[1] == 'income'}
@@ -212,45 +173,19 @@ def ui_analytics_overview():
     flow_over_time_net = [inc - exp for inc, exp in zip(flow_over_time_income, flow_over_time_expense)]
 
     # 5.2 Top Expense Accounts
-    top_expense_accounts = db.session.query(
-        Account.name,
-        func.sum(BankingTransaction.amount)
-    ).join(Account, BankingTransaction.account_id == Account.id).filter(
-        Account.user_id == current_user.id,
-        BankingTransaction.date >= start_date,
-        BankingTransaction.date <= end_date,
-        BankingTransaction.transaction_type == 'expense'
-    ).group_by(Account.name).order_by(func.sum(BankingTransaction.amount).desc()).limit(5).all()
+    top_expense_accounts = get_account_totals(current_user.id, start_day, end_day, 'expense')
 
     top_expense_account_labels = [item[0] for item in top_expense_accounts]
     top_expense_account_data = [float(item[1]) for item in top_expense_accounts]
 
     # 5.3 Top Merchants
-    top_merchants = db.session.query(
-        BankingTransaction.merchant,
-        func.sum(BankingTransaction.amount)
-    ).join(Account, BankingTransaction.account_id == Account.id).filter(
-        Account.user_id == current_user.id,
-        BankingTransaction.date >= start_date,
-        BankingTransaction.date <= end_date,
-        BankingTransaction.transaction_type == 'expense',
-        BankingTransaction.merchant.isnot(None),
-        BankingTransaction.merchant != ''
-    ).group_by(BankingTransaction.merchant).order_by(func.sum(BankingTransaction.amount).desc()).limit(5).all()
+    top_merchants = get_merchant_totals(current_user.id, start_day, end_day)
 
     top_merchant_labels = [item[0] for item in top_merchants]
     top_merchant_data = [float(item[1]) for item in top_merchants]
 
     # 5.4 Top Income Accounts
-    top_income_accounts = db.session.query(
-        Account.name,
-        func.sum(BankingTransaction.amount)
-    ).join(Account, BankingTransaction.account_id == Account.id).filter(
-        Account.user_id == current_user.id,
-        BankingTransaction.date >= start_date,
-        BankingTransaction.date <= end_date,
-        BankingTransaction.transaction_type == 'income'
-    ).group_by(Account.name).order_by(func.sum(BankingTransaction.amount).desc()).limit(5).all()
+    top_income_accounts = get_account_totals(current_user.id, start_day, end_day, 'income')
 
     top_income_labels = [item[0] for item in top_income_accounts]
     top_income_data = [float(item[1]) for item in top_income_accounts]
@@ -303,6 +238,7 @@ def ui_analytics_overview():
         net_cash_flow=net_cash_flow,
         total_income=income_total,
         total_expense=expense_total,
+        period_comparison=period_comparison,
         
         purchase_category_labels=json.dumps(purchase_category_labels),
         purchase_category_data=json.dumps(purchase_category_data),
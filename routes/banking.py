@@ -1,13 +1,17 @@
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from decimal import Decimal, InvalidOperation
-from flask import render_template, request, redirect, url_for, flash, current_app
+from flask import render_template, request, redirect, url_for, flash, current_app, jsonify
 from sqlalchemy.orm import joinedload
 from sqlalchemy import asc, desc, or_
 
 from routes import main_bp
 from extensions import db
 from models import Account, Bank, BankingTransaction, Category, Debt, TransactionItem
+from services.account_ledger import capture_transaction, delete_account_ledger, get_balance_history, post_transaction, reverse_captured
 from services.banking_service import populate_account_from_form
+from services.counterparty_directory import get_top_counterparties, search_counterparties
+from services.transaction_search import search_transactions
+from services.pagination import keyset_paginate, resolve_sort_column, count_cache_key
 
 from flask_login import login_required, current_user
 
@@ -68,6 +72,7 @@ def ui_delete_account(account_id):
         flash(f'Нельзя удалить счет "{account.name}", так как с ним связаны транзакции. Сначала удалите или перенесите транзакции.', 'danger')
         return redirect(url_for('main.ui_banking_overview'))
     
+    delete_account_ledger(account.id)
     db.session.delete(account)
     db.session.commit()
     flash(f'Счет "{account.name}" успешно удален.', 'success')
@@ -126,11 +131,12 @@ def ui_delete_bank(bank_id):
 @main_bp.route('/banking-transactions')
 @login_required
 def ui_transactions():
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     sort_by = request.args.get('sort_by', 'date')
     order = request.args.get('order', 'desc')
     filter_account_id = request.args.get('filter_account_id', 'all')
     filter_type = request.args.get('filter_type', 'all')
+    search_query = request.args.get('q', '').strip()
 
     query = BankingTransaction.query.join(Account, BankingTransaction.account_id == Account.id).filter(Account.user_id == current_user.id).options(
         joinedload(BankingTransaction.account_ref),
@@ -145,17 +151,27 @@ def ui_transactions():
     if filter_type != 'all':
         query = query.filter(BankingTransaction.transaction_type == filter_type)
 
-    sort_column = getattr(BankingTransaction, sort_by, BankingTransaction.date)
-    if order == 'desc':
-        query = query.order_by(desc(sort_column))
+    snippets = {}
+    if search_query:
+        # Полнотекстовый поиск: результаты по релевантности, без пагинации
+        results = search_transactions(current_user.id, search_query, limit=100)
+        snippets = {result['transaction_id']: result['snippet'] for result in results}
+        found = {tx.id: tx for tx in query.filter(BankingTransaction.id.in_(snippets.keys())).all()} if snippets else {}
+        transactions = [found[tx_id] for tx_id in snippets if tx_id in found]
+        pagination = None
     else:
-        query = query.order_by(asc(sort_column))
-
-    pagination = query.paginate(page=page, per_page=50, error_out=False)
+        sort_column = resolve_sort_column(BankingTransaction, sort_by, 'date')
+        # Общее количество считаем (с кэшем) только для первой страницы
+        pagination = keyset_paginate(
+            query, sort_column, BankingTransaction.id, descending=(order == 'desc'), per_page=50, cursor=cursor,
+            count_cache_key=None if cursor else count_cache_key('banking_tx', current_user.id, request.args)
+        )
+        transactions = pagination.items
     accounts = Account.query.filter_by(is_active=True, user_id=current_user.id).order_by(Account.name).all()
     unique_types = [r[0] for r in db.session.query(BankingTransaction.transaction_type).join(Account, BankingTransaction.account_id == Account.id).filter(Account.user_id == current_user.id).distinct().order_by(BankingTransaction.transaction_type).all()]
 
-    return render_template('transactions.html', transactions=pagination.items, pagination=pagination, sort_by=sort_by, order=order, filter_account_id=filter_account_id, filter_type=filter_type, accounts=accounts, unique_types=unique_types)
+    base_args = {key: value for key, value in request.args.items() if key not in ('cursor', 'page')}
+    return render_template('transactions.html', transactions=transactions, pagination=pagination, base_args=base_args, search_query=search_query, snippets=snippets, sort_by=sort_by, order=order, filter_account_id=filter_account_id, filter_type=filter_type, accounts=accounts, unique_types=unique_types)
 
 @main_bp.route('/transactions/add', methods=['GET', 'POST'])
 @login_required
@@ -171,11 +187,6 @@ def ui_add_transaction_form():
             if tx_type == 'expense':
                 amount = Decimal(request.form.get('amount', '0'))
                 if amount <= 0: raise ValueError("Сумма должна быть положительной.")
-                
-                if account.account_type == 'credit':
-                    account.balance += amount
-                else:
-                    account.balance -= amount
 
                 new_tx = BankingTransaction(
                     transaction_type=tx_type,
@@ -188,6 +199,7 @@ def ui_add_transaction_form():
                     user_id=current_user.id
                 )
                 db.session.add(new_tx)
+                post_transaction(new_tx, account)
 
                 # --- АВТОМАТИЧЕСКОЕ СОЗДАНИЕ ДОЛГА ---
                 category_id = int(request.form.get('category_id')) if request.form.get('category_id') else None
@@ -218,11 +230,6 @@ def ui_add_transaction_form():
                 amount = Decimal(request.form.get('amount', '0'))
                 if amount <= 0: raise ValueError("Сумма должна быть положительной.")
 
-                if account.account_type == 'credit':
-                    account.balance -= amount
-                else:
-                    account.balance += amount
-
                 new_tx = BankingTransaction(
                     transaction_type=tx_type,
                     amount=amount,
@@ -234,6 +241,7 @@ def ui_add_transaction_form():
                     user_id=current_user.id
                 )
                 db.session.add(new_tx)
+                post_transaction(new_tx, account)
 
                 # --- АВТОМАТИЧЕСКОЕ СОЗДАНИЕ ДОЛГА (INCOME) ---
                 category_id = int(request.form.get('category_id')) if request.form.get('category_id') else None
@@ -273,16 +281,6 @@ def ui_add_transaction_form():
                 if not to_account:
                     raise ValueError("Счет зачисления не найден.")
 
-                if from_account.account_type == 'credit':
-                    from_account.balance += amount
-                else:
-                    from_account.balance -= amount
-                
-                if to_account.account_type == 'credit':
-                    to_account.balance -= amount
-                else:
-                    to_account.balance += amount
-
                 new_tx = BankingTransaction(
                     transaction_type=tx_type,
                     amount=amount,
@@ -294,6 +292,7 @@ def ui_add_transaction_form():
                     user_id=current_user.id
                 )
                 db.session.add(new_tx)
+                post_transaction(new_tx, from_account, to_account)
 
             elif tx_type == 'exchange':
                 from_amount = Decimal(request.form.get('amount', '0'))
@@ -309,8 +308,6 @@ def ui_add_transaction_form():
                 from_account = account # Already fetched
                 to_account = Account.query.filter_by(id=to_account_id, user_id=current_user.id).first()
                 if not to_account: raise ValueError("Счет зачисления не найден.")
-                from_account.balance -= from_amount
-                to_account.balance += to_amount
 
                 new_tx = BankingTransaction(
                     transaction_type=tx_type,
@@ -324,6 +321,7 @@ def ui_add_transaction_form():
                     user_id=current_user.id
                 )
                 db.session.add(new_tx)
+                post_transaction(new_tx, from_account, to_account)
             elif tx_type in ['purchase', 'manual_purchase']:
                 item_names = request.form.getlist('item_name[]')
                 item_quantities = request.form.getlist('item_quantity[]')
@@ -336,8 +334,6 @@ def ui_add_transaction_form():
                     Decimal(qty) * Decimal(price) for qty, price in zip(item_quantities, item_prices)
                 )
 
-                account.balance -= total_purchase_amount
-
                 purchase_tx = BankingTransaction(
                     transaction_type='expense',
                     amount=total_purchase_amount,
@@ -349,6 +345,7 @@ def ui_add_transaction_form():
                     user_id=current_user.id
                 )
                 db.session.add(purchase_tx)
+                post_transaction(purchase_tx, account)
                 db.session.flush()
 
                 for i in range(len(item_names)):
@@ -382,14 +379,7 @@ def ui_add_transaction_form():
     income_categories = Category.query.filter_by(type='income', parent_id=None).filter((Category.user_id == current_user.id) | (Category.user_id == None)).order_by(Category.name).options(joinedload(Category.subcategories)).all()
     categories = Category.query.filter((Category.user_id == current_user.id) | (Category.user_id == None)).order_by(Category.name).all()
 
-    # Собираем список контрагентов из долгов и транзакций
-    debt_counterparties = db.session.query(Debt.counterparty).filter(Debt.counterparty.isnot(None), Debt.user_id == current_user.id).distinct().all()
-    tx_counterparties = db.session.query(BankingTransaction.counterparty).join(Account, BankingTransaction.account_id == Account.id).filter(BankingTransaction.counterparty.isnot(None), Account.user_id == current_user.id).distinct().all()
-    tx_merchants = db.session.query(BankingTransaction.merchant).join(Account, BankingTransaction.account_id == Account.id).filter(BankingTransaction.merchant.isnot(None), Account.user_id == current_user.id).distinct().all()
-    counterparties = set()
-    for cp in debt_counterparties + tx_counterparties + tx_merchants:
-        counterparties.add(cp[0])
-    counterparties = sorted(list(counterparties))
+    counterparties = get_top_counterparties(current_user.id)
 
     return render_template(
         'add_transaction.html',
@@ -407,19 +397,26 @@ def ui_edit_transaction_form(tx_id):
     
     if request.method == 'POST':
         try:
+            # Запоминаем эффект операции на балансы до изменений, чтобы сторнировать его в журнале
+            old_account = db.session.get(Account, transaction.account_id)
+            to_account = db.session.get(Account, transaction.to_account_id) if transaction.to_account_id else None
+            captured = capture_transaction(transaction, old_account, to_account)
+            old_key = (transaction.amount, transaction.account_id, transaction.date)
+
             # Обновление общих полей
             transaction.date = datetime.strptime(request.form['date'], '%Y-%m-%dT%H:%M')
             transaction.description = request.form.get('description')
             transaction.counterparty = request.form.get('counterparty') or None
 
-            # Логика обновления баланса только для простых типов (Расход/Доход)
+            # Сумму и счет можно менять только у простых типов (Расход/Доход)
             # Для переводов и обменов пока поддерживается только изменение описания/даты/контрагента
+            new_account = old_account
             if transaction.transaction_type in ['expense', 'income']:
-                old_amount = transaction.amount
-                old_account_id = transaction.account_id
-                
                 # Получаем новые значения
                 new_account_id = int(request.form['account_id'])
+                new_account = Account.query.filter_by(id=new_account_id, user_id=current_user.id).first()
+                if not new_account:
+                    raise ValueError("Счет не найден.")
                 
                 # Обработка суммы (через товары или напрямую)
                 new_amount = Decimal(0)
@@ -446,26 +443,6 @@ def ui_edit_transaction_form(tx_id):
                      new_amount = Decimal(request.form['amount'])
                      transaction.category_id = int(request.form['category_id']) if request.form.get('category_id') else None
 
-                # Если сумма или счет изменились - корректируем балансы
-                if old_amount != new_amount or old_account_id != new_account_id:
-                    # 1. Откат старой транзакции
-                    old_account = Account.query.get(old_account_id)
-                    if transaction.transaction_type == 'expense':
-                        if old_account.account_type == 'credit': old_account.balance += old_amount
-                        else: old_account.balance += old_amount
-                    elif transaction.transaction_type == 'income':
-                        if old_account.account_type == 'credit': old_account.balance -= old_amount
-                        else: old_account.balance -= old_amount
-                    
-                    # 2. Применение новой транзакции
-                    new_account = Account.query.get(new_account_id)
-                    if transaction.transaction_type == 'expense':
-                        if new_account.account_type == 'credit': new_account.balance -= new_amount
-                        else: new_account.balance -= new_amount
-                    elif transaction.transaction_type == 'income':
-                        if new_account.account_type == 'credit': new_account.balance += new_amount
-                        else: new_account.balance += new_amount
-                
                 # Обновляем сумму и счет в объекте транзакции
                 transaction.amount = new_amount
                 transaction.account_id = new_account_id
@@ -473,6 +450,11 @@ def ui_edit_transaction_form(tx_id):
                     # Если это расход, обновляем также категорию, если она была изменена
                     transaction.category_id = int(request.form['category_id']) if request.form.get('category_id') else None
 
+            # Если сумма, счет или дата изменились - сторнируем прежний эффект и проводим операцию заново
+            if (transaction.amount, transaction.account_id, transaction.date) != old_key:
+                reverse_captured(transaction, captured)
+                post_transaction(transaction, new_account, to_account)
+
             db.session.commit()
             flash('Транзакция успешно обновлена.', 'success')
             return redirect(url_for('main.ui_transactions'))
@@ -485,17 +467,68 @@ def ui_edit_transaction_form(tx_id):
     categories = Category.query.filter((Category.user_id == current_user.id) | (Category.user_id == None)).order_by(Category.name).all()
     expense_categories = Category.query.filter_by(type='expense', parent_id=None).filter((Category.user_id == current_user.id) | (Category.user_id == None)).order_by(Category.name).options(joinedload(Category.subcategories)).all()
 
-    # Fetch counterparties
-    debt_counterparties = db.session.query(Debt.counterparty).filter(Debt.counterparty.isnot(None), Debt.user_id == current_user.id).distinct().all()
-    tx_counterparties = db.session.query(BankingTransaction.counterparty).join(Account, BankingTransaction.account_id == Account.id).filter(BankingTransaction.counterparty.isnot(None), Account.user_id == current_user.id).distinct().all()
-    tx_merchants = db.session.query(BankingTransaction.merchant).join(Account, BankingTransaction.account_id == Account.id).filter(BankingTransaction.merchant.isnot(None), Account.user_id == current_user.id).distinct().all()
-    counterparties = set()
-    for cp in debt_counterparties + tx_counterparties + tx_merchants:
-        counterparties.add(cp[0])
-    counterparties = sorted(list(counterparties))
+    counterparties = get_top_counterparties(current_user.id)
 
     return render_template('edit_transaction.html', transaction=transaction, accounts=accounts, categories=categories, expense_categories=expense_categories, counterparties=counterparties)
 
+@main_bp.route('/api/transactions/search')
+@login_required
+def api_search_transactions():
+    """Полнотекстовый поиск по операциям и позициям чеков (см. services/transaction_search.py)."""
+    query = request.args.get('q', '')
+    limit = request.args.get('limit', 50, type=int)
+    results = search_transactions(current_user.id, query, limit)
+    transaction_ids = [result['transaction_id'] for result in results]
+    transactions = {tx.id: tx for tx in BankingTransaction.query.join(Account, BankingTransaction.account_id == Account.id).filter(
+        Account.user_id == current_user.id, BankingTransaction.id.in_(transaction_ids)
+    ).options(joinedload(BankingTransaction.account_ref)).all()} if transaction_ids else {}
+
+    response = []
+    for result in results:
+        tx = transactions.get(result['transaction_id'])
+        if not tx:
+            continue
+        response.append({
+            'id': tx.id,
+            'score': result['score'],
+            'snippet': str(result['snippet']),
+            'date': tx.date.isoformat(),
+            'transaction_type': tx.transaction_type,
+            'amount': str(tx.amount),
+            'account': tx.account_ref.name,
+            'url': url_for('main.ui_edit_transaction_form', tx_id=tx.id)
+        })
+    return jsonify({'results': response})
+
+@main_bp.route('/api/accounts/<int:account_id>/balance-history')
+@login_required
+def api_account_balance_history(account_id):
+    """История баланса счета по журналу изменений (см. services/account_ledger.py)."""
+    account = Account.query.filter_by(id=account_id, user_id=current_user.id).first_or_404()
+    try:
+        end_date = datetime.strptime(request.args['end'], '%Y-%m-%d').date() if request.args.get('end') else datetime.now().date()
+        start_date = datetime.strptime(request.args['start'], '%Y-%m-%d').date() if request.args.get('start') else end_date - timedelta(days=90)
+        history = get_balance_history(account.id, start_date, end_date, unit=request.args.get('unit', 'day'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({
+        'account_id': account.id,
+        'currency': account.currency,
+        'start': start_date.isoformat(),
+        'end': end_date.isoformat(),
+        'opening_balance': str(history['opening_balance']),
+        'closing_balance': str(history['closing_balance']),
+        'points': [{'period': point['period'], 'change': str(point['change']), 'balance': str(point['balance'])} for point in history['points']]
+    })
+
+@main_bp.route('/api/counterparties')
+@login_required
+def api_search_counterparties():
+    """Подсказки контрагентов для форм: поиск по префиксу, затем по вхождению (см. services/counterparty_directory.py)."""
+    query = request.args.get('q', '')
+    limit = request.args.get('limit', 10, type=int)
+    return jsonify({'results': search_counterparties(current_user.id, query, limit)})
+
 @main_bp.route('/cashback_rules')
 @login_required
 def ui_cashback_rules():
@@ -1,6 +1,4 @@
 from datetime import datetime, date, timezone, timedelta
-from dateutil.relativedelta import relativedelta
-from collections import defaultdict
 from decimal import Decimal, InvalidOperation
 from flask import render_template, request, redirect, url_for, flash, current_app
 from sqlalchemy.orm import joinedload
@@ -9,55 +7,15 @@ from sqlalchemy import func, asc, desc, or_
 from routes import main_bp
 from extensions import db
 from models import Debt, RecurringPayment, Account, BankingTransaction, Category
+from services.account_ledger import post_transaction
 from services.common import _get_or_create_category
+from services.counterparty_balances import get_active_counterparty_balances, get_counterparty_summary
+from services.pagination import keyset_paginate
+from services.recurring_payments import materialize_recurring_payments
+from services.counterparty_directory import get_top_counterparties
 
 from flask_login import login_required, current_user
 
-def _create_debt_from_recurring_payment(payment: RecurringPayment):
-    """Creates a new Debt record from a RecurringPayment."""
-    current_app.logger.info(f"--- [Recurring Payments] Checking recurring payment: {payment.description} - {payment.next_due_date}")
-    due_date = payment.next_due_date    
-    current_app.logger.info(f"--- [Recurring Payments] Debt due date: {due_date}")
-    existing_debt = Debt.query.filter_by(
-        debt_type='i_owe',
-        counterparty=payment.description,
-        initial_amount=payment.amount,
-        currency=payment.currency,
-        due_date=due_date,
-        user_id=payment.user_id
-    ).first()
-
-    if not existing_debt:
-        new_debt = Debt(
-            debt_type='i_owe',
-            counterparty=payment.description,
-            initial_amount=payment.amount,
-            currency=payment.currency,
-            due_date=due_date,
-            user_id=payment.user_id,
-            recurring_payment_id=payment.id
-        )
-        # Если у регулярного платежа есть контрагент, используем его
-        if hasattr(payment, 'counterparty') and payment.counterparty:
-             new_debt.counterparty = payment.counterparty
-             new_debt.description = payment.description # Описание остается описанием
-
-        db.session.add(new_debt)
-        current_app.logger.info(f"--- [Recurring Payments] Создан новый долг для {payment.description} на сумму {payment.amount} {payment.currency} с датой погашения {due_date}.")
-
-        # Обновляем дату следующего платежа
-        interval = payment.interval_value
-        if payment.frequency == 'daily':
-            payment.next_due_date += timedelta(days=interval)
-        elif payment.frequency == 'monthly':
-            payment.next_due_date += relativedelta(months=interval)
-        elif payment.frequency == 'yearly':
-            payment.next_due_date += relativedelta(years=interval)
-        
-        db.session.add(payment)
-    else:
-        current_app.logger.info(f"--- [Recurring Payments] Долг для {payment.description} на сумму {payment.amount} {payment.currency} с датой погашения {due_date} уже существует.")
-
 @main_bp.route('/debts')
 @login_required
 def ui_debts():
@@ -88,39 +46,8 @@ def ui_debts():
     ]
     upcoming_recurring_payments.sort(key=lambda p: p.next_due_date)
 
-    # 3. Counterparty Balances
-    # {counterparty: {currency: {'balance': Decimal, 'i_owe_exists': bool, 'owed_to_me_exists': bool}}}
-    counterparty_data = defaultdict(lambda: defaultdict(lambda: {'balance': Decimal(0), 'i_owe_exists': False, 'owed_to_me_exists': False}))
-
-    # Process Debts
-    for debt in i_owe_list:
-        if debt.status == 'active':
-            remaining = debt.initial_amount - debt.repaid_amount
-            # I owe: negative balance
-            counterparty_data[debt.counterparty][debt.currency]['balance'] -= remaining
-            counterparty_data[debt.counterparty][debt.currency]['i_owe_exists'] = True
-
-    for debt in owed_to_me_list:
-        if debt.status == 'active':
-            remaining = debt.initial_amount - debt.repaid_amount
-            # Owed to me: positive balance
-            counterparty_data[debt.counterparty][debt.currency]['balance'] += remaining
-            counterparty_data[debt.counterparty][debt.currency]['owed_to_me_exists'] = True
-            
-    # Format counterparty balances for template
-    formatted_balances = []
-    for counterparty, currency_balances in counterparty_data.items():
-        for currency, data in currency_balances.items():
-            # Display even if balance is zero so history can be accessed
-            formatted_balances.append({
-                'counterparty': counterparty,
-                'currency': currency,
-                'balance': data['balance'],
-                'can_net': data['i_owe_exists'] and data['owed_to_me_exists']
-            })
-    
-    # Sort by counterparty name
-    formatted_balances.sort(key=lambda x: x['counterparty'])
+    # 3. Counterparty Balances (агрегаты CounterpartyBalance, см. services/counterparty_balances.py)
+    formatted_balances = get_active_counterparty_balances(current_user.id)
     # --- NEW LOGIC END ---
 
     return render_template('debts.html', 
@@ -140,19 +67,9 @@ def add_debt():
     Создает долги из регулярных платежей, проверяя дату и создавая долг в запланированный день next_due_date.
     """
     current_app.logger.info("--- [MANUAL] add_debt called ---")
-    # Manual trigger for current user's recurring payments could be added here, 
-    # but the background task handles it for all users.
-    # If we want to force check for current user:
-    with current_app.app_context():
-        current_app.logger.info("--- [add_debt] Running debt creation from recurring payments for current user ---")
-        recurring_payments = RecurringPayment.query.filter_by(user_id=current_user.id).all()
-        today = date.today()
-        for payment in recurring_payments:
-            days_until_due = (payment.next_due_date - today).days
-            if 0 <= days_until_due <= 3:
-                _create_debt_from_recurring_payment(payment)
-    
-        db.session.commit()        
+    # Перед показом формы создаем долги по регулярным платежам текущего пользователя, срок которых наступает в ближайшие 3 дня
+    # (включая пропущенные периоды); для всех пользователей это делает фоновая задача
+    materialize_recurring_payments(user_id=current_user.id, horizon_days=3)
 
     if request.method == 'POST':
         try:
@@ -321,11 +238,9 @@ def repay_debt(debt_id):
             if debt.debt_type == 'i_owe':
                 # I owe -> I pay -> Expense, Account balance decreases
                 tx_type = 'expense'
-                account.balance -= amount
             else: # owed_to_me
                 # Owed to me -> I receive -> Income, Account balance increases
                 tx_type = 'income'
-                account.balance += amount
 
             # Determine category
             if debt.recurring_payment_id and debt.recurring_payment_ref.category_ref:
@@ -363,6 +278,7 @@ def repay_debt(debt_id):
                 user_id=current_user.id
             )
             db.session.add(new_tx)
+            post_transaction(new_tx, account)
             
             db.session.commit()
             return redirect(url_for('main.ui_debts'))
@@ -464,34 +380,23 @@ def ui_counterparty_history(counterparty):
         flash('Контрагент не указан.', 'danger')
         return redirect(url_for('main.ui_debts'))
 
-    # Получить все долги по контрагенту
+    # Долги по контрагенту - поиск по индексу (user_id, counterparty, created_at)
     debts = Debt.query.filter_by(counterparty=counterparty, user_id=current_user.id).order_by(Debt.created_at.desc()).all()
 
-    # Получить все транзакции по контрагенту (counterparty или merchant)
-    # Need to join Account to check user_id
-    transactions = BankingTransaction.query.join(Account, BankingTransaction.account_id == Account.id).filter(Account.user_id == current_user.id).options(
+    # Транзакции по контрагенту (counterparty или merchant) - постранично, по курсору
+    query = BankingTransaction.query.join(Account, BankingTransaction.account_id == Account.id).filter(Account.user_id == current_user.id).options(
         joinedload(BankingTransaction.account_ref),
         joinedload(BankingTransaction.category_ref)
     ).filter(
         (BankingTransaction.counterparty == counterparty) | (BankingTransaction.merchant == counterparty)
-    ).order_by(BankingTransaction.date.desc()).all()
-
-    # Рассчитать общий баланс
-    total_debt_balance = Decimal(0)
-    for debt in debts:
-        if debt.debt_type == 'i_owe':
-            total_debt_balance -= (debt.initial_amount - debt.repaid_amount)
-        else:
-            total_debt_balance += (debt.initial_amount - debt.repaid_amount)
+    )
+    pagination = keyset_paginate(query, BankingTransaction.date, BankingTransaction.id, descending=True, per_page=50, cursor=request.args.get('cursor'))
 
-    # Валюты - предположим, что все в одной валюте, или показать по валютам
-    currencies = set()
-    for debt in debts:
-        currencies.add(debt.currency)
-    for tx in transactions:
-        currencies.add(tx.account_ref.currency)
+    # Общий баланс и валюты - из агрегатов, без обхода всех долгов и транзакций
+    summary = get_counterparty_summary(current_user.id, counterparty)
+    pagination = pagination._replace(total=summary['tx_count'])
 
-    return render_template('counterparty_history.html', counterparty=counterparty, debts=debts, transactions=transactions, total_debt_balance=total_debt_balance, currencies=currencies)
+    return render_template('counterparty_history.html', counterparty=counterparty, debts=debts, transactions=pagination.items, pagination=pagination, total_debt_balance=summary['total_debt_balance'], currencies=summary['currencies'])
 
 @main_bp.route('/recurring_payments/add', methods=['GET', 'POST'])
 @login_required
@@ -525,9 +430,7 @@ def ui_add_recurring_payment():
         except (ValueError, InvalidOperation) as e:
             flash(f'Ошибка в данных: {e}', 'danger')
             
-    # Fetch counterparties for autocomplete
-    debt_counterparties = db.session.query(Debt.counterparty).filter(Debt.counterparty.isnot(None), Debt.user_id == current_user.id).distinct().all()
-    counterparties = sorted([cp[0] for cp in debt_counterparties])
+    counterparties = get_top_counterparties(current_user.id)
 
     categories = Category.query.filter_by(user_id=current_user.id, type='expense').order_by(Category.name).all()
 
@@ -554,9 +457,7 @@ def ui_edit_recurring_payment(payment_id):
         except (ValueError, InvalidOperation) as e:
             flash(f'Ошибка в данных: {e}', 'danger')
 
-    # Fetch counterparties for autocomplete
-    debt_counterparties = db.session.query(Debt.counterparty).filter(Debt.counterparty.isnot(None), Debt.user_id == current_user.id).distinct().all()
-    counterparties = sorted([cp[0] for cp in debt_counterparties])
+    counterparties = get_top_counterparties(current_user.id)
 
     categories = Category.query.filter_by(user_id=current_user.id, type='expense').order_by(Category.name).all()
 
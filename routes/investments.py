@@ -12,6 +12,7 @@ from extensions import db
 from models import InvestmentPlatform, InvestmentAsset, Transaction, HistoricalPriceCache, CryptoPortfolioHistory
 from api_clients import PRICE_TICKER_DISPATCHER
 from services.common import _get_currency_rates
+from services.pagination import keyset_paginate, resolve_sort_column, count_cache_key
 from analytics_logic import get_performance_chart_data_from_cache, refresh_crypto_price_change_data, refresh_performance_chart_data, refresh_crypto_portfolio_history
 from news_logic import get_crypto_news, get_securities_news
 from logic.news_analysis import get_news_trends_for_portfolio
@@ -39,9 +40,9 @@ def _get_sync_function(platform_name: str, dispatcher: dict):
             
     return None
 
-def _apply_crypto_transaction_filters_and_sort(query, args):
+def _apply_crypto_transaction_filters(query, args):
     """
-    Применяет общие фильтры и сортировку из аргументов запроса к запросу транзакций.
+    Применяет общие фильтры из аргументов запроса к запросу транзакций.
     """
     filter_type = args.get('filter_type', 'all')
     if filter_type != 'all':
@@ -57,16 +58,17 @@ def _apply_crypto_transaction_filters_and_sort(query, args):
         query = query.filter(
             or_(Transaction.asset1_ticker == args.get('filter_asset'), Transaction.asset2_ticker == args.get('filter_asset')))
     
-    sort_by = args.get('sort_by', 'timestamp')
-    order = args.get('order', 'desc')
-    sort_column = getattr(Transaction, sort_by, Transaction.timestamp)
-    if order == 'desc':
-        query = query.order_by(desc(sort_column))
-    else:
-        query = query.order_by(asc(sort_column))
-        
     return query
 
+def _paginate_crypto_transactions(query, args, per_page: int = 150):
+    """Keyset-пагинация списка крипто-транзакций с сортировкой из аргументов запроса."""
+    sort_column = resolve_sort_column(Transaction, args.get('sort_by', 'timestamp'), 'timestamp')
+    cursor = args.get('cursor')
+    return keyset_paginate(
+        query, sort_column, Transaction.id, descending=(args.get('order', 'desc') == 'desc'), per_page=per_page, cursor=cursor,
+        count_cache_key=None if cursor else count_cache_key('crypto_tx', current_user.id, args)
+    )
+
 # Routes
 @main_bp.route('/platforms')
 @login_required
@@ -188,7 +190,7 @@ def ui_investment_platform_detail(platform_id):
     all_valued_assets.sort(key=lambda x: (x['asset'].source_account_type or '', x['asset'].ticker or ''))
     sorted_account_type_summary = sorted(account_type_summary.items(), key=lambda item: item[0])
     
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     sort_by = request.args.get('sort_by', 'timestamp')
     order = request.args.get('order', 'desc')
     filter_type = request.args.get('filter_type', 'all')
@@ -198,10 +200,8 @@ def ui_investment_platform_detail(platform_id):
     if filter_type != 'all':
         transactions_query = transactions_query.filter_by(type=filter_type)
 
-    sort_column = getattr(Transaction, sort_by, Transaction.timestamp)
-    transactions_query = transactions_query.order_by(desc(sort_column) if order == 'desc' else asc(sort_column))
-    
-    transactions_pagination = transactions_query.paginate(page=page, per_page=15, error_out=False)
+    sort_column = resolve_sort_column(Transaction, sort_by, 'timestamp')
+    transactions_pagination = keyset_paginate(transactions_query, sort_column, Transaction.id, descending=(order == 'desc'), per_page=15, cursor=cursor)
     platform_transactions = transactions_pagination.items
 
     unique_transaction_types = [t.type for t in platform.transactions.with_entities(Transaction.type).distinct().all()]
@@ -594,7 +594,6 @@ def ui_crypto_assets():
 @main_bp.route('/api/crypto-transactions')
 @login_required
 def api_crypto_transactions():
-    page = request.args.get('page', 1, type=int)
     start_date_str = request.args.get('start_date', '')
     end_date_str = request.args.get('end_date', '')
 
@@ -603,7 +602,7 @@ def api_crypto_transactions():
         InvestmentPlatform.user_id == current_user.id
     ).options(joinedload(Transaction.platform))
 
-    transactions_query = _apply_crypto_transaction_filters_and_sort(transactions_query, request.args)
+    transactions_query = _apply_crypto_transaction_filters(transactions_query, request.args)
 
     try:
         if start_date_str:
@@ -615,16 +614,14 @@ def api_crypto_transactions():
     except ValueError:
         pass 
 
-    pagination = transactions_query.paginate(page=page, per_page=150, error_out=False)
-    transactions = pagination.items
+    pagination = _paginate_crypto_transactions(transactions_query, request.args)
 
-    html = render_template('_crypto_transaction_rows.html', transactions=transactions)
-    return jsonify({'html': html, 'has_next': pagination.has_next})
+    html = render_template('_crypto_transaction_rows.html', transactions=pagination.items)
+    return jsonify({'html': html, 'has_next': pagination.has_next, 'next_cursor': pagination.next_cursor})
 
 @main_bp.route('/crypto-transactions')
 @login_required
 def ui_crypto_transactions():
-    page = request.args.get('page', 1, type=int)
     start_date_str = request.args.get('start_date', '')
     end_date_str = request.args.get('end_date', '')
 
@@ -633,7 +630,7 @@ def ui_crypto_transactions():
         InvestmentPlatform.user_id == current_user.id
     ).options(joinedload(Transaction.platform))
 
-    transactions_query = _apply_crypto_transaction_filters_and_sort(transactions_query, request.args)
+    transactions_query = _apply_crypto_transaction_filters(transactions_query, request.args)
 
     try:
         if start_date_str:
@@ -646,7 +643,7 @@ def ui_crypto_transactions():
         flash('Неверный формат даты. Используйте ГГГГ-ММ-ДД.', 'danger')
         start_date_str, end_date_str = '', '' 
 
-    transactions_pagination = transactions_query.paginate(page=page, per_page=150, error_out=False)
+    transactions_pagination = _paginate_crypto_transactions(transactions_query, request.args)
     
     unique_transaction_types = [r[0] for r in db.session.query(Transaction.type).join(InvestmentPlatform).filter(InvestmentPlatform.platform_type == 'crypto_exchange', InvestmentPlatform.user_id == current_user.id).distinct().order_by(Transaction.type).all()]
     available_platforms = InvestmentPlatform.query.filter_by(platform_type='crypto_exchange', user_id=current_user.id).order_by(InvestmentPlatform.name).all()
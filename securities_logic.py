@@ -7,19 +7,24 @@ from decimal import Decimal, InvalidOperation
 
 import apimoex
 import pandas as pd
-import requests
 from flask import (Blueprint, flash, redirect, render_template, request,
-                   url_for, current_app)
+                   url_for, current_app, jsonify)
 from sqlalchemy import asc, desc
 from sqlalchemy.orm import joinedload
-from werkzeug.utils import secure_filename
 
 # Импортируем модели и db из новых централизованных файлов
-from models import InvestmentPlatform, InvestmentAsset, Transaction, MoexHistoricalPrice, HistoricalPriceCache
+from models import InvestmentPlatform, InvestmentAsset, Transaction, MoexHistoricalPrice, HistoricalPriceCache, ReportImportJob
 from extensions import db
 from news_logic import get_securities_news
-# ИМПОРТ ДЛЯ НОВОЙ ФУНКЦИИ ЗАГРУЗКИ PDF
-from pdf_parsers import parse_bcs_report_pdf
+from services.currency_rates import get_currency_rates
+from services.moex_iss import iss_pause, iss_session
+from services.moex_market_snapshot import get_board_snapshot
+from services.moex_securities import resolve_moex_securities, resolve_secids
+from services.pagination import keyset_paginate, resolve_sort_column, count_cache_key
+from services.report_import import start_report_import, get_recent_import_jobs, import_job_status
+from services.report_fingerprint import best_layout, file_content_hash, fingerprint_report, log_unknown_layout
+from services.workbook_loader import (load_workbook, frame_with_header, sheet_cells, sheet_row_texts,
+                                      find_header_row, find_text_row)
 
 # Создаем Blueprint для маршрутов, связанных с ценными бумагами
 # ИЗМЕНЕНО: Добавляем префикс /securities для всех маршрутов этого блюпринта для лучшей организации URL.
@@ -29,46 +34,14 @@ securities_bp = Blueprint('securities', __name__, url_prefix='/securities', temp
 
 def fetch_moex_securities_metadata(tickers: list[str]) -> dict[str, dict]:
     """
-    Получает метаданные (SECID, ISIN, NAME, TYPE) для списка тикеров с MOEX.
-    Принимает на вход как SECID, так и ISIN.
+    Получает метаданные (SECID, ISIN, NAME, TYPE, доска, рынок, движок) для списка тикеров.
+    Принимает на вход как SECID, так и ISIN. Данные берутся из локального справочника MOEX
+    (services/moex_securities.py), в ISS запрашиваются только отсутствующие в нем инструменты.
     Возвращает словарь, где ключ - исходный тикер из запроса.
     """
     if not tickers:
         return {}
-
-    # Используем один запрос для всех тикеров для эффективности
-    metadata = {}
-    with requests.Session() as session:
-        # apimoex.find_securities может принимать список, но для надежности лучше по одному
-        for ticker_query in tickers:
-            try:
-                print(f"--- [MOEX Meta Fetch] Поиск метаданных для '{ticker_query}'...")
-                # Ищем по SECID или ISIN
-                data = apimoex.find_securities(session, ticker_query, columns=('secid', 'isin', 'name', 'group', 'primary_boardid'))
-                if data:
-                    # Берем первую, наиболее релевантную запись
-                    sec_info = data[0]
-                    print(f"--- [MOEX Meta Fetch DEBUG] Найдены данные для '{ticker_query}': {sec_info}")
-                    type_map = {
-                        'stock_shares': 'stock',
-                        'stock_bonds': 'bond',
-                        'stock_etf': 'etf',
-                        'stock_ppif': 'etf',
-                    }
-                    asset_type = type_map.get(sec_info.get('group'), 'other')
-                    
-                    # Ключом будет исходный запрос (обычно ISIN)
-                    metadata[ticker_query] = {
-                        'ticker': sec_info.get('secid'), 
-                        'isin': sec_info.get('isin'), 
-                        'name': sec_info.get('name'), 
-                        'asset_type': asset_type,
-                        'board': sec_info.get('primary_boardid'),
-                        'group': sec_info.get('group') # Сохраняем группу для точного запроса
-                    }
-            except Exception as e:
-                print(f"INFO: Не удалось найти метаданные для '{ticker_query}' на MOEX: {e}")
-    return metadata
+    return resolve_moex_securities(tickers)
 
 def fetch_moex_historical_price_range(secids: list[str], start_date: date, end_date: date) -> dict[str, dict[date, Decimal]]:
     """
@@ -76,7 +49,7 @@ def fetch_moex_historical_price_range(secids: list[str], start_date: date, end_d
     Возвращает словарь {secid: {дата: цена}}.
     """
     all_prices = defaultdict(dict)
-    with requests.Session() as session:
+    with iss_session() as session:
         for secid in secids:
             try:
                 print(f"--- [MOEX History Range] Запрос истории для {secid} с {start_date} по {end_date}...")
@@ -94,7 +67,7 @@ def fetch_moex_historical_price_range(secids: list[str], start_date: date, end_d
                         all_prices[secid][trade_date] = Decimal(str(record['CLOSE']))
             except Exception as e:
                 print(f"--- [MOEX History Range] Ошибка при получении истории для {secid}: {e}")
-            time.sleep(0.2) # Пауза между запросами по тикерам
+            iss_pause(0.2) # Пауза между запросами по тикерам
     return all_prices
 
 def fetch_moex_historical_prices(isins: list[str], target_date: date) -> dict[str, Decimal]:
@@ -121,12 +94,12 @@ def fetch_moex_historical_prices(isins: list[str], target_date: date) -> dict[st
     # 3. Запрашиваем недостающие данные
     if isins_to_fetch:
         print(f"--- [MOEX History] Запрос исторических цен на {target_date} для {len(isins_to_fetch)} ISIN...")
-        with requests.Session() as session:
+        secids = resolve_secids(isins_to_fetch)
+        with iss_session() as session:
             for isin in isins_to_fetch:
                 try:
-                    meta_list = apimoex.find_securities(session, isin, columns=('secid',))
-                    if not meta_list: continue
-                    secid = meta_list[0]['secid']
+                    secid = secids.get(isin)
+                    if not secid: continue
                     # Запрашиваем данные за небольшой диапазон до целевой даты, чтобы найти последнюю торговую сессию
                     start_date_for_request = target_date - timedelta(days=7)
                     history = apimoex.get_market_history(
@@ -143,14 +116,15 @@ def fetch_moex_historical_prices(isins: list[str], target_date: date) -> dict[st
                         db.session.add(MoexHistoricalPrice(isin=isin, date=target_date, price_rub=price))
                 except Exception as e:
                     print(f"--- [MOEX History] Ошибка при получении исторической цены для {isin} на {target_date}: {e}")
-                time.sleep(0.1)
+                iss_pause(0.1)
         db.session.commit()
     return prices
 
 def fetch_moex_securities_prices(securities_meta: dict) -> dict[str, Decimal]:
     """
     Получает последние цены для списка ценных бумаг с Московской биржи (MOEX ISS).
-    Использует пакетные запросы к доскам с указанием рынка и движка для надежности.
+    Цены берутся из общих для всех пользователей снимков досок (services/moex_market_snapshot.py):
+    одна загрузка доски на срок жизни снимка вместо запросов при каждой синхронизации.
     Корректно рассчитывает "грязную" цену для облигаций.
     """
     if not securities_meta:
@@ -166,68 +140,65 @@ def fetch_moex_securities_prices(securities_meta: dict) -> dict[str, Decimal]:
             secid = meta['ticker'].upper()
             board = meta['board']
             
-            # Разбираем группу на движок и рынок
-            group_parts = meta['group'].split('_')
-            engine, market = 'stock', 'shares' # Значения по умолчанию
-            if len(group_parts) == 2:
-                engine, market = group_parts
-            
-            # Особый случай для фондов, где рынок называется 'stock'
-            if market in ['etf', 'ppif']:
-                market = 'stock'
+            # Движок и рынок хранятся в справочнике MOEX; для старых метаданных разбираем группу
+            engine, market = meta.get('engine'), meta.get('market')
+            if not engine or not market:
+                group_parts = meta['group'].split('_')
+                engine, market = 'stock', 'shares' # Значения по умолчанию
+                if len(group_parts) == 2:
+                    engine, market = group_parts
+                
+                # Особый случай для фондов, где рынок называется 'stock'
+                if market in ['etf', 'ppif']:
+                    market = 'stock'
 
             requests_by_key[(board, market, engine)].append(secid)
             secid_to_isin_map[secid] = isin
     
     print(f"--- [MOEX Debug] Группировка для запросов: { {f'{k[0]}/{k[1]}/{k[2]}': v for k, v in requests_by_key.items()} }")
 
-    # Этап 2: Сбор и обработка данных
+    # Этап 2: Сбор и обработка данных из снимков досок (services/moex_market_snapshot.py)
     final_prices = {}
     price_priority = ['LAST', 'MARKETPRICE', 'MARKETPRICE2', 'LCLOSE', 'PREVADMITTEDQUOTE', 'PREVPRICE']
-    marketdata_columns = ['SECID', 'LAST', 'MARKETPRICE', 'MARKETPRICE2', 'LCLOSE', 'PREVADMITTEDQUOTE', 'PREVPRICE', 'ACCRUEDINT']
-    securities_columns = ['SECID', 'FACEVALUE']
 
-    with requests.Session() as session:
-        for (board, market, engine), secids_on_board in requests_by_key.items():
-            print(f"\n--- [MOEX Price Fetch] Запрос для: доска='{board}', рынок='{market}', движок='{engine}'...")
-            try:
-                kwargs = {'market': market, 'engine': engine}
-                specs_data = apimoex.get_board_securities(session, board=board, table='securities', columns=securities_columns, **kwargs)
-                market_data = apimoex.get_board_securities(session, board=board, table='marketdata', columns=marketdata_columns, **kwargs)
+    for (board, market, engine), secids_on_board in requests_by_key.items():
+        print(f"\n--- [MOEX Price Fetch] Снимок для: доска='{board}', рынок='{market}', движок='{engine}'...")
+        try:
+            snapshot = get_board_snapshot(board, market=market, engine=engine)
+            if not snapshot['marketdata']:
+                print(f"--- [MOEX Price Fetch] WARNING: Не получены рыночные данные для доски '{board}'.")
+                continue
+
+            specs_lookup = snapshot['securities']
+            market_lookup = snapshot['marketdata']
+
+            for secid in secids_on_board:
+                specs = specs_lookup.get(secid)
+                market = market_lookup.get(secid)
                 
-                if not market_data:
-                    print(f"--- [MOEX Price Fetch] WARNING: Не получены рыночные данные для доски '{board}'.")
+                if not market:
+                    print(f"--- [MOEX DEBUG] Не найдены рыночные данные для {secid} в ответе от доски '{board}'")
                     continue
-                
-                specs_lookup = {item['SECID']: item for item in specs_data}
-                market_lookup = {item['SECID']: item for item in market_data}
 
-                for secid in secids_on_board:
-                    specs = specs_lookup.get(secid)
-                    market = market_lookup.get(secid)
-                    
-                    if not market:
-                        print(f"--- [MOEX DEBUG] Не найдены рыночные данные для {secid} в ответе от доски '{board}'")
-                        continue
+                price_val = next((Decimal(str(market[key])) for key in price_priority if market.get(key) is not None and market.get(key) > 0), None)
+                if not price_val: continue
 
-                    price_val = next((Decimal(str(market[key])) for key in price_priority if market.get(key) is not None and market.get(key) > 0), None)
-                    if not price_val: continue
-
-                    isin = secid_to_isin_map[secid]
-                    if securities_meta.get(isin, {}).get('asset_type') == 'bond':
-                        if not specs or not specs.get('FACEVALUE'):
-                            print(f"--- [MOEX Price Fetch] WARNING: Не найдены спецификации (номинал) для облигации '{secid}'.")
-                            continue
-                        
-                        face_value = specs.get('FACEVALUE')
-                        accrued_int = market.get('ACCRUEDINT', '0')
-                        dirty_price = (Decimal(str(face_value)) * price_val / Decimal('100')) + Decimal(str(accrued_int))
-                        final_prices[isin] = dirty_price
-                    else:
-                        final_prices[isin] = price_val
+                isin = secid_to_isin_map[secid]
+                if securities_meta.get(isin, {}).get('asset_type') == 'bond':
+                    if not specs or not specs.get('FACEVALUE'):
+                        print(f"--- [MOEX Price Fetch] WARNING: Не найдены спецификации (номинал) для облигации '{secid}'.")
+                        continue
+                    
+                    face_value = specs.get('FACEVALUE')
+                    # НКД есть в marketdata не на всех досках облигаций, иначе берем его из спецификации
+                    accrued_int = market.get('ACCRUEDINT') if market.get('ACCRUEDINT') is not None else specs.get('ACCRUEDINT', '0')
+                    dirty_price = (Decimal(str(face_value)) * price_val / Decimal('100')) + Decimal(str(accrued_int))
+                    final_prices[isin] = dirty_price
+                else:
+                    final_prices[isin] = price_val
 
-            except Exception as e:
-                print(f"--- [MOEX Price Fetch] ERROR: Ошибка при обработке доски '{board}': {e}")
+        except Exception as e:
+            print(f"--- [MOEX Price Fetch] ERROR: Ошибка при обработке доски '{board}': {e}")
 
     final_not_found = [isin for isin in securities_meta if isin not in final_prices]
     if final_not_found:
@@ -248,35 +219,24 @@ def fetch_moex_market_leaders(tickers: list[str]) -> list[dict]:
     indices = [t for t in tickers if t.startswith('IMOEX') or t.startswith('RTSI')]
     stocks = [t for t in tickers if t not in indices]
 
-    with requests.Session() as session:
-        try:
-            # Запрос для акций
-            if stocks:
-                market_data = apimoex.get_board_securities(
-                    session, 
-                    board='TQBR', 
-                    table='marketdata',
-                    columns=('SECID', 'LAST', 'LASTTOPREVPRICE')
-                )
-                market_lookup = {item['SECID']: item for item in market_data}
-                for ticker in stocks:
-                    data = market_lookup.get(ticker)
-                    if data and data.get('LAST') is not None:
-                        leaders_data.append({'ticker': ticker, 'price': Decimal(str(data['LAST'])), 'change_pct': data.get('LASTTOPREVPRICE')})
-
-            # Запрос для индексов
-            if indices:
-                index_data = apimoex.get_board_securities(
-                    session, board='SNDX', table='marketdata',
-                    columns=('SECID', 'CURRENTVALUE', 'LASTTOPREVPRICE')
-                )
-                index_lookup = {item['SECID']: item for item in index_data}
-                for ticker in indices:
-                    data = index_lookup.get(ticker)
-                    if data and data.get('CURRENTVALUE') is not None:
-                        leaders_data.append({'ticker': ticker, 'price': Decimal(str(data['CURRENTVALUE'])), 'change_pct': data.get('LASTTOPREVPRICE')})
-        except Exception as e:
-            print(f"Ошибка при получении данных о лидерах рынка MOEX: {e}")
+    try:
+        # Снимок основной доски акций
+        if stocks:
+            market_lookup = get_board_snapshot('TQBR')['marketdata']
+            for ticker in stocks:
+                data = market_lookup.get(ticker)
+                if data and data.get('LAST') is not None:
+                    leaders_data.append({'ticker': ticker, 'price': Decimal(str(data['LAST'])), 'change_pct': data.get('LASTTOPREVPRICE')})
+
+        # Снимок доски индексов
+        if indices:
+            index_lookup = get_board_snapshot('SNDX', market='index')['marketdata']
+            for ticker in indices:
+                data = index_lookup.get(ticker)
+                if data and data.get('CURRENTVALUE') is not None:
+                    leaders_data.append({'ticker': ticker, 'price': Decimal(str(data['CURRENTVALUE'])), 'change_pct': data.get('LASTTOPREVPRICE')})
+    except Exception as e:
+        print(f"Ошибка при получении данных о лидерах рынка MOEX: {e}")
 
     return leaders_data
 # --- Парсеры брокерских отчетов ---
@@ -292,35 +252,46 @@ def _clean_and_convert_to_decimal(value):
     except (InvalidOperation, TypeError):
         return Decimal('0')
 
-def _parse_bcs_report(xls_file):
+def _column_or_default(df, column, default):
+    """Колонка таблицы или колонка со значением по умолчанию, если в отчете ее нет (аналог row.get(column, default))."""
+    if column is None:
+        return pd.Series(default, index=df.index, dtype=object)
+    return df[column]
+
+def _decimal_column(df, column):
+    return _column_or_default(df, column, None).map(_clean_and_convert_to_decimal)
+
+def _text_column(df, column, default=''):
+    return _column_or_default(df, column, default).astype(str).str.strip()
+
+# Регулярные выражения парсеров компилируются один раз при импорте модуля
+_FINREZ_HEADER_RE = re.compile(r'^(?=.*Валюта)(?=.*Инструмент)', re.DOTALL)
+_GENERIC_PORTFOLIO_HEADER_RE = re.compile('|'.join(re.escape(keyword) for keyword in [
+    'Код финансового инструмента', 'Тикер', 'Наименование инструмента', 'Эмитент', 'Актив', 'Инструмент', 'Код актива', 'Symbol'
+]))
+_DINAMIKA_HEADER_RE = re.compile(r'^(?=.*Инструмент)(?=.*(?:Код инструмента|ISIN))', re.DOTALL)
+_PARENTHESIZED_TICKER_RE = re.compile(r'\((.*?)\)')
+
+def _parse_bcs_report(workbook):
     """
     Парсер для отчетов брокера БКС.
     Ищет лист, похожий на "Портфель по активам", и извлекает данные.
     """
     # Ищем лист с активами. Названия могут варьироваться.
-    sheet_name = next((name for name in xls_file.sheet_names if 'портфель' in name.lower() and 'клиент' in name.lower()), None)
+    sheet_name = next((name for name in workbook.sheet_names if 'портфель' in name.lower() and 'клиент' in name.lower()), None)
     if not sheet_name:
-        sheet_name = next((name for name in xls_file.sheet_names if 'портфель' in name.lower()), None)
-    
+        sheet_name = next((name for name in workbook.sheet_names if 'портфель' in name.lower()), None)
+
     if not sheet_name:
         return [] # Не нашли подходящий лист
 
-    df = pd.read_excel(xls_file, sheet_name=sheet_name, header=None)
-
-    # Ищем строку с заголовками. Она может быть не на первой строке.
-    header_row_index = -1
-    for i, row in df.iterrows():
-        row_values = [str(cell).strip() for cell in row.values if pd.notna(cell)]
-        # Ищем строку, где есть хотя бы несколько ключевых слов из заголовков
-        if 'Вид ЦБ' in row_values and 'Наименование ЦБ' in row_values and 'Кол-во' in row_values:
-            header_row_index = i
-            break
-    
+    # Ищем строку с заголовками (она может быть не на первой строке) по ключевым колонкам
+    header_row_index = find_header_row(sheet_cells(workbook, sheet_name), ['Вид ЦБ', 'Наименование ЦБ', 'Кол-во'])
     if header_row_index == -1:
         return [] # Не нашли строку с заголовками
 
-    # Читаем данные, используя найденную строку как заголовок
-    df = pd.read_excel(xls_file, sheet_name=sheet_name, header=header_row_index)
+    # Берем данные из уже прочитанного листа, используя найденную строку как заголовок
+    df = frame_with_header(workbook.sheets[sheet_name], header_row_index)
     df.columns = df.columns.str.strip()
 
     # Карта возможных названий колонок для гибкости
@@ -339,113 +310,176 @@ def _parse_bcs_report(xls_file):
     if not all(actual_columns.get(key) for key in ['ticker', 'name', 'quantity']):
         return []
 
-    assets = []
-    for _, row in df.iterrows():
-        ticker_val = row.get(actual_columns['ticker'])
-        if pd.isna(ticker_val) or not str(ticker_val).strip(): continue
-        quantity = _clean_and_convert_to_decimal(row.get(actual_columns['quantity']))
-        if quantity <= 0: continue
-        price = _clean_and_convert_to_decimal(row.get(actual_columns.get('price')))
-        currency = str(row.get(actual_columns.get('currency'), 'RUB')).strip()
-        name = str(row.get(actual_columns['name'])).strip()
-        asset_type_raw = str(row.get(actual_columns.get('asset_type_raw'), '')).lower()
-        asset_type = 'bond' if 'облига' in asset_type_raw else ('etf' if 'паи' in asset_type_raw or 'etf' in asset_type_raw else 'stock')
+    tickers = _text_column(df, actual_columns['ticker'])
+    quantities = _decimal_column(df, actual_columns['quantity'])
+    df = df[df[actual_columns['ticker']].notna() & tickers.ne('') & quantities.gt(0)]
+    if df.empty:
+        return []
 
-        assets.append({'ticker': str(ticker_val).strip(), 'name': name, 'quantity': quantity, 'current_price': price, 'currency_of_price': currency, 'asset_type': asset_type, 'source_account_type': 'Brokerage'})
+    asset_type_raw = _text_column(df, actual_columns.get('asset_type_raw')).str.lower()
+    asset_types = pd.Series('stock', index=df.index, dtype=object)
+    asset_types = asset_types.mask(asset_type_raw.str.contains('паи|etf'), 'etf').mask(asset_type_raw.str.contains('облига', regex=False), 'bond')
 
-    return assets
+    return [
+        {'ticker': ticker, 'name': name, 'quantity': quantity, 'current_price': price, 'currency_of_price': currency, 'asset_type': asset_type, 'source_account_type': 'Brokerage'}
+        for ticker, name, quantity, price, currency, asset_type in zip(
+            tickers[df.index], _text_column(df, actual_columns['name']), quantities[df.index],
+            _decimal_column(df, actual_columns.get('price')), _text_column(df, actual_columns.get('currency'), 'RUB'), asset_types
+        )
+    ]
 
-def _parse_finrez_report(xls_file):
+def _parse_finrez_report(workbook):
     sheet_name = "Фин.рез."
-    if sheet_name not in xls_file.sheet_names: return []
-    df = pd.read_excel(xls_file, sheet_name=sheet_name, header=None)
-    header_row_index = next((i for i, row in df.iterrows() if 'Валюта' in str(row.values) and 'Инструмент' in str(row.values)), -1)
+    if sheet_name not in workbook.sheet_names: return []
+    header_row_index = find_text_row(sheet_row_texts(workbook, sheet_name), _FINREZ_HEADER_RE)
     if header_row_index == -1: return []
-    df = pd.read_excel(xls_file, sheet_name=sheet_name, header=header_row_index)
+    df = frame_with_header(workbook.sheets[sheet_name], header_row_index)
     df.columns = df.columns.str.strip()
     column_map = {'currency': ['Валюта'], 'asset_type_raw': ['Инструмент'], 'name': ['Актив'], 'total_value': ['Открытая позиция стоимость'], 'quantity': ['Количество', 'Кол-во', 'Количество, шт.', 'Открытая позиция кол-во']}
     actual_columns = {key: next((name for name in names if name in df.columns), None) for key, names in column_map.items()}
     if not all(actual_columns.get(key) for key in ['name', 'total_value', 'quantity']): return []
-    df_filtered = df[df[actual_columns['asset_type_raw']].isin(['Акции', 'Облигации'])]
-    assets = []
-    for _, row in df_filtered.iterrows():
-        name_val = row.get(actual_columns['name'])
-        if pd.isna(name_val): continue
-        quantity = _clean_and_convert_to_decimal(row.get(actual_columns['quantity']))
-        total_value = _clean_and_convert_to_decimal(row.get(actual_columns['total_value']))
-        if quantity <= 0: continue
-        price = total_value / quantity if quantity != 0 else Decimal('0')
-        ticker_match = re.search(r'\((.*?)\)', name_val)
-        ticker = ticker_match.group(1).strip().upper() if ticker_match else name_val.split(' ')[0].upper()
-        asset_type_map = {'Акции': 'stock', 'Облигации': 'bond'}
-        asset_type = asset_type_map.get(row.get(actual_columns.get('asset_type_raw')), 'other')
-        assets.append({'ticker': ticker, 'name': name_val.strip(), 'quantity': quantity, 'current_price': price, 'currency_of_price': str(row.get(actual_columns.get('currency'), 'RUB')).strip(), 'asset_type': asset_type, 'source_account_type': 'Brokerage'})
-    return assets
-
-def _parse_generic_portfolio_report(xls_file):
+    df = df[df[actual_columns['asset_type_raw']].isin(['Акции', 'Облигации']) & df[actual_columns['name']].notna()]
+    quantities = _decimal_column(df, actual_columns['quantity'])
+    df, quantities = df[quantities.gt(0)], quantities[quantities.gt(0)]
+    if df.empty: return []
+    names = df[actual_columns['name']].astype(str)
+    tickers = names.str.extract(_PARENTHESIZED_TICKER_RE, expand=False).str.strip().str.upper()
+    tickers = tickers.fillna(names.str.split(' ').str[0].str.upper())
+    asset_types = df[actual_columns['asset_type_raw']].map({'Акции': 'stock', 'Облигации': 'bond'}).fillna('other')
+    return [
+        {'ticker': ticker, 'name': name.strip(), 'quantity': quantity, 'current_price': total_value / quantity, 'currency_of_price': currency, 'asset_type': asset_type, 'source_account_type': 'Brokerage'}
+        for ticker, name, quantity, total_value, currency, asset_type in zip(
+            tickers, names, quantities, _decimal_column(df, actual_columns['total_value']),
+            _text_column(df, actual_columns.get('currency'), 'RUB'), asset_types
+        )
+    ]
+
+def _parse_generic_portfolio_report(workbook):
     try:
-        sheet_name = next((name for name in xls_file.sheet_names if any(keyword in name.lower() for keyword in ['портфель', 'активы', 'portfolio', 'assets'])), None)
+        sheet_name = next((name for name in workbook.sheet_names if any(keyword in name.lower() for keyword in ['портфель', 'активы', 'portfolio', 'assets'])), None)
         if not sheet_name: return []
-        df = pd.read_excel(xls_file, sheet_name=sheet_name, header=None)
-        header_keywords = ['Код финансового инструмента', 'Тикер', 'Наименование инструмента', 'Эмитент', 'Актив', 'Инструмент', 'Код актива', 'Symbol']
-        header_row_index = next((i for i, row in df.iterrows() if any(keyword in str(cell) for keyword in header_keywords for cell in row.values if pd.notna(cell))), -1)
+        header_row_index = find_text_row(sheet_row_texts(workbook, sheet_name), _GENERIC_PORTFOLIO_HEADER_RE)
         if header_row_index == -1: return []
-        df = pd.read_excel(xls_file, sheet_name=sheet_name, header=header_row_index)
+        df = frame_with_header(workbook.sheets[sheet_name], header_row_index)
         df.columns = df.columns.str.strip()
         column_map = {'ticker': ['Код финансового инструмента', 'Тикер', 'Код актива', 'Symbol'], 'name': ['Эмитент', 'Наименование инструмента', 'Наименование', 'Актив', 'Инструмент', 'Name'], 'quantity': ['Количество, шт.', 'Количество', 'Кол-во', 'Остаток', 'Quantity'], 'current_price': ['Цена закрытия', 'Рыночная цена', 'Цена последней сделки', 'Цена послед.', 'Текущая цена', 'Price'], 'currency_of_price': ['Валюта цены', 'Валюта', 'Currency'], 'asset_type': ['Тип ЦБ', 'Тип актива', 'Тип инструмента', 'Asset Type']}
         actual_columns = {key: next((name for name in potential_names if name in df.columns), None) for key, potential_names in column_map.items()}
-        if 'ticker' not in actual_columns or 'quantity' not in actual_columns: raise ValueError(f"Не найдены обязательные колонки ('Тикер' и 'Количество').")
-        assets = []
-        for index, row in df.iterrows():
-            ticker_val = row.get(actual_columns['ticker'])
-            if pd.isna(ticker_val): continue
-            quantity_val = _clean_and_convert_to_decimal(row.get(actual_columns.get('quantity')))
-            if quantity_val <= 0: continue
-            price_val = _clean_and_convert_to_decimal(row.get(actual_columns.get('current_price')))
-            assets.append({'ticker': str(ticker_val).strip(), 'name': str(row.get(actual_columns.get('name'), ticker_val)).strip(), 'quantity': quantity_val, 'current_price': price_val, 'currency_of_price': str(row.get(actual_columns.get('currency_of_price'), 'RUB')).strip(), 'asset_type': str(row.get(actual_columns.get('asset_type'), 'stock')).lower().strip(), 'source_account_type': 'Brokerage'})
-        return assets
+        if not actual_columns['ticker']: return []
+        quantities = _decimal_column(df, actual_columns.get('quantity'))
+        mask = df[actual_columns['ticker']].notna() & quantities.gt(0)
+        df, quantities = df[mask], quantities[mask]
+        if df.empty: return []
+        tickers = df[actual_columns['ticker']]
+        names = tickers if actual_columns['name'] is None else df[actual_columns['name']]
+        return [
+            {'ticker': ticker, 'name': name, 'quantity': quantity, 'current_price': price, 'currency_of_price': currency, 'asset_type': asset_type, 'source_account_type': 'Brokerage'}
+            for ticker, name, quantity, price, currency, asset_type in zip(
+                tickers.astype(str).str.strip(), names.astype(str).str.strip(), quantities,
+                _decimal_column(df, actual_columns.get('current_price')),
+                _text_column(df, actual_columns.get('currency_of_price'), 'RUB'),
+                _text_column(df, actual_columns.get('asset_type'), 'stock').str.lower()
+            )
+        ]
     except Exception as e:
         raise type(e)(f"Ошибка при обработке файла отчета: {e}")
 
-def _parse_dinamika_pozitsiy_report(xls_file):
+def _parse_dinamika_pozitsiy_report(workbook):
     sheet_name = "Динамика позиций"
-    if sheet_name not in xls_file.sheet_names: return []
-    df = pd.read_excel(xls_file, sheet_name=sheet_name, header=None)
-    header_row_index = next((i for i, row in df.iterrows() if 'Инструмент' in str(row.values) and ('Код инструмента' in str(row.values) or 'ISIN' in str(row.values))), -1)
+    if sheet_name not in workbook.sheet_names: return []
+    header_row_index = find_text_row(sheet_row_texts(workbook, sheet_name), _DINAMIKA_HEADER_RE)
     if header_row_index == -1: return []
-    df.columns = [str(col).strip() for col in df.iloc[header_row_index]]
-    df = df.iloc[header_row_index + 1:].reset_index(drop=True)
+    raw_df = workbook.sheets[sheet_name]
+    # Сырой лист общий для всех парсеров - заголовки задаем на срезе, а не на нем
+    df = raw_df.iloc[header_row_index + 1:].reset_index(drop=True)
+    df.columns = [str(col).strip() for col in raw_df.iloc[header_row_index]]
     column_map = {'ticker': ['Код инструмента', 'ISIN'], 'name': ['Инструмент'], 'quantity': ['Количество на конец периода', 'Конечный остаток, шт']}
     actual_columns = {key: next((name for name in names if name in df.columns), None) for key, names in column_map.items()}
     if not all(actual_columns.get(key) for key in ['ticker', 'name', 'quantity']): return []
-    assets = []
+    names = _text_column(df, actual_columns['name'])
+    quantities = _decimal_column(df, actual_columns['quantity'])
+    mask = df[actual_columns['name']].notna() & names.ne('') & quantities.gt(0)
+    df, names, quantities = df[mask], names[mask], quantities[mask]
     QUANTIZER = Decimal('1.000000')
-    for _, row in df.iterrows():
-        name_val = row.get(actual_columns['name'])
-        if pd.isna(name_val) or not str(name_val).strip(): continue
-        quantity = _clean_and_convert_to_decimal(row.get(actual_columns['quantity']))
-        if quantity <= 0: continue
-        ticker_val = str(row.get(actual_columns['ticker'])).strip()
-        quantized_quantity = quantity.quantize(QUANTIZER)
-        assets.append({'ticker': ticker_val, 'name': str(name_val).strip(), 'quantity': quantized_quantity, 'current_price': Decimal('0'), 'currency_of_price': 'RUB', 'asset_type': 'stock', 'source_account_type': 'Brokerage'})
-    return assets
-
-def _parse_broker_portfolio_report(file_path):
-    engine = 'openpyxl' if file_path.endswith('.xlsx') else 'xlrd'
-    xls = pd.ExcelFile(file_path, engine=engine)
-    # ИЗМЕНЕНО: Добавляем новый парсер для БКС в начало списка
-    for parser_func in [_parse_bcs_report, _parse_dinamika_pozitsiy_report, _parse_generic_portfolio_report, _parse_finrez_report]:
+    return [
+        {'ticker': ticker, 'name': name, 'quantity': quantity.quantize(QUANTIZER), 'current_price': Decimal('0'), 'currency_of_price': 'RUB', 'asset_type': 'stock', 'source_account_type': 'Brokerage'}
+        for ticker, name, quantity in zip(_text_column(df, actual_columns['ticker']), names, quantities)
+    ]
+
+def _dispatch_broker_report(file_path, kind, parsers, content_hash=None):
+    """
+    Разбирает отчет парсером формата, определенного по отпечатку (services/report_fingerprint.py).
+    Если формат не распознан или его парсер не вернул данных, остальные парсеры пробуются по очереди.
+    """
+    # Файл читается один раз, все парсеры работают с уже загруженными листами
+    workbook = load_workbook(file_path)
+    fingerprint = fingerprint_report(workbook, content_hash or file_content_hash(file_path))
+    layout, confidence = best_layout(fingerprint, kind)
+    if layout:
+        current_app.logger.info(f"--- [Parser] Формат отчета: {layout} (уверенность {confidence:.2f})")
+        chain = [parsers[layout]] + [parser_func for name, parser_func in parsers.items() if name != layout]
+    else:
+        log_unknown_layout(fingerprint, workbook, kind)
+        chain = list(parsers.values())
+
+    for parser_func in chain:
         try:
-            assets = parser_func(xls)
-            if assets:
+            result = parser_func(workbook)
+            if result:
+                if layout and parser_func is not parsers[layout]:
+                    current_app.logger.warning(f"--- [Parser] Парсер формата {layout} не вернул данных, отпечаток отчета {fingerprint.content_hash[:12]} нужно уточнить. Оценки: {fingerprint.scores}")
                 current_app.logger.info(f"--- [Parser] Отчет успешно разобран с помощью: {parser_func.__name__}")
-                return assets
+                return result
         except Exception as e:
             current_app.logger.warning(f"--- [Parser] Ошибка при использовании парсера {parser_func.__name__}: {e}")
             continue # Пробуем следующий парсер
     return []
 
-def _parse_bcs_universal_deals_report(xls_file):
+# Парсеры портфеля по форматам services/report_fingerprint.LAYOUTS, в порядке перебора для нераспознанных отчетов
+_PORTFOLIO_PARSERS = {
+    'bcs_portfolio': _parse_bcs_report,
+    'dinamika_pozitsiy': _parse_dinamika_pozitsiy_report,
+    'generic_portfolio': _parse_generic_portfolio_report,
+    'finrez': _parse_finrez_report,
+}
+
+def _parse_broker_portfolio_report(file_path, content_hash=None):
+    return _dispatch_broker_report(file_path, 'portfolio', _PORTFOLIO_PARSERS, content_hash)
+
+# Ключевые слова для поиска начала раздела сделок БКС
+_BCS_SECTION_START_RE = re.compile('|'.join(re.escape(keyword) for keyword in ['2.1. Сделки:', 'Сделки купли/продажи ЦБ']))
+# Ключевые слова для поиска конца раздела
+_BCS_SECTION_END_RE = re.compile(r'^\s*3\.\s*Активы:|^\s*2\.2\.\s*')
+# Ключевые слова для игнорирования секций
+_BCS_IGNORED_SECTION_RE = re.compile('|'.join(re.escape(keyword) for keyword in ['Инструменты срочного рынка']), re.IGNORECASE)
+_BCS_ISIN_RE = re.compile(r'ISIN:\s*([A-Z0-9]+)')
+_DEAL_DATE_RE = re.compile(r'\d{2}\.\d{2}\.\d{2}')
+
+def _looks_like_deal_date(value):
+    """Первая ячейка строки сделки - дата (datetime или строка вида ДД.ММ.ГГГГ / ДД.ММ.ГГ)."""
+    if isinstance(value, datetime):
+        return True
+    return isinstance(value, str) and _DEAL_DATE_RE.match(value.strip()) is not None
+
+def _bcs_header_indices(header_row_list, column_map):
+    """Позиции колонок таблицы сделок по строке заголовка. Первая 'Цена' - цена покупки, вторая - продажи."""
+    header_indices = {}
+    price_indices = [idx for idx, col_name in enumerate(header_row_list) if col_name == 'Цена']
+    for key, names in column_map.items():
+        if key in ['buy_price', 'sell_price']: continue
+        index = next((header_row_list.index(name) for name in names if name in header_row_list), None)
+        if index is not None:
+            header_indices[key] = index
+    if len(price_indices) > 0:
+        header_indices['buy_price'] = price_indices[0]
+    if len(price_indices) > 1:
+        header_indices['sell_price'] = price_indices[1]
+    return header_indices
+
+def _to_timestamp(value):
+    # Ячейки с датой xlrd уже отдает как datetime - pd.to_datetime нужен только для строк
+    return value if isinstance(value, datetime) else pd.to_datetime(value)
+
+def _parse_bcs_universal_deals_report(workbook):
     """
     Универсальный и более надежный парсер для отчетов по сделкам от брокера БКС.
     Он объединяет логику предыдущих парсеров и добавляет гибкости.
@@ -453,16 +487,13 @@ def _parse_bcs_universal_deals_report(xls_file):
     - Гибко находит заголовок таблицы и сопоставляет колонки.
     - Обрабатывает отчеты, где сделки по разным активам сгруппированы.
     - Игнорирует секции, не связанные с ЦБ (например, фьючерсы).
+
+    Признаки строк (границы разделов, ISIN, заголовок таблицы, строка сделки) вычисляются
+    для всего листа по колонкам; построчно обходятся только непустые строки, потому что
+    разбор зависит от текущего раздела и актива.
     """
     current_app.logger.info("--- [BCS Universal Deals Parser] Начало работы...")
 
-    # Ключевые слова для поиска начала раздела
-    section_start_keywords = ['2.1. Сделки:', 'Сделки купли/продажи ЦБ']
-    # Ключевые слова для поиска конца раздела
-    section_end_keywords = [r'^\s*3\.\s*Активы:', r'^\s*2\.2\.\s*']
-    # Ключевые слова для игнорирования секций
-    ignore_section_keywords = ['Инструменты срочного рынка']
-
     # Карта для гибкого сопоставления колонок
     column_map = {
         'id': ['Номер', 'Номер сделки'],
@@ -480,39 +511,52 @@ def _parse_bcs_universal_deals_report(xls_file):
 
     all_transactions = []
 
-    for sheet_name in xls_file.sheet_names:
+    for sheet_name in workbook.sheet_names:
         try:
-            df = pd.read_excel(xls_file, sheet_name=sheet_name, header=None)
+            df = workbook.sheets[sheet_name]
             if df.empty:
                 continue
-            
+
+            texts = sheet_row_texts(workbook, sheet_name)
+            # Быстрая проверка: без начала раздела сделок лист можно не обходить
+            is_section_start = texts.str.contains(_BCS_SECTION_START_RE)
+            if not is_section_start.any():
+                continue
+
+            cells = sheet_cells(workbook, sheet_name)
+            is_ignored_section = texts.str.contains(_BCS_IGNORED_SECTION_RE)
+            is_section_end = texts.str.contains(_BCS_SECTION_END_RE)
+            isins = texts.str.extract(_BCS_ISIN_RE, expand=False)
+            is_header = cells.eq('Дата').any(axis=1) & cells.eq('Куплено, шт').any(axis=1) & cells.eq('Продано, шт').any(axis=1)
+            is_deal_row = df[df.columns[0]].map(_looks_like_deal_date)
+            values = df.to_numpy(dtype=object)
+
             in_deals_section = False
             in_ignored_section = False
             current_asset_info = None
             header_indices = {}
 
-            for i, row in df.iterrows():
-                row = df.iloc[i]
-                row_str = ' '.join([str(cell).strip() for cell in row if pd.notna(cell)])
-                if not row_str: continue
+            for i in texts.index[texts.ne('')]:
+                row = values[i]
+                row_str = texts[i]
 
                 # Проверяем, не вошли ли мы в секцию фьючерсов
-                if any(re.search(keyword, row_str, re.IGNORECASE) for keyword in ignore_section_keywords):
+                if is_ignored_section[i]:
                     current_app.logger.info(f"--- [BCS Universal] Обнаружена игнорируемая секция: '{row_str}'")
                     in_ignored_section = True
                     in_deals_section = False # Выходим из секции сделок, если она была активна
                     current_asset_info = None
                     header_indices = {}
                     continue
-                
+
                 # Проверяем, не закончился ли раздел
-                if in_deals_section and any(re.search(keyword, row_str) for keyword in section_end_keywords):
+                if in_deals_section and is_section_end[i]:
                     current_app.logger.info(f"--- [BCS Universal] Обнаружен конец раздела сделок: '{row_str}'")
                     in_deals_section = False
                     break # Переходим к следующему листу
 
                 # Ищем начало раздела сделок
-                if not in_deals_section and any(keyword in row_str for keyword in section_start_keywords):
+                if not in_deals_section and is_section_start[i]:
                     current_app.logger.info(f"--- [BCS Universal] Найден раздел сделок на листе '{sheet_name}': '{row_str}'")
                     in_deals_section = True
                     in_ignored_section = False # Сбрасываем флаг игнорирования
@@ -522,73 +566,42 @@ def _parse_bcs_universal_deals_report(xls_file):
                     continue
 
                 # Внутри раздела сделок ищем информацию об активе
-                isin_match = re.search(r'ISIN:\s*([A-Z0-9]+)', row_str)
-                if isin_match:
-                    name_candidate = str(row.iloc[7]).strip() if len(row) > 7 and pd.notna(row.iloc[7]) and str(row.iloc[7]).strip() else isin_match.group(1)
-                    current_asset_info = {'isin': isin_match.group(1), 'name': name_candidate}
+                if pd.notna(isins[i]):
+                    name_cell = cells.iat[i, 7] if len(row) > 7 else None
+                    name_candidate = name_cell if pd.notna(name_cell) and name_cell else isins[i]
+                    current_asset_info = {'isin': isins[i], 'name': name_candidate}
                     header_indices = {} # Сбрасываем заголовки для нового актива
                     current_app.logger.info(f"--- [BCS Universal] Найден актив: {current_asset_info}")
                     continue
 
-                # Ищем заголовок таблицы
-                header_row_list = [str(c).strip() for c in row]
-                # Проверяем, что это заголовок, по наличию ключевых колонок
-                if 'Дата' in header_row_list and 'Куплено, шт' in header_row_list and 'Продано, шт' in header_row_list:
-                    header_indices = {}
-                    # Find all indices for 'Цена'
-                    price_indices = [idx for idx, col_name in enumerate(header_row_list) if col_name == 'Цена']
-                    
-                    # Map other columns
-                    for key, names in column_map.items():
-                        if key in ['buy_price', 'sell_price']: continue # Skip price for now
-                        for name in names:
-                            try:
-                                header_indices[key] = header_row_list.index(name)
-                                break
-                            except ValueError:
-                                continue
-                    
-                    # Map price columns specifically
-                    if len(price_indices) > 0:
-                        header_indices['buy_price'] = price_indices[0]
-                    if len(price_indices) > 1:
-                        header_indices['sell_price'] = price_indices[1]
-
+                # Ищем заголовок таблицы по наличию ключевых колонок
+                if is_header[i]:
+                    header_indices = _bcs_header_indices([str(c).strip() for c in row], column_map)
                     current_app.logger.info(f"--- [BCS Universal] Найден и обработан заголовок таблицы. Индексы: {header_indices}")
                     continue
 
                 # Парсим строку транзакции, если есть информация об активе и заголовках
-                first_cell = row.iloc[0]
-                is_transaction_row = False
-                if pd.notna(first_cell):
-                    if isinstance(first_cell, datetime):
-                        is_transaction_row = True
-                    elif isinstance(first_cell, str) and (re.match(r'\d{2}\.\d{2}\.\d{4}', first_cell.strip()) or re.match(r'\d{2}\.\d{2}\.\d{2}', first_cell.strip())):
-                        is_transaction_row = True
-
-                if current_asset_info and header_indices and 'date' in header_indices and is_transaction_row:
+                if current_asset_info and header_indices and 'date' in header_indices and is_deal_row[i]:
                     try:
-                        buy_qty = _clean_and_convert_to_decimal(row.iloc[header_indices['buy_qty']])
-                        sell_qty = _clean_and_convert_to_decimal(row.iloc[header_indices['sell_qty']])
-                        
+                        buy_qty = _clean_and_convert_to_decimal(row[header_indices['buy_qty']])
+                        sell_qty = _clean_and_convert_to_decimal(row[header_indices['sell_qty']])
+
                         if buy_qty > 0:
-                            trade_type, quantity, price, total_sum = 'buy', buy_qty, _clean_and_convert_to_decimal(row.iloc[header_indices['buy_price']]), _clean_and_convert_to_decimal(row.iloc[header_indices['buy_sum']])
+                            trade_type, quantity, price, total_sum = 'buy', buy_qty, _clean_and_convert_to_decimal(row[header_indices['buy_price']]), _clean_and_convert_to_decimal(row[header_indices['buy_sum']])
                         elif sell_qty > 0:
-                            trade_type, quantity, price, total_sum = 'sell', sell_qty, _clean_and_convert_to_decimal(row.iloc[header_indices['sell_price']]), _clean_and_convert_to_decimal(row.iloc[header_indices['sell_sum']])
+                            trade_type, quantity, price, total_sum = 'sell', sell_qty, _clean_and_convert_to_decimal(row[header_indices['sell_price']]), _clean_and_convert_to_decimal(row[header_indices['sell_sum']])
                         else:
                             continue
-                            
-                        date_val = row.iloc[header_indices['date']]
-                        time_val = row.iloc[header_indices['time']]
-                        trade_date = pd.to_datetime(date_val).date()
-                        trade_time = pd.to_datetime(time_val).time()
+
+                        trade_date = _to_timestamp(row[header_indices['date']]).date()
+                        trade_time = _to_timestamp(row[header_indices['time']]).time()
                         timestamp = datetime.combine(trade_date, trade_time).replace(tzinfo=timezone.utc)
-                        
-                        fee = _clean_and_convert_to_decimal(row.iloc[header_indices['fee']]) if 'fee' in header_indices and header_indices['fee'] is not None else Decimal('0')
-                        currency = str(row.iloc[header_indices['currency']]).strip()
+
+                        fee = _clean_and_convert_to_decimal(row[header_indices['fee']]) if 'fee' in header_indices and header_indices['fee'] is not None else Decimal('0')
+                        currency = str(row[header_indices['currency']]).strip()
 
                         all_transactions.append({
-                            'exchange_tx_id': f"bcs_deal_{str(row.iloc[header_indices['id']]).strip()}", 'timestamp': timestamp, 'type': trade_type,
+                            'exchange_tx_id': f"bcs_deal_{str(row[header_indices['id']]).strip()}", 'timestamp': timestamp, 'type': trade_type,
                             'raw_type': f"Сделка {trade_type}", 'asset1_ticker': current_asset_info['isin'], 'asset1_amount': quantity,
                             'asset2_ticker': currency, 'asset2_amount': total_sum, 'execution_price': price,
                             'fee_amount': fee, 'fee_currency': currency, 'description': f"BCS deal for {current_asset_info['name']}"
@@ -608,7 +621,21 @@ def _parse_bcs_universal_deals_report(xls_file):
     current_app.logger.warning("--- [BCS Universal] Подходящий лист для этого парсера не найден во всем файле.")
     return all_transactions
 
-def _parse_generic_transactions_report(xls_file):
+# Карта колонок универсального парсера сделок и объединенное выражение для поиска строки заголовка
+_GENERIC_TRANSACTIONS_COLUMN_MAP = {'trade_id': ['№ сделки', 'Номер сделки'], 'trade_date': ['Дата сделки', 'Дата заключен.'], 'trade_time': ['Время', 'Время сделки', 'Время заключ.'], 'trade_type': ['Вид сделки', 'Тип сделки', 'Операция', 'Тип операции'], 'ticker': ['Инструмент', 'Тикер', 'Код актива', 'ISIN/рег.код'], 'name': ['Актив'], 'quantity': ['Кол-во', 'Количество, шт.', 'Количество', 'Количество актива', 'Количество актива⁷, шт./грамм'], 'price': ['Цена', 'Цена сделки'], 'total_sum': ['Сумма сделки', 'Сумма', 'Сумма сделки в валюте расчетов', 'Сумма сделки в валюте расчетов⁸'], 'currency': ['Валюта цены', 'Валюта', 'Валюта расчетов'], 'broker_fee': ['Комиссия брокера', 'Ком. брокера', 'Комиссия банка'], 'exchange_fee': ['Комиссия биржи', 'Ком. биржи'], 'fee_currency': ['Валюта комиссии'], 'comment': ['Коммент.', 'Комментарий']}
+_GENERIC_TRANSACTIONS_HEADER_KEYWORDS = [name for names in _GENERIC_TRANSACTIONS_COLUMN_MAP.values() for name in names]
+_GENERIC_TRANSACTIONS_HEADER_RE = re.compile('|'.join(re.escape(keyword) for keyword in _GENERIC_TRANSACTIONS_HEADER_KEYWORDS))
+
+def _first_token(series):
+    """Первое слово ячейки (перевод строки считается пробелом)."""
+    return series.astype(str).str.replace('\n', ' ', regex=False).str.split().str[0]
+
+def _time_of_day(series):
+    """Время суток из ячеек колонки времени; нераспознанные значения - 00:00:00."""
+    times = pd.to_datetime(_first_token(series), errors='coerce', format='mixed')
+    return (times - times.dt.normalize()).fillna(pd.Timedelta(0))
+
+def _parse_generic_transactions_report(workbook):
     """
     Универсальный парсер для отчетов по сделкам.
     Ищет лист с ключевыми словами "сделки", "операции".
@@ -616,77 +643,120 @@ def _parse_generic_transactions_report(xls_file):
     try:
         # ИЗМЕНЕНО: Расширяем список ключевых слов для поиска листа с транзакциями
         primary_keywords = [
-            'завершенные сделки', 'торговые операции', 'сделки купли/продажи цб', 
+            'завершенные сделки', 'торговые операции', 'сделки купли/продажи цб',
             'отчет по сделкам', 'движение по ценным бумагам'
         ]
         secondary_keywords = ['сделки', 'transactions', 'операции с цб']
 
-        sheet_name = next((name for name in xls_file.sheet_names if any(k in name.lower() for k in primary_keywords)), None)
+        sheet_name = next((name for name in workbook.sheet_names if any(k in name.lower() for k in primary_keywords)), None)
+        if not sheet_name:
+            sheet_name = next((name for name in workbook.sheet_names if any(k in name.lower() for k in secondary_keywords) and 'репо' not in name.lower()), None)
+
         if not sheet_name:
-            sheet_name = next((name for name in xls_file.sheet_names if any(k in name.lower() for k in secondary_keywords) and 'репо' not in name.lower()), None)
-        
-        if not sheet_name: 
             raise ValueError("Не найден лист с транзакциями. Проверьте, что название листа содержит ключевые слова (например, 'Сделки', 'Операции').")
-        
+
         current_app.logger.info(f"--- [Generic Parser] Найден лист с транзакциями: '{sheet_name}'")
-        df_raw = pd.read_excel(xls_file, sheet_name=sheet_name).dropna(how='all').dropna(axis=1, how='all').reset_index(drop=True)
-        column_map = {'trade_id': ['№ сделки', 'Номер сделки'], 'trade_date': ['Дата сделки', 'Дата заключен.'], 'trade_time': ['Время', 'Время сделки', 'Время заключ.'], 'trade_type': ['Вид сделки', 'Тип сделки', 'Операция', 'Тип операции'], 'ticker': ['Инструмент', 'Тикер', 'Код актива', 'ISIN/рег.код'], 'name': ['Актив'], 'quantity': ['Кол-во', 'Количество, шт.', 'Количество', 'Количество актива', 'Количество актива⁷, шт./грамм'], 'price': ['Цена', 'Цена сделки'], 'total_sum': ['Сумма сделки', 'Сумма', 'Сумма сделки в валюте расчетов', 'Сумма сделки в валюте расчетов⁸'], 'currency': ['Валюта цены', 'Валюта', 'Валюта расчетов'], 'broker_fee': ['Комиссия брокера', 'Ком. брокера', 'Комиссия банка'], 'exchange_fee': ['Комиссия биржи', 'Ком. биржи'], 'fee_currency': ['Валюта комиссии'], 'comment': ['Коммент.', 'Комментарий']}
-        all_header_keywords = [name for names in column_map.values() for name in names]
+        df_raw = workbook.sheets[sheet_name].dropna(how='all').dropna(axis=1, how='all').reset_index(drop=True)
+        column_map = _GENERIC_TRANSACTIONS_COLUMN_MAP
+        # Заголовок - первая строка, где ячейки содержат не меньше 4 вхождений ключевых слов.
+        # Кандидаты отбираются одним поиском по колонкам, точный подсчет - только для них.
+        cells = df_raw.astype(str).apply(lambda column: column.str.replace('\n', ' ', regex=False).str.strip()).where(df_raw.notna())
+        candidates = cells.apply(lambda column: column.str.contains(_GENERIC_TRANSACTIONS_HEADER_RE, na=False)).sum(axis=1)
         header_row_index = -1
-        for i, row in df_raw.iterrows():
-            row_values = [str(cell).replace('\n', ' ').strip() for cell in row.values if pd.notna(cell)]
-            matches = sum(1 for cell_value in row_values for keyword in all_header_keywords if keyword in cell_value)
+        for i in candidates.index[candidates > 0]:
+            matches = sum(1 for cell_value in cells.loc[i].dropna() for keyword in _GENERIC_TRANSACTIONS_HEADER_KEYWORDS if keyword in cell_value)
             if matches >= 4:
                 header_row_index = i
                 break
         if header_row_index == -1: raise ValueError(f"Не удалось найти заголовок таблицы транзакций.")
-        df_raw.columns = [str(col).replace('\n', ' ').strip() if pd.notna(col) else f'unnamed_{i}' for i, col in enumerate(df_raw.iloc[header_row_index])]
+        header = [str(col).replace('\n', ' ').strip() if pd.notna(col) else f'unnamed_{i}' for i, col in enumerate(df_raw.iloc[header_row_index])]
         df = df_raw.iloc[header_row_index + 1:].reset_index(drop=True)
+        df.columns = header
         actual_columns = {key: next((name for name in potential_names if name in df.columns), None) for key, potential_names in column_map.items()}
-        if any(key not in actual_columns for key in ['trade_id', 'ticker', 'quantity', 'price', 'trade_date']): raise ValueError("Не найдены обязательные колонки в отчете о сделках.")
+        if not all(actual_columns[key] for key in ['trade_id', 'ticker', 'quantity', 'price', 'trade_date']): raise ValueError("Не найдены обязательные колонки в отчете о сделках.")
         df = df.dropna(subset=[actual_columns['trade_id']])
-        transactions = []
-        for index, row in df.iterrows():
-            try:
-                date_cell_value = str(row[actual_columns['trade_date']]).replace('\n', ' ').strip().split()[0]
-                time_str_candidate = str(row.get(actual_columns.get('trade_time'), '00:00:00')).replace('\n', ' ').strip().split()[0]
-                time_str = '00:00:00' if pd.isna(pd.to_datetime(time_str_candidate, errors='coerce')) else time_str_candidate
-                timestamp = datetime.combine(pd.to_datetime(date_cell_value, dayfirst=True).date(), pd.to_datetime(time_str).time()).replace(tzinfo=timezone.utc)
-                quantity_raw = _clean_and_convert_to_decimal(row[actual_columns['quantity']])
-                trade_type_raw = str(row.get(actual_columns.get('trade_type'), 'N/A'))
-                trade_type = 'buy' if 'покупка' in trade_type_raw.lower() or quantity_raw > 0 else ('sell' if 'продажа' in trade_type_raw.lower() or quantity_raw < 0 else None)
-                if not trade_type: continue
-                if 'репо' in str(row.get(actual_columns.get('comment'), '')).lower(): continue
-                quantity = abs(quantity_raw)
-                price = _clean_and_convert_to_decimal(row[actual_columns['price']])
-                total_sum = _clean_and_convert_to_decimal(row.get(actual_columns.get('total_sum'), quantity * price))
-                total_fee = _clean_and_convert_to_decimal(row.get(actual_columns.get('broker_fee'), 0)) + _clean_and_convert_to_decimal(row.get(actual_columns.get('exchange_fee'), 0))
-                currency_val = str(row.get(actual_columns.get('currency'), 'RUB')).strip()
-                transactions.append({'exchange_tx_id': f"broker_trade_{row[actual_columns['trade_id']]}", 'timestamp': timestamp, 'type': trade_type, 'raw_type': trade_type_raw, 'asset1_ticker': row[actual_columns['ticker']].strip(), 'asset1_amount': quantity, 'asset2_ticker': currency_val, 'asset2_amount': total_sum, 'execution_price': price, 'fee_amount': total_fee, 'fee_currency': currency_val, 'description': f"Broker trade {row.get(actual_columns.get('name'), '').strip()}"})
-            except Exception as e:
-                print(f"Ошибка при обработке строки транзакции {index}: {e}")
-                continue
-        return transactions
+        if df.empty:
+            return []
+
+        # Все поля считаются по колонкам; строки с нераспознанной датой или без тикера пропускаются
+        dates = pd.to_datetime(_first_token(df[actual_columns['trade_date']]), errors='coerce', dayfirst=True, format='mixed').dt.normalize()
+        timestamps = (dates + _time_of_day(_column_or_default(df, actual_columns.get('trade_time'), '00:00:00'))).dt.tz_localize(timezone.utc)
+        quantities_raw = _decimal_column(df, actual_columns['quantity'])
+        trade_types_raw = _column_or_default(df, actual_columns.get('trade_type'), 'N/A').astype(str)
+        trade_types_lower = trade_types_raw.str.lower()
+        is_buy = trade_types_lower.str.contains('покупка', regex=False) | quantities_raw.gt(0)
+        is_sell = ~is_buy & (trade_types_lower.str.contains('продажа', regex=False) | quantities_raw.lt(0))
+        trade_types = pd.Series(None, index=df.index, dtype=object).mask(is_buy, 'buy').mask(is_sell, 'sell')
+        is_repo = _column_or_default(df, actual_columns.get('comment'), '').astype(str).str.lower().str.contains('репо', regex=False)
+        tickers = df[actual_columns['ticker']]
+        names = _column_or_default(df, actual_columns.get('name'), '')
+        mask = dates.notna() & trade_types.notna() & ~is_repo & tickers.map(lambda v: isinstance(v, str)) & names.map(lambda v: isinstance(v, str))
+        skipped = int((~mask).sum())
+        if skipped:
+            current_app.logger.info(f"--- [Generic Parser] Пропущено строк без сделки или с нераспознанными данными: {skipped}")
+        df = df[mask]
+
+        quantities = quantities_raw[mask].map(abs)
+        prices = _decimal_column(df, actual_columns['price'])
+        if actual_columns.get('total_sum'):
+            total_sums = _decimal_column(df, actual_columns['total_sum'])
+        else:
+            total_sums = quantities * prices
+        total_fees = _decimal_column(df, actual_columns.get('broker_fee')) + _decimal_column(df, actual_columns.get('exchange_fee'))
+        currencies = _text_column(df, actual_columns.get('currency'), 'RUB')
+        return [
+            {'exchange_tx_id': f"broker_trade_{trade_id}", 'timestamp': timestamp, 'type': trade_type, 'raw_type': trade_type_raw, 'asset1_ticker': ticker.strip(), 'asset1_amount': quantity, 'asset2_ticker': currency, 'asset2_amount': total_sum, 'execution_price': price, 'fee_amount': total_fee, 'fee_currency': currency, 'description': f"Broker trade {name.strip()}"}
+            for trade_id, timestamp, trade_type, trade_type_raw, ticker, quantity, currency, total_sum, price, total_fee, name in zip(
+                df[actual_columns['trade_id']], timestamps[mask].map(pd.Timestamp.to_pydatetime), trade_types[mask], trade_types_raw[mask], tickers[mask],
+                quantities, currencies, total_sums, prices, total_fees, names[mask]
+            )
+        ]
     except Exception as e:
         raise type(e)(f"Ошибка при обработке файла отчета о транзакциях: {e}") from e
 
-def _parse_broker_transactions_report(file_path):
+# ИЗМЕНЕНО: Порядок парсеров. Сначала пробуем новый универсальный парсер для БКС, затем общий.
+_TRANSACTION_PARSERS = {
+    'bcs_universal_deals': _parse_bcs_universal_deals_report,
+    'generic_transactions': _parse_generic_transactions_report,
+}
+
+def _parse_broker_transactions_report(file_path, content_hash=None):
     """
-    Диспетчер парсеров отчетов по транзакциям. Пробует разные парсеры по очереди.
+    Диспетчер парсеров отчетов по транзакциям: парсер выбирается по отпечатку отчета.
     """
-    engine = 'openpyxl' if file_path.endswith('.xlsx') else 'xlrd'
-    xls = pd.ExcelFile(file_path, engine=engine)
-    # ИЗМЕНЕНО: Порядок парсеров. Сначала пробуем новый универсальный парсер для БКС, затем общий.    
-    for parser_func in [_parse_bcs_universal_deals_report, _parse_generic_transactions_report]:
-        try:
-            transactions = parser_func(xls)
-            if transactions:
-                current_app.logger.info(f"--- [Parser] Отчет о транзакциях успешно разобран с помощью: {parser_func.__name__}")
-                return transactions
-        except Exception as e:
-            current_app.logger.warning(f"--- [Parser] Ошибка при использовании парсера транзакций {parser_func.__name__}: {e}")
-            continue
-    return []
+    return _dispatch_broker_report(file_path, 'transactions', _TRANSACTION_PARSERS, content_hash)
+
+def benchmark_broker_report(file_path, repeat=3):
+    """
+    Замеряет разбор отчета: чтение файла и каждый парсер портфеля и сделок на одном загруженном файле.
+    Возвращает [(этап, лучшее время в секундах, количество записей или текст ошибки)].
+    """
+    def best_of(func):
+        best, result = None, None
+        for _ in range(max(repeat, 1)):
+            started = time.perf_counter()
+            try:
+                result = func()
+            except Exception as e:
+                result = e
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best, result
+
+    load_time, workbook = best_of(lambda: load_workbook(file_path))
+    if isinstance(workbook, Exception):
+        return [('load_workbook', load_time, str(workbook))]
+    results = [('load_workbook', load_time, sum(len(sheet) for sheet in workbook.sheets.values()))]
+    # Отпечаток считается без кэша, чтобы замер отражал классификацию
+    fingerprint_time, fingerprint = best_of(lambda: (workbook.derived.clear(), fingerprint_report(workbook, None, use_cache=False))[1])
+    results.append(('fingerprint', fingerprint_time, ', '.join(f"{name}={score}" for name, score in fingerprint.scores.items() if score)))
+    parsers = [_parse_bcs_report, _parse_dinamika_pozitsiy_report, _parse_generic_portfolio_report, _parse_finrez_report,
+               _parse_bcs_universal_deals_report, _parse_generic_transactions_report]
+    for parser_func in parsers:
+        # Кэш производных представлений сбрасывается, чтобы каждый замер включал их построение
+        elapsed, parsed = best_of(lambda: (workbook.derived.clear(), parser_func(workbook))[1])
+        results.append((parser_func.__name__, elapsed, str(parsed) if isinstance(parsed, Exception) else len(parsed)))
+    return results
 
 # --- Маршруты (Views) ---
 
@@ -713,36 +783,10 @@ def ui_upload_securities_report():
 
         # Обрабатываем только PDF файлы, так как Excel загружается на другой странице
         if file and file.filename.endswith('.pdf'):
-            filename = secure_filename(file.filename)
-            upload_folder = current_app.config.get('UPLOAD_FOLDER', 'uploads')
-            file_path = os.path.join(upload_folder, filename)
-            file.save(file_path)
-
-            parsed_assets = parse_bcs_report_pdf(file_path)
-            os.remove(file_path)
-
-            if not parsed_assets:
-                flash('Не удалось извлечь данные из PDF-отчета. Проверьте формат файла или лог ошибок в консоли.', 'danger')
-                return redirect(request.url)
-
-            updated_count, created_count = 0, 0
-            for parsed_asset in parsed_assets:
-                existing_asset = InvestmentAsset.query.filter_by(platform_id=platform_id, ticker=parsed_asset['ticker']).first()
-                if existing_asset:
-                    existing_asset.quantity = parsed_asset['quantity']
-                    updated_count += 1
-                else:
-                    db.session.add(InvestmentAsset(platform_id=platform_id, ticker=parsed_asset['ticker'], name=parsed_asset['name'], asset_type=parsed_asset['asset_type'], quantity=parsed_asset['quantity'], current_price=Decimal(0), currency_of_price='RUB'))
-                    created_count += 1
-            
-            try:
-                db.session.commit()
-                flash(f'Импорт из PDF успешно завершен. Обновлено: {updated_count}, Создано: {created_count} активов.', 'success')
-            except Exception as e:
-                db.session.rollback()
-                flash(f'Ошибка при сохранении данных в БД: {e}', 'danger')
-
-            return redirect(url_for('securities.ui_securities_assets'))
+            platform = InvestmentPlatform.query.filter_by(id=platform_id, platform_type='stock_broker').first_or_404()
+            # ИЗМЕНЕНО: PDF разбирается фоновой задачей, активы записываются пачками без запроса на каждую строку
+            _flash_import_started(*start_report_import(platform, 'pdf_portfolio', file))
+            return redirect(url_for('securities.ui_broker_detail', platform_id=platform.id))
 
     broker_platforms = InvestmentPlatform.query.filter_by(platform_type='stock_broker', is_active=True).all()
     return render_template('securities/upload_report.html', platforms=broker_platforms)
@@ -755,7 +799,7 @@ def ui_brokers():
 @securities_bp.route('/brokers/<int:platform_id>')
 def ui_broker_detail(platform_id):
     platform = InvestmentPlatform.query.filter_by(id=platform_id, platform_type='stock_broker').first_or_404()
-    currency_rates_to_rub = {'RUB': Decimal('1.0'), 'USD': Decimal('90.0'), None: Decimal('1.0')}
+    currency_rates_to_rub = get_currency_rates()
     valued_assets = []
     platform_total_value_rub = Decimal(0)
     assets_with_balance = platform.assets.filter(InvestmentAsset.quantity > 0).order_by(InvestmentAsset.name)
@@ -763,13 +807,14 @@ def ui_broker_detail(platform_id):
         asset_value_rub = (asset.quantity or 0) * (asset.current_price or 0) * currency_rates_to_rub.get(asset.currency_of_price, Decimal('1.0'))
         platform_total_value_rub += asset_value_rub
         valued_assets.append({'asset': asset, 'value_rub': asset_value_rub})
-    page = request.args.get('page', 1, type=int)
     sort_by = request.args.get('sort_by', 'timestamp')
     order = request.args.get('order', 'desc')
-    sort_column = getattr(Transaction, sort_by, Transaction.timestamp)
-    transactions_query = platform.transactions.order_by(desc(sort_column) if order == 'desc' else asc(sort_column))
-    transactions_pagination = transactions_query.paginate(page=page, per_page=15, error_out=False)
-    return render_template('broker_detail.html', platform=platform, valued_assets=valued_assets, platform_total_value_rub=platform_total_value_rub, platform_transactions=transactions_pagination.items, transactions_pagination=transactions_pagination, sort_by=sort_by, order=order)
+    sort_column = resolve_sort_column(Transaction, sort_by, 'timestamp')
+    transactions_pagination = keyset_paginate(
+        platform.transactions, sort_column, Transaction.id, descending=(order == 'desc'), per_page=15, cursor=request.args.get('cursor')
+    )
+    import_jobs = get_recent_import_jobs(platform.id)
+    return render_template('broker_detail.html', platform=platform, valued_assets=valued_assets, platform_total_value_rub=platform_total_value_rub, platform_transactions=transactions_pagination.items, transactions_pagination=transactions_pagination, sort_by=sort_by, order=order, import_jobs=import_jobs)
 
 @securities_bp.route('/brokers/<int:platform_id>/assets/add', methods=['GET', 'POST'])
 def ui_add_security_asset_form(platform_id):
@@ -895,48 +940,9 @@ def ui_upload_broker_report(platform_id):
     if not (file.filename.endswith('.xls') or file.filename.endswith('.xlsx')):
         flash('Допускаются только файлы формата .xls или .xlsx', 'danger')
         return redirect(url_for('securities.ui_broker_detail', platform_id=platform.id))
-    
-    filename = secure_filename(file.filename)
-    filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-    try:
-        file.save(filepath)
-        parsed_assets = _parse_broker_portfolio_report(filepath)
-        if not parsed_assets:
-            raise ValueError("Не удалось извлечь ни одного актива из файла. Проверьте формат отчета.")
-        
-        # ИЗМЕНЕНО: Логика обновления активов. Вместо полного удаления,
-        # активы обновляются, добавляются или обнуляются.
-        existing_assets = {asset.ticker: asset for asset in platform.assets}
-        report_tickers = set()
-        updated_count, added_count, zeroed_count = 0, 0, 0
-
-        for asset_data in parsed_assets:
-            ticker = asset_data['ticker']
-            report_tickers.add(ticker)
-            
-            if ticker in existing_assets:
-                existing_asset = existing_assets[ticker]
-                existing_asset.quantity = asset_data['quantity']
-                existing_asset.current_price = asset_data.get('current_price', existing_asset.current_price)
-                existing_asset.name = asset_data.get('name', existing_asset.name)
-                updated_count += 1
-            else:
-                db.session.add(InvestmentAsset(platform_id=platform.id, **asset_data))
-                added_count += 1
-
-        for ticker, asset in existing_assets.items():
-            if ticker not in report_tickers:
-                asset.quantity = Decimal('0')
-                zeroed_count += 1
 
-        db.session.commit()
-        flash(f'Отчет успешно загружен. Добавлено: {added_count}, Обновлено: {updated_count}, Обнулено: {zeroed_count}.', 'success')
-    except Exception as e:
-        db.session.rollback()
-        flash(f'Ошибка при обработке файла: {e}', 'danger')
-    finally:
-        if os.path.exists(filepath):
-            os.remove(filepath)
+    # ИЗМЕНЕНО: Разбор и обновление активов выполняются фоновой задачей (services/report_import.py)
+    _flash_import_started(*start_report_import(platform, 'portfolio', file))
     return redirect(url_for('securities.ui_broker_detail', platform_id=platform.id))
 
 @securities_bp.route('/brokers/<int:platform_id>/upload_transactions_report', methods=['POST'])
@@ -950,29 +956,23 @@ def ui_upload_broker_transactions_report(platform_id):
         flash('Допускаются только файлы формата .xls или .xlsx', 'danger')
         return redirect(url_for('securities.ui_broker_detail', platform_id=platform.id))
 
-    filename = secure_filename(file.filename)
-    filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-    try:
-        file.save(filepath)
-        parsed_txs = _parse_broker_transactions_report(filepath)
-        if not parsed_txs:
-            raise ValueError("Не удалось извлечь ни одной транзакции из файла.")
-        existing_tx_ids = {tx.exchange_tx_id for tx in platform.transactions}
-        added_count = 0
-        for tx_data in parsed_txs:
-            if tx_data['exchange_tx_id'] not in existing_tx_ids:
-                db.session.add(Transaction(platform_id=platform.id, **tx_data))
-                added_count += 1
-        db.session.commit()
-        flash(f'Отчет о транзакциях успешно загружен. Добавлено {added_count} новых сделок.', 'success')
-    except Exception as e:
-        db.session.rollback()
-        flash(f'Ошибка при обработке файла транзакций: {e}', 'danger')
-    finally:
-        if os.path.exists(filepath):
-            os.remove(filepath)
+    _flash_import_started(*start_report_import(platform, 'transactions', file))
     return redirect(url_for('securities.ui_broker_detail', platform_id=platform.id))
 
+def _flash_import_started(job, started):
+    if started:
+        flash(f'Файл "{job.filename}" принят. Импорт выполняется в фоне (задача #{job.id}), прогресс отображается на странице брокера.', 'info')
+    elif job.status == 'done':
+        flash(job.message, 'info')
+    else:
+        flash(f'Этот файл уже импортируется (задача #{job.id}).', 'warning')
+
+@securities_bp.route('/imports/<int:job_id>')
+def api_report_import_status(job_id):
+    """Состояние фонового импорта отчета для опроса со страницы брокера."""
+    job = db.get_or_404(ReportImportJob, job_id)
+    return jsonify(import_job_status(job))
+
 @securities_bp.route('/brokers/<int:platform_id>/calculate_assets', methods=['POST'])
 def ui_calculate_broker_assets_from_transactions(platform_id):
     platform = InvestmentPlatform.query.filter_by(id=platform_id, platform_type='stock_broker').first_or_404()
@@ -1043,7 +1043,7 @@ def ui_securities_assets():
         InvestmentAsset.quantity > 0
     ).options(joinedload(InvestmentAsset.platform)).all()
 
-    currency_rates_to_rub = {'RUB': Decimal('1.0'), 'USD': Decimal('90.0'), None: Decimal('1.0')}
+    currency_rates_to_rub = get_currency_rates()
 
     if not all_securities_assets:
         return render_template('securities_assets.html', assets=[], grand_total_rub=0, platform_summary=[])
@@ -1115,7 +1115,7 @@ def ui_securities_assets():
 
 @securities_bp.route('/transactions')
 def ui_securities_transactions():
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     sort_by = request.args.get('sort_by', 'timestamp')
     order = request.args.get('order', 'desc')
     filter_platform_id = request.args.get('filter_platform_id', 'all')
@@ -1133,15 +1133,12 @@ def ui_securities_transactions():
     if filter_type != 'all':
         query = query.filter(Transaction.type == filter_type)
 
-    # Apply sorting
-    sort_column = getattr(Transaction, sort_by, Transaction.timestamp)
-    if order == 'desc':
-        query = query.order_by(desc(sort_column))
-    else:
-        query = query.order_by(asc(sort_column))
-    
-    # Paginate the results
-    pagination = query.paginate(page=page, per_page=50, error_out=False)
+    # Keyset-пагинация по (колонка сортировки, id); количество - только на первой странице, с кэшем
+    sort_column = resolve_sort_column(Transaction, sort_by, 'timestamp')
+    pagination = keyset_paginate(
+        query, sort_column, Transaction.id, descending=(order == 'desc'), per_page=50, cursor=cursor,
+        count_cache_key=None if cursor else count_cache_key('securities_tx', 'all', request.args)
+    )
     
     # Get distinct values for filters
     platforms = InvestmentPlatform.query.filter_by(platform_type='stock_broker').order_by(InvestmentPlatform.name).all()
@@ -0,0 +1,321 @@
+"""
+Журнал изменений балансов счетов (AccountLedgerEntry) и снимки балансов (AccountBalanceSnapshot).
+
+Все изменения Account.balance проходят через этот модуль: каждое изменение баланса
+записывается в журнал со знаком и датой, к которой оно относится (дата операции).
+Журнал только дополняется: при редактировании операции прежний эффект сторнируется
+отдельной записью, а новый записывается заново. Единственная переносимая запись - начальный
+баланс счета: он всегда датирован раньше первой операции, поэтому при записи операции
+задним числом переносится на секунду раньше нее.
+
+Правило знака единое для всех операций: расход уменьшает баланс дебетового счета и
+увеличивает задолженность (баланс) кредитного, доход - наоборот. Перевод и обмен -
+расход со счета списания и доход на счет зачисления.
+
+Снимки хранят баланс на начало каждого месяца, поэтому баланс на дату - это один снимок
+плюс сумма записей не более чем за месяц. Снимки дописывает фоновая задача
+(refresh_balance_snapshots), а при записи задним числом более поздние снимки удаляются
+слушателем сессии и пересоздаются при следующем обновлении.
+Журнал существующих счетов заполняет миграция a9b0c1d2e3f5, сверка журнала с балансами - `flask analytics backfill-ledger`.
+"""
+from collections import defaultdict
+from itertools import chain
+from datetime import date, datetime, time
+from decimal import Decimal
+
+from dateutil.relativedelta import relativedelta
+from sqlalchemy import delete, event, func, inspect
+from sqlalchemy.orm import Session
+
+from extensions import db
+from models import Account, AccountBalanceSnapshot, AccountLedgerEntry, BankingTransaction
+from services.sql_helpers import time_bucket
+
+ENTRY_OPENING = 'opening'
+ENTRY_TRANSACTION = 'transaction'
+ENTRY_REVERSAL = 'reversal'
+ENTRY_ADJUSTMENT = 'adjustment'
+
+
+def _as_datetime(value) -> datetime:
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None)
+    if isinstance(value, date):
+        return datetime.combine(value, time.min)
+    return datetime.now()
+
+
+def _month_start(value: datetime) -> datetime:
+    return datetime(value.year, value.month, 1)
+
+
+def _outflow(account: Account, amount: Decimal) -> Decimal:
+    """Изменение баланса счета при списании amount."""
+    return amount if account.account_type == 'credit' else -amount
+
+
+def transaction_effects(transaction_type: str, amount, to_amount, account: Account, to_account: Account | None = None) -> list:
+    """Изменения балансов от операции: [(счет, изменение)]."""
+    amount = Decimal(amount or 0)
+    if transaction_type == 'expense':
+        return [(account, _outflow(account, amount))]
+    if transaction_type == 'income':
+        return [(account, -_outflow(account, amount))]
+    if transaction_type in ('transfer', 'exchange') and to_account is not None:
+        received = Decimal(to_amount) if transaction_type == 'exchange' and to_amount else amount
+        return [(account, _outflow(account, amount)), (to_account, -_outflow(to_account, received))]
+    return []
+
+
+def _append(account: Account, delta: Decimal, occurred_at: datetime, entry_type: str, transaction=None):
+    if not delta:
+        return
+    account.balance = (account.balance or Decimal(0)) + delta
+    db.session.add(AccountLedgerEntry(
+        account=account, transaction=transaction, entry_type=entry_type, amount=delta, occurred_at=occurred_at
+    ))
+
+
+def _move_opening_before(account: Account, occurred_at: datetime):
+    """Переносит начальный баланс счета раньше записи, датированной occurred_at."""
+    opening = AccountLedgerEntry.query.filter(
+        AccountLedgerEntry.account == account,
+        AccountLedgerEntry.entry_type == ENTRY_OPENING,
+        AccountLedgerEntry.occurred_at >= occurred_at
+    ).first()
+    if opening is not None:
+        opening.occurred_at = occurred_at - relativedelta(seconds=1)
+
+
+def post_transaction(transaction: BankingTransaction, account: Account, to_account: Account | None = None):
+    """Применяет операцию к балансам счетов и записывает изменения в журнал."""
+    effects = transaction_effects(transaction.transaction_type, transaction.amount, transaction.to_amount, account, to_account)
+    occurred_at = _as_datetime(transaction.date)
+    for target, delta in effects:
+        if delta:
+            _move_opening_before(target, occurred_at)
+        _append(target, delta, occurred_at, ENTRY_TRANSACTION, transaction)
+
+
+def capture_transaction(transaction: BankingTransaction, account: Account, to_account: Account | None = None) -> tuple:
+    """Запоминает текущий эффект операции до ее редактирования: (изменения, дата)."""
+    effects = transaction_effects(transaction.transaction_type, transaction.amount, transaction.to_amount, account, to_account)
+    return effects, _as_datetime(transaction.date)
+
+
+def reverse_captured(transaction: BankingTransaction, captured: tuple):
+    """Сторнирует эффект операции, запомненный capture_transaction."""
+    effects, occurred_at = captured
+    for target, delta in effects:
+        _append(target, -delta, occurred_at, ENTRY_REVERSAL, transaction)
+
+
+def record_balance_adjustment(account: Account, new_balance: Decimal):
+    """Ручное изменение баланса из формы счета: для нового счета - начальный баланс."""
+    delta = Decimal(new_balance) - (account.balance or Decimal(0))
+    entry_type = ENTRY_OPENING if account.id is None else ENTRY_ADJUSTMENT
+    _append(account, delta, datetime.now(), entry_type)
+
+
+def realign_opening_entries() -> int:
+    """
+    Переносит начальные балансы, датированные позже первой записи счета (журналы, созданные
+    до переноса начального баланса), на секунду раньше этой записи. Возвращает количество перенесенных записей.
+    """
+    first_entries = dict(db.session.query(AccountLedgerEntry.account_id, func.min(AccountLedgerEntry.occurred_at)).filter(
+        AccountLedgerEntry.entry_type != ENTRY_OPENING
+    ).group_by(AccountLedgerEntry.account_id).all())
+    moved = 0
+    for opening in AccountLedgerEntry.query.filter(AccountLedgerEntry.entry_type == ENTRY_OPENING).all():
+        first_occurred_at = first_entries.get(opening.account_id)
+        if first_occurred_at is not None and opening.occurred_at >= first_occurred_at:
+            opening.occurred_at = first_occurred_at - relativedelta(seconds=1)
+            moved += 1
+    # Снимки после новой даты начального баланса удаляет слушатель сессии
+    db.session.commit()
+    return moved
+
+
+def delete_account_ledger(account_id: int):
+    """Удаляет журнал и снимки счета при удалении самого счета."""
+    db.session.execute(delete(AccountBalanceSnapshot).where(AccountBalanceSnapshot.account_id == account_id))
+    db.session.execute(delete(AccountLedgerEntry).where(AccountLedgerEntry.account_id == account_id))
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_backdated_entries(session, flush_context):
+    earliest = session.info.setdefault('ledger_earliest', {})
+    # dirty - перенесенные начальные балансы
+    for obj in chain(session.new, session.dirty):
+        if isinstance(obj, AccountLedgerEntry):
+            state = inspect(obj)
+            account_id, occurred_at = state.dict.get('account_id'), state.dict.get('occurred_at')
+            if account_id is not None and occurred_at is not None:
+                earliest[account_id] = min(earliest.get(account_id, occurred_at), occurred_at)
+    if not earliest:
+        session.info.pop('ledger_earliest', None)
+
+
+@event.listens_for(Session, 'before_commit')
+def _invalidate_snapshots(session):
+    if not session.info.get('ledger_earliest') and not (session.new or session.dirty or session.deleted):
+        return
+    # Дописываем ожидающие изменения, чтобы after_flush успел собрать новые записи
+    session.flush()
+    earliest = session.info.pop('ledger_earliest', None)
+    if not earliest:
+        return
+    table = AccountBalanceSnapshot.__table__
+    connection = session.connection()
+    for account_id, occurred_at in sorted(earliest.items()):
+        # Снимки после даты записи ее не учитывают
+        connection.execute(delete(table).where(table.c.account_id == account_id, table.c.as_of > occurred_at))
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_backdated_entries(session):
+    session.info.pop('ledger_earliest', None)
+
+
+def refresh_balance_snapshots(account_ids=None) -> int:
+    """
+    Дописывает снимки на начало каждого месяца от последнего снимка счета (или от первой
+    записи журнала) до текущего месяца включительно. Возвращает количество новых снимков.
+    """
+    current_month = _month_start(datetime.now())
+    first_entries = db.session.query(AccountLedgerEntry.account_id, func.min(AccountLedgerEntry.occurred_at)).group_by(AccountLedgerEntry.account_id)
+    latest_snapshots = db.session.query(AccountBalanceSnapshot.account_id, func.max(AccountBalanceSnapshot.as_of)).group_by(AccountBalanceSnapshot.account_id)
+    if account_ids is not None:
+        first_entries = first_entries.filter(AccountLedgerEntry.account_id.in_(account_ids))
+        latest_snapshots = latest_snapshots.filter(AccountBalanceSnapshot.account_id.in_(account_ids))
+    latest = dict(latest_snapshots.all())
+
+    created = []
+    for account_id, first_occurred_at in first_entries.all():
+        if account_id in latest:
+            cursor = latest[account_id]
+            balance = db.session.query(AccountBalanceSnapshot.balance).filter_by(account_id=account_id, as_of=cursor).scalar()
+        else:
+            cursor = _month_start(first_occurred_at)
+            balance = Decimal(0)
+            created.append({'account_id': account_id, 'as_of': cursor, 'balance': balance})
+        if cursor >= current_month:
+            continue
+
+        period = time_bucket('month', AccountLedgerEntry.occurred_at).label('period')
+        monthly = dict(db.session.query(period, func.sum(AccountLedgerEntry.amount)).filter(
+            AccountLedgerEntry.account_id == account_id,
+            AccountLedgerEntry.occurred_at >= cursor,
+            AccountLedgerEntry.occurred_at < current_month
+        ).group_by(period).all())
+        while cursor < current_month:
+            balance += monthly.get(cursor.strftime('%Y-%m')) or Decimal(0)
+            cursor += relativedelta(months=1)
+            created.append({'account_id': account_id, 'as_of': cursor, 'balance': balance})
+
+    if created:
+        db.session.execute(AccountBalanceSnapshot.__table__.insert(), created)
+    db.session.commit()
+    return len(created)
+
+
+def backfill_ledger() -> tuple[int, int]:
+    """
+    Сверяет журнал всех счетов с операциями и Account.balance: дописывает записи по операциям,
+    которых в журнале счета еще нет, и сводит сумму журнала к текущему балансу начальной записью
+    (opening = balance - сумма записей журнала). Счета с частичным журналом, начатым до заполнения,
+    тоже сверяются. Повторный запуск ничего не меняет.
+    Балансы счетов не меняются. Возвращает (количество измененных счетов, количество новых записей).
+    """
+    accounts = {account.id: account for account in Account.query.all()}
+    if not accounts:
+        return 0, 0
+
+    posted = set(db.session.query(AccountLedgerEntry.account_id, AccountLedgerEntry.transaction_id)
+                 .filter(AccountLedgerEntry.transaction_id.isnot(None)).distinct())
+    totals = defaultdict(Decimal, db.session.query(AccountLedgerEntry.account_id, func.sum(AccountLedgerEntry.amount))
+                         .group_by(AccountLedgerEntry.account_id).all())
+    first_dates = dict(db.session.query(AccountLedgerEntry.account_id, func.min(AccountLedgerEntry.occurred_at)).filter(
+        AccountLedgerEntry.entry_type != ENTRY_OPENING
+    ).group_by(AccountLedgerEntry.account_id).all())
+    openings = {entry.account_id: entry for entry in AccountLedgerEntry.query.filter_by(entry_type=ENTRY_OPENING)}
+
+    rows = []
+    changed = set()
+    now = datetime.now()
+    transactions = BankingTransaction.query.order_by(BankingTransaction.date, BankingTransaction.id).yield_per(1000)
+    for tx in transactions:
+        account = accounts.get(tx.account_id)
+        to_account = accounts.get(tx.to_account_id) if tx.to_account_id else None
+        if account is None:
+            continue
+        occurred_at = _as_datetime(tx.date)
+        for target, delta in transaction_effects(tx.transaction_type, tx.amount, tx.to_amount, account, to_account):
+            if not delta or (target.id, tx.id) in posted:
+                continue
+            rows.append({'account_id': target.id, 'transaction_id': tx.id, 'entry_type': ENTRY_TRANSACTION, 'amount': delta, 'occurred_at': occurred_at, 'created_at': now})
+            totals[target.id] += delta
+            first_dates[target.id] = min(first_dates.get(target.id, occurred_at), occurred_at)
+            changed.add(target.id)
+
+    for account_id, account in accounts.items():
+        difference = (account.balance or Decimal(0)) - totals[account_id]
+        occurred_at = first_dates.get(account_id, now) - relativedelta(seconds=1)
+        opening = openings.get(account_id)
+        if opening is not None:
+            if difference or opening.occurred_at > occurred_at:
+                opening.amount += difference
+                opening.occurred_at = min(opening.occurred_at, occurred_at)
+                changed.add(account_id)
+        elif difference:
+            rows.append({'account_id': account_id, 'transaction_id': None, 'entry_type': ENTRY_OPENING, 'amount': difference, 'occurred_at': occurred_at, 'created_at': now})
+            changed.add(account_id)
+
+    if rows:
+        db.session.execute(AccountLedgerEntry.__table__.insert(), rows)
+    if changed:
+        # Записи задним числом, добавленные вставкой без ORM, слушатель сессии не видит
+        db.session.execute(delete(AccountBalanceSnapshot).where(AccountBalanceSnapshot.account_id.in_(changed)))
+    db.session.commit()
+    if changed:
+        refresh_balance_snapshots(list(changed))
+    return len(changed), len(rows)
+
+
+def balance_at(account_id: int, at: datetime) -> Decimal:
+    """Баланс счета на момент at (без учета записей с occurred_at >= at): снимок плюс записи после него."""
+    at = _as_datetime(at)
+    snapshot = AccountBalanceSnapshot.query.filter(
+        AccountBalanceSnapshot.account_id == account_id, AccountBalanceSnapshot.as_of <= at
+    ).order_by(AccountBalanceSnapshot.as_of.desc()).first()
+    query = db.session.query(func.sum(AccountLedgerEntry.amount)).filter(
+        AccountLedgerEntry.account_id == account_id, AccountLedgerEntry.occurred_at < at
+    )
+    if snapshot:
+        query = query.filter(AccountLedgerEntry.occurred_at >= snapshot.as_of)
+    return (snapshot.balance if snapshot else Decimal(0)) + (query.scalar() or Decimal(0))
+
+
+def get_balance_history(account_id: int, start: date, end: date, unit: str = 'day') -> dict:
+    """
+    История баланса счета за период [start, end] по периодам unit ('day', 'month', 'year').
+    Возвращает {'opening_balance', 'closing_balance', 'points': [{'period', 'change', 'balance'}]},
+    где balance - баланс на конец периода. Точки есть только для периодов с изменениями.
+    """
+    start_dt = _as_datetime(start)
+    end_dt = _as_datetime(end) + relativedelta(days=1)
+    opening = balance_at(account_id, start_dt)
+
+    period = time_bucket(unit, AccountLedgerEntry.occurred_at).label('period')
+    rows = db.session.query(period, func.sum(AccountLedgerEntry.amount)).filter(
+        AccountLedgerEntry.account_id == account_id,
+        AccountLedgerEntry.occurred_at >= start_dt,
+        AccountLedgerEntry.occurred_at < end_dt
+    ).group_by(period).order_by(period).all()
+
+    points = []
+    balance = opening
+    for label, change in rows:
+        balance += change or Decimal(0)
+        points.append({'period': label, 'change': change, 'balance': balance})
+    return {'opening_balance': opening, 'closing_balance': balance, 'points': points}
@@ -0,0 +1,224 @@
+"""
+Дневные агрегаты банковских операций (BankingDailyRollup) для страницы аналитики.
+
+Таблица хранит суммы и количество операций в разрезе
+(пользователь, день, тип, счет, категория, контрагент-мерчант, источник).
+Источник 'transaction' - сами BankingTransaction, 'item' - позиции чеков TransactionItem
+(категория берется из позиции).
+
+Агрегаты поддерживаются инкрементально: слушатели сессии собирают затронутые пары
+(счет, день) при каждом flush, а перед коммитом строки этих дней пересчитываются
+из исходных таблиц в той же транзакции. Существующие операции заполняет миграция c5d6e7f8a9b0,
+полная перестройка - `flask analytics rebuild-rollup`.
+"""
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+from sqlalchemy import Date, String, delete, event, func, insert, inspect, literal, select
+from sqlalchemy.orm import Session
+
+from extensions import db
+from models import Account, BankingTransaction, BankingDailyRollup, Category, TransactionItem
+from services.sql_helpers import time_bucket
+
+SOURCE_TRANSACTION = 'transaction'
+SOURCE_ITEM = 'item'
+
+_ROLLUP_COLUMNS = ['user_id', 'day', 'transaction_type', 'account_id', 'category_id', 'merchant', 'source', 'total', 'tx_count']
+
+
+def _as_day(value) -> date | None:
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return None
+
+
+def _collect_transaction_keys(obj, keys: set):
+    """Добавляет (счет, день) транзакции - текущие и, для измененных, прежние значения."""
+    state = inspect(obj)
+    # Берем только загруженные значения, чтобы не обращаться к БД посреди flush
+    account_ids = {state.dict.get('account_id')}
+    days = {_as_day(state.dict.get('date'))}
+    if state.persistent or state.deleted:
+        account_ids.update(state.attrs.account_id.history.deleted or ())
+        days.update(_as_day(d) for d in (state.attrs.date.history.deleted or ()))
+    for account_id in account_ids:
+        for day in days:
+            if account_id is not None and day is not None:
+                keys.add((account_id, day))
+
+
+def _rebuild_rollup_day(connection, account_id: int, day: date):
+    """Пересчитывает агрегаты одного счета за один день."""
+    rollup = BankingDailyRollup.__table__
+    tx = BankingTransaction.__table__
+    item = TransactionItem.__table__
+    acc = Account.__table__
+    day_start = datetime.combine(day, time.min)
+    day_end = day_start + timedelta(days=1)
+
+    connection.execute(delete(rollup).where(rollup.c.account_id == account_id, rollup.c.day == day))
+
+    tx_select = select(
+        acc.c.user_id, literal(day, Date), tx.c.transaction_type, tx.c.account_id, tx.c.category_id, tx.c.merchant,
+        literal(SOURCE_TRANSACTION, String), func.sum(tx.c.amount), func.count(tx.c.id)
+    ).select_from(tx.join(acc, tx.c.account_id == acc.c.id)).where(
+        tx.c.account_id == account_id, tx.c.date >= day_start, tx.c.date < day_end
+    ).group_by(acc.c.user_id, tx.c.transaction_type, tx.c.account_id, tx.c.category_id, tx.c.merchant)
+    connection.execute(insert(rollup).from_select(_ROLLUP_COLUMNS, tx_select))
+
+    item_select = select(
+        acc.c.user_id, literal(day, Date), tx.c.transaction_type, tx.c.account_id, item.c.category_id, tx.c.merchant,
+        literal(SOURCE_ITEM, String), func.sum(item.c.total), func.count(item.c.id)
+    ).select_from(
+        item.join(tx, item.c.transaction_id == tx.c.id).join(acc, tx.c.account_id == acc.c.id)
+    ).where(
+        tx.c.account_id == account_id, tx.c.date >= day_start, tx.c.date < day_end
+    ).group_by(acc.c.user_id, tx.c.transaction_type, tx.c.account_id, item.c.category_id, tx.c.merchant)
+    connection.execute(insert(rollup).from_select(_ROLLUP_COLUMNS, item_select))
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_rollup_keys(session, flush_context):
+    keys = session.info.setdefault('rollup_keys', set())
+    item_tx_ids = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, BankingTransaction):
+            _collect_transaction_keys(obj, keys)
+        elif isinstance(obj, TransactionItem):
+            item_tx_ids.add(inspect(obj).dict.get('transaction_id'))
+    item_tx_ids.discard(None)
+    if item_tx_ids:
+        tx = BankingTransaction.__table__
+        rows = session.connection().execute(select(tx.c.account_id, tx.c.date).where(tx.c.id.in_(item_tx_ids)))
+        keys.update((account_id, _as_day(tx_date)) for account_id, tx_date in rows)
+    if not keys:
+        session.info.pop('rollup_keys', None)
+
+
+@event.listens_for(Session, 'before_commit')
+def _apply_rollup_changes(session):
+    if not session.info.get('rollup_keys') and not (session.new or session.dirty or session.deleted):
+        return
+    # Дописываем ожидающие изменения, чтобы after_flush успел собрать их ключи
+    session.flush()
+    keys = session.info.pop('rollup_keys', None)
+    if not keys:
+        return
+    connection = session.connection()
+    for account_id, day in sorted(keys):
+        _rebuild_rollup_day(connection, account_id, day)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_rollup_keys(session):
+    session.info.pop('rollup_keys', None)
+
+
+def rebuild_all_rollups() -> int:
+    """Полностью перестраивает таблицу агрегатов. Возвращает количество пересчитанных дней."""
+    keys = {
+        (account_id, _as_day(tx_date))
+        for account_id, tx_date in db.session.query(BankingTransaction.account_id, BankingTransaction.date).yield_per(1000)
+    }
+    connection = db.session.connection()
+    connection.execute(delete(BankingDailyRollup.__table__))
+    for account_id, day in sorted(keys):
+        _rebuild_rollup_day(connection, account_id, day)
+    db.session.commit()
+    return len(keys)
+
+
+# --- Чтение агрегатов ---
+
+def _rollup_filter(user_id: int, start_day: date, end_day: date, source: str = SOURCE_TRANSACTION):
+    return (
+        BankingDailyRollup.user_id == user_id,
+        BankingDailyRollup.day >= start_day,
+        BankingDailyRollup.day <= end_day,
+        BankingDailyRollup.source == source
+    )
+
+
+def get_category_totals(user_id: int, start_day: date, end_day: date, source: str = SOURCE_TRANSACTION, subcategories_only: bool = False, limit: int = 10) -> list:
+    """Расходы по категориям: [(название, сумма)], по убыванию суммы."""
+    total = func.sum(BankingDailyRollup.total)
+    query = db.session.query(Category.name, total).join(Category, BankingDailyRollup.category_id == Category.id).filter(
+        *_rollup_filter(user_id, start_day, end_day, source),
+        BankingDailyRollup.transaction_type == 'expense'
+    )
+    if subcategories_only:
+        query = query.filter(Category.parent_id.isnot(None))
+    return query.group_by(Category.name).order_by(total.desc()).limit(limit).all()
+
+
+def get_type_totals(user_id: int, start_day: date, end_day: date) -> dict:
+    """Суммы доходов и расходов за период: {'income': Decimal, 'expense': Decimal}."""
+    rows = db.session.query(BankingDailyRollup.transaction_type, func.sum(BankingDailyRollup.total)).filter(
+        *_rollup_filter(user_id, start_day, end_day),
+        BankingDailyRollup.transaction_type.in_(['income', 'expense'])
+    ).group_by(BankingDailyRollup.transaction_type).all()
+    totals = {'income': Decimal(0), 'expense': Decimal(0)}
+    totals.update({tx_type: amount or Decimal(0) for tx_type, amount in rows})
+    return totals
+
+
+def get_flow_over_time(user_id: int, start_day: date, end_day: date, unit: str = 'day') -> list:
+    """Доходы и расходы по периодам ('day', 'month', 'year'): [(метка периода, тип, сумма)]."""
+    period = time_bucket(unit, BankingDailyRollup.day).label('period')
+    return db.session.query(
+        period, BankingDailyRollup.transaction_type, func.sum(BankingDailyRollup.total)
+    ).filter(
+        *_rollup_filter(user_id, start_day, end_day),
+        BankingDailyRollup.transaction_type.in_(['income', 'expense'])
+    ).group_by(period, BankingDailyRollup.transaction_type).order_by(period).all()
+
+
+def get_account_totals(user_id: int, start_day: date, end_day: date, transaction_type: str, limit: int = 5) -> list:
+    """Счета с наибольшими суммами операций заданного типа: [(название счета, сумма)]."""
+    total = func.sum(BankingDailyRollup.total)
+    return db.session.query(Account.name, total).join(Account, BankingDailyRollup.account_id == Account.id).filter(
+        *_rollup_filter(user_id, start_day, end_day),
+        BankingDailyRollup.transaction_type == transaction_type
+    ).group_by(Account.name).order_by(total.desc()).limit(limit).all()
+
+
+def get_merchant_totals(user_id: int, start_day: date, end_day: date, limit: int = 5) -> list:
+    """Мерчанты с наибольшими расходами: [(мерчант, сумма)]."""
+    total = func.sum(BankingDailyRollup.total)
+    return db.session.query(BankingDailyRollup.merchant, total).filter(
+        *_rollup_filter(user_id, start_day, end_day),
+        BankingDailyRollup.transaction_type == 'expense',
+        BankingDailyRollup.merchant.isnot(None),
+        BankingDailyRollup.merchant != ''
+    ).group_by(BankingDailyRollup.merchant).order_by(total.desc()).limit(limit).all()
+
+
+def _change_pct(current: Decimal, previous: Decimal) -> float | None:
+    if not previous:
+        return None
+    return float((current - previous) / previous * 100)
+
+
+def get_period_comparison(user_id: int, start_day: date, end_day: date) -> dict:
+    """
+    Сравнение доходов и расходов периода с тем же периодом месяцем (MoM) и годом (YoY) ранее.
+    Возвращает {'mom': {...}, 'yoy': {...}}, где для каждого типа есть сумма прошлого периода и изменение в %.
+    """
+    from dateutil.relativedelta import relativedelta
+
+    current = get_type_totals(user_id, start_day, end_day)
+    comparison = {}
+    for key, shift in (('mom', relativedelta(months=1)), ('yoy', relativedelta(years=1))):
+        previous = get_type_totals(user_id, start_day - shift, end_day - shift)
+        comparison[key] = {
+            'start_date': (start_day - shift).strftime('%Y-%m-%d'),
+            'end_date': (end_day - shift).strftime('%Y-%m-%d'),
+            'income': previous['income'],
+            'expense': previous['expense'],
+            'income_change_pct': _change_pct(current['income'], previous['income']),
+            'expense_change_pct': _change_pct(current['expense'], previous['expense'])
+        }
+    return comparison
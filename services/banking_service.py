@@ -1,13 +1,15 @@
 from datetime import datetime
 from decimal import Decimal
 from models import Account
+from services.account_ledger import record_balance_adjustment
 
 def populate_account_from_form(account: Account, form_data: dict):
     """Вспомогательная функция для заполнения объекта Account из данных формы."""
     account.name = form_data.get('name')
     account.account_type = form_data.get('account_type')
     account.currency = form_data.get('currency')
-    account.balance = Decimal(form_data.get('balance', '0'))
+    # Ручное изменение баланса тоже попадает в журнал счета
+    record_balance_adjustment(account, Decimal(form_data.get('balance', '0')))
     account.is_active = 'is_active' in form_data
     account.is_external = 'is_external' in form_data
     interest_rate_str = form_data.get('interest_rate')
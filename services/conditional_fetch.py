@@ -0,0 +1,89 @@
+"""
+Условные HTTP-запросы (conditional GET) к источникам новостей.
+
+Для каждого URL (с параметрами запроса, без api_key) в таблице http_fetch_state хранятся
+ETag, Last-Modified и SHA-256 последнего обработанного ответа. conditional_get отправляет
+If-None-Match/If-Modified-Since; ответ 304 или 200 с тем же хэшем содержимого означает,
+что источник не изменился, и вызывающий код пропускает разбор, перевод и запись в кэш.
+
+Валидаторы сохраняются отдельным вызовом remember() после успешной обработки ответа,
+чтобы сбой обработки не закрепил ответ как уже обработанный.
+"""
+import hashlib
+from collections import namedtuple
+from datetime import datetime, timezone
+from urllib.parse import urlencode
+
+import requests
+from flask import current_app
+
+from extensions import db
+from models import HttpFetchState
+
+# Параметры, которые не входят в ключ состояния и не сохраняются в БД
+_SECRET_PARAMS = ('api_key', 'apikey', 'token')
+
+FetchResult = namedtuple('FetchResult', ['key', 'url', 'status_code', 'content', 'content_hash',
+                                         'etag', 'last_modified', 'not_modified'])
+
+
+def _state_url(url: str, params: dict | None) -> str:
+    public_params = sorted((key, str(value)) for key, value in (params or {}).items() if key.lower() not in _SECRET_PARAMS)
+    return f"{url}?{urlencode(public_params)}" if public_params else url
+
+
+def conditional_get(url: str, params: dict | None = None, headers: dict | None = None, timeout: int = 15,
+                    force: bool = False) -> FetchResult:
+    """
+    GET с валидаторами последнего обработанного ответа. Ошибки HTTP поднимаются как в requests (raise_for_status).
+    force=True - запрос без валидаторов, например если разобранные данные прошлого ответа потеряны.
+    """
+    state_url = _state_url(url, params)
+    key = hashlib.md5(state_url.encode('utf-8')).hexdigest()
+    state = None if force else HttpFetchState.query.filter_by(url_hash=key).first()
+
+    request_headers = dict(headers or {})
+    if state is not None and state.etag:
+        request_headers['If-None-Match'] = state.etag
+    if state is not None and state.last_modified:
+        request_headers['If-Modified-Since'] = state.last_modified
+
+    response = requests.get(url, params=params, headers=request_headers, timeout=timeout)
+    if response.status_code == 304 and state is not None:
+        current_app.logger.info(f"--- [Conditional GET] {state_url}: 304 Not Modified.")
+        return FetchResult(key, state_url, 304, None, state.content_hash, state.etag, state.last_modified, True)
+    response.raise_for_status()
+
+    content_hash = hashlib.sha256(response.content).hexdigest()
+    not_modified = state is not None and state.content_hash == content_hash
+    if not_modified:
+        current_app.logger.info(f"--- [Conditional GET] {state_url}: содержимое не изменилось.")
+    return FetchResult(key, state_url, response.status_code, response.content, content_hash,
+                       response.headers.get('ETag'), response.headers.get('Last-Modified'), not_modified)
+
+
+def remember(result: FetchResult):
+    """Сохраняет валидаторы и хэш ответа как обработанные."""
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+
+    values = {
+        'url_hash': result.key,
+        'url': result.url,
+        'etag': result.etag,
+        'last_modified': result.last_modified,
+        'content_hash': result.content_hash,
+        'checked_at': datetime.now(timezone.utc),
+    }
+    statement = insert(HttpFetchState).values(values)
+    try:
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=['url_hash'],
+            set_={column: statement.excluded[column] for column in ('etag', 'last_modified', 'content_hash', 'checked_at')}
+        ))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"--- [Conditional GET] Не удалось сохранить состояние {result.url}: {e}")
@@ -0,0 +1,187 @@
+"""
+Агрегаты по контрагентам (CounterpartyBalance) для страницы долгов и истории по контрагенту.
+
+Для каждой пары (контрагент, валюта) пользователя хранятся остаток активных долгов,
+остаток по всем долгам, количество активных долгов каждого типа (для взаимозачета),
+а также количество операций, где контрагент указан как counterparty или merchant, и их сумма
+со знаком: доход - плюс, расход - минус, переводы и обмены не учитываются (валюта операции - валюта счета).
+
+Агрегаты поддерживаются так же, как дневные агрегаты аналитики (services/analytics_rollup.py):
+слушатели сессии собирают затронутые пары (пользователь, контрагент) при flush, а перед
+коммитом их строки пересчитываются из исходных таблиц по индексам
+ix_debt_user_counterparty_created, ix_banking_transaction_counterparty_date и
+ix_banking_transaction_merchant. Существующие долги и операции заполняет миграция b0c1d2e3f4a6,
+полная перестройка - `flask analytics rebuild-counterparty-balances`.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from sqlalchemy import and_, case, delete, event, func, inspect, or_, select
+from sqlalchemy.orm import Session
+
+from extensions import db
+from models import Account, BankingTransaction, CounterpartyBalance, Debt
+
+_BALANCE_DEFAULTS = {
+    'active_balance': Decimal(0), 'total_balance': Decimal(0), 'i_owe_active_count': 0, 'owed_to_me_active_count': 0,
+    'debt_count': 0, 'tx_count': 0, 'tx_total': Decimal(0), 'last_activity_at': None,
+}
+
+
+def _values_with_history(state, field: str) -> set:
+    """Текущее значение поля и, для измененных объектов, прежние значения."""
+    values = {state.dict.get(field)}
+    if state.persistent or state.deleted:
+        values.update(state.attrs[field].history.deleted or ())
+    return values
+
+
+def _later(first, second):
+    if first is None:
+        return second
+    if second is None:
+        return first
+    return max(first, second)
+
+
+def _rebuild_counterparty(connection, user_id: int, name: str):
+    """Пересчитывает строки одного контрагента пользователя по всем валютам."""
+    table = CounterpartyBalance.__table__
+    debt = Debt.__table__
+    tx = BankingTransaction.__table__
+    acc = Account.__table__
+
+    connection.execute(delete(table).where(table.c.user_id == user_id, table.c.counterparty == name))
+
+    remaining = debt.c.initial_amount - debt.c.repaid_amount
+    signed = case((debt.c.debt_type == 'i_owe', -remaining), else_=remaining)
+    is_active = debt.c.status == 'active'
+    debt_rows = connection.execute(select(
+        debt.c.currency,
+        func.sum(case((is_active, signed), else_=0)),
+        func.sum(signed),
+        func.sum(case((and_(is_active, debt.c.debt_type == 'i_owe'), 1), else_=0)),
+        func.sum(case((and_(is_active, debt.c.debt_type == 'owed_to_me'), 1), else_=0)),
+        func.count(debt.c.id),
+        func.max(debt.c.created_at)
+    ).where(debt.c.user_id == user_id, debt.c.counterparty == name).group_by(debt.c.currency))
+
+    rows = defaultdict(lambda: dict(_BALANCE_DEFAULTS))
+    for currency, active_balance, total_balance, i_owe_active, owed_to_me_active, debt_count, last_created in debt_rows:
+        rows[currency].update({
+            'active_balance': active_balance or Decimal(0),
+            'total_balance': total_balance or Decimal(0),
+            'i_owe_active_count': i_owe_active or 0,
+            'owed_to_me_active_count': owed_to_me_active or 0,
+            'debt_count': debt_count,
+            'last_activity_at': last_created,
+        })
+
+    signed_amount = case((tx.c.transaction_type == 'income', tx.c.amount), (tx.c.transaction_type == 'expense', -tx.c.amount), else_=0)
+    tx_rows = connection.execute(select(
+        acc.c.currency, func.count(tx.c.id), func.sum(signed_amount), func.max(tx.c.date)
+    ).select_from(tx.join(acc, tx.c.account_id == acc.c.id)).where(
+        acc.c.user_id == user_id, or_(tx.c.counterparty == name, tx.c.merchant == name)
+    ).group_by(acc.c.currency))
+    for currency, tx_count, tx_total, last_date in tx_rows:
+        row = rows[currency]
+        row.update({'tx_count': tx_count, 'tx_total': tx_total or Decimal(0), 'last_activity_at': _later(row['last_activity_at'], last_date)})
+
+    if rows:
+        connection.execute(table.insert(), [
+            dict(values, user_id=user_id, counterparty=name, currency=currency) for currency, values in rows.items()
+        ])
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_counterparty_balance_keys(session, flush_context):
+    keys = session.info.setdefault('counterparty_balance_keys', set())
+    by_account = []
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Debt):
+            state = inspect(obj)
+            for user_id in _values_with_history(state, 'user_id'):
+                for name in _values_with_history(state, 'counterparty'):
+                    if user_id is not None and name:
+                        keys.add((user_id, name))
+        elif isinstance(obj, BankingTransaction):
+            state = inspect(obj)
+            names = _values_with_history(state, 'counterparty') | _values_with_history(state, 'merchant')
+            for account_id in _values_with_history(state, 'account_id'):
+                by_account.extend((account_id, name) for name in names if name)
+
+    account_ids = {account_id for account_id, _ in by_account if account_id is not None}
+    if account_ids:
+        acc = Account.__table__
+        owners = dict(session.connection().execute(select(acc.c.id, acc.c.user_id).where(acc.c.id.in_(account_ids))).all())
+        keys.update((owners[account_id], name) for account_id, name in by_account if owners.get(account_id) is not None)
+    if not keys:
+        session.info.pop('counterparty_balance_keys', None)
+
+
+@event.listens_for(Session, 'before_commit')
+def _apply_counterparty_balance_changes(session):
+    if not session.info.get('counterparty_balance_keys') and not (session.new or session.dirty or session.deleted):
+        return
+    # Дописываем ожидающие изменения, чтобы after_flush успел собрать их ключи
+    session.flush()
+    keys = session.info.pop('counterparty_balance_keys', None)
+    if not keys:
+        return
+    connection = session.connection()
+    for user_id, name in sorted(keys):
+        _rebuild_counterparty(connection, user_id, name)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_counterparty_balance_keys(session):
+    session.info.pop('counterparty_balance_keys', None)
+
+
+def rebuild_all_counterparty_balances() -> int:
+    """Полностью перестраивает агрегаты по контрагентам. Возвращает количество пересчитанных контрагентов."""
+    keys = set(db.session.query(Debt.user_id, Debt.counterparty).filter(Debt.user_id.isnot(None)).distinct())
+    for column in (BankingTransaction.counterparty, BankingTransaction.merchant):
+        keys.update(db.session.query(Account.user_id, column).join(Account, BankingTransaction.account_id == Account.id).filter(
+            Account.user_id.isnot(None), column.isnot(None), column != ''
+        ).distinct())
+    connection = db.session.connection()
+    connection.execute(delete(CounterpartyBalance.__table__))
+    for user_id, name in sorted(keys):
+        _rebuild_counterparty(connection, user_id, name)
+    db.session.commit()
+    return len(keys)
+
+
+# --- Чтение агрегатов ---
+
+def get_active_counterparty_balances(user_id: int) -> list[dict]:
+    """
+    Балансы по контрагентам с активными долгами: [{'counterparty', 'currency', 'balance', 'can_net'}],
+    по имени контрагента. Нулевые балансы тоже возвращаются, чтобы была доступна история.
+    """
+    rows = CounterpartyBalance.query.filter(
+        CounterpartyBalance.user_id == user_id,
+        (CounterpartyBalance.i_owe_active_count + CounterpartyBalance.owed_to_me_active_count) > 0
+    ).order_by(CounterpartyBalance.counterparty, CounterpartyBalance.currency).all()
+    return [
+        {
+            'counterparty': row.counterparty,
+            'currency': row.currency,
+            'balance': row.active_balance,
+            'can_net': row.i_owe_active_count > 0 and row.owed_to_me_active_count > 0
+        }
+        for row in rows
+    ]
+
+
+def get_counterparty_summary(user_id: int, name: str) -> dict:
+    """Сводка по контрагенту: {'total_debt_balance', 'currencies', 'debt_count', 'tx_count', 'by_currency'}."""
+    rows = CounterpartyBalance.query.filter_by(user_id=user_id, counterparty=name).order_by(CounterpartyBalance.currency).all()
+    return {
+        'total_debt_balance': sum((row.total_balance for row in rows), Decimal(0)),
+        'currencies': [row.currency for row in rows],
+        'debt_count': sum(row.debt_count for row in rows),
+        'tx_count': sum(row.tx_count for row in rows),
+        'by_currency': rows,
+    }
@@ -0,0 +1,205 @@
+"""
+Справочник контрагентов пользователя (Counterparty) для автодополнения в формах.
+
+Раньше каждая форма операции или регулярного платежа собирала список контрагентов
+тремя SELECT DISTINCT по долгам и транзакциям и целиком вставляла его в HTML.
+Теперь имена хранятся в отдельной таблице со счетчиком использований:
+слушатели сессии собирают добавленные и удаленные значения Debt.counterparty,
+RecurringPayment.counterparty, BankingTransaction.counterparty и merchant при каждом flush,
+а перед коммитом счетчики обновляются одним upsert на имя в той же транзакции.
+
+Формы получают только самые частые имена, остальные подгружаются через
+/api/counterparties (поиск по префиксу, затем по вхождению). Справочник заполняется
+из существующих данных миграцией e7f8a9b0c1d2; перестроить его заново -
+`flask analytics rebuild-counterparties`.
+"""
+from collections import Counter
+from datetime import datetime, timezone
+
+from sqlalchemy import delete, event, func, inspect, select, update
+from sqlalchemy.orm import Session
+
+from extensions import db
+from models import Account, BankingTransaction, Counterparty, Debt, RecurringPayment
+
+DEFAULT_SUGGESTIONS = 20
+MAX_SEARCH_RESULTS = 50
+
+# Модели и их поля с именами контрагентов
+_TRACKED_FIELDS = {
+    Debt: ('counterparty',),
+    RecurringPayment: ('counterparty',),
+    BankingTransaction: ('counterparty', 'merchant'),
+}
+
+
+def normalize_name(name) -> str:
+    """Ключ поиска: нижний регистр, схлопнутые пробелы."""
+    if not isinstance(name, str):
+        return ''
+    return ' '.join(name.split()).lower()
+
+
+def _clean_name(name) -> str:
+    return ' '.join(name.split()) if isinstance(name, str) else ''
+
+
+def _field_changes(obj, field: str) -> tuple[list, list]:
+    """Возвращает (добавленные, удаленные) значения поля объекта в этом flush."""
+    state = inspect(obj)
+    if state.deleted or state.was_deleted:
+        return [], [state.dict.get(field)]
+    history = state.attrs[field].history
+    return list(history.added or ()), list(history.deleted or ())
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_counterparty_changes(session, flush_context):
+    changes = session.info.setdefault('counterparty_changes', Counter())
+    by_account = []
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        fields = _TRACKED_FIELDS.get(type(obj))
+        if not fields:
+            continue
+        for field in fields:
+            added, removed = _field_changes(obj, field)
+            deltas = [(name, 1) for name in added] + [(name, -1) for name in removed]
+            deltas = [(_clean_name(name), delta) for name, delta in deltas if _clean_name(name)]
+            if not deltas:
+                continue
+            if isinstance(obj, BankingTransaction):
+                # Владелец транзакции определяется по счету, счета загружаем одним запросом ниже
+                by_account.extend((inspect(obj).dict.get('account_id'), name, delta) for name, delta in deltas)
+            else:
+                user_id = inspect(obj).dict.get('user_id')
+                if user_id is not None:
+                    for name, delta in deltas:
+                        changes[(user_id, name)] += delta
+
+    account_ids = {account_id for account_id, _, _ in by_account if account_id is not None}
+    if account_ids:
+        acc = Account.__table__
+        owners = dict(session.connection().execute(select(acc.c.id, acc.c.user_id).where(acc.c.id.in_(account_ids))).all())
+        for account_id, name, delta in by_account:
+            if owners.get(account_id) is not None:
+                changes[(owners[account_id], name)] += delta
+    if not changes:
+        session.info.pop('counterparty_changes', None)
+
+
+def _upsert_counterparty(connection, user_id: int, name: str, delta: int, now: datetime):
+    """Прибавляет delta к счетчику имени; новое имя создается только при положительном delta."""
+    table = Counterparty.__table__
+    name_key = normalize_name(name)
+    values = {'usage_count': table.c.usage_count + delta}
+    if delta > 0:
+        values['last_used_at'] = now
+    result = connection.execute(update(table).where(table.c.user_id == user_id, table.c.name_key == name_key).values(**values))
+    if result.rowcount or delta <= 0:
+        return
+
+    if connection.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    # Строку мог одновременно создать другой воркер - тогда просто увеличиваем счетчик
+    stmt = insert(table).values(user_id=user_id, name=name, name_key=name_key, usage_count=delta, last_used_at=now)
+    connection.execute(stmt.on_conflict_do_update(
+        index_elements=['user_id', 'name_key'],
+        set_={'usage_count': table.c.usage_count + delta, 'last_used_at': now}
+    ))
+
+
+@event.listens_for(Session, 'before_commit')
+def _apply_counterparty_changes(session):
+    if not session.info.get('counterparty_changes') and not (session.new or session.dirty or session.deleted):
+        return
+    # Дописываем ожидающие изменения, чтобы after_flush успел их собрать
+    session.flush()
+    changes = session.info.pop('counterparty_changes', None)
+    if not changes:
+        return
+    connection = session.connection()
+    now = datetime.now(timezone.utc)
+    for (user_id, name), delta in sorted(changes.items()):
+        if delta:
+            _upsert_counterparty(connection, user_id, name, delta, now)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_counterparty_changes(session):
+    session.info.pop('counterparty_changes', None)
+
+
+def rebuild_counterparties() -> int:
+    """Перестраивает справочник из долгов, регулярных платежей и транзакций. Возвращает количество имен."""
+    counts = Counter()
+    display_names = {}
+
+    def add(user_id, name, used):
+        name = _clean_name(name)
+        if user_id is None or not name:
+            return
+        key = (user_id, normalize_name(name))
+        counts[key] += used
+        display_names.setdefault(key, name)
+
+    for model in (Debt, RecurringPayment):
+        rows = db.session.query(model.user_id, model.counterparty, func.count(model.id)).filter(
+            model.counterparty.isnot(None)
+        ).group_by(model.user_id, model.counterparty)
+        for user_id, name, used in rows:
+            add(user_id, name, used)
+    for column in (BankingTransaction.counterparty, BankingTransaction.merchant):
+        rows = db.session.query(Account.user_id, column, func.count(BankingTransaction.id)).join(
+            Account, BankingTransaction.account_id == Account.id
+        ).filter(column.isnot(None)).group_by(Account.user_id, column)
+        for user_id, name, used in rows:
+            add(user_id, name, used)
+
+    connection = db.session.connection()
+    connection.execute(delete(Counterparty.__table__))
+    now = datetime.now(timezone.utc)
+    rows = [
+        {'user_id': user_id, 'name': display_names[(user_id, name_key)], 'name_key': name_key, 'usage_count': used, 'last_used_at': now}
+        for (user_id, name_key), used in counts.items()
+    ]
+    if rows:
+        connection.execute(Counterparty.__table__.insert(), rows)
+    db.session.commit()
+    return len(rows)
+
+
+def _escape_like(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def get_top_counterparties(user_id: int, limit: int = DEFAULT_SUGGESTIONS) -> list[str]:
+    """Самые часто используемые имена пользователя - первоначальные подсказки формы."""
+    return [name for name, in db.session.query(Counterparty.name).filter(
+        Counterparty.user_id == user_id, Counterparty.usage_count > 0
+    ).order_by(Counterparty.usage_count.desc(), Counterparty.name).limit(limit)]
+
+
+def search_counterparties(user_id: int, query: str, limit: int = 10) -> list[dict]:
+    """
+    Ищет имена по префиксу (диапазон по name_key, использует уникальный индекс), а если
+    совпадений меньше limit - добавляет имена, содержащие запрос. Результаты упорядочены
+    по частоте использования. Возвращает [{'name', 'usage_count'}].
+    """
+    limit = max(1, min(limit, MAX_SEARCH_RESULTS))
+    key = normalize_name(query)
+    if not key:
+        return [{'name': name, 'usage_count': None} for name in get_top_counterparties(user_id, limit)]
+
+    base = db.session.query(Counterparty.name, Counterparty.usage_count).filter(
+        Counterparty.user_id == user_id, Counterparty.usage_count > 0
+    )
+    order = (Counterparty.usage_count.desc(), Counterparty.name)
+    rows = base.filter(Counterparty.name_key >= key, Counterparty.name_key < key + '\uffff').order_by(*order).limit(limit).all()
+    if len(rows) < limit:
+        contains = base.filter(Counterparty.name_key.like(f'%{_escape_like(key)}%', escape='\\'))
+        if rows:
+            contains = contains.filter(Counterparty.name.notin_([name for name, _ in rows]))
+        rows.extend(contains.order_by(*order).limit(limit - len(rows)).all())
+    return [{'name': name, 'usage_count': used} for name, used in rows]
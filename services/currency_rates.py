@@ -0,0 +1,102 @@
+"""
+Сервис курсов валют к рублю.
+
+Курсы хранятся в неизменяемом снимке в памяти процесса и разделяются всеми запросами.
+Снимок обновляет фоновая задача update_usdt_rub_rate_in_background (ЦБ РФ -> JsonCache -> снимок).
+В пути запроса нет обращений к сети: при первом обращении снимок читается из JsonCache,
+затем перечитывается не чаще раза в CURRENCY_RATES_RELOAD_SECONDS, чтобы подхватить
+курсы, сохраненные фоновой задачей другого воркера.
+"""
+import threading
+import time
+from decimal import Decimal, InvalidOperation
+from types import MappingProxyType
+
+from flask import current_app
+
+from extensions import db
+from services.json_cache import get_cached, set_cached
+
+CACHE_KEY = 'currency_rates'
+DEFAULT_RELOAD_SECONDS = 600
+# Валюты, курсы которых сохраняются из ответа ЦБ РФ
+TRACKED_CURRENCIES = ('USD', 'EUR', 'CNY', 'GBP', 'CHF', 'JPY', 'HKD', 'KZT', 'TRY', 'AED')
+
+# Значения по умолчанию на случай, если курсы еще ни разу не загружались
+DEFAULT_RATES = {
+    'USD': Decimal('90.0'),
+    'EUR': Decimal('100.0'),
+    'CNY': Decimal('12.5'),
+    'RUB': Decimal('1.0'),
+    'USDT': Decimal('90.0'),
+    None: Decimal('1.0')  # Для активов без указания валюты
+}
+
+_snapshot = MappingProxyType(dict(DEFAULT_RATES))
+_loaded_at = None
+_lock = threading.Lock()
+
+
+def _build_snapshot(cached_rates: dict) -> MappingProxyType:
+    rates = dict(DEFAULT_RATES)
+    for code, value in (cached_rates or {}).items():
+        try:
+            rates[code] = Decimal(str(value))
+        except (InvalidOperation, TypeError, ValueError):
+            continue
+    rates['RUB'] = Decimal('1.0')
+    rates[None] = Decimal('1.0')
+    return MappingProxyType(rates)
+
+
+def _reload_from_cache():
+    """Перечитывает снимок из JsonCache. Пока один поток читает, остальные получают текущий снимок."""
+    global _snapshot, _loaded_at
+    # Первую загрузку ждут все, последующие выполняются без блокировки читателей
+    if not _lock.acquire(blocking=_loaded_at is None):
+        return
+    try:
+        reload_seconds = current_app.config.get('CURRENCY_RATES_RELOAD_SECONDS', DEFAULT_RELOAD_SECONDS)
+        if _loaded_at is not None and time.monotonic() - _loaded_at < reload_seconds:
+            return
+        try:
+            cached_rates, _ = get_cached(CACHE_KEY, default={})
+            _snapshot = _build_snapshot(cached_rates)
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"--- [Currency Rates] Ошибка при чтении курсов из кэша, используется текущий снимок: {e}")
+        # Отмечаем попытку и при ошибке, чтобы не обращаться к БД на каждой странице
+        _loaded_at = time.monotonic()
+    finally:
+        _lock.release()
+
+
+def get_currency_rates():
+    """
+    Возвращает неизменяемый словарь {код валюты: курс к RUB в Decimal}.
+    Ключ None соответствует активам без указания валюты.
+    """
+    reload_seconds = current_app.config.get('CURRENCY_RATES_RELOAD_SECONDS', DEFAULT_RELOAD_SECONDS)
+    if _loaded_at is None or time.monotonic() - _loaded_at >= reload_seconds:
+        _reload_from_cache()
+    return _snapshot
+
+
+def refresh_currency_rates() -> tuple[bool, str]:
+    """Загружает курсы ЦБ РФ, сохраняет их в JsonCache и заменяет снимок процесса."""
+    global _snapshot, _loaded_at
+    from api_clients import fetch_cbr_rates  # Локальный импорт для избежания циклической зависимости
+
+    cbr_rates = fetch_cbr_rates()
+    if not cbr_rates.get('USD'):
+        return False, "Не удалось получить курсы валют от ЦБ РФ."
+
+    rates_data = {code: str(cbr_rates[code]) for code in TRACKED_CURRENCIES if code in cbr_rates}
+    # Отдельного курса USDT у ЦБ нет, считаем его равным USD
+    rates_data['USDT'] = rates_data['USD']
+    set_cached(CACHE_KEY, rates_data)
+
+    with _lock:
+        _snapshot = _build_snapshot(rates_data)
+        _loaded_at = time.monotonic()
+    return True, f"Курсы валют обновлены: USD={rates_data['USD']}, валют: {len(rates_data)}."
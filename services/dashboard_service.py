@@ -0,0 +1,448 @@
+"""
+Материализованная сводка главной страницы (DashboardSnapshot).
+
+Сводка пересчитывается целиком и сохраняется одной строкой на пользователя, а страница
+читает ее одним запросом. Любой flush, затрагивающий входные данные сводки (активы, транзакции,
+счета, долги), помечает устаревшими сводки их владельцев, а изменение общих данных (история
+портфелей, кэш изменений цен) - все сводки. Устаревшие сводки пересчитываются при следующем
+открытии главной страницы.
+"""
+import itertools
+import json
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+
+from flask import current_app
+from sqlalchemy import event, inspect, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, joinedload
+
+from extensions import db
+from models import (
+    InvestmentAsset, InvestmentPlatform, SecuritiesPortfolioHistory, CryptoPortfolioHistory, Account, Debt,
+    Transaction, BankingTransaction, HistoricalPriceCache, DashboardSnapshot
+)
+from services.common import _get_currency_rates
+
+DEFAULT_SNAPSHOT_MAX_AGE_SECONDS = 900
+
+# Модели, изменение которых делает сводку неактуальной
+_DASHBOARD_INPUT_MODELS = (
+    InvestmentAsset, InvestmentPlatform, Transaction, Account, Debt, BankingTransaction,
+    SecuritiesPortfolioHistory, CryptoPortfolioHistory, HistoricalPriceCache
+)
+# Общие для всех пользователей входные данные: их изменение делает устаревшими все сводки
+_SHARED_INPUT_MODELS = (SecuritiesPortfolioHistory, CryptoPortfolioHistory, HistoricalPriceCache)
+
+
+def _calculate_portfolio_changes(history_records: list) -> dict:
+    """Рассчитывает процентные изменения портфеля для разных периодов."""
+    changes = {'1d': None, '7d': None, '30d': None, '180d': None, '365d': None}
+    if not history_records:
+        return changes
+
+    history_by_date = {record.date: record.total_value_rub for record in history_records}
+    
+    # Находим самую последнюю доступную дату в истории как "текущую"
+    latest_date = max(history_by_date.keys())
+    latest_val = history_by_date[latest_date]
+
+    periods = {'1d': 1, '7d': 7, '30d': 30, '180d': 180, '365d': 365}
+    for period_name, days_ago in periods.items():
+        past_date = latest_date - timedelta(days=days_ago)
+        past_val = history_by_date.get(past_date)
+        
+        if past_val is not None and past_val > 0:
+            change_pct = ((latest_val - past_val) / past_val) * 100
+            changes[period_name] = change_pct
+            
+    return changes
+
+
+def compute_dashboard_context(user_id: int) -> dict:
+    """Рассчитывает данные главной страницы напрямую из БД (живой расчет)."""
+    # --- Константы и курсы ---
+    currency_rates_to_rub = _get_currency_rates()
+
+    # --- 1. Сводка по портфелю ценных бумаг ---
+    securities_assets = InvestmentAsset.query.join(InvestmentPlatform).filter(InvestmentPlatform.platform_type == 'stock_broker', InvestmentPlatform.user_id == user_id).all()
+    securities_total_rub = sum(
+        (asset.quantity or 0) * (asset.current_price or 0) * currency_rates_to_rub.get(asset.currency_of_price, Decimal(1.0))
+        for asset in securities_assets
+    )
+    # Расчет изменений для портфеля ЦБ
+    # Note: SecuritiesPortfolioHistory is currently global/not linked to user_id directly in model, 
+    # but usually history is aggregate. If we want per user history, we need to add user_id to History models too.
+    # For now, assuming single user or global history is okay, OR we need to filter history if possible.
+    # However, History tables don't have user_id yet. I will skip filtering history tables for now 
+    # as adding user_id to them requires more complex migration for existing data.
+    # BUT, the prompt said "application is essentially single user". So maybe it's fine for history to remain global for now
+    # or assume it belongs to the logged in user if we are migrating to multi-user.
+    # Given the scope, I will filter what has user_id.
+    
+    securities_history_start_date = date.today() - timedelta(days=366)
+    securities_history = SecuritiesPortfolioHistory.query.filter(SecuritiesPortfolioHistory.date >= securities_history_start_date).order_by(SecuritiesPortfolioHistory.date.asc()).all()
+    securities_changes = _calculate_portfolio_changes(securities_history)
+
+    # --- 2. Сводка по крипто-портфелю ---
+    crypto_assets = InvestmentAsset.query.join(InvestmentPlatform).filter(InvestmentPlatform.platform_type == 'crypto_exchange', InvestmentPlatform.user_id == user_id).all()
+    crypto_total_usdt = sum((asset.quantity or 0) * (asset.current_price or 0) for asset in crypto_assets)
+    crypto_total_rub = crypto_total_usdt * currency_rates_to_rub['USDT']
+
+    # Расчет изменений для крипто-портфеля за разные периоды
+    start_date_query = date.today() - timedelta(days=366)
+    crypto_history = CryptoPortfolioHistory.query.filter(CryptoPortfolioHistory.date >= start_date_query).order_by(CryptoPortfolioHistory.date.asc()).all()
+    crypto_changes = _calculate_portfolio_changes(crypto_history)
+
+    # --- 3. Сводка по банковским счетам (включая кредитные карты) ---
+    bank_accounts = Account.query.filter(Account.account_type.in_(['bank_account', 'deposit', 'bank_card', 'credit']), Account.user_id == user_id).all()
+    banking_total_rub = Decimal(0)
+    for acc in bank_accounts:
+        value_in_rub = acc.balance * currency_rates_to_rub.get(acc.currency, Decimal(1.0))
+        if acc.account_type == 'credit':
+            banking_total_rub -= value_in_rub # Вычитаем долг по кредитке
+        else:
+            banking_total_rub += value_in_rub # Прибавляем активы
+    
+    # Список вкладов и накопительных счетов для отображения
+    deposits_and_savings = Account.query.filter(
+        Account.account_type.in_(['deposit', 'bank_account']),
+        Account.is_active == True,
+        Account.user_id == user_id
+    ).order_by(Account.balance.desc()).all()
+    deposits_and_savings = [
+        {'name': acc.name, 'account_type': acc.account_type, 'balance': acc.balance, 'currency': acc.currency, 'interest_rate': acc.interest_rate}
+        for acc in deposits_and_savings
+    ]
+
+    # --- 4. Сводка по долгам ---
+    i_owe_list = Debt.query.filter_by(debt_type='i_owe', status='active', user_id=user_id).all()
+    owed_to_me_list = Debt.query.filter_by(debt_type='owed_to_me', status='active', user_id=user_id).all()
+    i_owe_total_rub = sum(d.initial_amount - d.repaid_amount for d in i_owe_list)
+    owed_to_me_total_rub = sum(d.initial_amount - d.repaid_amount for d in owed_to_me_list)
+
+    # --- 5. Последние операции ---
+    last_investment_txs = Transaction.query.join(InvestmentPlatform).filter(InvestmentPlatform.user_id == user_id).options(joinedload(Transaction.platform)).order_by(Transaction.timestamp.desc()).limit(7).all()
+    last_banking_txs = BankingTransaction.query.join(Account, BankingTransaction.account_id == Account.id).filter(Account.user_id == user_id).options(
+        joinedload(BankingTransaction.account_ref), 
+        joinedload(BankingTransaction.to_account_ref)
+    ).order_by(BankingTransaction.date.desc()).limit(7).all()
+
+    combined_txs = []
+    for tx in last_investment_txs:
+        desc = tx.raw_type or tx.type.capitalize()
+        value_str = ""
+        if tx.type == 'buy':
+            desc = f"Покупка {tx.asset1_ticker}"
+            value_str = f"-{tx.asset2_amount:,.2f}".replace(',', ' ') + f" {tx.asset2_ticker}"
+        elif tx.type == 'sell':
+            desc = f"Продажа {tx.asset1_ticker}"
+            value_str = f"+{tx.asset2_amount:,.2f}".replace(',', ' ') + f" {tx.asset2_ticker}"
+        elif tx.type == 'deposit':
+            desc = f"Депозит {tx.asset1_ticker}"
+            value_str = f"+{tx.asset1_amount:,.4f}".replace(',', ' ').rstrip('0').rstrip('.') + f" {tx.asset1_ticker}"
+        elif tx.type == 'withdrawal':
+            desc = f"Вывод {tx.asset1_ticker}"
+            value_str = f"-{tx.asset1_amount:,.4f}".replace(',', ' ').rstrip('0').rstrip('.') + f" {tx.asset1_ticker}"
+        elif tx.type == 'transfer':
+            desc = f"Перевод {tx.asset1_ticker}"
+            value_str = f"{tx.asset1_amount:,.4f}".replace(',', ' ').rstrip('0').rstrip('.') + f" {tx.asset1_ticker}"
+        
+        combined_txs.append({
+            'timestamp': tx.timestamp,
+            'description': desc,
+            'value': value_str,
+            'source': tx.platform.name,
+            'is_investment': True,
+            'is_positive': None
+        })
+
+    for tx in last_banking_txs:
+        desc = tx.description or tx.transaction_type.capitalize()
+        value_str = ""
+        is_positive = None
+        if tx.transaction_type == 'expense':
+            value_str = f"-{tx.amount:,.2f}".replace(',', ' ') + f" {tx.account_ref.currency}"
+            is_positive = False
+        elif tx.transaction_type == 'income':
+            value_str = f"+{tx.amount:,.2f}".replace(',', ' ') + f" {tx.account_ref.currency}"
+            is_positive = True
+        elif tx.transaction_type == 'transfer':
+            desc = f"Перевод на {tx.to_account_ref.name}"
+            value_str = f"-{tx.amount:,.2f}".replace(',', ' ') + f" {tx.account_ref.currency}"
+            is_positive = False
+        elif tx.transaction_type == 'exchange':
+            desc = f"Обмен {tx.account_ref.currency} -> {tx.to_account_ref.currency}"
+            value_str = f"+{tx.to_amount:,.2f}".replace(',', ' ') + f" {tx.to_account_ref.currency}"
+            is_positive = True
+        
+        combined_txs.append({
+            'timestamp': tx.date,
+            'description': desc,
+            'value': value_str,
+            'source': tx.account_ref.name,
+            'is_investment': False,
+            'is_positive': is_positive
+        })
+
+    combined_txs.sort(key=lambda x: x['timestamp'], reverse=True)
+    last_10_transactions = combined_txs[:10]
+
+    # --- 5.1 Последние операции по ЦБ ---
+    last_securities_txs_raw = Transaction.query.join(InvestmentPlatform).filter(
+        InvestmentPlatform.platform_type == 'stock_broker',
+        InvestmentPlatform.user_id == user_id
+    ).options(joinedload(Transaction.platform)).order_by(Transaction.timestamp.desc()).limit(10).all()
+
+    last_securities_txs = []
+    for tx in last_securities_txs_raw:
+        desc = tx.raw_type or tx.type.capitalize()
+        value_str = ""
+        is_positive = None
+        if tx.type == 'buy':
+            desc = f"Покупка {tx.asset1_ticker}"
+            value_str = f"-{tx.asset2_amount:,.2f}".replace(',', ' ') + f" {tx.asset2_ticker}"
+            is_positive = False
+        elif tx.type == 'sell':
+            desc = f"Продажа {tx.asset1_ticker}"
+            value_str = f"+{tx.asset2_amount:,.2f}".replace(',', ' ') + f" {tx.asset2_ticker}"
+            is_positive = True
+        
+        last_securities_txs.append({
+            'timestamp': tx.timestamp, 'description': desc, 'value': value_str,
+            'source': tx.platform.name, 'is_positive': is_positive
+        })
+
+    # --- 6. Общая стоимость ---
+    net_worth_rub = securities_total_rub + crypto_total_rub + banking_total_rub + owed_to_me_total_rub - i_owe_total_rub
+
+    # --- 7. Топ-5 активов по стоимости ---
+    # --- Top 5 Securities ---
+    securities_valued_assets = []
+    for asset in securities_assets:
+        value_rub = (asset.quantity or 0) * (asset.current_price or 0) * currency_rates_to_rub.get(asset.currency_of_price, Decimal(1.0))
+        securities_valued_assets.append({'asset': {'ticker': asset.ticker, 'name': asset.name}, 'value_rub': value_rub})
+
+    top_5_securities_sorted = sorted(securities_valued_assets, key=lambda x: x['value_rub'], reverse=True)[:5]
+    top_securities_isins = [item['asset']['ticker'] for item in top_5_securities_sorted]
+
+    securities_price_changes_raw = db.session.query(
+        HistoricalPriceCache.ticker, 
+        HistoricalPriceCache.period, 
+        HistoricalPriceCache.change_percent
+    ).filter(
+        HistoricalPriceCache.ticker.in_(top_securities_isins),
+        HistoricalPriceCache.period.in_(['1d', '7d', '30d'])
+    ).all()
+
+    securities_changes_by_isin = defaultdict(dict)
+    for isin, period, change in securities_price_changes_raw:
+        securities_changes_by_isin[isin][period] = change
+
+    top_5_securities = []
+    for item in top_5_securities_sorted:
+        isin = item['asset']['ticker']
+        item['changes'] = securities_changes_by_isin.get(isin, {})
+        top_5_securities.append(item)
+
+    # --- Top 5 Crypto ---
+    aggregated_crypto_assets = defaultdict(lambda: {
+        'total_quantity': Decimal(0),
+        'total_value_rub': Decimal(0),
+        'name': ''
+    })
+
+    for asset in crypto_assets: 
+        ticker = asset.ticker
+        quantity = asset.quantity or Decimal(0)
+        price = asset.current_price or Decimal(0)
+        
+        asset_value_usdt = quantity * price
+        asset_value_rub = asset_value_usdt * currency_rates_to_rub.get('USDT', Decimal(1.0))
+
+        agg = aggregated_crypto_assets[ticker]
+        agg['total_quantity'] += quantity
+        agg['total_value_rub'] += asset_value_rub
+        agg['name'] = asset.name 
+
+    top_5_crypto_sorted = sorted(aggregated_crypto_assets.items(), key=lambda item: item[1]['total_value_rub'], reverse=True)[:5]
+    top_crypto_tickers = [ticker for ticker, data in top_5_crypto_sorted]
+
+    crypto_price_changes_raw = db.session.query(
+        HistoricalPriceCache.ticker, 
+        HistoricalPriceCache.period, 
+        HistoricalPriceCache.change_percent
+    ).filter(
+        HistoricalPriceCache.ticker.in_(top_crypto_tickers),
+        HistoricalPriceCache.period.in_(['24h', '7d', '30d'])
+    ).all()
+
+    crypto_changes_by_ticker = defaultdict(dict)
+    for ticker, period, change in crypto_price_changes_raw:
+        period_key = '1d' if period == '24h' else period
+        crypto_changes_by_ticker[ticker][period_key] = change
+
+    top_5_crypto = []
+    for ticker, data in top_5_crypto_sorted:
+        top_5_crypto.append({
+            'ticker': ticker,
+            'name': data['name'],
+            'value_rub': data['total_value_rub'],
+            'changes': crypto_changes_by_ticker.get(ticker, {})
+        })
+
+    return {
+        'net_worth_rub': net_worth_rub,
+        'securities_summary': {'total_rub': securities_total_rub, 'changes': securities_changes},
+        'crypto_summary': {'total_rub': crypto_total_rub, 'changes': crypto_changes},
+        'banking_summary': {'total_rub': banking_total_rub},
+        'debt_summary': {'i_owe': i_owe_total_rub, 'owed_to_me': owed_to_me_total_rub},
+        'last_transactions': last_10_transactions,
+        'last_securities_txs': last_securities_txs,
+        'deposits_and_savings': deposits_and_savings,
+        'top_5_securities': top_5_securities,
+        'top_5_crypto': top_5_crypto
+    }
+
+
+def _encode_value(value):
+    # Decimal и даты сохраняем с типом, чтобы шаблон получил те же объекты, что и при живом расчете
+    if isinstance(value, Decimal):
+        return {'__decimal__': str(value)}
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    if isinstance(value, date):
+        return {'__date__': value.isoformat()}
+    raise TypeError(f"Тип {type(value).__name__} не поддерживается в сводке")
+
+
+def _decode_object(obj: dict):
+    if '__decimal__' in obj:
+        return Decimal(obj['__decimal__'])
+    if '__datetime__' in obj:
+        return datetime.fromisoformat(obj['__datetime__'])
+    if '__date__' in obj:
+        return date.fromisoformat(obj['__date__'])
+    return obj
+
+
+def _dumps(context: dict) -> str:
+    return json.dumps(context, default=_encode_value)
+
+
+def _loads(json_data: str) -> dict:
+    return json.loads(json_data, object_hook=_decode_object)
+
+
+def _save_snapshot(user_id: int, snapshot: DashboardSnapshot | None, context: dict):
+    try:
+        if snapshot is None:
+            snapshot = DashboardSnapshot(user_id=user_id)
+            db.session.add(snapshot)
+        snapshot.json_data = _dumps(context)
+        snapshot.is_stale = False
+        snapshot.computed_at = datetime.now(timezone.utc)
+        db.session.commit()
+    except IntegrityError:
+        # Сводку параллельно сохранил другой запрос - его результат не хуже нашего
+        db.session.rollback()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"--- [Dashboard] Не удалось сохранить сводку пользователя {user_id}: {e}", exc_info=True)
+
+
+def get_dashboard_context(user_id: int, live: bool = False) -> dict:
+    """
+    Возвращает данные главной страницы.
+    Актуальная сводка читается одним запросом; устаревшая или отсутствующая пересчитывается и сохраняется.
+    live=True или DASHBOARD_SNAPSHOT_ENABLED=False - живой расчет без использования сводки.
+    """
+    if live or not current_app.config.get('DASHBOARD_SNAPSHOT_ENABLED', True):
+        return compute_dashboard_context(user_id)
+
+    snapshot = DashboardSnapshot.query.filter_by(user_id=user_id).first()
+    if snapshot and not snapshot.is_stale and snapshot.computed_at:
+        computed_at = snapshot.computed_at
+        if computed_at.tzinfo is None:
+            computed_at = computed_at.replace(tzinfo=timezone.utc)
+        # Ограничение возраста нужно из-за курсов валют, которые меняются без изменения данных пользователя
+        max_age = current_app.config.get('DASHBOARD_SNAPSHOT_MAX_AGE_SECONDS', DEFAULT_SNAPSHOT_MAX_AGE_SECONDS)
+        if datetime.now(timezone.utc) - computed_at < timedelta(seconds=max_age):
+            try:
+                return _loads(snapshot.json_data)
+            except ValueError as e:
+                current_app.logger.error(f"--- [Dashboard] Поврежденная сводка пользователя {user_id}, пересчет: {e}")
+
+    context = compute_dashboard_context(user_id)
+    _save_snapshot(user_id, snapshot, context)
+    return context
+
+
+def _attribute_values(obj, key: str) -> set:
+    """Текущее и прежнее (до flush) значения атрибута объекта."""
+    state = inspect(obj)
+    values = set(state.attrs[key].history.deleted)
+    values.add(state.dict.get(key))
+    values.discard(None)
+    return values
+
+
+def _owner_ids(session, objects) -> set | None:
+    """
+    Пользователи, чьи сводки зависят от объектов: напрямую по user_id или через платформу и счет.
+    None - изменены общие данные (история портфелей, кэш цен) или владельца определить не удалось.
+    """
+    user_ids, platform_ids, account_ids = set(), set(), set()
+    for obj in objects:
+        if isinstance(obj, _SHARED_INPUT_MODELS):
+            return None
+        owners = _attribute_values(obj, 'user_id') if not isinstance(obj, InvestmentAsset) else set()
+        if owners:
+            user_ids |= owners
+        elif isinstance(obj, (InvestmentAsset, Transaction)) and _attribute_values(obj, 'platform_id'):
+            platform_ids |= _attribute_values(obj, 'platform_id')
+        elif isinstance(obj, BankingTransaction) and _attribute_values(obj, 'account_id'):
+            account_ids |= _attribute_values(obj, 'account_id')
+        else:
+            return None
+
+    connection = session.connection()
+    for model, ids in ((InvestmentPlatform, platform_ids), (Account, account_ids)):
+        if ids:
+            table = model.__table__
+            owners = set(connection.execute(select(table.c.user_id).where(table.c.id.in_(ids))).scalars())
+            if None in owners:
+                return None
+            user_ids |= owners
+    return user_ids
+
+
+@event.listens_for(Session, 'after_flush')
+def _mark_dashboards_stale_on_change(session, flush_context):
+    """Помечает устаревшими сводки пользователей, чьи входные данные изменил flush (один раз за транзакцию)."""
+    if session.info.get('dashboard_marked_stale'):
+        return
+    changed = [obj for obj in itertools.chain(session.new, session.dirty, session.deleted)
+               if isinstance(obj, _DASHBOARD_INPUT_MODELS)]
+    if not changed:
+        return
+    user_ids = _owner_ids(session, changed)
+    table = DashboardSnapshot.__table__
+    statement = update(table).where(table.c.is_stale == False)  # noqa: E712
+    if user_ids is None:
+        session.connection().execute(statement.values(is_stale=True))
+        session.info['dashboard_marked_stale'] = True
+        return
+    marked = session.info.setdefault('dashboard_stale_users', set())
+    user_ids -= marked
+    if user_ids:
+        session.connection().execute(statement.where(table.c.user_id.in_(user_ids)).values(is_stale=True))
+        marked |= user_ids
+
+
+@event.listens_for(Session, 'after_commit')
+@event.listens_for(Session, 'after_rollback')
+def _reset_dashboard_stale_flag(session):
+    session.info.pop('dashboard_marked_stale', None)
+    session.info.pop('dashboard_stale_users', None)
@@ -0,0 +1,329 @@
+"""
+Двухуровневый кэш поверх таблицы JsonCache.
+
+1. Внутрипроцессный LRU хранит уже разобранные данные вместе с номером версии записи.
+   Пока версия в БД не изменилась, чтение сводится к выборке (version, last_updated)
+   без передачи json_data и без json.loads.
+2. Таблица JsonCache - общее хранилище для всех воркеров. Крупные данные сжимаются zlib.
+
+get_or_refresh реализует stale-while-revalidate: устаревшие данные отдаются сразу,
+а обновление выполняется в фоне. Обновлять ключ одновременно может только один поток
+во всех воркерах - "аренда" захватывается атомарным UPDATE колонки refresh_started_at.
+Аренда и сами данные пишутся в отдельных транзакциях (db.engine.begin()), не затрагивая
+сессию вызывающего кода: ее незавершенные изменения не коммитятся и не откатываются.
+
+Возвращаемые данные разделяются между запросами, изменять их нельзя.
+"""
+import base64
+import json
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timezone, timedelta
+
+from flask import current_app
+from sqlalchemy import or_, select, update
+
+from extensions import db
+from models import JsonCache
+
+DEFAULT_LRU_SIZE = 64
+DEFAULT_COMPRESS_MIN_BYTES = 4096
+DEFAULT_REFRESH_LEASE_SECONDS = 300
+
+_MISSING = object()
+# Результат refresh_func: источник не изменился, данные в кэше остаются, обновляется только last_updated
+NOT_MODIFIED = object()
+
+
+class _LruTier:
+    """Потокобезопасный LRU: ключ -> (версия, last_updated, данные)."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, version: int):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or item[0] != version:
+                return None
+            self._items.move_to_end(key)
+            return item
+
+    def put(self, key: str, version: int, last_updated, data):
+        with self._lock:
+            current = self._items.get(key)
+            if current is not None and current[0] > version:
+                return  # Не затираем более свежую версию, записанную другим потоком
+            self._items[key] = (version, last_updated, data)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+_lru_tier = None
+_lru_tier_lock = threading.Lock()
+# Ключи, которые обновляются в этом процессе прямо сейчас
+_inflight = set()
+_inflight_lock = threading.Lock()
+
+
+def _get_lru() -> _LruTier:
+    global _lru_tier
+    if _lru_tier is None:
+        with _lru_tier_lock:
+            if _lru_tier is None:
+                _lru_tier = _LruTier(current_app.config.get('JSON_CACHE_LRU_SIZE', DEFAULT_LRU_SIZE))
+    return _lru_tier
+
+
+def clear_local_cache():
+    """Очищает LRU процесса; данные в таблице JsonCache не затрагиваются."""
+    _get_lru().clear()
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _as_aware(dt: datetime | None) -> datetime | None:
+    # SQLite возвращает "наивное" время, считаем его UTC
+    if dt is not None and dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt
+
+
+def _encode(raw: str, compress: bool | None) -> tuple[str, bool]:
+    if compress is None:
+        min_bytes = current_app.config.get('JSON_CACHE_COMPRESS_MIN_BYTES', DEFAULT_COMPRESS_MIN_BYTES)
+        compress = min_bytes is not None and len(raw) >= min_bytes
+    if not compress:
+        return raw, False
+    return base64.b64encode(zlib.compress(raw.encode('utf-8'), 6)).decode('ascii'), True
+
+
+def _decode(text: str, is_compressed: bool):
+    if is_compressed:
+        text = zlib.decompress(base64.b64decode(text)).decode('utf-8')
+    return json.loads(text)
+
+
+def get_cached(cache_key: str, default=None):
+    """
+    Возвращает (data, last_updated) для ключа или (default, None), если данных нет.
+    При совпадении версии данные берутся из LRU без чтения json_data.
+    """
+    # Чтение кэша не дописывает изменения сессии вызывающего кода: на SQLite flush занял бы
+    # блокировку записи, и аренда и запись кэша в отдельной транзакции ждали бы ее до таймаута
+    with db.session.no_autoflush:
+        return _read_cached(cache_key, default)
+
+
+def _read_cached(cache_key: str, default):
+    row = db.session.query(JsonCache.version, JsonCache.last_updated).filter_by(cache_key=cache_key).first()
+    if not row or not row.version:
+        return default, None
+
+    lru = _get_lru()
+    item = lru.get(cache_key, row.version)
+    if item is not None:
+        # last_updated берется из БД: его продлевают ответы NOT_MODIFIED без смены версии
+        return item[2], row.last_updated
+
+    entry = db.session.query(JsonCache.version, JsonCache.last_updated, JsonCache.json_data, JsonCache.is_compressed).filter_by(cache_key=cache_key).first()
+    if not entry or not entry.version or not entry.json_data:
+        return default, None
+    try:
+        data = _decode(entry.json_data, entry.is_compressed)
+    except (ValueError, zlib.error) as e:
+        current_app.logger.error(f"--- [JsonCache] Не удалось разобрать кэш '{cache_key}': {e}")
+        return default, None
+    lru.put(cache_key, entry.version, entry.last_updated, data)
+    return data, entry.last_updated
+
+
+def _dialect_insert():
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+def set_cached(cache_key: str, data, compress: bool | None = None):
+    """
+    Сохраняет данные в JsonCache, увеличивает версию и снимает аренду обновления.
+    Запись выполняется в отдельной транзакции: незавершенные изменения сессии вызывающего кода
+    не коммитятся и не откатываются.
+    Возвращает данные в том виде, в каком их увидят читатели (после JSON-сериализации).
+    """
+    raw = json.dumps(data, default=str)
+    text, is_compressed = _encode(raw, compress)
+    now = _utcnow()
+    table = JsonCache.__table__
+    statement = _dialect_insert()(table).values(
+        cache_key=cache_key, json_data=text, is_compressed=is_compressed, version=1, last_updated=now, refresh_started_at=None
+    )
+    with db.engine.begin() as connection:
+        # Конкурентная вставка того же ключа другим воркером превращается в обновление
+        connection.execute(statement.on_conflict_do_update(index_elements=['cache_key'], set_={
+            'json_data': statement.excluded.json_data,
+            'is_compressed': statement.excluded.is_compressed,
+            'version': table.c.version + 1,
+            'last_updated': statement.excluded.last_updated,
+            'refresh_started_at': None,
+        }))
+        version = connection.execute(select(table.c.version).where(table.c.cache_key == cache_key)).scalar()
+
+    normalized = json.loads(raw)
+    _get_lru().put(cache_key, version, now, normalized)
+    return normalized
+
+
+def _release_inflight(cache_key: str):
+    with _inflight_lock:
+        _inflight.discard(cache_key)
+
+
+def _try_acquire_refresh(cache_key: str) -> bool:
+    """
+    Захватывает право обновить ключ: одно на процесс (через _inflight) и одно на все воркеры (через БД).
+    Аренда пишется в отдельной транзакции, чтобы не закоммитить незавершенные изменения сессии запроса.
+    """
+    with _inflight_lock:
+        if cache_key in _inflight:
+            return False
+        _inflight.add(cache_key)
+
+    lease_seconds = current_app.config.get('JSON_CACHE_REFRESH_LEASE_SECONDS', DEFAULT_REFRESH_LEASE_SECONDS)
+    now = _utcnow()
+    table = JsonCache.__table__
+    acquired = False
+    try:
+        with db.engine.begin() as connection:
+            result = connection.execute(
+                update(table)
+                .where(
+                    table.c.cache_key == cache_key,
+                    or_(table.c.refresh_started_at.is_(None), table.c.refresh_started_at < now - timedelta(seconds=lease_seconds))
+                )
+                # last_updated передаем явно, чтобы onupdate не сделал запись "свежей"
+                .values(refresh_started_at=now, last_updated=table.c.last_updated)
+            )
+            acquired = result.rowcount == 1
+            if not acquired:
+                # Записи еще нет: создаем пустую заглушку (version=0), она и будет арендой
+                result = connection.execute(_dialect_insert()(table).values(
+                    cache_key=cache_key, json_data='', version=0, is_compressed=False, refresh_started_at=now
+                ).on_conflict_do_nothing(index_elements=['cache_key']))
+                acquired = result.rowcount == 1
+    except Exception as e:
+        current_app.logger.error(f"--- [JsonCache] Ошибка при захвате обновления '{cache_key}': {e}")
+        acquired = False
+
+    if not acquired:
+        _release_inflight(cache_key)
+    return acquired
+
+
+def _end_lease(cache_key: str, last_updated):
+    """Снимает аренду обновления в отдельной транзакции; last_updated=None оставляет срок жизни записи прежним."""
+    table = JsonCache.__table__
+    with db.engine.begin() as connection:
+        connection.execute(
+            update(table)
+            .where(table.c.cache_key == cache_key)
+            .values(refresh_started_at=None, last_updated=table.c.last_updated if last_updated is None else last_updated)
+        )
+
+
+def _release_refresh(cache_key: str):
+    try:
+        _end_lease(cache_key, None)
+    except Exception as e:
+        current_app.logger.error(f"--- [JsonCache] Не удалось снять аренду обновления '{cache_key}': {e}")
+
+
+def _mark_fresh(cache_key: str):
+    """Продлевает свежесть записи и снимает аренду, не меняя данные и версию."""
+    _end_lease(cache_key, _utcnow())
+
+
+def _run_refresh(cache_key: str, refresh_func, default):
+    """
+    Выполняет refresh_func под захваченной арендой. Пустой результат в кэш не пишется,
+    результат NOT_MODIFIED только продлевает срок жизни уже сохраненных данных.
+    Запись в кэш и снятие аренды идут отдельными транзакциями, сессия вызывающего кода не затрагивается.
+    """
+    try:
+        fresh = refresh_func()
+        if fresh is NOT_MODIFIED:
+            data, _ = get_cached(cache_key, default=_MISSING)
+            if data is _MISSING:
+                _release_refresh(cache_key)
+                return default
+            _mark_fresh(cache_key)
+            return data
+        if not fresh:
+            _release_refresh(cache_key)
+            return default
+        return set_cached(cache_key, fresh)
+    except Exception as e:
+        current_app.logger.error(f"--- [JsonCache] Ошибка при обновлении '{cache_key}': {e}", exc_info=True)
+        _release_refresh(cache_key)
+        return default
+    finally:
+        _release_inflight(cache_key)
+
+
+def _start_background_refresh(cache_key: str, refresh_func):
+    app = current_app._get_current_object()
+
+    def worker():
+        with app.app_context():
+            _run_refresh(cache_key, refresh_func, None)
+
+    threading.Thread(target=worker, name=f"json-cache-refresh-{cache_key}", daemon=True).start()
+
+
+def get_or_refresh(cache_key: str, refresh_func, ttl: timedelta, default=None, force: bool = False, wait_seconds: float = 10.0):
+    """
+    Возвращает данные из кэша, обновляя их через refresh_func() по правилам stale-while-revalidate.
+
+    - данные свежие: возвращаются сразу;
+    - данные устарели: возвращаются сразу, обновление запускается в фоновом потоке;
+    - данных нет: обновление выполняется синхронно; если его уже выполняет другой поток
+      или воркер, ждем результат не дольше wait_seconds;
+    - force=True: синхронное обновление (для фоновых задач), если ключ не обновляет кто-то другой.
+    """
+    data, last_updated = get_cached(cache_key, default=_MISSING)
+
+    if data is not _MISSING and not force:
+        last_updated = _as_aware(last_updated)
+        if last_updated and _utcnow() - last_updated < ttl:
+            return data
+        if _try_acquire_refresh(cache_key):
+            current_app.logger.info(f"--- [JsonCache] Ключ '{cache_key}' устарел, обновление в фоне.")
+            _start_background_refresh(cache_key, refresh_func)
+        return data
+
+    fallback = default if data is _MISSING else data
+    if _try_acquire_refresh(cache_key):
+        return _run_refresh(cache_key, refresh_func, fallback)
+    if data is not _MISSING:
+        return data
+
+    deadline = time.monotonic() + wait_seconds
+    while time.monotonic() < deadline:
+        time.sleep(0.25)
+        data, _ = get_cached(cache_key, default=_MISSING)
+        if data is not _MISSING:
+            return data
+    return default
@@ -0,0 +1,165 @@
+"""
+Бенчмарк цепочки ценных бумаг MOEX на эмуляторе ISS (services/moex_iss_emulator.py).
+
+Для каждого размера портфеля создается отдельная временная база SQLite с пользователем,
+брокером и покупками всех инструментов эмулятора, после чего по очереди выполняются
+операции цепочки: сопоставление ISIN (до и после загрузки справочника), цены из снимков
+досок, исторические цены, маршруты синхронизации цен и расчета активов брокера и пересчет
+истории портфеля. Для каждой операции измеряются время и количество запросов к ISS.
+
+Паузы между запросами к ISS (iss_pause) с эмулятором не выполняются, поэтому время
+показывает собственные затраты приложения, а число запросов - нагрузку на настоящий ISS.
+"""
+import contextlib
+import io
+import os
+import tempfile
+import time
+from collections import namedtuple
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+
+from flask import Flask, current_app
+from flask_login import login_user
+from sqlalchemy import insert
+
+from extensions import db, login_manager
+from models import InvestmentAsset, InvestmentPlatform, Transaction, User
+from services.json_cache import clear_local_cache
+from services.moex_iss import use_iss_adapter
+from services.moex_iss_emulator import MoexIssEmulator, generate_instruments
+
+DEFAULT_SIZES = (10, 100, 1000)
+DEFAULT_HISTORY_DAYS = 90
+
+BenchmarkResult = namedtuple('BenchmarkResult', ['size', 'operation', 'seconds', 'requests', 'result'])
+
+
+def _benchmark_app(database_uri: str) -> Flask:
+    """Приложение с настройками текущего, но со своей базой и без планировщика."""
+    from securities_logic import securities_bp
+
+    app = Flask('app', root_path=current_app.root_path)
+    app.config.update(current_app.config)
+    app.config.update({
+        'SQLALCHEMY_DATABASE_URI': database_uri,
+        'JOBS': [],
+        # Снимки досок не должны устаревать посреди замера, иначе их обновление уйдет в фоновый поток
+        'MOEX_SNAPSHOT_TTL_SECONDS': 24 * 3600,
+        'MOEX_SNAPSHOT_CLOSED_TTL_SECONDS': 24 * 3600,
+    })
+    db.init_app(app)
+    login_manager.init_app(app)
+    app.register_blueprint(securities_bp)
+    return app
+
+
+def _seed_portfolio(instruments: list, history_days: int) -> tuple[User, InvestmentPlatform]:
+    """Пользователь, брокер и по одной покупке каждого инструмента в пределах history_days дней."""
+    user = User(username='moex_benchmark')
+    db.session.add(user)
+    db.session.flush()
+    platform = InvestmentPlatform(name='MOEX Benchmark', platform_type='stock_broker', user_id=user.id)
+    db.session.add(platform)
+    db.session.commit()
+
+    first_day = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=history_days)
+    db.session.execute(insert(Transaction), [{
+        'exchange_tx_id': f'moex-benchmark-{number}',
+        'timestamp': first_day + timedelta(days=number % history_days),
+        'type': 'buy',
+        'asset1_ticker': instrument.isin,
+        'asset1_amount': Decimal(10),
+        'asset2_ticker': 'RUB',
+        'asset2_amount': Decimal(str(instrument.price)) * 10,
+        'platform_id': platform.id,
+        'user_id': user.id,
+    } for number, instrument in enumerate(instruments)])
+    db.session.commit()
+    return user, platform
+
+
+def _priced_assets(platform_id: int) -> str:
+    total = InvestmentAsset.query.filter_by(platform_id=platform_id).count()
+    priced = InvestmentAsset.query.filter(InvestmentAsset.platform_id == platform_id, InvestmentAsset.current_price > 0).count()
+    return f'активов {total}, с ценой {priced}'
+
+
+def _operations(app: Flask, user: User, platform: InvestmentPlatform, isins: list[str]) -> list[tuple]:
+    """(название, функция без аргументов, возвращающая краткий итог) в порядке выполнения."""
+    from analytics_logic import refresh_securities_portfolio_history
+    from securities_logic import fetch_moex_historical_prices, fetch_moex_securities_metadata, fetch_moex_securities_prices
+    from services.moex_securities import refresh_moex_securities
+
+    client = app.test_client()
+    metadata = {}
+
+    def resolve():
+        metadata.clear()
+        metadata.update(fetch_moex_securities_metadata(isins))
+        return f'найдено {len(metadata)}'
+
+    def prices():
+        return f'цен {len(fetch_moex_securities_prices(metadata))}'
+
+    def post(endpoint):
+        def run():
+            response = client.post(f'/securities/brokers/{platform.id}/{endpoint}')
+            return f'HTTP {response.status_code}, {_priced_assets(platform.id)}'
+        return run
+
+    def portfolio_history():
+        with app.test_request_context():
+            login_user(user)
+            return refresh_securities_portfolio_history()[1]
+
+    return [
+        ('fetch_moex_securities_metadata (пустой справочник)', resolve),
+        ('refresh_moex_securities', lambda: refresh_moex_securities()[1]),
+        ('fetch_moex_securities_metadata (справочник)', resolve),
+        ('fetch_moex_securities_prices (холодные снимки)', prices),
+        ('fetch_moex_securities_prices (снимки в кэше)', prices),
+        ('fetch_moex_historical_prices', lambda: f'цен {len(fetch_moex_historical_prices(isins, date.today() - timedelta(days=1)))}'),
+        ('ui_calculate_broker_assets_from_transactions', post('calculate_assets')),
+        ('ui_sync_broker_prices', post('sync_prices')),
+        ('refresh_securities_portfolio_history', portfolio_history),
+    ]
+
+
+def _run_size(size: int, history_days: int, recordings: dict | None, verbose: bool):
+    """Генератор результатов операций для портфеля из size инструментов."""
+    instruments = generate_instruments(size)
+    emulator = MoexIssEmulator(instruments, recordings=recordings)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        app = _benchmark_app('sqlite:///' + os.path.join(tmp_dir, 'moex_benchmark.db'))
+        with app.app_context(), use_iss_adapter(emulator):
+            db.create_all()
+            # LRU процесса хранит данные по номеру версии записи, а версии в новой базе начинаются заново
+            clear_local_cache()
+            user, platform = _seed_portfolio(instruments, history_days)
+            for name, func in _operations(app, user, platform, [instrument.isin for instrument in instruments]):
+                requests_before = emulator.total_requests()
+                started = time.perf_counter()
+                try:
+                    # Функции цепочки подробно пишут ход работы через print
+                    with contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO()):
+                        outcome = func()
+                except Exception as e:
+                    db.session.rollback()
+                    outcome = f'ошибка: {e}'
+                yield BenchmarkResult(size, name, time.perf_counter() - started, emulator.total_requests() - requests_before, outcome)
+            db.session.remove()
+            db.engine.dispose()
+        clear_local_cache()
+
+
+def run_securities_benchmark(sizes=DEFAULT_SIZES, history_days: int = DEFAULT_HISTORY_DAYS, recordings: dict | None = None,
+                             verbose: bool = False, on_result=None) -> list[BenchmarkResult]:
+    """Выполняет бенчмарк для портфелей из sizes инструментов. on_result(result) вызывается после каждой операции."""
+    results = []
+    for size in sizes:
+        for result in _run_size(size, history_days, recordings, verbose):
+            results.append(result)
+            if on_result:
+                on_result(result)
+    return results
@@ -0,0 +1,45 @@
+"""
+Общие HTTP-сессии для запросов к MOEX ISS.
+
+Все функции, обращающиеся к iss.moex.com (fetch_moex_*, справочник и снимки досок),
+создают сессии через iss_session(). Это позволяет подменить транспорт целиком - например,
+эмулятором ISS (services/moex_iss_emulator.py) для бенчмарка без доступа к сети.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+
+ISS_BASE_URL = 'https://iss.moex.com/'
+
+_adapter = None
+_adapter_lock = threading.Lock()
+
+
+def iss_session() -> requests.Session:
+    """Новая сессия для запросов к ISS; при подключенном адаптере запросы уходят в него."""
+    session = requests.Session()
+    if _adapter is not None:
+        session.mount(ISS_BASE_URL, _adapter)
+    return session
+
+
+def iss_pause(seconds: float):
+    """Пауза между запросами к ISS. Нужна только настоящему ISS, с подключенным адаптером не выполняется."""
+    if _adapter is None:
+        time.sleep(seconds)
+
+
+@contextmanager
+def use_iss_adapter(adapter):
+    """Направляет все запросы к ISS в transport-адаптер requests на время блока with."""
+    global _adapter
+    with _adapter_lock:
+        if _adapter is not None:
+            raise RuntimeError("Адаптер ISS уже подключен.")
+        _adapter = adapter
+    try:
+        yield adapter
+    finally:
+        _adapter = None
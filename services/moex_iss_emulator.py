@@ -0,0 +1,196 @@
+"""
+Эмулятор MOEX ISS для бенчмарков и проверок без доступа к iss.moex.com.
+
+MoexIssEmulator - transport-адаптер requests, который подключается через
+services.moex_iss.use_iss_adapter и отвечает на запросы в формате ISS (iss.json=extended):
+
+- /iss/securities.json - поиск (q=...) и постраничный список инструментов рынка;
+- /iss/engines/[engine]/markets/[market]/boards/[board]/securities.json - таблицы securities и marketdata доски;
+- /iss/history/engines/[engine]/markets/[market]/securities/[secid].json - история с history.cursor.
+
+Данные берутся из записанных ответов (load_recordings: файл {путь: ответ ISS}), а для остальных
+путей строятся по детерминированному набору инструментов generate_instruments. Адаптер считает
+запросы по видам, чтобы бенчмарк мог показать их количество для каждой операции.
+"""
+import json
+import math
+import re
+import threading
+from collections import Counter, namedtuple
+from datetime import date, datetime, timedelta
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+from requests.adapters import BaseAdapter
+
+PAGE_SIZE = 100
+
+Instrument = namedtuple('Instrument', ['secid', 'isin', 'name', 'group', 'engine', 'market', 'board', 'price', 'face_value'])
+
+# (группа ISS, рынок, доска) для каждого из десяти инструментов подряд: 60% акций, 30% облигаций, 10% фондов
+_SHARE, _CORPORATE_BOND, _OFZ, _ETF = (('stock_shares', 'shares', 'TQBR'), ('stock_bonds', 'bonds', 'TQCB'),
+                                      ('stock_bonds', 'bonds', 'TQOB'), ('stock_etf', 'shares', 'TQTF'))
+_INSTRUMENT_KINDS = (_SHARE,) * 6 + (_CORPORATE_BOND,) * 2 + (_OFZ, _ETF)
+INDICES = {'IMOEX': 2850.0, 'RTSI': 1050.0}
+
+_BOARD_PATH_RE = re.compile(r'^/iss/engines/(\w+)/markets/(\w+)/boards/(\w+)/securities\.json$')
+_HISTORY_PATH_RE = re.compile(r'^/iss/history/engines/(\w+)/markets/(\w+)/securities/([^/]+)\.json$')
+
+
+def generate_instruments(count: int) -> list[Instrument]:
+    """Детерминированный набор из count инструментов: акции, облигации и фонды в пропорциях _INSTRUMENT_KINDS."""
+    instruments = []
+    for number in range(1, count + 1):
+        group, market, board = _INSTRUMENT_KINDS[(number - 1) % len(_INSTRUMENT_KINDS)]
+        is_bond = market == 'bonds'
+        instruments.append(Instrument(
+            secid=f'SU{number:05d}RMFS' if is_bond else f'EM{number:04d}',
+            isin=f'RU000E{number:05d}0',
+            name=f'Эмулятор {board} {number}',
+            group=group, engine='stock', market=market, board=board,
+            price=float(90 + (number * 37) % 15) if is_bond else round(50 + (number * 7919) % 5000 / 10, 2),
+            face_value=1000 if is_bond else None,
+        ))
+    return instruments
+
+
+def load_recordings(file_path: str) -> dict:
+    """Записанные ответы ISS: JSON-объект {путь запроса: ответ в формате iss.json=extended}."""
+    with open(file_path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _select_columns(rows: list[dict], columns: str | None) -> list[dict]:
+    if not columns:
+        return rows
+    wanted = {column.lower() for column in columns.split(',')}
+    return [{key: value for key, value in row.items() if key.lower() in wanted} for row in rows]
+
+
+def _trading_days(start: date, end: date) -> list[date]:
+    return [start + timedelta(days=i) for i in range((end - start).days + 1) if (start + timedelta(days=i)).weekday() < 5]
+
+
+def _close_price(instrument: Instrument, trade_date: date) -> float:
+    """Цена закрытия: плавные колебания вокруг базовой цены, разные у разных инструментов."""
+    phase = int(instrument.isin[6:11])
+    return round(instrument.price * (1 + 0.05 * math.sin(trade_date.toordinal() / 9 + phase)), 2)
+
+
+class MoexIssEmulator(BaseAdapter):
+    """Transport-адаптер requests, отвечающий на запросы к ISS без обращения к сети."""
+
+    def __init__(self, instruments: list[Instrument], recordings: dict | None = None, today: date | None = None):
+        super().__init__()
+        self.instruments = list(instruments)
+        self.recordings = recordings or {}
+        self.today = today or date.today()
+        self.by_secid = {instrument.secid: instrument for instrument in self.instruments}
+        self.request_counts = Counter()
+        self._lock = threading.Lock()
+
+    def total_requests(self) -> int:
+        with self._lock:
+            return sum(self.request_counts.values())
+
+    def send(self, request, **kwargs):
+        url = urlsplit(request.url)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        if url.path in self.recordings:
+            kind, payload = 'recorded', self._recorded(url.path, params)
+        elif url.path == '/iss/securities.json':
+            kind, payload = 'securities', self._securities(params)
+        elif _BOARD_PATH_RE.match(url.path):
+            kind, payload = 'board', self._board(*_BOARD_PATH_RE.match(url.path).groups(), params)
+        elif _HISTORY_PATH_RE.match(url.path):
+            kind, payload = 'history', self._history(*_HISTORY_PATH_RE.match(url.path).groups(), params)
+        else:
+            kind, payload = 'unknown', None
+        with self._lock:
+            self.request_counts[kind] += 1
+        return self._response(request, payload)
+
+    def close(self):
+        pass
+
+    def _response(self, request, payload) -> requests.Response:
+        response = requests.Response()
+        response.request = request
+        response.url = request.url
+        response.status_code = 404 if payload is None else 200
+        response.headers['Content-Type'] = 'application/json; charset=utf-8'
+        response.encoding = 'utf-8'
+        response._content = json.dumps(payload if payload is not None else {'error': 'not found'}, ensure_ascii=False).encode('utf-8')
+        return response
+
+    @staticmethod
+    def _wrap(tables: dict) -> list:
+        return [{'charsetinfo': {'name': 'utf-8'}}, tables]
+
+    def _recorded(self, path: str, params: dict) -> list:
+        """Записанный ответ целиком; следующая страница (start > 0) пуста, курсор истории пересчитывается."""
+        _, tables = self.recordings[path]
+        start = int(params.get('start', 0))
+        tables = {name: rows[start:] for name, rows in tables.items() if name != 'history.cursor'}
+        if 'history' in tables:
+            total = start + len(tables['history'])
+            tables['history.cursor'] = [{'INDEX': start, 'TOTAL': total, 'PAGESIZE': max(total - start, 1)}]
+        return self._wrap(tables)
+
+    def _security_row(self, instrument: Instrument) -> dict:
+        return {
+            'secid': instrument.secid, 'shortname': instrument.name[:20], 'regnumber': None, 'name': instrument.name,
+            'isin': instrument.isin, 'is_traded': 1, 'emitent_id': None, 'type': instrument.group.split('_')[1],
+            'group': instrument.group, 'primary_boardid': instrument.board, 'marketprice_boardid': instrument.board,
+        }
+
+    def _securities(self, params: dict) -> list:
+        if params.get('q'):
+            query = params['q'].upper()
+            matches = [i for i in self.instruments if query in (i.secid, i.isin)] or \
+                      [i for i in self.instruments if query in i.secid or query in i.name.upper()]
+            rows = [self._security_row(i) for i in matches[:PAGE_SIZE]]
+        else:
+            instruments = [i for i in self.instruments
+                           if params.get('engine', i.engine) == i.engine and params.get('market', i.market) == i.market]
+            start = int(params.get('start', 0))
+            limit = min(int(params.get('limit', PAGE_SIZE)), PAGE_SIZE)
+            rows = [self._security_row(i) for i in instruments[start:start + limit]]
+        return self._wrap({'securities': _select_columns(rows, params.get('securities.columns'))})
+
+    def _board(self, engine: str, market: str, board: str, params: dict) -> list:
+        if market == 'index':
+            securities = [{'SECID': secid, 'BOARDID': board, 'NAME': secid} for secid in INDICES]
+            marketdata = [{'SECID': secid, 'BOARDID': board, 'CURRENTVALUE': value, 'LASTTOPREVPRICE': 0.42}
+                          for secid, value in INDICES.items()]
+        else:
+            instruments = [i for i in self.instruments if i.engine == engine and i.market == market and i.board == board]
+            securities, marketdata = [], []
+            for instrument in instruments:
+                row = {'SECID': instrument.secid, 'BOARDID': board, 'SHORTNAME': instrument.name[:20], 'LOTSIZE': 1, 'CURRENCYID': 'SUR'}
+                if instrument.face_value:
+                    row.update({'FACEVALUE': instrument.face_value, 'ACCRUEDINT': 12.5})
+                securities.append(row)
+                price = _close_price(instrument, self.today)
+                marketdata.append({
+                    'SECID': instrument.secid, 'BOARDID': board, 'LAST': price, 'MARKETPRICE': price, 'MARKETPRICE2': None,
+                    'LCLOSE': price, 'PREVADMITTEDQUOTE': None, 'PREVPRICE': price, 'LASTTOPREVPRICE': 0.42,
+                    'UPDATETIME': '18:39:59',
+                })
+        only = (params.get('iss.only') or 'securities,marketdata').split(',')
+        tables = {'securities': securities, 'marketdata': marketdata}
+        return self._wrap({name: _select_columns(rows, params.get(f'{name}.columns')) for name, rows in tables.items() if name in only})
+
+    def _history(self, engine: str, market: str, secid: str, params: dict) -> list:
+        instrument = self.by_secid.get(secid)
+        rows = []
+        if instrument and instrument.engine == engine and instrument.market == market:
+            start_date = datetime.strptime(params['from'], '%Y-%m-%d').date() if params.get('from') else self.today - timedelta(days=365)
+            end_date = min(datetime.strptime(params['till'], '%Y-%m-%d').date() if params.get('till') else self.today, self.today)
+            rows = [{'BOARDID': instrument.board, 'TRADEDATE': day.isoformat(), 'CLOSE': _close_price(instrument, day), 'VOLUME': 1000, 'VALUE': 100000.0}
+                    for day in _trading_days(start_date, end_date)]
+        start = int(params.get('start', 0))
+        return self._wrap({
+            'history': _select_columns(rows[start:start + PAGE_SIZE], params.get('history.columns')),
+            'history.cursor': [{'INDEX': start, 'TOTAL': len(rows), 'PAGESIZE': PAGE_SIZE}],
+        })
@@ -0,0 +1,70 @@
+"""
+Снимки рыночных данных MOEX по режимам торгов (доскам), общие для всех пользователей.
+
+Раньше каждая синхронизация цен брокера запрашивала у ISS таблицы securities и
+marketdata каждой нужной доски, и при одинаковых бумагах у нескольких пользователей одни
+и те же данные скачивались повторно. Теперь таблицы доски целиком загружаются одним
+запросом (/iss/engines/[engine]/markets/[market]/boards/[board]/securities.json) и
+хранятся в JsonCache (LRU процесса + таблица, общая для воркеров), а все запросы цен
+отвечаются из снимка.
+
+Срок жизни снимка зависит от времени: во время торгов - MOEX_SNAPSHOT_TTL_SECONDS,
+вне торгов - MOEX_SNAPSHOT_CLOSED_TTL_SECONDS. Устаревший снимок отдается сразу и
+обновляется в фоне (services.json_cache.get_or_refresh).
+"""
+from datetime import datetime, time, timedelta, timezone
+
+from apimoex import client as iss_client
+from flask import current_app
+
+from services.json_cache import get_or_refresh
+from services.moex_iss import iss_session
+
+BOARD_SECURITIES_URL = 'https://iss.moex.com/iss/engines/{engine}/markets/{market}/boards/{board}/securities.json'
+DEFAULT_TTL_SECONDS = 60
+DEFAULT_CLOSED_TTL_SECONDS = 1800
+# Время Москвы без перехода на летнее время
+MOSCOW_TZ = timezone(timedelta(hours=3))
+# Утренняя, основная и вечерняя сессии фондового рынка по будним дням
+TRADING_HOURS = (time(6, 50), time(23, 50))
+
+# Набор колонок общий для всех досок: ISS пропускает колонки, которых нет в таблице доски
+SECURITIES_COLUMNS = ('SECID', 'SHORTNAME', 'FACEVALUE', 'ACCRUEDINT', 'LOTSIZE', 'CURRENCYID')
+MARKETDATA_COLUMNS = ('SECID', 'LAST', 'MARKETPRICE', 'MARKETPRICE2', 'LCLOSE', 'PREVADMITTEDQUOTE', 'PREVPRICE',
+                      'ACCRUEDINT', 'LASTTOPREVPRICE', 'CURRENTVALUE', 'UPDATETIME')
+
+
+def is_trading_time(now: datetime | None = None) -> bool:
+    moscow_now = (now or datetime.now(timezone.utc)).astimezone(MOSCOW_TZ)
+    return moscow_now.weekday() < 5 and TRADING_HOURS[0] <= moscow_now.time() <= TRADING_HOURS[1]
+
+
+def snapshot_ttl(now: datetime | None = None) -> timedelta:
+    if is_trading_time(now):
+        return timedelta(seconds=current_app.config.get('MOEX_SNAPSHOT_TTL_SECONDS', DEFAULT_TTL_SECONDS))
+    return timedelta(seconds=current_app.config.get('MOEX_SNAPSHOT_CLOSED_TTL_SECONDS', DEFAULT_CLOSED_TTL_SECONDS))
+
+
+def _download_board(board: str, market: str, engine: str) -> dict:
+    """Таблицы securities и marketdata доски одним запросом к ISS: {'securities': {SECID: строка}, 'marketdata': {...}}."""
+    query = {
+        'iss.only': 'securities,marketdata',
+        'securities.columns': ','.join(SECURITIES_COLUMNS),
+        'marketdata.columns': ','.join(MARKETDATA_COLUMNS),
+    }
+    url = BOARD_SECURITIES_URL.format(engine=engine, market=market, board=board)
+    current_app.logger.info(f"--- [MOEX Snapshot] Загрузка снимка доски {engine}/{market}/{board}...")
+    with iss_session() as session:
+        data = iss_client.ISSClient(session, url, query).get()
+    return {table: {row['SECID']: row for row in data.get(table, [])} for table in ('securities', 'marketdata')}
+
+
+def get_board_snapshot(board: str, market: str = 'shares', engine: str = 'stock', force: bool = False) -> dict:
+    """
+    Снимок доски {'securities': {SECID: {...}}, 'marketdata': {SECID: {...}}}.
+    Если загрузить снимок не удалось, возвращаются пустые таблицы. Данные разделяются между запросами, изменять их нельзя.
+    """
+    cache_key = f'moex_board_{engine}_{market}_{board}'
+    empty = {'securities': {}, 'marketdata': {}}
+    snapshot = get_or_refresh(cache_key, lambda: _download_board(board, market, engine), ttl=snapshot_ttl(), default=empty, force=force)
+    return snapshot or empty
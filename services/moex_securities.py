@@ -0,0 +1,197 @@
+"""
+Локальный справочник инструментов MOEX (ISIN <-> SECID, название, группа, основной режим торгов).
+
+Раньше каждая синхронизация цен, расчет активов и обновление истории вызывали
+apimoex.find_securities отдельно для каждого ISIN. Теперь справочник MoexSecurity
+раз в сутки целиком загружается из ISS (/iss/securities.json постранично по рынкам
+MOEX_SECURITY_MARKETS) и обновляется пакетно, а все сопоставления ISIN -> SECID
+выполняются индексированным запросом к локальной таблице.
+
+Инструменты, которых еще нет в справочнике (например, размещенные после последней
+загрузки), ищутся в ISS по одному, как раньше, и сразу сохраняются в справочник.
+Исчезнувшие из выгрузки инструменты не удаляются: по ним может быть история цен.
+"""
+from datetime import datetime, timezone
+
+import requests
+from apimoex import client as iss_client
+from flask import current_app
+from sqlalchemy import insert, or_, update
+import apimoex
+
+from extensions import db
+from services.moex_iss import iss_session
+from models import MoexSecurity
+
+SECURITIES_URL = 'https://iss.moex.com/iss/securities.json'
+# (движок, рынок), инструменты которых загружаются в справочник
+MOEX_SECURITY_MARKETS = (('stock', 'shares'), ('stock', 'bonds'))
+_ISS_COLUMNS = ('secid', 'isin', 'shortname', 'name', 'group', 'primary_boardid', 'is_traded')
+_LOOKUP_CHUNK = 500
+_WRITE_CHUNK = 1000
+
+ASSET_TYPES = {
+    'stock_shares': 'stock',
+    'stock_bonds': 'bond',
+    'stock_etf': 'etf',
+    'stock_ppif': 'etf',
+}
+
+
+def _utcnow():
+    return datetime.now(timezone.utc)
+
+
+def _engine_market_from_group(group: str | None) -> tuple[str | None, str | None]:
+    """Движок и рынок по группе ISS ('stock_bonds' -> ('stock', 'bonds')); фонды торгуются на рынке акций."""
+    parts = (group or '').split('_')
+    if len(parts) != 2:
+        return None, None
+    engine, market = parts
+    if market in ('etf', 'ppif', 'dr'):
+        market = 'shares'
+    return engine, market
+
+
+def _security_values(row: dict, engine: str | None = None, market: str | None = None) -> dict:
+    if engine is None:
+        engine, market = _engine_market_from_group(row.get('group'))
+    return {
+        'secid': row['secid'],
+        'isin': row.get('isin') or None,
+        'shortname': (row.get('shortname') or '')[:128] or None,
+        'name': (row.get('name') or '')[:255] or None,
+        'security_group': row.get('group'),
+        'primary_boardid': row.get('primary_boardid'),
+        'engine': engine,
+        'market': market,
+        'asset_type': ASSET_TYPES.get(row.get('group'), 'other'),
+        'is_traded': bool(row.get('is_traded')),
+        'updated_at': _utcnow(),
+    }
+
+
+def download_securities_list(session: requests.Session, engine: str, market: str) -> list[dict]:
+    """Торгуемые инструменты рынка из ISS (постраничная загрузка /iss/securities.json по 100 записей)."""
+    query = {
+        'engine': engine,
+        'market': market,
+        'is_trading': 1,
+        'limit': 100,
+        'iss.only': 'securities',
+        'securities.columns': ','.join(_ISS_COLUMNS),
+    }
+    return iss_client.ISSClient(session, SECURITIES_URL, query).get_all()['securities']
+
+
+def _upsert_securities(rows: list[dict]) -> tuple[int, int]:
+    """Пакетно обновляет справочник по SECID. Возвращает (добавлено, обновлено)."""
+    existing = dict(db.session.query(MoexSecurity.secid, MoexSecurity.id))
+    created_count = updated_count = 0
+    for start in range(0, len(rows), _WRITE_CHUNK):
+        updates, inserts = [], []
+        for values in rows[start:start + _WRITE_CHUNK]:
+            security_id = existing.get(values['secid'])
+            if security_id is not None:
+                updates.append(dict(values, id=security_id))
+            else:
+                inserts.append(values)
+        if updates:
+            db.session.execute(update(MoexSecurity), updates)
+        if inserts:
+            db.session.execute(insert(MoexSecurity), inserts)
+        created_count += len(inserts)
+        updated_count += len(updates)
+    db.session.commit()
+    return created_count, updated_count
+
+
+def refresh_moex_securities() -> tuple[bool, str]:
+    """Загружает справочник инструментов MOEX целиком и обновляет таблицу MoexSecurity."""
+    by_secid = {}
+    with iss_session() as session:
+        for engine, market in MOEX_SECURITY_MARKETS:
+            try:
+                rows = download_securities_list(session, engine, market)
+            except Exception as e:
+                db.session.rollback()
+                return False, f"Ошибка загрузки справочника MOEX ({engine}/{market}): {e}"
+            current_app.logger.info(f"--- [MOEX Securities] {engine}/{market}: получено {len(rows)} инструментов.")
+            for row in rows:
+                if row.get('secid'):
+                    by_secid[row['secid']] = _security_values(row, engine, market)
+    if not by_secid:
+        return False, "Справочник MOEX пуст, таблица не изменена."
+    created_count, updated_count = _upsert_securities(list(by_secid.values()))
+    return True, f"Справочник MOEX обновлен: добавлено {created_count}, обновлено {updated_count} инструментов."
+
+
+def _security_meta(security: MoexSecurity) -> dict:
+    """Метаданные в формате fetch_moex_securities_metadata."""
+    return {
+        'ticker': security.secid,
+        'isin': security.isin,
+        'name': security.name or security.shortname,
+        'asset_type': security.asset_type,
+        'board': security.primary_boardid,
+        'group': security.security_group,
+        'engine': security.engine,
+        'market': security.market,
+    }
+
+
+def _find_local(identifiers: list[str]) -> dict[str, MoexSecurity]:
+    """Инструменты справочника по ISIN или SECID. Для ISIN с несколькими SECID предпочитается торгуемый."""
+    found = {}
+    wanted = set(identifiers)
+    for start in range(0, len(identifiers), _LOOKUP_CHUNK):
+        chunk = identifiers[start:start + _LOOKUP_CHUNK]
+        securities = MoexSecurity.query.filter(or_(MoexSecurity.isin.in_(chunk), MoexSecurity.secid.in_(chunk))).all()
+        for security in securities:
+            for key in (security.secid, security.isin):
+                if key in wanted and (key not in found or (security.is_traded and not found[key].is_traded)):
+                    found[key] = security
+    return found
+
+
+def _find_remote(identifiers: list[str]) -> dict[str, dict]:
+    """Поиск отсутствующих в справочнике инструментов в ISS по одному, как до появления справочника."""
+    rows = {}
+    with iss_session() as session:
+        for identifier in identifiers:
+            try:
+                data = apimoex.find_securities(session, identifier, columns=_ISS_COLUMNS)
+            except Exception as e:
+                current_app.logger.info(f"--- [MOEX Securities] Не удалось найти '{identifier}' на MOEX: {e}")
+                continue
+            # Предпочитаем точное совпадение кода, иначе берем первую, наиболее релевантную запись
+            query = identifier.upper()
+            match = next((row for row in data if query in (row.get('secid'), row.get('isin'))), data[0] if data else None)
+            if match and match.get('secid'):
+                rows[identifier] = match
+    return rows
+
+
+def resolve_moex_securities(identifiers: list[str]) -> dict[str, dict]:
+    """
+    Метаданные инструментов по списку ISIN или SECID из локального справочника.
+    Ключ результата - исходный идентификатор. Не найденные локально ищутся в ISS и добавляются в справочник.
+    """
+    identifiers = list(dict.fromkeys(identifier for identifier in identifiers if identifier))
+    if not identifiers:
+        return {}
+    found = _find_local(identifiers)
+    missing = [identifier for identifier in identifiers if identifier not in found]
+    if missing:
+        current_app.logger.info(f"--- [MOEX Securities] Нет в справочнике, поиск в ISS: {missing}")
+        remote_rows = _find_remote(missing)
+        if remote_rows:
+            _upsert_securities(list({row['secid']: _security_values(row) for row in remote_rows.values()}.values()))
+            by_secid = _find_local([row['secid'] for row in remote_rows.values()])
+            found.update({identifier: by_secid[row['secid']] for identifier, row in remote_rows.items() if row['secid'] in by_secid})
+    return {identifier: _security_meta(found[identifier]) for identifier in identifiers if identifier in found}
+
+
+def resolve_secids(isins: list[str]) -> dict[str, str]:
+    """Сопоставление ISIN -> SECID по справочнику."""
+    return {isin: meta['ticker'] for isin, meta in resolve_moex_securities(isins).items()}
@@ -0,0 +1,271 @@
+"""
+Нормализованное хранилище крипто-новостей CryptoCompare.
+
+Раньше фоновая задача запрашивала ленту отдельно для каждого из топ-10 тикеров и еще
+дважды для общей ленты, а каждый ответ кэшировался отдельным JSON в JsonCache. Одна и та же
+статья хранилась и переводилась столько раз, во сколько лент она попала.
+
+Теперь статья хранится один раз в news_article (ключ - MD5 ссылки) и связывается
+с тикерами и категориями через news_article_category: категории берутся из самой статьи
+(поле categories API) и из запроса, которым она была получена. Загрузка идет от новых
+к старым по курсору API (lTs) и останавливается на последней уже сохраненной статье,
+поэтому переводятся только новые статьи. Общая лента содержит статьи всех категорий,
+так что отдельные запросы по тикеру нужны только для дозагрузки редких тикеров.
+Страницы новостей читаются запросами по индексам published_at.
+"""
+import hashlib
+import threading
+import time
+from datetime import datetime, timezone
+
+from flask import current_app
+from sqlalchemy import update
+
+from api_clients import fetch_cryptocompare_news
+from extensions import db
+from logic.lexicon_sentiment_logic import score_articles
+from models import NewsArticle, NewsArticleCategory
+from services.conditional_fetch import FetchResult, remember
+from translation_logic import translate_texts
+
+PAGE_SIZE = 50
+DEFAULT_MAX_PAGES = 5
+DEFAULT_MIN_TICKER_ARTICLES = 30
+BOOTSTRAP_INTERVAL_SECONDS = 30 * 60
+_LOOKUP_CHUNK = 500
+_SCORE_CHUNK = 1000
+_CATEGORY_LENGTH = 64
+
+# Время последней синхронной загрузки пустой ленты по запросу страницы: {категории: time.monotonic()}
+_last_bootstrap = {}
+_bootstrap_lock = threading.Lock()
+
+
+def _url_hash(url: str) -> str:
+    return hashlib.md5(url.encode('utf-8')).hexdigest()
+
+
+def _parse_categories(categories: str | None) -> list[str]:
+    """'BTC,eth' -> ['BTC', 'ETH']. Разделитель ',' - у параметра запроса, '|' - у поля статьи."""
+    if not categories:
+        return []
+    names = categories.replace('|', ',').split(',')
+    return list(dict.fromkeys(name.strip().upper()[:_CATEGORY_LENGTH] for name in names if name.strip()))
+
+
+def _to_datetime(timestamp: int) -> datetime:
+    return datetime.fromtimestamp(int(timestamp), tz=timezone.utc).replace(tzinfo=None)
+
+
+def _to_timestamp(value: datetime | None) -> int | None:
+    return int(value.replace(tzinfo=timezone.utc).timestamp()) if value else None
+
+
+def _category_filter(query, categories: list[str]):
+    return query.filter(NewsArticleCategory.category.in_(categories))
+
+
+def _latest_timestamp(categories: list[str]) -> int | None:
+    """Курсор: время самой свежей сохраненной статьи ленты."""
+    if categories:
+        latest = _category_filter(db.session.query(db.func.max(NewsArticleCategory.published_at)), categories).scalar()
+    else:
+        latest = db.session.query(db.func.max(NewsArticle.published_at)).scalar()
+    return _to_timestamp(latest)
+
+
+def _oldest_timestamp(categories: list[str]) -> int | None:
+    oldest = _category_filter(db.session.query(db.func.min(NewsArticleCategory.published_at)), categories).scalar()
+    return _to_timestamp(oldest)
+
+
+def count_articles(categories: str | None = None) -> int:
+    names = _parse_categories(categories)
+    if not names:
+        return NewsArticle.query.count()
+    return _category_filter(db.session.query(db.func.count(db.distinct(NewsArticleCategory.article_id))), names).scalar()
+
+
+def _fetch_pages(categories: str | None, since_ts: int | None, before_ts: int | None,
+                 max_pages: int) -> tuple[list[dict], list[FetchResult]]:
+    """
+    Статьи ленты от новых к старым, страница за страницей по курсору lTs.
+    С since_ts загрузка останавливается на первой странице, дошедшей до уже сохраненных статей,
+    без since_ts загружается одна страница.
+    Возвращает статьи и ответы API, которые нужно запомнить (remember) после сохранения статей.
+    """
+    articles = []
+    results = []
+    for _ in range(max_pages):
+        # Первая страница с курсором запрашивается условно: неизмененный ответ означает, что новых статей нет
+        page, result = fetch_cryptocompare_news(limit=PAGE_SIZE, categories=categories, before_ts=before_ts,
+                                                if_changed=since_ts is not None and before_ts is None)
+        if result is not None:
+            results.append(result)
+        page = [article for article in page if article.get('url') and article.get('published_on')]
+        if not page:
+            break
+        articles.extend(article for article in page if since_ts is None or article['published_on'] > since_ts)
+        oldest = min(article['published_on'] for article in page)
+        if since_ts is None or oldest <= since_ts or len(page) < PAGE_SIZE or (before_ts and oldest >= before_ts):
+            break
+        before_ts = oldest
+    return articles, results
+
+
+def _existing_ids(hashes: list[str]) -> dict[str, int]:
+    found = {}
+    for start in range(0, len(hashes), _LOOKUP_CHUNK):
+        chunk = hashes[start:start + _LOOKUP_CHUNK]
+        found.update(db.session.query(NewsArticle.url_hash, NewsArticle.id).filter(NewsArticle.url_hash.in_(chunk)).all())
+    return found
+
+
+def _save(articles: dict[str, dict], requested_categories: list[str]) -> int:
+    """Сохраняет новые статьи (с переводом) и связи с категориями. Возвращает количество новых статей."""
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+
+    existing = _existing_ids(list(articles))
+    new_articles = {url_hash: article for url_hash, article in articles.items() if url_hash not in existing}
+    if new_articles:
+        # Заголовки и тексты только новых статей переводятся одним пакетом
+        raw = list(new_articles.values())
+        texts_ru = translate_texts([article.get('title', '') for article in raw] + [article.get('body', '') for article in raw])
+        # Тональность оценивается по оригинальному тексту всем пакетом
+        sentiments = score_articles([article.get('title') for article in raw], [article.get('body') for article in raw])
+        db.session.execute(insert(NewsArticle).on_conflict_do_nothing(index_elements=['url_hash']), [{
+            'url_hash': url_hash,
+            'url': article['url'],
+            'title': article.get('title') or '',
+            'body': article.get('body'),
+            'title_ru': title_ru,
+            'body_ru': body_ru,
+            'source_name': (article.get('source_info') or {}).get('name') or article.get('source'),
+            'image_url': article.get('imageurl'),
+            'sentiment_compound': sentiment,
+            'published_at': _to_datetime(article['published_on']),
+        } for (url_hash, article), title_ru, body_ru, sentiment
+            in zip(new_articles.items(), texts_ru[:len(raw)], texts_ru[len(raw):], sentiments)])
+        existing.update(_existing_ids(list(new_articles)))
+
+    links = [
+        {'article_id': existing[url_hash], 'category': category, 'published_at': _to_datetime(article['published_on'])}
+        for url_hash, article in articles.items() if url_hash in existing
+        for category in dict.fromkeys(_parse_categories(article.get('categories')) + requested_categories)
+    ]
+    if links:
+        db.session.execute(insert(NewsArticleCategory).on_conflict_do_nothing(index_elements=['article_id', 'category']), links)
+    db.session.commit()
+    return len(new_articles)
+
+
+def ingest_crypto_news(categories: str | None = None, backfill: bool = False) -> int:
+    """
+    Загружает в хранилище новые статьи ленты (categories=None - общая лента) по курсору.
+    backfill=True - дозагрузка одной страницы статей старше самой старой сохраненной статьи категорий.
+    Возвращает количество новых статей.
+    """
+    names = _parse_categories(categories)
+    max_pages = current_app.config.get('NEWS_FETCH_MAX_PAGES', DEFAULT_MAX_PAGES)
+    if backfill:
+        raw, results = _fetch_pages(categories, None, _oldest_timestamp(names) if names else None, 1)
+    else:
+        raw, results = _fetch_pages(categories, _latest_timestamp(names), None, max_pages)
+
+    articles = {_url_hash(article['url']): article for article in raw}
+    try:
+        new_count = _save(articles, names)
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"--- [News Store] Не удалось сохранить новости ({categories or 'all'}): {e}", exc_info=True)
+        return 0
+    # Ответы запоминаются только после коммита статей: иначе сбой перевода или записи
+    # закрепил бы ответ как обработанный, и следующий условный запрос пропустил бы эти статьи
+    for result in results:
+        remember(result)
+    current_app.logger.info(
+        f"--- [News Store] Лента {categories or 'all'}: получено {len(articles)}, новых {new_count}."
+    )
+    return new_count
+
+
+def score_unscored_articles() -> int:
+    """Оценивает тональность статей, сохраненных без нее (например, до появления оценки). Возвращает их количество."""
+    scored_count = 0
+    while True:
+        rows = db.session.query(NewsArticle.id, NewsArticle.title, NewsArticle.body) \
+            .filter(NewsArticle.sentiment_compound.is_(None)).limit(_SCORE_CHUNK).all()
+        if not rows:
+            break
+        sentiments = score_articles([row.title for row in rows], [row.body for row in rows])
+        db.session.execute(update(NewsArticle), [
+            {'id': row.id, 'sentiment_compound': sentiment} for row, sentiment in zip(rows, sentiments)
+        ])
+        db.session.commit()
+        scored_count += len(rows)
+    if scored_count:
+        current_app.logger.info(f"--- [News Store] Оценена тональность {scored_count} сохраненных статей.")
+    return scored_count
+
+
+def refresh_crypto_news(tickers=()) -> int:
+    """
+    Обновление для фоновой задачи: общая лента по курсору, дозагрузка тикеров,
+    для которых сохранено меньше NEWS_MIN_TICKER_ARTICLES статей, и оценка тональности статей без нее.
+    """
+    new_count = ingest_crypto_news()
+    min_articles = current_app.config.get('NEWS_MIN_TICKER_ARTICLES', DEFAULT_MIN_TICKER_ARTICLES)
+    for ticker in tickers:
+        if count_articles(ticker) < min_articles:
+            current_app.logger.info(f"--- [News Store] Дозагрузка новостей для: {ticker}")
+            new_count += ingest_crypto_news(categories=ticker, backfill=True)
+    score_unscored_articles()
+    return new_count
+
+
+def _article_dict(article: NewsArticle) -> dict:
+    """Формат статьи API CryptoCompare с переводом и тональностью, который ожидают шаблоны."""
+    result = {
+        'url': article.url,
+        'title': article.title,
+        'body': article.body,
+        'title_ru': article.title_ru or article.title,
+        'body_ru': article.body_ru or article.body,
+        'published_on': _to_timestamp(article.published_at),
+        'imageurl': article.image_url,
+        'source_info': {'name': article.source_name},
+    }
+    if article.sentiment_compound is not None:
+        # score - оценка от -100 до 100 для отображения
+        result['sentiment'] = {'compound': article.sentiment_compound, 'score': round(article.sentiment_compound * 100)}
+    return result
+
+
+def get_articles(limit: int = 50, categories: str | None = None) -> list[dict]:
+    """Последние limit статей ленты из хранилища."""
+    names = _parse_categories(categories)
+    if not names:
+        query = NewsArticle.query.order_by(NewsArticle.published_at.desc())
+    elif len(names) == 1:
+        # Проход по индексу (category, published_at)
+        query = NewsArticle.query.join(NewsArticleCategory, NewsArticleCategory.article_id == NewsArticle.id) \
+            .filter(NewsArticleCategory.category == names[0]).order_by(NewsArticleCategory.published_at.desc())
+    else:
+        article_ids = _category_filter(db.session.query(NewsArticleCategory.article_id), names)
+        query = NewsArticle.query.filter(NewsArticle.id.in_(article_ids)).order_by(NewsArticle.published_at.desc())
+    return [_article_dict(article) for article in query.limit(limit).all()]
+
+
+def bootstrap_due(categories: str | None) -> bool:
+    """Разрешает синхронную загрузку пустой ленты не чаще раза в BOOTSTRAP_INTERVAL_SECONDS на процесс."""
+    key = ','.join(_parse_categories(categories)) or 'all'
+    now = time.monotonic()
+    with _bootstrap_lock:
+        last = _last_bootstrap.get(key)
+        if last is not None and now - last < BOOTSTRAP_INTERVAL_SECONDS:
+            return False
+        _last_bootstrap[key] = now
+        return True
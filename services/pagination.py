@@ -0,0 +1,196 @@
+"""
+Keyset-пагинация (по курсору) для списков транзакций.
+
+Вместо OFFSET и COUNT(*) на каждой странице запрос продолжается с последней показанной
+строки: WHERE (sort, id) < (значение, id) ORDER BY sort, id LIMIT n. Стоимость страницы
+не зависит от того, насколько далеко пролистан список.
+
+Курсор - непрозрачная строка (base64 от JSON), в которой закодированы значение сортировки,
+id строки и направление ('next' или 'prev'). Некорректный курсор означает первую страницу.
+
+Общее количество строк для набора фильтров кэшируется в памяти процесса на
+TRANSACTION_COUNT_TTL: подсчет выполняется синхронно в потоке запроса, его сессией.
+"""
+import base64
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from sqlalchemy import Date, DateTime, Integer, Numeric, String, and_, asc, desc, func, or_
+
+TRANSACTION_COUNT_TTL = timedelta(minutes=5)
+COUNT_CACHE_SIZE = 512
+_MISSING = object()
+
+# Значения, которыми заменяется NULL в колонке сортировки: NULL всегда меньше любого значения
+_NULL_SENTINELS = (
+    (String, ''),
+    (DateTime, datetime(1, 1, 1)),
+    (Date, date(1, 1, 1)),
+    (Integer, -2 ** 62),
+    (Numeric, Decimal('-1e24')),  # и Float
+)
+
+# items - строки страницы; total - общее количество (None, если не запрашивалось)
+KeysetPagination = namedtuple('KeysetPagination', ['items', 'has_next', 'has_prev', 'next_cursor', 'prev_cursor', 'total', 'per_page'])
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    if isinstance(value, date):
+        return {'d': value.isoformat()}
+    if isinstance(value, Decimal):
+        return {'n': str(value)}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        if 'dt' in value:
+            return datetime.fromisoformat(value['dt'])
+        if 'd' in value:
+            return date.fromisoformat(value['d'])
+        if 'n' in value:
+            return Decimal(value['n'])
+    return value
+
+
+def encode_cursor(sort_value, row_id: int, direction: str = 'next') -> str:
+    payload = json.dumps([_encode_value(sort_value), row_id, direction], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str | None):
+    """Возвращает (значение сортировки, id, направление) или None для некорректного курсора."""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        sort_value, row_id, direction = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        if direction not in ('next', 'prev') or not isinstance(row_id, int):
+            return None
+        return _decode_value(sort_value), row_id, direction
+    except (ValueError, TypeError):
+        return None
+
+
+class _CountCache:
+    """Потокобезопасный LRU количества строк с ограниченным сроком жизни: ключ -> (время записи, количество)."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, ttl_seconds: float):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or time.monotonic() - item[0] >= ttl_seconds:
+                return None
+            self._items.move_to_end(key)
+            return item[1]
+
+    def put(self, key: str, total: int):
+        with self._lock:
+            self._items[key] = (time.monotonic(), total)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+_count_cache = _CountCache(COUNT_CACHE_SIZE)
+
+
+def _cached_count(query, cache_key: str) -> int:
+    ttl_seconds = TRANSACTION_COUNT_TTL.total_seconds()
+    total = _count_cache.get(cache_key, ttl_seconds)
+    if total is None:
+        total = query.order_by(None).count()
+        _count_cache.put(cache_key, total)
+    return total
+
+
+def _null_sentinel(sort_column):
+    """
+    Значение для NULL, если колонка сортировки допускает NULL (иначе _MISSING): сортируем по COALESCE,
+    чтобы порядок был полным и одинаковым на всех СУБД, а строки с NULL не выпадали после первой страницы.
+    """
+    column = getattr(sort_column, 'property', None)
+    column = column.columns[0] if column is not None and hasattr(column, 'columns') else None
+    if column is None or not column.nullable:
+        return _MISSING
+    for type_class, sentinel in _NULL_SENTINELS:
+        if isinstance(column.type, type_class):
+            return sentinel
+    return _MISSING
+
+
+
+def keyset_paginate(query, sort_column, id_column, descending: bool = True, per_page: int = 50, cursor: str | None = None, count_cache_key: str | None = None) -> KeysetPagination:
+    """
+    Возвращает страницу query, упорядоченную по (sort_column, id_column).
+    Порядок из query сбрасывается. Если передан count_cache_key, общее количество строк
+    считается отдельным запросом и кэшируется в памяти процесса на TRANSACTION_COUNT_TTL.
+    """
+    null_value = _null_sentinel(sort_column)
+    coalesced = null_value is not _MISSING
+    sort_expr = func.coalesce(sort_column, null_value) if coalesced else sort_column
+    decoded = decode_cursor(cursor)
+    direction = decoded[2] if decoded else 'next'
+    # При движении назад идем в обратном порядке, а затем разворачиваем результат
+    reverse = descending if direction == 'next' else not descending
+
+    total = _cached_count(query, count_cache_key) if count_cache_key else None
+
+    page_query = query.order_by(None)
+    if decoded:
+        sort_value, row_id = decoded[0], decoded[1]
+        if coalesced and sort_value is None:
+            sort_value = null_value
+        if reverse:
+            page_query = page_query.filter(or_(sort_expr < sort_value, and_(sort_expr == sort_value, id_column < row_id)))
+        else:
+            page_query = page_query.filter(or_(sort_expr > sort_value, and_(sort_expr == sort_value, id_column > row_id)))
+    order = desc if reverse else asc
+    rows = page_query.order_by(order(sort_expr), order(id_column)).limit(per_page + 1).all()
+
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if direction == 'prev':
+        rows.reverse()
+        has_next, has_prev = bool(decoded), has_more
+    else:
+        has_next, has_prev = has_more, bool(decoded)
+
+    def key_of(row):
+        value = getattr(row, sort_column.key)
+        if value is None and coalesced:
+            value = null_value
+        return value, row.id
+
+    next_cursor = encode_cursor(*key_of(rows[-1]), 'next') if rows and has_next else None
+    prev_cursor = encode_cursor(*key_of(rows[0]), 'prev') if rows and has_prev else None
+    return KeysetPagination(rows, has_next, has_prev, next_cursor, prev_cursor, total, per_page)
+
+
+def resolve_sort_column(model, sort_by: str, default: str):
+    """Возвращает атрибут колонки модели для сортировки; неизвестные имена заменяются на default."""
+    if sort_by not in model.__table__.c:
+        sort_by = default
+    return getattr(model, sort_by)
+
+
+def count_cache_key(prefix: str, user_id, args) -> str:
+    """Ключ кэша количества строк для набора фильтров (без курсора и порядка сортировки)."""
+    filters = sorted((key, value) for key, value in args.items() if key not in ('cursor', 'page', 'sort_by', 'order'))
+    digest = hashlib.md5(json.dumps(filters).encode('utf-8')).hexdigest()
+    return f"count_{prefix}_{user_id}_{digest}"
@@ -0,0 +1,149 @@
+"""
+Распознавание QR-кодов на фотографиях чеков.
+
+Раньше pyzbar.decode запускался на исходной фотографии прямо в потоке запроса: снимок
+телефона на 12+ Мп разбирается долго и часто не распознается. Теперь:
+
+- JPEG сразу декодируется в оттенках серого и в уменьшенном масштабе (Image.draft),
+  до большей стороны не больше максимального размера из DECODE_SIDES;
+- распознавание пробуется на нескольких масштабах, затем на отдельных областях снимка
+  (центр, четверти, половины) и на изображении с растянутым контрастом; ищутся только QR-коды;
+- изображения обрабатываются в пуле процессов (QR_DECODE_WORKERS), поток запроса
+  только ждет результат не дольше QR_DECODE_TIMEOUT_SECONDS на изображение.
+
+decode_image_bytes выполняется в дочернем процессе и не использует контекст приложения.
+"""
+import io
+import multiprocessing
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import pyzbar.pyzbar as pyzbar
+from flask import current_app
+from PIL import Image, ImageOps
+from pyzbar.pyzbar import ZBarSymbol
+
+# Большая сторона изображения для попыток распознавания, в порядке попыток
+DECODE_SIDES = (1200, 1800, 800, 2400)
+# Области снимка (left, top, right, bottom) в долях и размер, до которого уменьшается область
+REGIONS = (
+    (0.2, 0.2, 0.8, 0.8),
+    (0.0, 0.0, 0.6, 0.6), (0.4, 0.0, 1.0, 0.6), (0.0, 0.4, 0.6, 1.0), (0.4, 0.4, 1.0, 1.0),
+    (0.0, 0.0, 1.0, 0.5), (0.0, 0.5, 1.0, 1.0),
+)
+REGION_SIDE = 1200
+CONTRAST_SIDES = (1200, 1800)
+DEFAULT_TIMEOUT_SECONDS = 20
+
+QrDecodeResult = namedtuple('QrDecodeResult', ['qr_string', 'attempts', 'error'])
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _load_grayscale(data: bytes, max_side: int) -> Image.Image:
+    image = Image.open(io.BytesIO(data))
+    width, height = image.size
+    ratio = min(1.0, max_side / max(width, height))
+    # Для JPEG: декодирование сразу в оттенках серого и с уменьшением в 2, 4 или 8 раз
+    image.draft('L', (max(1, int(width * ratio)), max(1, int(height * ratio))))
+    image = ImageOps.exif_transpose(image)
+    return image.convert('L')
+
+
+def _resize(image: Image.Image, max_side: int) -> Image.Image:
+    width, height = image.size
+    if max(width, height) <= max_side:
+        return image
+    ratio = max_side / max(width, height)
+    return image.resize((max(1, int(width * ratio)), max(1, int(height * ratio))), Image.Resampling.BILINEAR, reducing_gap=2.0)
+
+
+def _crop(image: Image.Image, region: tuple) -> Image.Image:
+    width, height = image.size
+    left, top, right, bottom = region
+    return image.crop((int(width * left), int(height * top), int(width * right), int(height * bottom)))
+
+
+def _candidates(image: Image.Image):
+    """Варианты изображения в порядке попыток: масштабы, области, растянутый контраст."""
+    tried_sizes = set()
+    for side in DECODE_SIDES:
+        scaled = _resize(image, side)
+        # Небольшой снимок на разных масштабах остается тем же изображением
+        if scaled.size not in tried_sizes:
+            tried_sizes.add(scaled.size)
+            yield scaled
+    for region in REGIONS:
+        yield _resize(_crop(image, region), REGION_SIDE)
+    for side in CONTRAST_SIDES:
+        yield ImageOps.autocontrast(_resize(image, side), cutoff=2)
+
+
+def decode_image_bytes(data: bytes) -> QrDecodeResult:
+    """Ищет QR-код на изображении. Выполняется в процессе пула."""
+    try:
+        image = _load_grayscale(data, max(DECODE_SIDES))
+    except Exception as e:
+        return QrDecodeResult(None, 0, f'Не удалось открыть изображение: {e}')
+
+    attempts = 0
+    for candidate in _candidates(image):
+        attempts += 1
+        for symbol in pyzbar.decode(candidate, symbols=[ZBarSymbol.QRCODE]):
+            return QrDecodeResult(symbol.data.decode('utf-8', errors='replace'), attempts, None)
+    return QrDecodeResult(None, attempts, 'QR-код на изображении не найден.')
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            workers = current_app.config.get('QR_DECODE_WORKERS') or min(4, os.cpu_count() or 1)
+            # spawn: дочерние процессы не наследуют потоки планировщика и соединения с БД
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def decode_qr_images(images: list[bytes]) -> list[QrDecodeResult]:
+    """Распознает QR-коды на пачке изображений параллельно в пуле процессов, сохраняя порядок."""
+    if not images:
+        return []
+    timeout = current_app.config.get('QR_DECODE_TIMEOUT_SECONDS', DEFAULT_TIMEOUT_SECONDS)
+    try:
+        futures = [_get_pool().submit(decode_image_bytes, data) for data in images]
+    except BrokenProcessPool:
+        _reset_pool()
+        futures = [_get_pool().submit(decode_image_bytes, data) for data in images]
+
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result(timeout=timeout))
+        except TimeoutError:
+            future.cancel()
+            results.append(QrDecodeResult(None, 0, 'Превышено время распознавания изображения.'))
+        except BrokenProcessPool as e:
+            current_app.logger.error(f"--- [QR Decode] Пул процессов распознавания завершился с ошибкой: {e}")
+            _reset_pool()
+            results.append(QrDecodeResult(None, 0, 'Ошибка распознавания изображения.'))
+        except Exception as e:
+            results.append(QrDecodeResult(None, 0, f'Ошибка распознавания изображения: {e}'))
+    decoded = sum(1 for result in results if result.qr_string)
+    current_app.logger.info(f"--- [QR Decode] Изображений: {len(images)}, распознано: {decoded}.")
+    return results
+
+
+def decode_qr_image(data: bytes) -> QrDecodeResult:
+    return decode_qr_images([data])[0]
@@ -0,0 +1,110 @@
+"""
+Создание долгов из регулярных платежей.
+
+За один проход выбираются только платежи, срок которых наступает в пределах горизонта
+(RECURRING_PAYMENTS_HORIZON_DAYS дней от сегодняшней даты), и для каждого создаются долги
+за все периоды до горизонта, включая пропущенные. Уже созданные периоды определяются
+одним запросом по (recurring_payment_id, due_date), новые долги добавляются одним flush.
+"""
+from datetime import date, timedelta
+
+from dateutil.relativedelta import relativedelta
+from flask import current_app
+
+from extensions import db
+from models import Debt, RecurringPayment
+
+DEFAULT_HORIZON_DAYS = 30
+# Защита от бесконечного цикла для платежей с очень старой датой или нулевым интервалом
+MAX_PERIODS_PER_PAYMENT = 366
+_EXISTING_CHUNK = 500
+
+
+def next_due_date(due_date: date, frequency: str, interval: int) -> date | None:
+    """Дата следующего периода или None для неизвестной частоты."""
+    interval = max(interval or 1, 1)
+    if frequency == 'daily':
+        return due_date + timedelta(days=interval)
+    if frequency == 'monthly':
+        return due_date + relativedelta(months=interval)
+    if frequency == 'yearly':
+        return due_date + relativedelta(years=interval)
+    return None
+
+
+def _existing_periods(payment_ids: list, start: date, end: date) -> set:
+    """Пары (recurring_payment_id, due_date), для которых долг уже существует."""
+    existing = set()
+    for offset in range(0, len(payment_ids), _EXISTING_CHUNK):
+        chunk = payment_ids[offset:offset + _EXISTING_CHUNK]
+        existing.update(db.session.query(Debt.recurring_payment_id, Debt.due_date).filter(
+            Debt.recurring_payment_id.in_(chunk), Debt.due_date >= start, Debt.due_date <= end
+        ).all())
+    return existing
+
+
+def _debt_for_period(payment: RecurringPayment, due_date: date) -> Debt:
+    debt = Debt(
+        debt_type='i_owe',
+        counterparty=payment.description,
+        initial_amount=payment.amount,
+        repaid_amount=0,
+        currency=payment.currency,
+        due_date=due_date,
+        user_id=payment.user_id,
+        recurring_payment_id=payment.id
+    )
+    # Если у регулярного платежа есть контрагент, используем его, а описание остается описанием
+    if payment.counterparty:
+        debt.counterparty = payment.counterparty
+        debt.description = payment.description
+    return debt
+
+
+def materialize_recurring_payments(user_id: int | None = None, horizon_days: int | None = None, today: date | None = None) -> tuple[int, int]:
+    """
+    Создает долги по всем периодам регулярных платежей со сроком не позже today + horizon_days
+    и переносит next_due_date за горизонт. Изменения фиксируются коммитом.
+    Возвращает (количество созданных долгов, количество обработанных платежей).
+    """
+    today = today or date.today()
+    if horizon_days is None:
+        horizon_days = current_app.config.get('RECURRING_PAYMENTS_HORIZON_DAYS', DEFAULT_HORIZON_DAYS)
+    horizon = today + timedelta(days=horizon_days)
+
+    query = RecurringPayment.query.filter(RecurringPayment.next_due_date <= horizon)
+    if user_id is not None:
+        query = query.filter(RecurringPayment.user_id == user_id)
+    payments = query.all()
+    if not payments:
+        return 0, 0
+
+    # Все периоды до горизонта для каждого платежа
+    planned = []
+    for payment in payments:
+        due_date = payment.next_due_date
+        for _ in range(MAX_PERIODS_PER_PAYMENT):
+            if due_date is None or due_date > horizon:
+                break
+            planned.append((payment, due_date))
+            due_date = next_due_date(due_date, payment.frequency, payment.interval_value)
+        if due_date is None:
+            current_app.logger.warning(f"--- [Recurring Payments] Неизвестная частота '{payment.frequency}' у платежа {payment.id}, создан только один период.")
+            continue
+        payment.next_due_date = due_date
+
+    existing = _existing_periods(
+        [payment.id for payment in payments],
+        min(due for _, due in planned),
+        max(due for _, due in planned)
+    )
+    new_debts = [_debt_for_period(payment, due) for payment, due in planned if (payment.id, due) not in existing]
+    # Один flush: INSERT выполняется пакетно, а слушатели сессии (агрегаты, справочники) видят новые долги
+    db.session.add_all(new_debts)
+    db.session.commit()
+
+    current_app.logger.info(
+        f"--- [Recurring Payments] Обработано платежей: {len(payments)}, периодов: {len(planned)}, "
+        f"создано долгов: {len(new_debts)}, уже существовало: {len(planned) - len(new_debts)}."
+    )
+    return len(new_debts), len(payments)
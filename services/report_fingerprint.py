@@ -0,0 +1,140 @@
+"""
+Определение формата брокерского отчета по "отпечатку".
+
+Вместо перебора парсеров отчет один раз классифицируется по названиям листов и первым
+FINGERPRINT_ROWS строкам каждого листа. Для каждого известного формата считается
+уверенность - доля веса совпавших признаков, и диспетчер сразу вызывает парсер
+лучшего формата нужного вида (портфель или сделки).
+
+Отпечатки кэшируются в памяти процесса по SHA-256 содержимого файла. Отчеты, для которых
+ни один формат не набрал MIN_CONFIDENCE, записываются в лог вместе с названиями листов
+и первыми строками, чтобы по ним можно было добавить новый формат.
+"""
+import hashlib
+import re
+import threading
+from collections import OrderedDict, namedtuple
+
+from flask import current_app
+
+from services.workbook_loader import sheet_row_texts
+
+FINGERPRINT_ROWS = 40
+MIN_CONFIDENCE = 0.5
+_CACHE_SIZE = 256
+_LOGGED_ROWS = 8
+
+# scores: {формат: уверенность 0..1}, отсортированы по убыванию уверенности
+Fingerprint = namedtuple('Fingerprint', ['content_hash', 'sheet_names', 'scores'])
+# sheet - регулярное выражение для названия листа (None - любой лист),
+# head - регулярные выражения, которые ищутся в первых строках подходящих листов
+Signal = namedtuple('Signal', ['weight', 'sheet', 'head'])
+Layout = namedtuple('Layout', ['kind', 'signals'])
+
+
+def _any_of(*keywords) -> re.Pattern:
+    return re.compile('|'.join(re.escape(keyword) for keyword in keywords), re.IGNORECASE)
+
+
+LAYOUTS = {
+    'bcs_portfolio': Layout('portfolio', [
+        Signal(1, _any_of('портфель'), None),
+        Signal(2, _any_of('портфель'), [_any_of('Вид ЦБ'), _any_of('Наименование ЦБ'), _any_of('Кол-во')]),
+    ]),
+    'dinamika_pozitsiy': Layout('portfolio', [
+        Signal(2, re.compile(r'^\s*Динамика позиций\s*$'), None),
+        Signal(1, re.compile(r'^\s*Динамика позиций\s*$'), [_any_of('Инструмент'), _any_of('Код инструмента', 'ISIN')]),
+    ]),
+    'finrez': Layout('portfolio', [
+        Signal(2, re.compile(r'^\s*Фин\.рез\.\s*$'), None),
+        Signal(1, re.compile(r'^\s*Фин\.рез\.\s*$'), [_any_of('Валюта'), _any_of('Инструмент'), _any_of('Открытая позиция')]),
+    ]),
+    'generic_portfolio': Layout('portfolio', [
+        Signal(1, _any_of('портфель', 'активы', 'portfolio', 'assets'), None),
+        Signal(1, _any_of('портфель', 'активы', 'portfolio', 'assets'), [_any_of(
+            'Код финансового инструмента', 'Тикер', 'Наименование инструмента', 'Эмитент', 'Код актива', 'Symbol')]),
+    ]),
+    'bcs_universal_deals': Layout('transactions', [
+        Signal(2, None, [re.compile(r'Брокерский отчет.*БКС', re.IGNORECASE)]),
+        Signal(1, None, [re.compile(r'^\s*\d+\.\s*Движение денежных средств')]),
+    ]),
+    'generic_transactions': Layout('transactions', [
+        Signal(2, _any_of('завершенные сделки', 'торговые операции', 'сделки купли/продажи цб', 'отчет по сделкам', 'движение по ценным бумагам'), None),
+        Signal(1, _any_of('сделки', 'transactions', 'операции с цб'), [_any_of('№ сделки', 'Номер сделки'), _any_of('Цена')]),
+    ]),
+}
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def file_content_hash(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _head_texts(workbook, sheet_name: str) -> list[str]:
+    return [text for text in sheet_row_texts(workbook, sheet_name).iloc[:FINGERPRINT_ROWS] if text]
+
+
+def _signal_matches(signal: Signal, workbook, heads: dict) -> bool:
+    sheets = [name for name in workbook.sheet_names if signal.sheet is None or signal.sheet.search(name)]
+    if not sheets:
+        return False
+    if not signal.head:
+        return True
+    for name in sheets:
+        if name not in heads:
+            heads[name] = '\n'.join(_head_texts(workbook, name))
+        if all(pattern.search(heads[name]) for pattern in signal.head):
+            return True
+    return False
+
+
+def _score_layouts(workbook) -> dict:
+    heads = {}
+    scores = {}
+    for layout_name, layout in LAYOUTS.items():
+        total = sum(signal.weight for signal in layout.signals)
+        matched = sum(signal.weight for signal in layout.signals if _signal_matches(signal, workbook, heads))
+        scores[layout_name] = round(matched / total, 2)
+    return dict(sorted(scores.items(), key=lambda item: item[1], reverse=True))
+
+
+def fingerprint_report(workbook, content_hash: str, use_cache: bool = True) -> Fingerprint:
+    """Отпечаток загруженного отчета (services/workbook_loader.py). Кэшируется по хэшу содержимого файла."""
+    if use_cache:
+        with _cache_lock:
+            if content_hash in _cache:
+                _cache.move_to_end(content_hash)
+                return _cache[content_hash]
+    fingerprint = Fingerprint(content_hash, list(workbook.sheet_names), _score_layouts(workbook))
+    if not use_cache:
+        return fingerprint
+    with _cache_lock:
+        _cache[content_hash] = fingerprint
+        while len(_cache) > _CACHE_SIZE:
+            _cache.popitem(last=False)
+    return fingerprint
+
+
+def best_layout(fingerprint: Fingerprint, kind: str) -> tuple[str | None, float]:
+    """Формат вида kind ('portfolio' или 'transactions') с наибольшей уверенностью или (None, 0), если уверенность ниже порога."""
+    for layout_name, confidence in fingerprint.scores.items():
+        if LAYOUTS[layout_name].kind == kind:
+            if confidence >= MIN_CONFIDENCE:
+                return layout_name, confidence
+            break
+    return None, 0.0
+
+
+def log_unknown_layout(fingerprint: Fingerprint, workbook, kind: str):
+    """Пишет в лог названия листов и первые строки отчета нераспознанного формата."""
+    sample = {name: [text[:200] for text in _head_texts(workbook, name)[:_LOGGED_ROWS]] for name in workbook.sheet_names}
+    current_app.logger.warning(
+        f"--- [Report Fingerprint] Неизвестный формат отчета ({kind}), файл {fingerprint.content_hash[:12]}. "
+        f"Оценки: {fingerprint.scores}. Листы и первые строки: {sample}"
+    )
@@ -0,0 +1,239 @@
+"""
+Фоновый импорт брокерских отчетов (состав портфеля XLS/PDF и сделки XLS).
+
+Маршруты загрузки только сохраняют файл и создают задачу ReportImportJob. Разбор и запись
+выполняются в фоновом потоке с контекстом приложения (как фоновое обновление в
+services/json_cache.py). Состояние и прогресс задачи хранятся в БД, поэтому их видит
+любой воркер (/securities/imports/<id>).
+
+- Повторная загрузка файла с тем же SHA-256, уже успешно импортированного на эту платформу,
+  сразу завершается задачей без изменений. Если такой файл еще импортируется,
+  возвращается текущая задача.
+- Отчет разбирается один раз (services/workbook_loader.py), после чего строки записываются
+  пачками по REPORT_IMPORT_CHUNK_SIZE. Существующие записи пачки выбираются одним запросом,
+  новые добавляются пакетным INSERT, изменения - пакетным UPDATE по первичному ключу.
+  После каждой пачки выполняются коммит и обновление прогресса задачи.
+"""
+import hashlib
+import os
+import threading
+from datetime import datetime, timezone, timedelta
+from decimal import Decimal
+
+from flask import current_app
+from sqlalchemy import insert, select, update
+
+from extensions import db
+from models import InvestmentAsset, InvestmentPlatform, ReportImportJob, Transaction
+
+IMPORT_KINDS = ('portfolio', 'transactions', 'pdf_portfolio')
+DEFAULT_CHUNK_SIZE = 500
+# Задача в статусе pending/running дольше этого срока считается прерванной (перезапуск воркера)
+STALE_JOB_MINUTES = 60
+_IN_PROGRESS = ('pending', 'running')
+
+
+def _utcnow():
+    return datetime.now(timezone.utc)
+
+
+def _as_aware(value):
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def _chunks(rows: list, size: int):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+def start_report_import(platform: InvestmentPlatform, kind: str, file_storage) -> tuple[ReportImportJob, bool]:
+    """
+    Сохраняет загруженный файл и запускает фоновый импорт.
+    Возвращает (задача, True если запущен новый импорт). Для уже импортированного файла
+    создается завершенная задача без изменений, для файла в процессе импорта - возвращается текущая.
+    """
+    if kind not in IMPORT_KINDS:
+        raise ValueError(f"Неизвестный тип импорта: {kind}")
+    content = file_storage.read()
+    content_hash = hashlib.sha256(content).hexdigest()
+
+    previous_jobs = ReportImportJob.query.filter(
+        ReportImportJob.platform_id == platform.id,
+        ReportImportJob.kind == kind,
+        ReportImportJob.content_hash == content_hash,
+        ReportImportJob.status.in_(_IN_PROGRESS + ('done',))
+    ).order_by(ReportImportJob.id.desc()).all()
+    stale_before = _utcnow() - timedelta(minutes=STALE_JOB_MINUTES)
+    for previous in previous_jobs:
+        if previous.status in _IN_PROGRESS:
+            if _as_aware(previous.created_at) >= stale_before:
+                return previous, False
+            previous.status, previous.message, previous.finished_at = 'failed', 'Импорт прерван (перезапуск приложения).', _utcnow()
+            continue
+        job = ReportImportJob(
+            platform_id=platform.id, kind=kind, filename=(file_storage.filename or '')[:255], content_hash=content_hash,
+            status='done', message=f'Файл уже импортирован (задача #{previous.id}), изменений нет.', finished_at=_utcnow()
+        )
+        db.session.add(job)
+        db.session.commit()
+        current_app.logger.info(f"--- [Report Import] Повторная загрузка файла {content_hash[:12]} для платформы {platform.id}: без изменений.")
+        return job, False
+
+    # Имя файла на диске строится по хэшу: secure_filename удаляет кириллицу, а расширение нужно для выбора движка
+    extension = os.path.splitext(file_storage.filename or '')[1].lower()
+    file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], f'import_{content_hash}{extension}')
+    with open(file_path, 'wb') as f:
+        f.write(content)
+
+    job = ReportImportJob(platform_id=platform.id, kind=kind, filename=(file_storage.filename or '')[:255], content_hash=content_hash, status='pending')
+    db.session.add(job)
+    db.session.commit()
+    _start_worker(job.id, file_path)
+    return job, True
+
+
+def _start_worker(job_id: int, file_path: str):
+    app = current_app._get_current_object()
+
+    def worker():
+        with app.app_context():
+            run_report_import(job_id, file_path)
+
+    threading.Thread(target=worker, name=f"report-import-{job_id}", daemon=True).start()
+
+
+def _parse_report(kind: str, file_path: str, content_hash: str) -> list[dict]:
+    # Парсеры живут рядом с маршрутами ценных бумаг, а маршруты импортируют этот модуль
+    from securities_logic import _parse_broker_portfolio_report, _parse_broker_transactions_report
+    from pdf_parsers import parse_bcs_report_pdf
+
+    if kind == 'portfolio':
+        return _parse_broker_portfolio_report(file_path, content_hash)
+    if kind == 'transactions':
+        return _parse_broker_transactions_report(file_path, content_hash)
+    return parse_bcs_report_pdf(file_path)
+
+
+def run_report_import(job_id: int, file_path: str):
+    """Выполняет импорт задачи: разбор файла и запись пачками. Файл удаляется по завершении."""
+    job = db.session.get(ReportImportJob, job_id)
+    if job is None:
+        return
+    job.status, job.started_at = 'running', _utcnow()
+    db.session.commit()
+    current_app.logger.info(f"--- [Report Import] Задача #{job.id} ({job.kind}) для платформы {job.platform_id}: начало импорта.")
+    try:
+        rows = _parse_report(job.kind, file_path, job.content_hash)
+        if not rows:
+            if job.kind == 'transactions':
+                raise ValueError("Не удалось извлечь ни одной транзакции из файла.")
+            raise ValueError("Не удалось извлечь ни одного актива из файла. Проверьте формат отчета.")
+        job.total_rows = len(rows)
+        db.session.commit()
+
+        chunk_size = max(current_app.config.get('REPORT_IMPORT_CHUNK_SIZE', DEFAULT_CHUNK_SIZE), 1)
+        if job.kind == 'transactions':
+            _import_transactions(job, rows, chunk_size)
+            job.message = f'Отчет о транзакциях загружен. Добавлено {job.created_count} новых сделок, пропущено существующих: {job.skipped_count}.'
+        else:
+            _import_assets(job, rows, chunk_size, zero_missing=(job.kind == 'portfolio'))
+            job.message = f'Отчет загружен. Добавлено: {job.created_count}, Обновлено: {job.updated_count}, Обнулено: {job.zeroed_count}.'
+        job.status = 'done'
+        current_app.logger.info(f"--- [Report Import] Задача #{job.id} завершена. {job.message}")
+    except Exception as e:
+        db.session.rollback()
+        job = db.session.get(ReportImportJob, job_id)
+        job.status, job.message = 'failed', f'Ошибка при обработке файла: {e}'
+        current_app.logger.error(f"--- [Report Import] Задача #{job_id} завершилась ошибкой: {e}", exc_info=True)
+    finally:
+        job.finished_at = _utcnow()
+        db.session.commit()
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+
+def _import_assets(job: ReportImportJob, rows: list[dict], chunk_size: int, zero_missing: bool):
+    """
+    Обновляет активы платформы по отчету, добавляя новые.
+    Для полного отчета о портфеле (zero_missing) активы, которых нет в отчете, обнуляются.
+    """
+    # Тикер, встречающийся в отчете несколько раз, берется по последней строке
+    by_ticker = {row['ticker']: row for row in rows}
+    existing = dict(db.session.query(InvestmentAsset.ticker, InvestmentAsset.id).filter(InvestmentAsset.platform_id == job.platform_id))
+    is_pdf = job.kind == 'pdf_portfolio'
+
+    for chunk in _chunks(list(by_ticker.values()), chunk_size):
+        updates, inserts = [], []
+        for asset_data in chunk:
+            asset_id = existing.get(asset_data['ticker'])
+            if asset_id is not None:
+                values = {'id': asset_id, 'quantity': asset_data['quantity']}
+                if not is_pdf:
+                    # Как и раньше, цена и название обновляются, только если их дал отчет
+                    values.update({key: asset_data[key] for key in ('current_price', 'name') if key in asset_data})
+                updates.append(values)
+            elif is_pdf:
+                inserts.append({'platform_id': job.platform_id, 'ticker': asset_data['ticker'], 'name': asset_data['name'], 'asset_type': asset_data['asset_type'],
+                                'quantity': asset_data['quantity'], 'current_price': Decimal(0), 'currency_of_price': 'RUB'})
+            else:
+                inserts.append(dict(asset_data, platform_id=job.platform_id))
+        if updates:
+            db.session.execute(update(InvestmentAsset), updates)
+        if inserts:
+            db.session.execute(insert(InvestmentAsset), inserts)
+        job.updated_count += len(updates)
+        job.created_count += len(inserts)
+        job.processed_rows += len(chunk)
+        db.session.commit()
+
+    if zero_missing:
+        missing_ids = [asset_id for ticker, asset_id in existing.items() if ticker not in by_ticker]
+        for chunk in _chunks(missing_ids, chunk_size):
+            db.session.execute(
+                update(InvestmentAsset).where(InvestmentAsset.id.in_(chunk)).values(quantity=Decimal('0')).execution_options(synchronize_session=False)
+            )
+        job.zeroed_count = len(missing_ids)
+        db.session.commit()
+    # Строки-дубликаты в отчете тоже считаются обработанными
+    job.processed_rows = job.total_rows
+
+
+def _import_transactions(job: ReportImportJob, rows: list[dict], chunk_size: int):
+    """Добавляет сделки, которых еще нет в базе (exchange_tx_id уникален для всех платформ)."""
+    by_tx_id = {row['exchange_tx_id']: row for row in rows}
+    for chunk in _chunks(list(by_tx_id.values()), chunk_size):
+        tx_ids = [row['exchange_tx_id'] for row in chunk]
+        existing = set(db.session.scalars(select(Transaction.exchange_tx_id).where(Transaction.exchange_tx_id.in_(tx_ids))))
+        inserts = [dict(row, platform_id=job.platform_id) for row in chunk if row['exchange_tx_id'] not in existing]
+        if inserts:
+            db.session.execute(insert(Transaction), inserts)
+        job.created_count += len(inserts)
+        job.skipped_count += len(chunk) - len(inserts)
+        job.processed_rows += len(chunk)
+        db.session.commit()
+    job.skipped_count += len(rows) - len(by_tx_id)
+    job.processed_rows = job.total_rows
+
+
+def get_recent_import_jobs(platform_id: int, limit: int = 5) -> list[ReportImportJob]:
+    return ReportImportJob.query.filter_by(platform_id=platform_id).order_by(ReportImportJob.id.desc()).limit(limit).all()
+
+
+def import_job_status(job: ReportImportJob) -> dict:
+    """Состояние задачи для JSON-ответа страницы брокера."""
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'filename': job.filename,
+        'status': job.status,
+        'total_rows': job.total_rows,
+        'processed_rows': job.processed_rows,
+        'progress': job.progress_percent,
+        'created': job.created_count,
+        'updated': job.updated_count,
+        'zeroed': job.zeroed_count,
+        'skipped': job.skipped_count,
+        'message': job.message,
+    }
@@ -0,0 +1,130 @@
+"""
+SQL-выражения, не зависящие от СУБД, и проверка планов запросов.
+
+Приложение работает и на SQLite (локально), и на PostgreSQL (render.yaml), поэтому
+функции дат, специфичные для одной СУБД (strftime, date_trunc), напрямую в запросах
+не используются - только через time_bucket.
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import String, func
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+from sqlalchemy.sql.visitors import InternalTraversal
+
+from extensions import db
+
+# Формат метки периода: (strftime для SQLite, to_char для PostgreSQL)
+_BUCKET_FORMATS = {
+    'day': ('%Y-%m-%d', 'YYYY-MM-DD'),
+    'month': ('%Y-%m', 'YYYY-MM'),
+    'year': ('%Y', 'YYYY'),
+}
+
+
+class time_bucket(FunctionElement):
+    """
+    Усекает дату/время до начала периода ('day', 'month', 'year') и возвращает строковую
+    метку периода ('2024-05-17', '2024-05', '2024') одинаково на всех СУБД.
+    """
+    type = String()
+    inherit_cache = True
+    # unit входит в ключ кэша компиляции: иначе SQL, собранный для первого периода, переиспользуется для остальных
+    _traverse_internals = FunctionElement._traverse_internals + [('unit', InternalTraversal.dp_string)]
+
+    def __init__(self, unit: str, column):
+        if unit not in _BUCKET_FORMATS:
+            raise ValueError(f"Неизвестный период группировки: {unit}. Доступны: {', '.join(_BUCKET_FORMATS)}")
+        self.unit = unit
+        super().__init__(column)
+
+
+@compiles(time_bucket)
+def _compile_time_bucket_default(element, compiler, **kw):
+    sqlite_format, _ = _BUCKET_FORMATS[element.unit]
+    return compiler.process(func.strftime(sqlite_format, *element.clauses.clauses), **kw)
+
+
+@compiles(time_bucket, 'postgresql')
+def _compile_time_bucket_postgresql(element, compiler, **kw):
+    _, pg_format = _BUCKET_FORMATS[element.unit]
+    column = element.clauses.clauses[0]
+    return compiler.process(func.to_char(func.date_trunc(element.unit, column), pg_format), **kw)
+
+
+def explain_query(statement) -> list[str]:
+    """Возвращает план выполнения запроса построчно (EXPLAIN QUERY PLAN на SQLite, EXPLAIN на PostgreSQL)."""
+    connection = db.session.connection()
+    dialect = connection.dialect
+    compiled = statement.compile(dialect=dialect)
+    params = compiled.construct_params()
+    if compiled.positional:
+        params = tuple(params[name] for name in compiled.positiontup)
+    prefix = 'EXPLAIN QUERY PLAN ' if dialect.name == 'sqlite' else 'EXPLAIN '
+    rows = connection.exec_driver_sql(prefix + str(compiled), params).fetchall()
+    return [' '.join(str(value) for value in row) for row in rows]
+
+
+def _analytics_index_checks() -> list:
+    """Запросы аналитики и индексы, которые они должны использовать: (название, индекс, запрос)."""
+    from models import AccountLedgerEntry, BankingTransaction, BankingDailyRollup, Debt, TransactionItem
+
+    end = datetime.now()
+    start = end - timedelta(days=30)
+    return [
+        ('Операции счета за период', 'ix_banking_transaction_account_date',
+         db.session.query(BankingTransaction.id).filter(
+             BankingTransaction.account_id == 1, BankingTransaction.date >= start, BankingTransaction.date <= end
+         ).order_by(BankingTransaction.date.desc()).statement),
+        ('Суммы по типам операций счета', 'ix_banking_transaction_account_type_date',
+         db.session.query(BankingTransaction.transaction_type, func.sum(BankingTransaction.amount)).filter(
+             BankingTransaction.account_id == 1, BankingTransaction.transaction_type == 'expense',
+             BankingTransaction.date >= start, BankingTransaction.date <= end
+         ).group_by(BankingTransaction.transaction_type).statement),
+        ('Операции категории за период', 'ix_banking_transaction_category_date',
+         db.session.query(func.sum(BankingTransaction.amount)).filter(
+             BankingTransaction.category_id == 1, BankingTransaction.date >= start, BankingTransaction.date <= end
+         ).statement),
+        ('Операции по мерчанту', 'ix_banking_transaction_merchant',
+         db.session.query(BankingTransaction.id).filter(BankingTransaction.merchant == 'test').statement),
+        ('Позиции чека', 'ix_transaction_item_transaction_id',
+         db.session.query(TransactionItem.id).filter(TransactionItem.transaction_id == 1).statement),
+        ('Дневные агрегаты пользователя', 'ix_banking_daily_rollup_user_day',
+         db.session.query(time_bucket('month', BankingDailyRollup.day), func.sum(BankingDailyRollup.total)).filter(
+             BankingDailyRollup.user_id == 1, BankingDailyRollup.day >= start.date(), BankingDailyRollup.day <= end.date(),
+             BankingDailyRollup.source == 'transaction', BankingDailyRollup.transaction_type == 'expense'
+         ).group_by(time_bucket('month', BankingDailyRollup.day)).statement),
+        ('Долги по контрагенту', 'ix_debt_user_counterparty_created',
+         db.session.query(Debt.id).filter(Debt.user_id == 1, Debt.counterparty == 'test').order_by(Debt.created_at.desc()).statement),
+        ('Операции по контрагенту', 'ix_banking_transaction_counterparty_date',
+         db.session.query(BankingTransaction.id).filter(BankingTransaction.counterparty == 'test').order_by(BankingTransaction.date.desc()).statement),
+        ('Изменения баланса счета за период', 'ix_account_ledger_entry_account_occurred',
+         db.session.query(func.sum(AccountLedgerEntry.amount)).filter(
+             AccountLedgerEntry.account_id == 1, AccountLedgerEntry.occurred_at >= start, AccountLedgerEntry.occurred_at < end
+         ).statement),
+    ]
+
+
+def check_analytics_indexes() -> list[dict]:
+    """
+    Выполняет EXPLAIN для запросов аналитики и проверяет, что в плане используется ожидаемый индекс.
+    На PostgreSQL последовательное сканирование отключается на время проверки: на маленьких
+    таблицах планировщик иначе предпочтет его любому индексу.
+    Возвращает [{'name', 'index', 'used', 'plan'}].
+    """
+    connection = db.session.connection()
+    if connection.dialect.name == 'postgresql':
+        connection.exec_driver_sql('SET LOCAL enable_seqscan = off')
+    try:
+        results = []
+        for name, index_name, statement in _analytics_index_checks():
+            plan = explain_query(statement)
+            results.append({
+                'name': name,
+                'index': index_name,
+                'used': any(index_name in line for line in plan),
+                'plan': plan
+            })
+        return results
+    finally:
+        db.session.rollback()
@@ -0,0 +1,201 @@
+"""
+Полнотекстовый поиск по банковским операциям и позициям чеков.
+
+Индекс охватывает BankingTransaction.description, merchant, counterparty и названия
+TransactionItem.name одной операции. Хранилище зависит от СУБД:
+- SQLite: виртуальная таблица FTS5 banking_transaction_fts (rowid = id операции),
+  ранжирование bm25, фрагменты - snippet();
+- PostgreSQL: таблица banking_transaction_search с колонкой tsvector и GIN-индексом,
+  ранжирование ts_rank, фрагменты - ts_headline() только для строк выдачи.
+Обе таблицы создаются миграцией и не описаны в models.py.
+
+Индекс поддерживается так же, как дневные агрегаты (services/analytics_rollup.py):
+слушатели сессии собирают id затронутых операций при flush и переиндексируют их
+перед коммитом в той же транзакции. Полная перестройка - `flask analytics rebuild-search-index`.
+"""
+import re
+
+from markupsafe import Markup, escape
+from sqlalchemy import event, inspect, select, text
+from sqlalchemy.orm import Session
+
+from extensions import db
+from models import Account, BankingTransaction, TransactionItem
+
+FTS_TABLE = 'banking_transaction_fts'
+PG_TABLE = 'banking_transaction_search'
+# Служебные таблицы FTS5 и таблица PostgreSQL не описаны в моделях - autogenerate их пропускает
+SEARCH_TABLES = {PG_TABLE, FTS_TABLE} | {f'{FTS_TABLE}_{suffix}' for suffix in ('data', 'idx', 'content', 'docsize', 'config')}
+
+MAX_RESULTS = 200
+_REINDEX_CHUNK = 500
+# Маркеры совпадений во фрагменте; заменяются на <mark> после экранирования текста
+_MARK_START, _MARK_END = '\x02', '\x03'
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def _is_postgresql(connection) -> bool:
+    return connection.dialect.name == 'postgresql'
+
+
+def _fold(value: str | None) -> str:
+    # Токенизаторы FTS5 и PostgreSQL не приравнивают "ё" к "е"
+    return (value or '').replace('ё', 'е').replace('Ё', 'Е')
+
+
+def _query_tokens(query: str) -> list[str]:
+    return _TOKEN_RE.findall(_fold(query).lower())[:10]
+
+
+def _is_prefix_token(tokens: list, index: int) -> bool:
+    """
+    Префиксом ищется только последнее слово запроса длиной от 3 символов (набор "на лету").
+    Короткий префикс совпадает с огромным числом строк, а ранжировать приходится все совпадения.
+    """
+    return index == len(tokens) - 1 and len(tokens[index]) >= 3
+
+
+def _build_documents(connection, transaction_ids: list) -> list[dict]:
+    """Собирает поисковые документы операций: поля операции и названия позиций чека."""
+    tx = BankingTransaction.__table__
+    acc = Account.__table__
+    item = TransactionItem.__table__
+    rows = connection.execute(
+        select(tx.c.id, acc.c.user_id, tx.c.description, tx.c.merchant, tx.c.counterparty)
+        .select_from(tx.join(acc, tx.c.account_id == acc.c.id))
+        .where(tx.c.id.in_(transaction_ids))
+    ).all()
+    item_names = {}
+    for transaction_id, name in connection.execute(select(item.c.transaction_id, item.c.name).where(item.c.transaction_id.in_(transaction_ids))):
+        item_names.setdefault(transaction_id, []).append(name)
+    return [
+        {
+            'transaction_id': tx_id,
+            'user_id': user_id,
+            'description': _fold(description),
+            'merchant': _fold(merchant),
+            'counterparty': _fold(counterparty),
+            'items': _fold(' '.join(item_names.get(tx_id, []))),
+        }
+        for tx_id, user_id, description, merchant, counterparty in rows
+    ]
+
+
+def _reindex_transactions(connection, transaction_ids):
+    """Удаляет и заново добавляет в индекс документы указанных операций."""
+    transaction_ids = sorted(transaction_ids)
+    for start in range(0, len(transaction_ids), _REINDEX_CHUNK):
+        chunk = transaction_ids[start:start + _REINDEX_CHUNK]
+        id_list = ', '.join(str(int(tx_id)) for tx_id in chunk)
+        documents = _build_documents(connection, chunk)
+        if _is_postgresql(connection):
+            connection.execute(text(f"DELETE FROM {PG_TABLE} WHERE transaction_id IN ({id_list})"))
+            if documents:
+                connection.execute(text(
+                    f"INSERT INTO {PG_TABLE} (transaction_id, user_id, body, document) VALUES ("
+                    ":transaction_id, :user_id, concat_ws(' ', :description, :merchant, :counterparty, :items), "
+                    "setweight(to_tsvector('russian', :description), 'A') || "
+                    "setweight(to_tsvector('russian', :merchant || ' ' || :counterparty), 'B') || "
+                    "setweight(to_tsvector('russian', :items), 'C'))"
+                ), documents)
+        else:
+            connection.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({id_list})"))
+            if documents:
+                connection.execute(text(
+                    f"INSERT INTO {FTS_TABLE} (rowid, user_id, description, merchant, counterparty, items) "
+                    "VALUES (:transaction_id, :user_id, :description, :merchant, :counterparty, :items)"
+                ), documents)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_search_keys(session, flush_context):
+    keys = session.info.setdefault('search_reindex_ids', set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, BankingTransaction):
+            keys.add(inspect(obj).dict.get('id'))
+        elif isinstance(obj, TransactionItem):
+            state = inspect(obj)
+            keys.add(state.dict.get('transaction_id'))
+            if state.persistent or state.deleted:
+                keys.update(state.attrs.transaction_id.history.deleted or ())
+    keys.discard(None)
+    if not keys:
+        session.info.pop('search_reindex_ids', None)
+
+
+@event.listens_for(Session, 'before_commit')
+def _apply_search_reindex(session):
+    if not session.info.get('search_reindex_ids') and not (session.new or session.dirty or session.deleted):
+        return
+    # Дописываем ожидающие изменения, чтобы after_flush успел собрать их id
+    session.flush()
+    keys = session.info.pop('search_reindex_ids', None)
+    if keys:
+        _reindex_transactions(session.connection(), keys)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_search_keys(session):
+    session.info.pop('search_reindex_ids', None)
+
+
+def rebuild_search_index() -> int:
+    """Полностью перестраивает поисковый индекс. Возвращает количество проиндексированных операций."""
+    connection = db.session.connection()
+    connection.execute(text(f"DELETE FROM {PG_TABLE if _is_postgresql(connection) else FTS_TABLE}"))
+    transaction_ids = [tx_id for tx_id, in db.session.query(BankingTransaction.id).yield_per(5000)]
+    _reindex_transactions(connection, transaction_ids)
+    if not _is_postgresql(connection):
+        connection.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')"))
+    db.session.commit()
+    return len(transaction_ids)
+
+
+def _render_snippet(raw: str | None) -> Markup:
+    """Экранирует фрагмент и превращает маркеры совпадений в <mark>."""
+    if not raw:
+        return Markup('')
+    return Markup(str(escape(raw)).replace(_MARK_START, '<mark>').replace(_MARK_END, '</mark>'))
+
+
+def search_transactions(user_id: int, query: str, limit: int = 50) -> list[dict]:
+    """
+    Ищет операции пользователя, содержащие все слова запроса (последнее слово - как префикс).
+    Возвращает [{'transaction_id', 'score', 'snippet'}] по убыванию релевантности;
+    snippet - безопасный HTML с <mark> вокруг совпадений.
+    """
+    tokens = _query_tokens(query)
+    if not tokens:
+        return []
+    limit = max(1, min(limit, MAX_RESULTS))
+    connection = db.session.connection()
+
+    if _is_postgresql(connection):
+        ts_query = ' & '.join(f'{token}:*' if _is_prefix_token(tokens, i) else token for i, token in enumerate(tokens))
+        # ts_headline дорогой, поэтому считаем его только для строк после LIMIT
+        rows = connection.execute(text(
+            "SELECT ranked.transaction_id, ranked.score, "
+            "ts_headline('russian', ranked.body, ranked.query, :headline_options) "
+            "FROM (SELECT s.transaction_id, s.body, q.query, ts_rank(s.document, q.query) AS score "
+            f"      FROM {PG_TABLE} s, to_tsquery('russian', :ts_query) AS q(query) "
+            "      WHERE s.user_id = :user_id AND s.document @@ q.query "
+            "      ORDER BY score DESC, s.transaction_id DESC LIMIT :limit) AS ranked "
+            "ORDER BY ranked.score DESC, ranked.transaction_id DESC"
+        ), {
+            'ts_query': ts_query, 'user_id': user_id, 'limit': limit,
+            'headline_options': f'StartSel="{_MARK_START}", StopSel="{_MARK_END}", MaxWords=20, MinWords=5, MaxFragments=2',
+        }).all()
+    else:
+        match = ' '.join(f'"{token}"*' if _is_prefix_token(tokens, i) else f'"{token}"' for i, token in enumerate(tokens))
+        # Веса колонок bm25: user_id не индексируется, описание важнее названий позиций
+        rows = connection.execute(text(
+            f"SELECT rowid, -bm25({FTS_TABLE}, 0, 3.0, 2.0, 2.0, 1.0) AS score, "
+            f"snippet({FTS_TABLE}, -1, :mark_start, :mark_end, '…', 12) "
+            f"FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :match AND user_id = :user_id "
+            "ORDER BY score DESC, rowid DESC LIMIT :limit"
+        ), {'match': match, 'user_id': user_id, 'limit': limit, 'mark_start': _MARK_START, 'mark_end': _MARK_END}).all()
+
+    return [
+        {'transaction_id': transaction_id, 'score': float(score or 0), 'snippet': _render_snippet(snippet)}
+        for transaction_id, score, snippet in rows
+    ]
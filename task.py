@@ -1,15 +1,7 @@
-from flask import Blueprint, current_app, jsonify
+from flask import Blueprint, current_app, jsonify, request
 from werkzeug.exceptions import Forbidden
 
-# Импортируем функции для обновления из analytics_logic
-from analytics_logic import (
-    refresh_securities_portfolio_history,
-    refresh_crypto_portfolio_history,
-    refresh_securities_price_change_data,
-    refresh_crypto_price_change_data,
-    refresh_performance_chart_data,
-    refresh_market_leaders_cache
-)
+from logic.refresh_orchestrator import run_refresh_tasks, DEFAULT_REFRESH_JOBS
 
 tasks_bp = Blueprint('tasks', __name__)
 
@@ -18,6 +10,7 @@ def trigger_refresh_all(secret_key):
     """
     Защищенный эндпоинт для запуска всех задач по обновлению аналитики.
     Вызывается внешним cron-сервисом.
+    Параметры запроса: jobs (число потоков), only (имена задач через запятую), user (id или имя пользователя).
     """
     # Проверяем секретный ключ из переменных окружения
     if not current_app.config.get('CRON_SECRET_KEY') or secret_key != current_app.config.get('CRON_SECRET_KEY'):
@@ -25,20 +18,20 @@ def trigger_refresh_all(secret_key):
         raise Forbidden("Invalid or missing secret key.")
 
     current_app.logger.info("Starting scheduled tasks via secret URL...")
-    results = {}
-    
-    try:
-        # Запускаем все задачи обновления по очереди
-        results['securities_portfolio_history'] = refresh_securities_portfolio_history()
-        results['crypto_portfolio_history'] = refresh_crypto_portfolio_history()
-        results['securities_price_change'] = refresh_securities_price_change_data()
-        results['crypto_price_change'] = refresh_crypto_price_change_data()
-        results['performance_chart'] = refresh_performance_chart_data()
-        results['market_leaders'] = refresh_market_leaders_cache()
+    only = [name.strip() for name in request.args.get('only', '').split(',') if name.strip()]
 
-        current_app.logger.info("Scheduled tasks completed successfully.")
-        return jsonify({"status": "success", "details": results})
+    try:
+        results = run_refresh_tasks(
+            jobs=request.args.get('jobs', DEFAULT_REFRESH_JOBS, type=int),
+            only=only or None,
+            user=request.args.get('user')
+        )
+        status = "success" if all(result['success'] for result in results.values()) else "partial"
+        current_app.logger.info(f"Scheduled tasks completed with status: {status}.")
+        return jsonify({"status": status, "details": results})
 
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
     except Exception as e:
         current_app.logger.error(f"Error during scheduled task execution: {e}", exc_info=True)
-        return jsonify({"status": "error", "message": str(e)}), 500
\ No newline at end of file
+        return jsonify({"status": "error", "message": str(e)}), 500
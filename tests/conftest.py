@@ -0,0 +1,80 @@
+import os
+import sys
+from decimal import Decimal
+
+import pytest
+from flask import Flask
+from sqlalchemy import text
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from extensions import db, login_manager  # noqa: E402
+
+
+def _trim_zeros(value):
+    if isinstance(value, Decimal):
+        value = "{:f}".format(value)
+    if isinstance(value, str) and '.' in value:
+        return value.rstrip('0').rstrip('.')
+    return value
+
+
+@pytest.fixture
+def app(tmp_path):
+    """
+    Приложение для тестов на отдельной SQLite-базе.
+    create_app не используется: он запускает планировщик фоновых задач и требует libzbar для api_routes.
+    """
+    from routes import main_bp
+    from routes.auth import auth_bp
+
+    app = Flask('app', root_path=ROOT)
+    app.config.update(
+        TESTING=True,
+        SECRET_KEY='test',
+        SQLALCHEMY_DATABASE_URI='sqlite:///' + str(tmp_path / 'test.db'),
+        SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        ITEMS_PER_PAGE=20,
+        DASHBOARD_SNAPSHOT_ENABLED=True,
+    )
+    db.init_app(app)
+    login_manager.init_app(app)
+    app.add_template_filter(_trim_zeros, 'trim_zeros')
+    app.register_blueprint(main_bp)
+    app.register_blueprint(auth_bp)
+
+    with app.app_context():
+        db.create_all()
+        # Поисковый индекс операций на SQLite создается миграцией f8a9b0c1d2e4, а не моделями
+        db.session.execute(text(
+            "CREATE VIRTUAL TABLE banking_transaction_fts USING fts5("
+            "user_id UNINDEXED, description, merchant, counterparty, items, "
+            "tokenize = 'unicode61 remove_diacritics 2')"
+        ))
+        db.session.commit()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def user(app):
+    from models import User
+
+    user = User(username='tester')
+    user.set_password('secret')
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+@pytest.fixture
+def client(app, user):
+    """Тестовый клиент с вошедшим пользователем user."""
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user.id)
+        session['_fresh'] = True
+    return client
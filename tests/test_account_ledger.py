@@ -0,0 +1,124 @@
+from datetime import date, datetime
+from decimal import Decimal
+
+from extensions import db
+from models import Account, AccountBalanceSnapshot, AccountLedgerEntry, BankingTransaction
+from services.account_ledger import (
+    ENTRY_OPENING, balance_at, get_balance_history, post_transaction, realign_opening_entries,
+    record_balance_adjustment, refresh_balance_snapshots
+)
+
+
+def _create_account(user, balance):
+    account = Account(name='Карта', account_type='debit', currency='RUB', user_id=user.id)
+    record_balance_adjustment(account, Decimal(balance))
+    db.session.add(account)
+    db.session.commit()
+    return account
+
+
+def _post(account, user, transaction_type, amount, when):
+    transaction = BankingTransaction(transaction_type=transaction_type, amount=Decimal(amount), date=when,
+                                     account_id=account.id, user_id=user.id)
+    db.session.add(transaction)
+    post_transaction(transaction, account)
+    db.session.commit()
+    return transaction
+
+
+def _opening(account):
+    return AccountLedgerEntry.query.filter_by(account_id=account.id, entry_type=ENTRY_OPENING).one()
+
+
+def test_backdated_transaction_moves_opening_balance(app, user):
+    account = _create_account(user, 1000)
+    _post(account, user, 'expense', 100, datetime(2024, 5, 17, 12, 0))
+    _post(account, user, 'income', 50, datetime(2024, 3, 1, 9, 0))
+
+    assert _opening(account).occurred_at == datetime(2024, 3, 1, 8, 59, 59)
+    assert account.balance == Decimal('950')
+    assert balance_at(account.id, datetime(2024, 3, 1)) == Decimal('0')
+    assert balance_at(account.id, datetime(2024, 3, 1, 9, 0)) == Decimal('1000')
+    assert balance_at(account.id, datetime(2024, 5, 1)) == Decimal('1050')
+    assert balance_at(account.id, datetime(2024, 6, 1)) == Decimal('950')
+
+
+def test_moved_opening_invalidates_snapshots(app, user):
+    account = _create_account(user, 1000)
+    _post(account, user, 'expense', 100, datetime(2024, 5, 17))
+    refresh_balance_snapshots([account.id])
+    assert balance_at(account.id, datetime(2024, 6, 1)) == Decimal('900')
+
+    _post(account, user, 'expense', 200, datetime(2024, 1, 10))
+    assert not AccountBalanceSnapshot.query.filter(
+        AccountBalanceSnapshot.account_id == account.id, AccountBalanceSnapshot.as_of > datetime(2024, 1, 10)
+    ).count()
+    refresh_balance_snapshots([account.id])
+    assert balance_at(account.id, datetime(2024, 2, 1)) == Decimal('800')
+    assert balance_at(account.id, datetime(2024, 6, 1)) == Decimal('700')
+
+
+def test_realign_opening_entries(app, user):
+    account = _create_account(user, 1000)
+    # Журнал, созданный до переноса начального баланса: операция раньше начальной записи
+    db.session.add(AccountLedgerEntry(account_id=account.id, entry_type='transaction', amount=Decimal('-100'),
+                                      occurred_at=datetime(2024, 2, 1)))
+    db.session.commit()
+
+    assert realign_opening_entries() == 1
+    assert _opening(account).occurred_at == datetime(2024, 1, 31, 23, 59, 59)
+    assert realign_opening_entries() == 0
+    assert balance_at(account.id, datetime(2024, 2, 1)) == Decimal('1000')
+
+
+def test_balance_history_periods_per_unit(app, user):
+    account = _create_account(user, 1000)
+    _post(account, user, 'expense', 100, datetime(2024, 5, 17, 12, 0))
+    _post(account, user, 'expense', 50, datetime(2024, 5, 20, 12, 0))
+
+    by_month = get_balance_history(account.id, date(2024, 5, 1), date(2024, 5, 31), unit='month')
+    by_day = get_balance_history(account.id, date(2024, 5, 1), date(2024, 5, 31), unit='day')
+
+    assert [point['period'] for point in by_month['points']] == ['2024-05']
+    assert [point['period'] for point in by_day['points']] == ['2024-05-17', '2024-05-20']
+    # Начальный баланс датирован секундой раньше первой операции и попадает в ее день
+    assert by_day['opening_balance'] == Decimal('0')
+    assert [point['change'] for point in by_day['points']] == [Decimal('900'), Decimal('-50')]
+    assert [point['balance'] for point in by_day['points']] == [Decimal('900'), Decimal('850')]
+    assert by_day['closing_balance'] == by_month['closing_balance'] == Decimal('850')
+
+
+def test_balance_history_endpoint_units(app, user, client):
+    account = _create_account(user, 1000)
+    _post(account, user, 'expense', 100, datetime(2024, 5, 17, 12, 0))
+    url = f'/api/accounts/{account.id}/balance-history'
+
+    for unit, periods in (('month', ['2024-05']), ('day', ['2024-05-17']), ('year', ['2024'])):
+        response = client.get(url, query_string={'start': '2024-05-01', 'end': '2024-05-31', 'unit': unit})
+        assert response.status_code == 200
+        data = response.get_json()
+        assert [point['period'] for point in data['points']] == periods
+        assert data['closing_balance'] == '900.00'
+
+    assert client.get(url, query_string={'unit': 'week'}).status_code == 400
+
+
+def test_backfill_reconciles_partial_ledger(app, user):
+    from services.account_ledger import backfill_ledger
+
+    # Счет и операция, созданные до появления журнала
+    account = Account(name='Карта', account_type='debit', currency='RUB', balance=Decimal('900'), user_id=user.id)
+    db.session.add(account)
+    db.session.flush()
+    db.session.add(BankingTransaction(transaction_type='expense', amount=Decimal('100'), date=datetime(2024, 5, 17),
+                                      account_id=account.id, user_id=user.id))
+    db.session.commit()
+    # Операция после деплоя, но до заполнения журнала: журнал счета частичный, без начальной записи
+    _post(account, user, 'income', 50, datetime(2024, 6, 1))
+
+    assert backfill_ledger() == (1, 2)
+    assert _opening(account).amount == Decimal('1000')
+    assert _opening(account).occurred_at == datetime(2024, 5, 16, 23, 59, 59)
+    assert balance_at(account.id, datetime(2024, 5, 18)) == Decimal('900')
+    assert balance_at(account.id, datetime(2030, 1, 1)) == Decimal('950')
+    assert backfill_ledger() == (0, 0)
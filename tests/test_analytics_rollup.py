@@ -0,0 +1,35 @@
+from datetime import date
+from decimal import Decimal
+
+from extensions import db
+from models import BankingDailyRollup
+from services.analytics_rollup import get_flow_over_time
+
+
+def _add_rollup(user_id, day, transaction_type, total):
+    db.session.add(BankingDailyRollup(user_id=user_id, day=day, transaction_type=transaction_type, account_id=1,
+                                      source='transaction', total=total, tx_count=1))
+
+
+def test_flow_over_time_day_and_month_in_same_process(app, user):
+    _add_rollup(user.id, date(2024, 5, 17), 'expense', 100)
+    _add_rollup(user.id, date(2024, 5, 20), 'expense', 50)
+    _add_rollup(user.id, date(2024, 6, 1), 'income', 30)
+    db.session.commit()
+
+    start, end = date(2024, 5, 1), date(2024, 6, 30)
+    # Как на странице аналитики: период до 60 дней по дням, длиннее - по месяцам, затем снова по дням
+    by_day = get_flow_over_time(user.id, start, end, unit='day')
+    by_month = get_flow_over_time(user.id, start, end, unit='month')
+    by_day_again = get_flow_over_time(user.id, start, end, unit='day')
+
+    assert [tuple(row) for row in by_day] == [
+        ('2024-05-17', 'expense', Decimal('100')),
+        ('2024-05-20', 'expense', Decimal('50')),
+        ('2024-06-01', 'income', Decimal('30')),
+    ]
+    assert [tuple(row) for row in by_month] == [
+        ('2024-05', 'expense', Decimal('150')),
+        ('2024-06', 'income', Decimal('30')),
+    ]
+    assert by_day_again == by_day
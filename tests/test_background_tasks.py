@@ -0,0 +1,39 @@
+import threading
+from decimal import Decimal
+
+import pytest
+
+import api_clients
+from background_tasks import update_usdt_rub_rate_in_background
+from extensions import scheduler
+from services import currency_rates
+from services.json_cache import get_cached
+
+
+@pytest.fixture
+def scheduler_app(app, monkeypatch):
+    monkeypatch.setattr(scheduler, 'app', app)
+    monkeypatch.setattr(currency_rates, '_snapshot', currency_rates._snapshot)
+    monkeypatch.setattr(currency_rates, '_loaded_at', None)
+    monkeypatch.setattr(api_clients, 'fetch_cbr_rates', lambda: {'USD': Decimal('95.5'), 'EUR': Decimal('101.2')})
+    return app
+
+
+def test_rate_job_runs_without_app_context(scheduler_app):
+    errors = []
+
+    def run_like_scheduler():
+        # Поток планировщика: контекста приложения нет
+        try:
+            update_usdt_rub_rate_in_background()
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=run_like_scheduler)
+    thread.start()
+    thread.join()
+
+    assert not errors
+    cached_rates, _ = get_cached(currency_rates.CACHE_KEY, default={})
+    assert cached_rates['USD'] == '95.5' and cached_rates['USDT'] == '95.5'
+    assert currency_rates.get_currency_rates()['EUR'] == Decimal('101.2')
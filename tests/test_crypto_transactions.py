@@ -0,0 +1,41 @@
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from extensions import db
+from models import InvestmentPlatform, Transaction
+
+
+def _add_transactions(user, count):
+    platform = InvestmentPlatform(name='Bybit', platform_type='crypto_exchange', user_id=user.id)
+    db.session.add(platform)
+    start = datetime(2024, 1, 1)
+    for index in range(count):
+        db.session.add(Transaction(
+            timestamp=start + timedelta(hours=index), type='buy', asset1_ticker='BTC', asset1_amount=Decimal('0.0100'),
+            asset2_ticker='USDT', asset2_amount=Decimal('600'), execution_price=Decimal('60000'),
+            platform=platform, user_id=user.id
+        ))
+    db.session.commit()
+
+
+def test_api_crypto_transactions_pages_by_cursor(app, user, client):
+    _add_transactions(user, 160)
+
+    first = client.get('/api/crypto-transactions')
+    assert first.status_code == 200
+    data = first.get_json()
+    assert data['has_next'] and data['next_cursor']
+    assert data['html'].count('class="transaction-row"') == 150
+    assert 'Bybit' in data['html'] and 'data-asset1-amount="0.01"' in data['html']
+
+    second = client.get('/api/crypto-transactions', query_string={'cursor': data['next_cursor']})
+    assert second.status_code == 200
+    data = second.get_json()
+    assert not data['has_next']
+    assert data['html'].count('class="transaction-row"') == 10
+
+
+def test_api_crypto_transactions_empty(app, user, client):
+    response = client.get('/api/crypto-transactions')
+    assert response.status_code == 200
+    assert response.get_json()['html'].strip() == ''
@@ -0,0 +1,68 @@
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+from extensions import db
+from models import (
+    Account, BankingTransaction, DashboardSnapshot, HistoricalPriceCache, InvestmentAsset, InvestmentPlatform, User
+)
+
+
+@pytest.fixture
+def users(app, user):
+    other = User(username='other')
+    other.set_password('secret')
+    db.session.add(other)
+    db.session.commit()
+    for owner in (user, other):
+        db.session.add(DashboardSnapshot(user_id=owner.id, json_data='{}', is_stale=False))
+    db.session.add_all([
+        Account(name='Счет 1', account_type='debit', currency='RUB', balance=0, user_id=user.id),
+        Account(name='Счет 2', account_type='debit', currency='RUB', balance=0, user_id=other.id),
+        InvestmentPlatform(name='Bybit', platform_type='crypto_exchange', user_id=user.id),
+    ])
+    db.session.commit()
+    _reset()
+    return user, other
+
+
+def _stale_users():
+    db.session.expire_all()
+    return {snapshot.user_id for snapshot in DashboardSnapshot.query.filter_by(is_stale=True)}
+
+
+def _reset():
+    DashboardSnapshot.query.update({'is_stale': False})
+    db.session.commit()
+
+
+def test_change_marks_only_owner_stale(users):
+    user, other = users
+    account = Account.query.filter_by(user_id=other.id).one()
+    account.balance = Decimal('10')
+    db.session.commit()
+    assert _stale_users() == {other.id}
+
+
+def test_owner_resolved_through_account_and_platform(users):
+    user, other = users
+    account = Account.query.filter_by(user_id=user.id).one()
+    # Операция без user_id: владелец определяется по счету
+    db.session.add(BankingTransaction(transaction_type='expense', amount=Decimal('5'), date=datetime(2024, 5, 17),
+                                      account_id=account.id))
+    db.session.commit()
+    assert _stale_users() == {user.id}
+
+    _reset()
+    platform = InvestmentPlatform.query.one()
+    db.session.add(InvestmentAsset(ticker='BTC', quantity=Decimal('1'), platform_id=platform.id))
+    db.session.commit()
+    assert _stale_users() == {user.id}
+
+
+def test_shared_data_marks_all_stale(users):
+    user, other = users
+    db.session.add(HistoricalPriceCache(ticker='BTC', period='7d', change_percent=1.5))
+    db.session.commit()
+    assert _stale_users() == {user.id, other.id}
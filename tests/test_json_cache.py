@@ -0,0 +1,80 @@
+from datetime import timedelta
+
+import pytest
+
+from extensions import db
+from models import JsonCache, User
+from services import json_cache
+
+
+@pytest.fixture(autouse=True)
+def clean_local_state(app):
+    json_cache.clear_local_cache()
+    yield
+    json_cache._inflight.clear()
+
+
+def _lease(cache_key):
+    db.session.expire_all()
+    return db.session.query(JsonCache.refresh_started_at).filter_by(cache_key=cache_key).scalar()
+
+
+def test_lease_does_not_commit_caller_session(app):
+    db.session.add(User(username='pending'))
+
+    assert json_cache._try_acquire_refresh('rates')
+    db.session.rollback()
+
+    assert User.query.filter_by(username='pending').first() is None
+    assert _lease('rates') is not None
+
+
+def test_lease_is_exclusive_until_released(app):
+    json_cache.set_cached('rates', {'USD': '90'})
+
+    assert json_cache._try_acquire_refresh('rates')
+    json_cache._release_inflight('rates')
+    # Аренда в БД держит ключ и для других воркеров
+    assert not json_cache._try_acquire_refresh('rates')
+
+    json_cache._release_refresh('rates')
+    assert _lease('rates') is None
+    assert json_cache._try_acquire_refresh('rates')
+
+
+def test_not_modified_refresh_extends_ttl(app):
+    json_cache.set_cached('rates', {'USD': '90'})
+    data = json_cache.get_or_refresh('rates', lambda: json_cache.NOT_MODIFIED, ttl=timedelta(hours=1), force=True)
+
+    assert data == {'USD': '90'}
+    assert _lease('rates') is None
+    assert json_cache.get_cached('rates')[0] == {'USD': '90'}
+
+
+def test_refresh_on_miss_keeps_caller_session(app):
+    db.session.add(User(username='pending'))
+
+    data = json_cache.get_or_refresh('rates', lambda: {'USD': '91'}, ttl=timedelta(hours=1))
+    assert data == {'USD': '91'}
+    db.session.rollback()
+    assert User.query.filter_by(username='pending').first() is None
+
+    db.session.add(User(username='kept'))
+
+    def failing_refresh():
+        raise RuntimeError('source unavailable')
+
+    assert json_cache.get_or_refresh('news', failing_refresh, ttl=timedelta(hours=1), default=[]) == []
+    db.session.commit()
+    assert User.query.filter_by(username='kept').one()
+    assert _lease('news') is None
+
+
+def test_set_cached_increments_version(app):
+    json_cache.set_cached('rates', {'USD': '90'})
+    json_cache.set_cached('rates', {'USD': '92'})
+    json_cache.clear_local_cache()
+
+    entry = JsonCache.query.filter_by(cache_key='rates').one()
+    assert entry.version == 2 and entry.refresh_started_at is None
+    assert json_cache.get_cached('rates')[0] == {'USD': '92'}
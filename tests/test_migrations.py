@@ -0,0 +1,157 @@
+import importlib.util
+import os
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+
+from extensions import db
+from models import Account, AccountLedgerEntry, BankingTransaction
+
+VERSIONS = os.path.join(os.path.dirname(__file__), '..', 'migrations', 'versions')
+
+
+def _load_migration(revision):
+    path = next(os.path.join(VERSIONS, name) for name in os.listdir(VERSIONS) if name.startswith(revision))
+    spec = importlib.util.spec_from_file_location(f'migration_{revision}', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _run_in_migration(func):
+    """Выполняет шаг миграции на соединении сессии, как при flask db upgrade."""
+    connection = db.session.connection()
+    with Operations.context(MigrationContext.configure(connection)):
+        func()
+    db.session.commit()
+
+
+@pytest.fixture
+def banking_data(app, user):
+    """Счета и операции без журнала и агрегатов - состояние базы до миграций."""
+    card = Account(name='Карта', account_type='debit', currency='RUB', balance=Decimal('850'), user_id=user.id)
+    credit = Account(name='Кредитка', account_type='credit', currency='RUB', balance=Decimal('300'), user_id=user.id)
+    db.session.add_all([card, credit])
+    db.session.flush()
+    db.session.add_all([
+        BankingTransaction(transaction_type='expense', amount=Decimal('100'), date=datetime(2024, 5, 17, 12, 0),
+                           account_id=card.id, user_id=user.id, merchant='Магазин', counterparty='Иван'),
+        BankingTransaction(transaction_type='income', amount=Decimal('50'), date=datetime(2024, 5, 20, 9, 0),
+                           account_id=card.id, user_id=user.id, counterparty='Иван'),
+        BankingTransaction(transaction_type='transfer', amount=Decimal('200'), date=datetime(2024, 6, 1, 10, 0),
+                           account_id=credit.id, to_account_id=card.id, user_id=user.id),
+    ])
+    db.session.commit()
+    # Операции созданы моделями: слушатели могли заполнить производные таблицы, очищаем их
+    AccountLedgerEntry.query.delete()
+    db.session.commit()
+    return card, credit
+
+
+def test_ledger_migration_matches_backfill(banking_data):
+    from services.account_ledger import ENTRY_OPENING, backfill_ledger, balance_at
+
+    card, credit = banking_data
+    _run_in_migration(_load_migration('a9b0c1d2e3f5')._fill_ledger)
+
+    # Журнал, заполненный миграцией, уже сверен с балансами
+    assert backfill_ledger() == (0, 0)
+    assert balance_at(card.id, datetime(2030, 1, 1)) == Decimal('850')
+    assert balance_at(credit.id, datetime(2030, 1, 1)) == Decimal('300')
+    # 850 = opening - 100 + 50 + 200
+    assert balance_at(card.id, datetime(2024, 5, 17, 12, 0)) == Decimal('700')
+    card_opening = AccountLedgerEntry.query.filter_by(account_id=card.id, entry_type=ENTRY_OPENING).one()
+    assert card_opening.occurred_at == datetime(2024, 5, 17, 11, 59, 59)
+    # Перевод с кредитной карты увеличивает задолженность: до перевода 100
+    assert balance_at(credit.id, datetime(2024, 6, 1, 10, 0)) == Decimal('100')
+
+
+def _rerun_upgrade(revision, *tables):
+    """Удаляет таблицы миграции и выполняет ее upgrade() заново на текущих данных."""
+    connection = db.session.connection()
+    for table in tables:
+        table.drop(connection)
+    _run_in_migration(_load_migration(revision).upgrade)
+
+
+def _rows(query):
+    return sorted(tuple(str(value) for value in row) for row in query)
+
+
+def test_rollup_migration_matches_rebuild(banking_data):
+    from models import BankingDailyRollup, TransactionItem
+    from services.analytics_rollup import rebuild_all_rollups
+
+    card, _ = banking_data
+    expense = BankingTransaction.query.filter_by(transaction_type='expense').one()
+    db.session.add(TransactionItem(name='Хлеб', quantity=1, price=Decimal('40'), total=Decimal('40'), transaction_id=expense.id))
+    db.session.commit()
+
+    _rerun_upgrade('c5d6e7f8a9b0', BankingDailyRollup.__table__)
+    columns = [getattr(BankingDailyRollup, name) for name in ('user_id', 'day', 'transaction_type', 'account_id',
+                                                              'category_id', 'merchant', 'source', 'total', 'tx_count')]
+    migrated = _rows(db.session.query(*columns))
+    assert len(migrated) == 4
+
+    rebuild_all_rollups()
+    assert _rows(db.session.query(*columns)) == migrated
+
+
+def test_counterparty_balance_migration_matches_rebuild(banking_data, user):
+    from models import CounterpartyBalance, Debt
+    from services.counterparty_balances import get_counterparty_summary, rebuild_all_counterparty_balances
+
+    db.session.add_all([
+        Debt(debt_type='owed_to_me', counterparty='Иван', initial_amount=Decimal('500'), repaid_amount=Decimal('100'),
+             currency='RUB', status='active', user_id=user.id, created_at=datetime(2024, 4, 1)),
+        Debt(debt_type='i_owe', counterparty='Иван', initial_amount=Decimal('150'), repaid_amount=Decimal('0'),
+             currency='RUB', status='active', user_id=user.id, created_at=datetime(2024, 4, 2)),
+        Debt(debt_type='i_owe', counterparty='Петр', initial_amount=Decimal('70'), repaid_amount=Decimal('70'),
+             currency='USD', status='repaid', user_id=user.id, created_at=datetime(2024, 4, 3)),
+    ])
+    db.session.commit()
+
+    CounterpartyBalance.query.delete()
+    db.session.commit()
+    _run_in_migration(_load_migration('b0c1d2e3f4a6')._fill_counterparty_balances)
+    columns = [column for name, column in CounterpartyBalance.__table__.columns.items() if name != 'id']
+    migrated = _rows(db.session.query(*columns))
+    assert len(migrated) == 3
+
+    summary = get_counterparty_summary(user.id, 'Иван')
+    assert summary['total_debt_balance'] == Decimal('250')
+    assert summary['tx_count'] == 2
+    # Доход 50 минус расход 100
+    assert summary['by_currency'][0].tx_total == Decimal('-50')
+    assert summary['by_currency'][0].i_owe_active_count == summary['by_currency'][0].owed_to_me_active_count == 1
+
+    rebuild_all_counterparty_balances()
+    assert _rows(db.session.query(*columns)) == migrated
+
+
+def test_counterparty_directory_migration_matches_rebuild(banking_data, user):
+    from models import Counterparty, Debt, RecurringPayment
+    from services.counterparty_directory import rebuild_counterparties
+
+    db.session.add_all([
+        Debt(debt_type='owed_to_me', counterparty='иван ', initial_amount=Decimal('500'), repaid_amount=Decimal('0'),
+             currency='RUB', status='active', user_id=user.id),
+        RecurringPayment(description='Аренда', amount=Decimal('1000'), currency='RUB', frequency='monthly',
+                         next_due_date=datetime(2024, 7, 1).date(), counterparty='Арендодатель', user_id=user.id),
+    ])
+    db.session.commit()
+
+    Counterparty.query.delete()
+    db.session.commit()
+    _run_in_migration(_load_migration('e7f8a9b0c1d2')._fill_counterparties)
+    columns = [Counterparty.user_id, Counterparty.name, Counterparty.name_key, Counterparty.usage_count]
+    migrated = _rows(db.session.query(*columns))
+    # 'Иван' из двух операций и 'иван ' из долга - одно имя
+    assert [row[2:] for row in migrated if row[2] == 'иван'] == [('иван', '3')]
+    assert len(migrated) == 3
+
+    rebuild_counterparties()
+    assert _rows(db.session.query(*columns)) == migrated
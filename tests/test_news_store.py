@@ -0,0 +1,33 @@
+import pytest
+
+from models import HttpFetchState, NewsArticle
+from services import news_store
+from services.conditional_fetch import FetchResult
+
+
+@pytest.fixture
+def news_page(app, monkeypatch):
+    """Одна страница ленты с ответом API, который еще не запомнен."""
+    article = {'url': 'https://example.com/a', 'published_on': 1715900000, 'title': 'Title', 'body': 'Body',
+               'categories': 'BTC'}
+    result = FetchResult('key', 'https://example.com/news?lang=EN', 200, b'{}', 'hash', '"etag"', None, False)
+    monkeypatch.setattr(news_store, 'fetch_cryptocompare_news', lambda **kwargs: ([article], result))
+    monkeypatch.setattr(news_store, 'score_articles', lambda titles, bodies: [0.0] * len(titles))
+    return article
+
+
+def test_failed_save_does_not_remember_response(news_page, monkeypatch):
+    def fail(texts):
+        raise RuntimeError('translator is down')
+
+    monkeypatch.setattr(news_store, 'translate_texts', fail)
+    assert news_store.ingest_crypto_news() == 0
+    # Следующий условный запрос должен снова получить и разобрать эту страницу
+    assert HttpFetchState.query.count() == 0
+
+
+def test_response_remembered_after_save(news_page, monkeypatch):
+    monkeypatch.setattr(news_store, 'translate_texts', lambda texts: texts)
+    assert news_store.ingest_crypto_news() == 1
+    assert NewsArticle.query.count() == 1
+    assert HttpFetchState.query.one().content_hash == 'hash'
@@ -0,0 +1,65 @@
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pytest
+
+from extensions import db
+from models import InvestmentPlatform, JsonCache, Transaction
+from services import pagination
+from services.pagination import keyset_paginate
+
+
+@pytest.fixture
+def transactions(app, user):
+    pagination._count_cache.clear()
+    platform = InvestmentPlatform(name='Bybit', platform_type='crypto_exchange', user_id=user.id)
+    db.session.add(platform)
+    for index in range(7):
+        db.session.add(Transaction(
+            timestamp=datetime(2024, 1, 1) + timedelta(hours=index), type='buy', asset1_ticker='BTC',
+            asset1_amount=Decimal('0.01'), asset2_ticker='USDT',
+            # Часть строк без суммы второго актива
+            asset2_amount=None if index % 3 == 0 else Decimal(100 + index),
+            platform=platform, user_id=user.id
+        ))
+    db.session.commit()
+    yield Transaction.query
+    pagination._count_cache.clear()
+
+
+def _all_pages(query, sort_column, descending, direction='next'):
+    ids, cursor = [], None
+    while True:
+        page = keyset_paginate(query, sort_column, Transaction.id, descending=descending, per_page=2, cursor=cursor)
+        ids.extend(row.id for row in page.items)
+        if not page.has_next:
+            return ids
+        cursor = page.next_cursor
+
+
+@pytest.mark.parametrize('descending', [True, False])
+def test_nullable_numeric_sort_keeps_null_rows(transactions, descending):
+    ids = _all_pages(transactions, Transaction.asset2_amount, descending)
+    assert sorted(ids) == [row.id for row in Transaction.query.order_by(Transaction.id)]
+    assert len(ids) == len(set(ids))
+
+
+def test_prev_cursor_returns_previous_page(transactions):
+    first = keyset_paginate(transactions, Transaction.asset2_amount, Transaction.id, per_page=3)
+    second = keyset_paginate(transactions, Transaction.asset2_amount, Transaction.id, per_page=3, cursor=first.next_cursor)
+    back = keyset_paginate(transactions, Transaction.asset2_amount, Transaction.id, per_page=3, cursor=second.prev_cursor)
+    assert [row.id for row in back.items] == [row.id for row in first.items]
+
+
+def test_count_is_cached_in_process(transactions):
+    first = keyset_paginate(transactions, Transaction.timestamp, Transaction.id, per_page=2, count_cache_key='count_test')
+    assert first.total == 7
+
+    db.session.add(Transaction(timestamp=datetime(2024, 2, 1), type='buy', platform_id=1, user_id=1))
+    db.session.commit()
+    cached = keyset_paginate(transactions, Transaction.timestamp, Transaction.id, per_page=2, count_cache_key='count_test')
+    assert cached.total == 7
+    assert not JsonCache.query.filter(JsonCache.cache_key.like('count_%')).count()
+
+    pagination._count_cache.clear()
+    assert keyset_paginate(transactions, Transaction.timestamp, Transaction.id, per_page=2, count_cache_key='count_test').total == 8
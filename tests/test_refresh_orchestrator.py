@@ -0,0 +1,40 @@
+import threading
+import time
+
+from logic import refresh_orchestrator
+from logic.refresh_orchestrator import RefreshTask, run_refresh_tasks
+
+
+def test_serial_tasks_run_one_at_a_time(app, monkeypatch):
+    lock = threading.Lock()
+    running = set()
+    overlaps = []
+    order = []
+
+    def task(name, serial):
+        def func():
+            with lock:
+                order.append(name)
+                if serial:
+                    overlaps.extend(other for other in running if other.startswith('serial'))
+                running.add(name)
+            time.sleep(0.05)
+            with lock:
+                running.discard(name)
+            # Ошибка задачи не должна мешать следующим задачам с serial=True
+            return name != 'serial_prices', name
+        return RefreshTask(name, name, func, (), False, serial)
+
+    monkeypatch.setattr(refresh_orchestrator, 'REFRESH_TASKS', [
+        task('serial_prices', True),
+        task('parallel_chart', False),
+        task('serial_history', True),
+    ])
+
+    results = run_refresh_tasks(jobs=4)
+
+    assert not overlaps
+    assert order.index('serial_prices') < order.index('serial_history')
+    # Параллельная задача стартует, не дожидаясь первой задачи с serial=True
+    assert order[:2] == ['serial_prices', 'parallel_chart']
+    assert results['serial_history']['success'] and not results['serial_prices']['success']
@@ -0,0 +1,33 @@
+import pytest
+from sqlalchemy import literal_column, select
+
+from extensions import db
+from services.sql_helpers import check_analytics_indexes, time_bucket
+
+
+@pytest.mark.parametrize('units', [('month', 'day', 'year', 'day'), ('day', 'year', 'month')])
+def test_time_bucket_label_per_unit(app, units):
+    expected = {'day': '2024-05-17', 'month': '2024-05', 'year': '2024'}
+    value = literal_column("'2024-05-17 13:45:00'")
+    # Один процесс, разные периоды подряд: SQL не должен браться из кэша компиляции другого периода
+    for unit in units:
+        assert db.session.execute(select(time_bucket(unit, value))).scalar() == expected[unit]
+
+
+def test_time_bucket_cache_key_includes_unit():
+    column = literal_column('day')
+    assert time_bucket('day', column)._generate_cache_key() != time_bucket('month', column)._generate_cache_key()
+    assert time_bucket('day', column)._generate_cache_key() == time_bucket('day', column)._generate_cache_key()
+
+
+def test_time_bucket_rejects_unknown_unit():
+    with pytest.raises(ValueError):
+        time_bucket('week', literal_column('day'))
+
+
+def test_analytics_queries_use_indexes(app):
+    results = check_analytics_indexes()
+    assert results
+    missing = [f"{result['name']}: {result['index']} -> {result['plan']}" for result in results if not result['used']]
+    assert not missing, '\n'.join(missing)
+
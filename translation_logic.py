@@ -1,61 +1,167 @@
 import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
 from flask import current_app
 from deep_translator import GoogleTranslator
+from sqlalchemy import delete
 from models import TranslationCache
 from extensions import db
-from sqlalchemy.exc import IntegrityError
 
-def translate_text(text: str, source: str = 'en', target: str = 'ru') -> str:
-    """
-    Переводит текст с исходного языка на целевой,
-    используя кэш в базе данных, чтобы избежать повторных переводов.
-    """
+# API Google Translate имеет ограничение около 5000 символов, лимит берем с запасом
+MAX_TEXT_LENGTH = 4900
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_LRU_SIZE = 2048
+DEFAULT_RETENTION_DAYS = 90
+DEFAULT_MAX_ROWS = 50000
+_LOOKUP_CHUNK = 500
+
+# LRU процесса перед таблицей TranslationCache: (хэш, исходный язык, целевой язык) -> перевод.
+# Переводы не меняются, поэтому записи LRU не требуют сверки с БД.
+_lru = OrderedDict()
+_lru_lock = threading.Lock()
+
+
+def _prepare_text(text) -> str:
     if not text or not isinstance(text, str):
         return ""
+    return text[:MAX_TEXT_LENGTH]
 
-    # ИЗМЕНЕНО: Добавляем ограничение на длину текста, чтобы избежать ошибок API.
-    # API Google Translate имеет ограничение около 5000 символов.
-    # Устанавливаем лимит с запасом, чтобы гарантировать успешный перевод.
-    if len(text) > 4900:
-        text = text[:4900]
 
+def _text_hash(text: str) -> str:
     # Используем MD5 хэш от текста в качестве ключа для кэша
-    text_hash = hashlib.md5(text.encode('utf-8')).hexdigest()
+    return hashlib.md5(text.encode('utf-8')).hexdigest()
+
 
-    # 1. Сначала проверяем кэш
-    cached_translation = TranslationCache.query.filter_by(
-        source_hash=text_hash,
-        source_lang=source,
-        target_lang=target
-    ).first()
+def _lru_get(hashes: list[str], source: str, target: str) -> dict[str, str]:
+    found = {}
+    with _lru_lock:
+        for text_hash in hashes:
+            key = (text_hash, source, target)
+            if key in _lru:
+                _lru.move_to_end(key)
+                found[text_hash] = _lru[key]
+    return found
 
-    if cached_translation:
-        current_app.logger.info(f"--- [Translation] Cache HIT for hash: {text_hash}")
-        return cached_translation.translated_text
 
-    current_app.logger.info(f"--- [Translation] Cache MISS for hash: {text_hash}. Calling translation API...")
+def _lru_put(translations: dict[str, str], source: str, target: str):
+    max_size = current_app.config.get('TRANSLATION_LRU_SIZE', DEFAULT_LRU_SIZE)
+    with _lru_lock:
+        for text_hash, translated_text in translations.items():
+            _lru[(text_hash, source, target)] = translated_text
+            _lru.move_to_end((text_hash, source, target))
+        while len(_lru) > max_size:
+            _lru.popitem(last=False)
 
-    # 2. Если в кэше нет, переводим
+
+def _cached_translations(hashes: list[str], source: str, target: str) -> dict[str, str]:
+    """Переводы из кэша для списка хэшей: один запрос IN на пачку."""
+    cached = {}
+    for start in range(0, len(hashes), _LOOKUP_CHUNK):
+        chunk = hashes[start:start + _LOOKUP_CHUNK]
+        cached.update(db.session.query(TranslationCache.source_hash, TranslationCache.translated_text).filter(
+            TranslationCache.source_hash.in_(chunk),
+            TranslationCache.source_lang == source,
+            TranslationCache.target_lang == target
+        ).all())
+    return cached
+
+
+def _translate_one(text: str, source: str, target: str):
+    """Выполняется в рабочем потоке без контекста приложения: возвращает (перевод или None, ошибка или None)."""
     try:
-        translated_text = GoogleTranslator(source=source, target=target).translate(text)
-        if not translated_text:
-            return text # Возвращаем оригинал в случае пустого ответа
+        return GoogleTranslator(source=source, target=target).translate(text), None
+    except Exception as e:
+        return None, e
 
-        # 3. Сохраняем в кэш
-        new_cache_entry = TranslationCache(
-            source_hash=text_hash, source_lang=source, target_lang=target, translated_text=translated_text
-        )
-        db.session.add(new_cache_entry)
+
+def _save_translations(rows: list[dict]):
+    """Пакетная вставка в кэш. Записи, которые успел сохранить другой процесс, пропускаются."""
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    try:
+        db.session.execute(insert(TranslationCache).on_conflict_do_nothing(
+            index_elements=['source_hash', 'source_lang', 'target_lang']
+        ), rows)
         db.session.commit()
-        return translated_text
-    except IntegrityError:
-        # Эта ошибка возникает, если два процесса одновременно пытаются вставить одну и ту же запись.
-        # Это безопасно, так как запись уже будет в БД. Просто откатываем нашу сессию.
-        db.session.rollback()
-        current_app.logger.info(f"--- [Translation] Race condition detected for hash: {text_hash}. Another process saved it first.")
-        return translated_text # Возвращаем результат, который мы уже получили от API
     except Exception as e:
-        current_app.logger.error(f"Ошибка во время перевода: {e}")
         db.session.rollback()
-        # В случае ошибки возвращаем оригинальный текст, чтобы не ломать интерфейс
-        return text
\ No newline at end of file
+        current_app.logger.error(f"--- [Translation] Не удалось сохранить переводы в кэш: {e}")
+
+
+def translate_texts(texts: list, source: str = 'en', target: str = 'ru') -> list[str]:
+    """
+    Переводит список текстов, сохраняя порядок.
+    Переводы ищутся в LRU процесса, затем одним запросом IN по хэшам в TranslationCache, промахи переводятся параллельно
+    (не более TRANSLATION_MAX_WORKERS потоков) и сохраняются в кэш одной пакетной вставкой.
+    Для пустых текстов возвращается "", для текстов, которые не удалось перевести, - оригинал.
+    """
+    prepared = [_prepare_text(text) for text in texts]
+    hashes = [_text_hash(text) if text else None for text in prepared]
+    hash_to_text = {text_hash: text for text_hash, text in zip(hashes, prepared) if text_hash}
+    if not hash_to_text:
+        return prepared
+
+    translations = _lru_get(list(hash_to_text), source, target)
+    from_memory = len(translations)
+    not_in_memory = [text_hash for text_hash in hash_to_text if text_hash not in translations]
+    if not_in_memory:
+        from_db = _cached_translations(not_in_memory, source, target)
+        _lru_put(from_db, source, target)
+        translations.update(from_db)
+    missing = [text_hash for text_hash in hash_to_text if text_hash not in translations]
+    if missing:
+        current_app.logger.info(
+            f"--- [Translation] Текстов: {len(hash_to_text)}, из памяти: {from_memory}, из БД: {len(translations) - from_memory}, перевод через API: {len(missing)}."
+        )
+
+    if missing:
+        max_workers = max(1, min(current_app.config.get('TRANSLATION_MAX_WORKERS', DEFAULT_MAX_WORKERS), len(missing)))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(lambda text_hash: _translate_one(hash_to_text[text_hash], source, target), missing))
+        new_rows = []
+        for text_hash, (translated_text, error) in zip(missing, results):
+            if error is not None:
+                current_app.logger.error(f"Ошибка во время перевода: {error}")
+            elif translated_text:
+                translations[text_hash] = translated_text
+                new_rows.append({'source_hash': text_hash, 'source_lang': source, 'target_lang': target, 'translated_text': translated_text})
+        if new_rows:
+            _save_translations(new_rows)
+            _lru_put({row['source_hash']: row['translated_text'] for row in new_rows}, source, target)
+
+    # В случае ошибки или пустого ответа возвращаем оригинальный текст, чтобы не ломать интерфейс
+    return [translations.get(text_hash, text) for text_hash, text in zip(hashes, prepared)]
+
+
+def translate_text(text: str, source: str = 'en', target: str = 'ru') -> str:
+    """
+    Переводит текст с исходного языка на целевой,
+    используя кэш в базе данных, чтобы избежать повторных переводов.
+    """
+    return translate_texts([text], source, target)[0]
+
+
+def prune_translation_cache(retention_days: int | None = None, max_rows: int | None = None) -> int:
+    """
+    Удаляет из TranslationCache записи старше retention_days дней, а затем самые старые записи
+    сверх max_rows. Возвращает количество удаленных записей.
+    """
+    if retention_days is None:
+        retention_days = current_app.config.get('TRANSLATION_CACHE_RETENTION_DAYS', DEFAULT_RETENTION_DAYS)
+    if max_rows is None:
+        max_rows = current_app.config.get('TRANSLATION_CACHE_MAX_ROWS', DEFAULT_MAX_ROWS)
+
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    deleted_count = db.session.execute(delete(TranslationCache).where(TranslationCache.created_at < cutoff)).rowcount
+    # id растет вместе с датой создания: все, что старше max_rows-й записи с конца, удаляется
+    boundary_id = db.session.query(TranslationCache.id).order_by(TranslationCache.id.desc()).offset(max_rows).limit(1).scalar()
+    if boundary_id is not None:
+        deleted_count += db.session.execute(delete(TranslationCache).where(TranslationCache.id <= boundary_id)).rowcount
+    db.session.commit()
+    current_app.logger.info(f"--- [Translation] Очистка кэша переводов: удалено {deleted_count} записей.")
+    return deleted_count